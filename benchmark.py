@@ -0,0 +1,342 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from core import (
+    ApplyPlanner,
+    ApplyTransaction,
+    BatchScanner,
+    MemoryRegistryBackend,
+    RegistryManager,
+    ScanCache,
+    SettingCatalog,
+    winreg,
+)
+from broker import BrokerClient, BrokerServer, LocalPipeTransport
+from hive import HiveWriter, open_image
+from journal import BackupJournal
+from overlay import ApplyPreview
+from search import SettingsFilter
+from userhives import FakeHiveProvider, MultiHiveRunner
+
+# 計測するカタログの規模
+DEFAULT_SIZES = (10, 1000, 10000)
+
+# マルチハイブのシナリオで模擬するユーザー数
+HIVE_USERS = 8
+
+# 1つのキーにまとめる値の数（実際のカタログと同じく複数の値が同じキーを共有する）
+VALUES_PER_KEY = 8
+
+def synthetic_records(count: int) -> List[Dict[str, Any]]:
+    """計測用のカタログレコードを作成"""
+    records = []
+    for number in range(count):
+        records.append({
+            "id": f"bench_{number:05d}",
+            "kind": "registry",
+            "name": f"ベンチマーク項目{number}",
+            "description": "計測用の設定項目",
+            "category": f"カテゴリ{number % 16}",
+            "root": winreg.HKEY_CURRENT_USER,
+            "key_path": f"Software\\PoleToWinBench\\Key{number // VALUES_PER_KEY:05d}",
+            "value_name": f"Value{number % VALUES_PER_KEY}",
+            "value_type": winreg.REG_DWORD,
+            "enabled_value": 1,
+            "disabled_value": 0,
+            "labels": ["有効", "無効"],
+        })
+    return records
+
+class BenchmarkEnvironment:
+    """1回の計測用に、メモリ上のレジストリ・設定項目・ジャーナルを用意する"""
+    
+    _numbers = itertools.count()
+    
+    def __init__(self, records: List[Dict[str, Any]], latency: float, journal_dir: str):
+        self.records = records
+        self.backend = MemoryRegistryBackend(latency)
+        # 半分の項目だけ値が存在する状態から始める
+        for record in records[::2]:
+            self.backend.preset(record["root"], record["key_path"], record["value_name"],
+                                record["disabled_value"], record["value_type"])
+        self.registry = RegistryManager(self.backend, cache_size=32)
+        self.catalog = SettingCatalog(records)
+        self.settings = self.catalog.settings
+        journal_file = os.path.join(journal_dir, f"journal_{next(self._numbers)}.jsonl")
+        self.journal = BackupJournal(journal_file)
+        # 計測後に閉じるもの（ブローカーの接続など）
+        self.cleanup: List[Callable[[], None]] = []
+    
+    def apply(self, setting_ids: List[str], state: str, label: str = "apply"):
+        """GUIの適用と同じく、計画を作成してジャーナル付きのトランザクションで書き込む"""
+        plan = ApplyPlanner(self.registry).plan(self.settings, {setting_id: state for setting_id in setting_ids})
+        result = ApplyTransaction(self.registry, self.journal).execute(plan, self.settings, label)
+        if not result.committed:
+            raise RuntimeError(f"適用に失敗しました: {result.failed}")
+        return result
+    
+    def close(self):
+        for cleanup in self.cleanup:
+            cleanup()
+        self.registry.close()
+
+def _scan(env: BenchmarkEnvironment):
+    BatchScanner(env.registry).scan(env.settings)
+
+def _cached_scan_setup(env: BenchmarkEnvironment):
+    # 前回の起動時のスキャンでキャッシュを作り、その後で1%の項目だけが書き換えられた状態にする
+    env.scan_cache = ScanCache(cache_file=None)
+    BatchScanner(env.registry, env.scan_cache).scan(env.settings)
+    for record in env.records[::100]:
+        env.registry.write_value(record["key_path"], record["value_name"], record["enabled_value"],
+                                 record["value_type"], record["root"])
+
+def _cached_scan(env: BenchmarkEnvironment):
+    # 最終書き込み時刻が変わったキーだけを読み直す
+    BatchScanner(env.registry, env.scan_cache).scan(env.settings)
+
+def _apply_selected(env: BenchmarkEnvironment):
+    # 1割の項目を選択して適用
+    env.apply(list(env.settings)[::10], "enabled")
+
+def _apply_all(env: BenchmarkEnvironment):
+    env.apply(list(env.settings), "enabled")
+
+def _preview_all(env: BenchmarkEnvironment):
+    # 「すべての設定を適用」を上書きレイヤーに対して実行して再スキャン（実際のレジストリには書き込まない）
+    preview = ApplyPreview(env.registry, env.catalog, {setting_id: "enabled" for setting_id in env.settings}).run()
+    if env.backend.calls["set"]:
+        raise RuntimeError("プレビューが実際のレジストリに書き込みました")
+    preview.discard()
+
+def _reset_setup(env: BenchmarkEnvironment):
+    env.apply(list(env.settings), "enabled")
+
+def _reset(env: BenchmarkEnvironment):
+    # 最後の適用の直前の状態に戻す（GUIの「初期設定に戻す」と同じ処理）
+    session = env.journal.last_session("apply")
+    plan = ApplyPlanner(env.registry).plan_values(env.journal.restore_targets(session["session"]), env.settings)
+    result = ApplyTransaction(env.registry, env.journal).execute(plan, env.settings, "restore")
+    if not result.committed:
+        raise RuntimeError(f"復元に失敗しました: {result.failed}")
+
+def _multi_hive_setup(env: BenchmarkEnvironment):
+    env.provider = FakeHiveProvider(HIVE_USERS, backend=env.backend)
+    env.provider.populate(env.records)
+
+def _multi_hive(env: BenchmarkEnvironment):
+    # 全ユーザーのハイブを並行してスキャンし、状態表を集計
+    MultiHiveRunner(env.provider, SettingCatalog(env.records), workers=HIVE_USERS).run()
+
+def _offline_hive_setup(env: BenchmarkEnvironment):
+    # メモリ上のレジストリと同じ内容のハイブファイルを作成（サブキーが多いキーはriレコードに分割する）
+    writer = HiveWriter(list_limit=512)
+    for record in env.records[::2]:
+        writer.set_value(record["key_path"], record["value_name"], record["value_type"], record["disabled_value"])
+    env.hive_file = f"{env.journal.journal_file}.NTUSER.DAT"
+    writer.write(env.hive_file)
+
+def _offline_hive(env: BenchmarkEnvironment):
+    # ハイブファイルをメモリマップしてスキャン（メモリ上のレジストリには触れない）
+    backend = open_image(env.hive_file, (winreg.HKEY_CURRENT_USER, ""))
+    try:
+        catalog = SettingCatalog(env.records, env.catalog.index)
+        BatchScanner(RegistryManager(backend, cache_size=32)).scan(catalog.settings)
+    finally:
+        backend.close()
+
+def _broker_setup(env: BenchmarkEnvironment):
+    # ブローカーを同じプロセスのスレッドで動かし、ローカルのパイプ越しに接続しておく
+    transport = LocalPipeTransport()
+    server = BrokerServer(env.catalog, env.registry, env.journal, privilege_check=lambda: True)
+    threading.Thread(target=server.serve, args=(transport,), daemon=True).start()
+    env.broker = BrokerClient(transport, launcher=lambda command: None)
+    env.broker.start()
+    env.cleanup.append(env.broker.close)
+
+def _broker_apply_all(env: BenchmarkEnvironment):
+    # すべての項目を1回の往復でブローカーに送って適用
+    reply = env.broker.execute("apply", {"targets": {setting_id: "enabled" for setting_id in env.settings}})
+    if reply["state"] != "done":
+        raise RuntimeError(f"ブローカーでの適用に失敗しました: {reply['error']}")
+
+# 検索のシナリオで1文字ずつ入力する検索語
+SEARCH_QUERY = "ベンチマーク項目123"
+
+def _search_setup(env: BenchmarkEnvironment):
+    env.settings_filter = SettingsFilter(env.catalog)
+
+def _search(env: BenchmarkEnvironment):
+    # GUIの検索ボックスに1文字ずつ入力し、最後にカテゴリと状態でも絞り込む
+    for length in range(1, len(SEARCH_QUERY) + 1):
+        env.settings_filter.apply(SEARCH_QUERY[:length])
+    env.settings_filter.apply(SEARCH_QUERY[:-1], category="カテゴリ3", state="modified")
+
+# バイナリ値の項目が参照する値の大きさ（Explorerの状態を保存する値のような大きな値）
+BLOB_SIZE = 64 * 1024
+
+def _binary_scan_setup(env: BenchmarkEnvironment):
+    # 各項目をキーごとの大きなバイナリ値の1ビットにし、値全体ではなく該当するバイトだけを比較させる
+    records = []
+    for record in env.records:
+        number = int(record["id"].rsplit("_", 1)[1])
+        records.append(dict(
+            record, value_name="State", value_type=winreg.REG_BINARY, offset=BLOB_SIZE // 2 + number % VALUES_PER_KEY,
+            mask=b"\x01", enabled_value=b"\x01", disabled_value=b"\x00",
+        ))
+    for record in records[::VALUES_PER_KEY]:
+        env.backend.preset(record["root"], record["key_path"], "State", bytes(BLOB_SIZE), winreg.REG_BINARY)
+    env.binary_settings = SettingCatalog(records).settings
+
+def _binary_scan(env: BenchmarkEnvironment):
+    BatchScanner(env.registry).scan(env.binary_settings)
+
+# シナリオ名 -> (準備（計測しない）, 計測する処理)
+SCENARIOS: Dict[str, Tuple[Optional[Callable], Callable]] = {
+    "scan": (None, _scan),
+    "cached_scan": (_cached_scan_setup, _cached_scan),
+    "apply_selected": (None, _apply_selected),
+    "apply_all": (None, _apply_all),
+    "preview_all": (None, _preview_all),
+    "reset": (_reset_setup, _reset),
+    "multi_hive": (_multi_hive_setup, _multi_hive),
+    "offline_hive": (_offline_hive_setup, _offline_hive),
+    "broker_apply_all": (_broker_setup, _broker_apply_all),
+    "search": (_search_setup, _search),
+    "binary_scan": (_binary_scan_setup, _binary_scan),
+}
+
+def run_scenario(name: str, records: List[Dict[str, Any]], latency: float, repeat: int,
+                 journal_dir: str) -> Dict[str, Any]:
+    """シナリオを計測（時間はrepeat回の最小値、メモリは別の1回をtracemallocで計測）"""
+    setup, operation = SCENARIOS[name]
+    best = None
+    calls = Counter()
+    for _ in range(repeat):
+        env = BenchmarkEnvironment(records, latency, journal_dir)
+        if setup is not None:
+            setup(env)
+        before = Counter(env.backend.calls)
+        started = time.perf_counter()
+        operation(env)
+        elapsed = time.perf_counter() - started
+        calls = Counter(env.backend.calls)
+        calls.subtract(before)
+        env.close()
+        if best is None or elapsed < best:
+            best = elapsed
+    
+    # tracemallocは処理を遅くするため、時間とは別に計測する
+    env = BenchmarkEnvironment(records, 0.0, journal_dir)
+    if setup is not None:
+        setup(env)
+    tracemalloc.start()
+    try:
+        operation(env)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        env.close()
+    
+    return {
+        "scenario": name,
+        "items": len(records),
+        "wall_ms": round(best * 1000, 3),
+        "calls": {operation_name: count for operation_name, count in sorted(calls.items()) if count},
+        "total_calls": sum(calls.values()),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+def _git_commit() -> Optional[str]:
+    """計測したコミット（gitがなければNone）"""
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        return completed.stdout.strip() or None
+    except OSError:
+        return None
+
+def run_benchmarks(sizes=DEFAULT_SIZES, scenarios=None, latency: float = 0.0, repeat: int = 3,
+                   progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """全シナリオを計測して結果をまとめる"""
+    results = []
+    with tempfile.TemporaryDirectory(prefix="poletowin-bench-") as journal_dir:
+        for size in sizes:
+            records = synthetic_records(size)
+            for name in scenarios or SCENARIOS:
+                result = run_scenario(name, records, latency, repeat, journal_dir)
+                results.append(result)
+                if progress is not None:
+                    progress(result)
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "latency": latency,
+        "repeat": repeat,
+        "results": results,
+    }
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[str]:
+    """基準の結果と比べて、wall_msがthreshold（割合）を超えて悪化した項目を返す"""
+    if baseline.get("latency") != current["latency"]:
+        print(f"警告: 遅延の設定が異なります（{baseline.get('latency')} -> {current['latency']}）", file=sys.stderr)
+    previous = {(result["scenario"], result["items"]): result for result in baseline.get("results", [])}
+    regressions = []
+    for result in current["results"]:
+        old = previous.get((result["scenario"], result["items"]))
+        if old is None or not old["wall_ms"]:
+            continue
+        ratio = result["wall_ms"] / old["wall_ms"]
+        line = (f"{result['scenario']:<16}{result['items']:>7}  {old['wall_ms']:10.2f} -> {result['wall_ms']:10.2f} ms"
+                f"  ({ratio - 1:+.0%})  calls {old['total_calls']} -> {result['total_calls']}")
+        print(line)
+        if ratio > 1 + threshold or result["total_calls"] > old["total_calls"]:
+            regressions.append(line)
+    return regressions
+
+def _print_result(result: Dict[str, Any]):
+    print(f"{result['scenario']:<16}{result['items']:>7}  {result['wall_ms']:10.2f} ms  "
+          f"{result['total_calls']:8d} calls  {result['peak_kib']:10.1f} KiB", flush=True)
+
+def main(argv: Optional[List[str]] = None):
+    """ベンチマークを実行して結果をJSONに保存（--compareで過去の結果と比較）"""
+    parser = argparse.ArgumentParser(description="メモリ上のレジストリでスキャン・適用・復元を計測")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="カタログの項目数")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), help="計測するシナリオ")
+    parser.add_argument("--latency", type=float, default=0.0, help="レジストリ操作1回ごとの遅延（秒）")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（最小値を採用）")
+    parser.add_argument("--output", default="benchmark_results.json", help="結果の出力先（JSON）")
+    parser.add_argument("--compare", metavar="BASELINE", help="比較する過去の結果（JSON）")
+    parser.add_argument("--threshold", type=float, default=0.2, help="悪化とみなす時間の増加率")
+    args = parser.parse_args(argv)
+    
+    report = run_benchmarks(args.sizes, args.scenarios, args.latency, args.repeat, _print_result)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+    print(f"結果を{args.output}に保存しました。")
+    
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print(f"{len(regressions)}件のシナリオが悪化しました。", file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
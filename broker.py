@@ -0,0 +1,455 @@
+import ctypes
+import itertools
+import json
+import os
+import secrets
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from core import (
+    HAS_WINREG,
+    SERVICE_START_TYPES,
+    ApplyPlanner,
+    RegistrySettingItem,
+    ServiceSettingItem,
+    SettingCatalog,
+    SystemSettingItem,
+    TaskSettingItem,
+    TransactionResult,
+    WritePlan,
+    is_admin,
+    winreg,
+)
+from instrumentation import INSTRUMENTATION
+from jobs import Job, JobQueue
+
+# プロトコルのバージョン（GUIとブローカーで一致しなければ接続しない）
+PROTOCOL_VERSION = 1
+
+# メッセージの種類
+MSG_HELLO = 1
+MSG_EXECUTE = 2
+MSG_PROGRESS = 3
+MSG_RESULT = 4
+MSG_CANCEL = 5
+MSG_ERROR = 6
+
+# フレームのヘッダー (メッセージの種類, 要求番号)。本体は空白を省いたJSON
+FRAME_HEADER = struct.Struct("<BI")
+
+# 1フレームの最大サイズ
+MAX_FRAME = 64 * 1024 * 1024
+
+# 復元で書き戻せる値の型（変更前の値はカタログの型と異なる場合がある）
+RESTORE_VALUE_TYPES = {
+    winreg.REG_SZ, winreg.REG_EXPAND_SZ, winreg.REG_BINARY, winreg.REG_DWORD, winreg.REG_MULTI_SZ, winreg.REG_QWORD,
+}
+
+# ブローカーを起動するスクリプト
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+class BrokerError(Exception):
+    """ブローカーとの通信・要求のエラー"""
+
+def _encode_bytes(value: Any) -> Any:
+    if isinstance(value, (bytes, bytearray)):
+        return {"$b": bytes(value).hex()}
+    raise TypeError(f"JSONに変換できない値です: {type(value).__name__}")
+
+def _decode_bytes(value: Dict[str, Any]) -> Any:
+    if len(value) == 1 and "$b" in value:
+        return bytes.fromhex(value["$b"])
+    return value
+
+def encode_frame(kind: int, sequence: int, payload: Optional[Dict[str, Any]] = None) -> bytes:
+    """メッセージを1フレームにする（バイナリの値は{"$b": 16進数}にする）"""
+    body = b""
+    if payload is not None:
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=_encode_bytes).encode("utf-8")
+    return FRAME_HEADER.pack(kind, sequence) + body
+
+def decode_frame(frame: bytes) -> Tuple[int, int, Dict[str, Any]]:
+    """フレームを (メッセージの種類, 要求番号, 本体) にする"""
+    if len(frame) < FRAME_HEADER.size:
+        raise BrokerError("フレームが短すぎます")
+    kind, sequence = FRAME_HEADER.unpack_from(frame)
+    payload = {}
+    if len(frame) > FRAME_HEADER.size:
+        try:
+            payload = json.loads(bytes(frame[FRAME_HEADER.size:]).decode("utf-8"), object_hook=_decode_bytes)
+        except ValueError as e:
+            raise BrokerError(f"フレームの本体を読み取れません: {e}") from e
+        if not isinstance(payload, dict):
+            raise BrokerError("フレームの本体がオブジェクトではありません")
+    return kind, sequence, payload
+
+class BrokerTransport:
+    """GUIとブローカーの接続を作る
+    
+    接続はmultiprocessing.connection.Connectionと同じく、send_bytes/recv_bytes/poll/closeを持つ。
+    """
+    
+    def listen(self):
+        """（ブローカー側）接続を待ち受ける（accept()とclose()を持つオブジェクトを返す）"""
+        raise NotImplementedError
+    
+    def connect(self, timeout: float):
+        """（GUI側）ブローカーに接続する（起動を待つためtimeout秒まで再試行する）"""
+        raise NotImplementedError
+
+class LocalPipeTransport(BrokerTransport):
+    """名前付きパイプ（Windows）・UNIXドメインソケット（それ以外）で接続する
+    
+    接続時にauthkeyで相互に認証するため、authkeyを知らないプロセスはブローカーに要求を送れない。
+    """
+    
+    def __init__(self, address: Optional[str] = None, authkey: Optional[bytes] = None):
+        self.family = "AF_PIPE" if sys.platform == "win32" else "AF_UNIX"
+        if address is None:
+            token = secrets.token_hex(8)
+            if self.family == "AF_PIPE":
+                address = f"\\\\.\\pipe\\PoleToWin-broker-{token}"
+            else:
+                address = os.path.join(tempfile.gettempdir(), f"poletowin-broker-{token}.sock")
+        self.address = address
+        self.authkey = authkey or secrets.token_bytes(32)
+    
+    def listen(self):
+        return Listener(self.address, self.family, authkey=self.authkey)
+    
+    def connect(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return Client(self.address, self.family, authkey=self.authkey)
+            except OSError as e:
+                if time.monotonic() >= deadline:
+                    raise BrokerError(f"ブローカーに接続できません: {e}") from e
+                time.sleep(0.05)
+
+def default_privilege_check() -> bool:
+    """レジストリに直接書き込めるか（Windows以外はメモリ上のレジストリのため常に書き込める）"""
+    return not HAS_WINREG or bool(is_admin())
+
+def broker_command(transport: LocalPipeTransport, journal_file: str) -> List[str]:
+    """ブローカーを起動するコマンドライン"""
+    if getattr(sys, "frozen", False):
+        command = [sys.executable]
+    else:
+        command = [sys.executable, MAIN_SCRIPT]
+    return command + [
+        "--journal", os.path.abspath(journal_file),
+        "broker", "--address", transport.address, "--authkey", transport.authkey.hex(),
+    ]
+
+def launch_elevated(command: List[str]) -> Optional[subprocess.Popen]:
+    """ブローカーを管理者権限で起動（既に書き込める場合は通常のプロセスとして起動）"""
+    if default_privilege_check():
+        return subprocess.Popen(command)
+    result = ctypes.windll.shell32.ShellExecuteW(
+        None, "runas", command[0], subprocess.list2cmdline(command[1:]), os.getcwd(), 0
+    )
+    # 32以下はエラー（UACで拒否された場合を含む）
+    if result <= 32:
+        raise BrokerError("ブローカーを管理者権限で起動できませんでした")
+    return None
+
+class BrokerServer:
+    """管理者権限で常駐し、GUIから受け取った適用・復元をまとめて実行するブローカー
+    
+    要求はブローカー自身が読み込んだカタログで検証し、カタログにない項目・場所の値は書き込まない
+    （対象外として結果に含める）。接続したGUIが終了するとブローカーも終了する。
+    """
+    
+    def __init__(self, catalog: SettingCatalog, registry=None, backup_journal=None,
+                 privilege_check: Callable[[], bool] = default_privilege_check):
+        self.catalog = catalog
+        self.settings = catalog.settings
+        self.privilege_check = privilege_check
+        self.jobs = JobQueue(registry, backup_journal, on_progress=self._on_progress, on_done=self._on_done)
+        self.connection = None
+        # ジョブID -> (要求番号, 対象外の項目, ジョブ)
+        self._requests: Dict[int, Tuple[int, List[str], Job]] = {}
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self.requests = 0
+    
+    def serve(self, transport: BrokerTransport):
+        """接続を1つ受け付け、切断されるまで要求を処理"""
+        if not self.privilege_check():
+            raise PermissionError("ブローカーの起動には管理者権限が必要です")
+        with transport.listen() as listener:
+            connection = listener.accept()
+        self.serve_connection(connection)
+    
+    def serve_connection(self, connection):
+        self.connection = connection
+        try:
+            self._send(MSG_HELLO, 0, {"version": PROTOCOL_VERSION, "pid": os.getpid(), "settings": len(self.settings)})
+            while True:
+                try:
+                    frame = connection.recv_bytes(MAX_FRAME)
+                except (EOFError, OSError):
+                    break
+                try:
+                    kind, sequence, payload = decode_frame(frame)
+                except BrokerError as e:
+                    self._send(MSG_ERROR, 0, {"error": str(e)})
+                    continue
+                if kind == MSG_EXECUTE:
+                    self._execute(sequence, payload)
+                elif kind == MSG_CANCEL:
+                    self._cancel(sequence)
+                else:
+                    self._send(MSG_ERROR, sequence, {"error": f"不明なメッセージです: {kind}"})
+        finally:
+            # GUIが終了したら実行中のジョブを取り消し、書き込んだ分を元に戻してから終了する
+            self.jobs.cancel_all()
+            self.jobs.wait()
+            connection.close()
+            self.connection = None
+    
+    def _send(self, kind: int, sequence: int, payload: Dict[str, Any]):
+        with self._send_lock:
+            try:
+                self.connection.send_bytes(encode_frame(kind, sequence, payload))
+            except (OSError, AttributeError):
+                # 切断済み
+                pass
+    
+    def validate(self, payload: Dict[str, Any]) -> Tuple[Callable[[ApplyPlanner], WritePlan], List[str]]:
+        """要求をカタログで検証し、計画を作る関数と対象外の項目を返す
+        
+        {"targets": {設定ID: 状態}} は状態の適用、{"values": [ApplyPlanner.plan_valuesの形式]} は生の値に戻す。
+        """
+        rejected = []
+        if isinstance(payload.get("targets"), dict):
+            targets = {}
+            for setting_id, state in payload["targets"].items():
+                if setting_id in self.settings and state in (None, "enabled", "disabled"):
+                    targets[setting_id] = state
+                else:
+                    rejected.append(setting_id)
+            return lambda planner: planner.plan(self.settings, targets), rejected
+        if isinstance(payload.get("values"), list):
+            values = []
+            for target in payload["values"]:
+                if self._known_value(target):
+                    values.append(tuple(target))
+                else:
+                    rejected.append(str(target[0]) if isinstance(target, list) and target else "")
+            return lambda planner: planner.plan_values(values, self.settings), rejected
+        raise BrokerError("要求にtargetsもvaluesもありません")
+    
+    def _known_value(self, target: Any) -> bool:
+        """カタログの項目の場所の値か（サービス・タスクは書き込む値もその種類の値か確かめる）"""
+        if not isinstance(target, list) or len(target) != 6:
+            return False
+        setting_id, root, key_path, value_name, value_type, value = target
+        setting = self.settings.get(setting_id) if isinstance(setting_id, str) else None
+        if isinstance(setting, RegistrySettingItem):
+            return (
+                root == setting.root
+                and isinstance(key_path, str) and key_path.lower() == setting.key_path.lower()
+                and isinstance(value_name, str) and value_name.lower() == setting.value_name.lower()
+                and (value_type is None or value_type in RESTORE_VALUE_TYPES)
+            )
+        if isinstance(setting, SystemSettingItem):
+            if root is not None or value_name != setting_id or value_type is not None:
+                return False
+            # 変更前の値はカタログの有効・無効の値以外（手動の開始など）のこともある
+            if isinstance(setting, ServiceSettingItem):
+                return isinstance(value, str) and value in SERVICE_START_TYPES
+            if isinstance(setting, TaskSettingItem):
+                return isinstance(value, bool)
+            return value in (setting.enabled_value, setting.disabled_value)
+        return False
+    
+    def _execute(self, sequence: int, payload: Dict[str, Any]):
+        label = payload.get("label", "apply")
+        if label not in ("apply", "restore"):
+            self._send(MSG_ERROR, sequence, {"error": f"不明なジョブです: {label}"})
+            return
+        try:
+            build_plan, rejected = self.validate(payload)
+        except BrokerError as e:
+            self._send(MSG_ERROR, sequence, {"error": str(e)})
+            return
+        self.requests += 1
+        # 進捗・完了の通知が要求番号を引けるよう、登録してからワーカースレッドに渡す
+        with self._lock:
+            job = self.jobs.submit(label, self.settings, build_plan)
+            self._requests[job.id] = (sequence, rejected, job)
+    
+    def _cancel(self, sequence: int):
+        with self._lock:
+            jobs = [job for request, _, job in self._requests.values() if request == sequence]
+        for job in jobs:
+            job.cancel()
+    
+    def _on_progress(self, job: Job, setting_id: str, ok: bool):
+        with self._lock:
+            sequence, _, _ = self._requests[job.id]
+        self._send(MSG_PROGRESS, sequence, {"id": setting_id, "ok": ok, "done": job.done, "total": job.total})
+    
+    def _on_done(self, job: Job):
+        with self._lock:
+            sequence, rejected, _ = self._requests.pop(job.id)
+        items = dict(job.items)
+        items.update((setting_id, "invalid") for setting_id in rejected)
+        result = None
+        if job.result is not None:
+            result = {
+                "committed": job.result.committed,
+                "written": job.result.written,
+                "failed": job.result.failed,
+                "rolled_back": job.result.rolled_back,
+                "rollback_errors": job.result.rollback_errors,
+                "cancelled": job.result.cancelled,
+            }
+        self._send(MSG_RESULT, sequence, {
+            "state": job.state,
+            "items": items,
+            "done": job.done,
+            "total": job.total,
+            "result": result,
+            "error": str(job.error) if job.error is not None else None,
+        })
+
+class BrokerClient:
+    """GUI側からブローカーを起動し、適用・復元の要求を1回の往復で送る
+    
+    ブローカーは最初の要求の前に1回だけ起動し、close()で接続を閉じると終了する。
+    """
+    
+    def __init__(self, transport: Optional[LocalPipeTransport] = None,
+                 launcher: Callable[[List[str]], Any] = launch_elevated,
+                 journal_file: str = "backup_journal.jsonl", connect_timeout: float = 120.0):
+        self.transport = transport or LocalPipeTransport()
+        self.launcher = launcher
+        self.journal_file = journal_file
+        # UACの確認を待つため長めにする
+        self.connect_timeout = connect_timeout
+        self.connection = None
+        # 通常のプロセスとして起動したブローカー（管理者権限で起動した場合はNone）
+        self.process: Optional[subprocess.Popen] = None
+        # ブローカーから受け取った情報（プロセスID・項目数）
+        self.info: Dict[str, Any] = {}
+        self.round_trips = 0
+        self._sequence = itertools.count(1)
+        self._lock = threading.Lock()
+    
+    def start(self):
+        """ブローカーを起動して接続（接続済みなら何もしない）"""
+        if self.connection is not None:
+            return
+        self.process = self.launcher(broker_command(self.transport, self.journal_file))
+        connection = self.transport.connect(self.connect_timeout)
+        try:
+            kind, _, payload = decode_frame(connection.recv_bytes(MAX_FRAME))
+        except (EOFError, OSError) as e:
+            connection.close()
+            raise BrokerError(f"ブローカーから応答がありません: {e}") from e
+        if kind != MSG_HELLO or payload.get("version") != PROTOCOL_VERSION:
+            connection.close()
+            raise BrokerError("ブローカーのバージョンが一致しません")
+        self.connection = connection
+        self.info = payload
+    
+    def close(self):
+        """接続を閉じる（ブローカーは実行中のジョブを取り消して終了する）"""
+        with self._lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+            if isinstance(self.process, subprocess.Popen):
+                try:
+                    self.process.wait(5)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                self.process = None
+    
+    def execute(self, label: str, request: Dict[str, Any],
+                on_progress: Optional[Callable[[str, bool, int, int], None]] = None,
+                cancel_event: Optional[threading.Event] = None) -> Dict[str, Any]:
+        """要求を送り、結果が返るまで待つ（進捗はon_progress(設定ID, 成否, 完了数, 総数)で受け取る）"""
+        with self._lock:
+            self.start()
+            sequence = next(self._sequence)
+            try:
+                self.connection.send_bytes(encode_frame(MSG_EXECUTE, sequence, dict(request, label=label)))
+                self.round_trips += 1
+                cancel_sent = False
+                while True:
+                    if cancel_event is not None and cancel_event.is_set() and not cancel_sent:
+                        self.connection.send_bytes(encode_frame(MSG_CANCEL, sequence))
+                        cancel_sent = True
+                    if not self.connection.poll(0.05):
+                        continue
+                    kind, reply, payload = decode_frame(self.connection.recv_bytes(MAX_FRAME))
+                    if kind == MSG_ERROR and reply in (sequence, 0):
+                        raise BrokerError(payload.get("error", "不明なエラー"))
+                    if reply != sequence:
+                        continue
+                    if kind == MSG_PROGRESS and on_progress is not None:
+                        on_progress(payload["id"], payload["ok"], payload["done"], payload["total"])
+                    elif kind == MSG_RESULT:
+                        return payload
+            except (EOFError, OSError) as e:
+                # ブローカーが終了した（次の要求で起動し直す）
+                self.connection.close()
+                self.connection = None
+                raise BrokerError(f"ブローカーとの接続が切れました: {e}") from e
+
+class BrokerJobQueue(JobQueue):
+    """ジョブをブローカーに送って実行するキュー（GUIを管理者権限なしで動かすときに使う）
+    
+    計画の作成と書き込みはブローカーで行うため、job.planは作成されない。
+    """
+    
+    def __init__(self, client: BrokerClient,
+                 on_progress: Optional[Callable[[Job, str, bool], None]] = None,
+                 on_done: Optional[Callable[[Job], None]] = None):
+        super().__init__(None, None, on_progress, on_done)
+        self.client = client
+    
+    def close(self):
+        self.client.close()
+    
+    def _run(self, job: Job):
+        with self._lock:
+            self.current = job
+        if job.cancel_event.is_set():
+            job.state = "cancelled"
+            return
+        job.state = "running"
+        
+        def progress(setting_id: str, ok: bool, done: int, total: int):
+            job.done, job.total = done, total
+            if self.on_progress is not None:
+                self.on_progress(job, setting_id, ok)
+        
+        try:
+            if job.request is None:
+                raise BrokerError("ブローカーに送れないジョブです")
+            with INSTRUMENTATION.span("phase", "job", job.label):
+                reply = self.client.execute(job.label, job.request(), progress, job.cancel_event)
+            job.done, job.total = reply["done"], reply["total"]
+            job.items = reply["items"]
+            job.state = reply["state"]
+            if reply["result"] is not None:
+                job.result = TransactionResult()
+                for name, value in reply["result"].items():
+                    setattr(job.result, name, value)
+            if reply["error"] is not None:
+                job.error = BrokerError(reply["error"])
+        except Exception as e:
+            print(f"ジョブエラー: {e}")
+            job.error = e
+            job.state = "failed"
@@ -0,0 +1,2193 @@
+import ctypes
+import sys
+import os
+import re
+import json
+import csv
+import hashlib
+import io
+import itertools
+import marshal
+import subprocess
+import time
+import threading
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import Dict, Any, Optional, List, Tuple, Iterator, Callable, NamedTuple
+
+from instrumentation import INSTRUMENTATION
+
+try:
+    import winreg
+    HAS_WINREG = True
+except ImportError:
+    # Windows以外（ベンチマーク・テスト環境）ではwinregの定数のみを用意する
+    import types
+    winreg = types.SimpleNamespace(
+        HKEY_CLASSES_ROOT=0x80000000,
+        HKEY_CURRENT_USER=0x80000001,
+        HKEY_LOCAL_MACHINE=0x80000002,
+        HKEY_USERS=0x80000003,
+        REG_NONE=0,
+        REG_SZ=1,
+        REG_EXPAND_SZ=2,
+        REG_BINARY=3,
+        REG_DWORD=4,
+        REG_MULTI_SZ=7,
+        REG_QWORD=11,
+        KEY_READ=0x20019,
+        KEY_WRITE=0x20006,
+        KEY_ALL_ACCESS=0xF003F,
+    )
+    HAS_WINREG = False
+
+try:
+    import tomllib
+except ImportError:
+    # Python 3.10以前ではTOMLのカタログは読み込めない
+    tomllib = None
+
+# プログラムのあるフォルダ（カタログとキャッシュの既定の場所。作業フォルダによらず同じ場所を使う）
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 管理者権限チェック
+def is_admin():
+    try:
+        return ctypes.windll.shell32.IsUserAnAdmin()
+    except:
+        return False
+
+# 管理者権限で再起動
+def run_as_admin():
+    if not is_admin():
+        ctypes.windll.shell32.ShellExecuteW(
+            None, "runas", sys.executable, " ".join(sys.argv), None, 1
+        )
+        sys.exit()
+
+# ルートキーの表示名
+ROOT_NAMES = {
+    winreg.HKEY_CLASSES_ROOT: "HKEY_CLASSES_ROOT",
+    winreg.HKEY_CURRENT_USER: "HKEY_CURRENT_USER",
+    winreg.HKEY_LOCAL_MACHINE: "HKEY_LOCAL_MACHINE",
+    winreg.HKEY_USERS: "HKEY_USERS",
+}
+
+# 開き直せば成功する無効なハンドルのWindowsのエラー（ERROR_INVALID_HANDLE, ERROR_KEY_DELETED）
+STALE_HANDLE_ERRORS = (6, 1018)
+
+class StaleHandleError(OSError):
+    """キーの削除などで無効になったハンドル（メモリ上のレジストリで使う）"""
+
+def is_stale_handle(error: OSError) -> bool:
+    """キャッシュ済みのハンドルを開き直せば成功する可能性があるエラーか"""
+    return isinstance(error, StaleHandleError) or getattr(error, "winerror", None) in STALE_HANDLE_ERRORS
+
+class RegistryBackend:
+    """レジストリへの低レベルアクセスを抽象化する基底クラス"""
+    
+    def open_key(self, root: int, key_path: str, access: int = winreg.KEY_READ) -> Any:
+        """キーを開いてハンドルを返す（存在しない場合はFileNotFoundError）"""
+        raise NotImplementedError
+    
+    def create_key(self, root: int, key_path: str, access: int = winreg.KEY_WRITE) -> Any:
+        """キーを作成して（または開いて）ハンドルを返す"""
+        raise NotImplementedError
+    
+    def close_key(self, handle: Any):
+        """ハンドルを閉じる"""
+        raise NotImplementedError
+    
+    def delete_key(self, root: int, key_path: str):
+        """キーを削除する（存在しない場合はFileNotFoundError）"""
+        raise NotImplementedError
+    
+    def query_value(self, handle: Any, value_name: str) -> Tuple[Any, int]:
+        """値とその型を返す（存在しない場合はFileNotFoundError）"""
+        raise NotImplementedError
+    
+    def set_value(self, handle: Any, value_name: str, value_type: int, value: Any):
+        """値を書き込む"""
+        raise NotImplementedError
+    
+    def delete_value(self, handle: Any, value_name: str):
+        """値を削除する（存在しない場合はFileNotFoundError）"""
+        raise NotImplementedError
+    
+    def enum_keys(self, handle: Any) -> List[str]:
+        """サブキーの名前の一覧を返す"""
+        raise NotImplementedError
+    
+    def enum_values(self, handle: Any) -> List[Tuple[str, Any, int]]:
+        """すべての値を (値名, 値, 型) の一覧で返す"""
+        raise NotImplementedError
+    
+    def query_info_key(self, handle: Any) -> Tuple[int, int, int]:
+        """(サブキー数, 値の数, 最終書き込み時刻) を返す（時刻は100ナノ秒単位の整数）"""
+        raise NotImplementedError
+
+class WinRegBackend(RegistryBackend):
+    """winregを使う実レジストリのバックエンド"""
+    
+    def open_key(self, root, key_path, access=winreg.KEY_READ):
+        return winreg.OpenKey(root, key_path, 0, access)
+    
+    def create_key(self, root, key_path, access=winreg.KEY_WRITE):
+        return winreg.CreateKeyEx(root, key_path, 0, access)
+    
+    def close_key(self, handle):
+        handle.Close()
+    
+    def delete_key(self, root, key_path):
+        winreg.DeleteKey(root, key_path)
+    
+    def query_value(self, handle, value_name):
+        return winreg.QueryValueEx(handle, value_name)
+    
+    def set_value(self, handle, value_name, value_type, value):
+        winreg.SetValueEx(handle, value_name, 0, value_type, value)
+    
+    def delete_value(self, handle, value_name):
+        winreg.DeleteValue(handle, value_name)
+    
+    def enum_keys(self, handle):
+        subkey_count, _, _ = winreg.QueryInfoKey(handle)
+        return [winreg.EnumKey(handle, index) for index in range(subkey_count)]
+    
+    def enum_values(self, handle):
+        _, value_count, _ = winreg.QueryInfoKey(handle)
+        return [winreg.EnumValue(handle, index) for index in range(value_count)]
+    
+    def query_info_key(self, handle):
+        return winreg.QueryInfoKey(handle)
+
+class RemoteRegistryBackend(WinRegBackend):
+    """winreg.ConnectRegistryで別のコンピューターのレジストリを操作するバックエンド
+    
+    リモートではHKEY_LOCAL_MACHINEとHKEY_USERSにしか接続できないため、
+    HKEY_CURRENT_USERはuser_sidを指定したときだけHKEY_USERS\\<SID>に読み替える。
+    """
+    
+    def __init__(self, computer_name: Optional[str], user_sid: Optional[str] = None):
+        self.computer_name = computer_name
+        self.user_sid = user_sid
+        # ルートキー -> 接続済みのリモートハンドル
+        self._roots: Dict[int, Any] = {}
+        self._lock = threading.Lock()
+    
+    def connect(self, root: int = winreg.HKEY_LOCAL_MACHINE):
+        """ルートキーに接続（接続済みなら既存のハンドルを返す）"""
+        with self._lock:
+            handle = self._roots.get(root)
+            if handle is None:
+                machine = rf"\\{self.computer_name}" if self.computer_name else None
+                handle = winreg.ConnectRegistry(machine, root)
+                self._roots[root] = handle
+            return handle
+    
+    def _resolve(self, root: int, key_path: str) -> Tuple[Any, str]:
+        """リモートのルートハンドルとキーパスに変換"""
+        if root == winreg.HKEY_CURRENT_USER:
+            if not self.user_sid:
+                raise PermissionError(
+                    f"{self.computer_name}: リモートのHKEY_CURRENT_USERにはユーザーのSIDが必要です"
+                )
+            root, key_path = winreg.HKEY_USERS, f"{self.user_sid}\\{key_path}"
+        return self.connect(root), key_path
+    
+    def open_key(self, root, key_path, access=winreg.KEY_READ):
+        remote_root, key_path = self._resolve(root, key_path)
+        return winreg.OpenKey(remote_root, key_path, 0, access)
+    
+    def create_key(self, root, key_path, access=winreg.KEY_WRITE):
+        remote_root, key_path = self._resolve(root, key_path)
+        return winreg.CreateKeyEx(remote_root, key_path, 0, access)
+    
+    def delete_key(self, root, key_path):
+        remote_root, key_path = self._resolve(root, key_path)
+        winreg.DeleteKey(remote_root, key_path)
+    
+    def close(self):
+        """リモート接続を閉じる"""
+        with self._lock:
+            for handle in self._roots.values():
+                handle.Close()
+            self._roots = {}
+
+class MemoryRegistryBackend(RegistryBackend):
+    """メモリ上のレジストリ（Windows以外でのベンチマーク・テスト用）"""
+    
+    def __init__(self, latency: float = 0.0):
+        # (root, 小文字のキーパス) -> {小文字の値名: (値名, 値, 型)}
+        self.keys: Dict[Tuple[int, str], Dict[str, Tuple[str, Any, int]]] = {}
+        # (root, 小文字のキーパス) -> {小文字のサブキー名: サブキー名}
+        self.subkeys: Dict[Tuple[int, str], Dict[str, str]] = {}
+        # (root, 小文字のキーパス) -> 最終書き込み時刻
+        # （別のプロセスで作成したスキャンキャッシュと食い違わないよう現在時刻から進める）
+        self.timestamps: Dict[Tuple[int, str], int] = {}
+        self._clock = itertools.count(time.time_ns() // 100)
+        self.latency = latency
+        self.calls = Counter()
+        # 書き込みを失敗させる値名（小文字、障害の再現用）
+        self.fail_writes: set = set()
+    
+    @staticmethod
+    def _normalize(key_path: str) -> str:
+        return key_path.strip("\\").lower()
+    
+    def _tick(self, operation: str):
+        """呼び出し回数を記録し、指定があれば遅延を挿入"""
+        self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+    
+    def _values(self, handle) -> Dict[str, Tuple[str, Any, int]]:
+        """ハンドルが指すキーの値を返す（削除・再作成後の古いハンドルはStaleHandleError）"""
+        key, values = handle
+        if self.keys.get(key) is not values:
+            raise StaleHandleError(f"キーは削除されています: {key[1]}")
+        return values
+    
+    def _touch(self, key: Tuple[int, str]):
+        """キーの最終書き込み時刻を進める"""
+        self.timestamps[key] = next(self._clock)
+    
+    def preset(self, root: int, key_path: str, value_name: str, value: Any, value_type: int):
+        """呼び出し回数を数えずに初期値を設定"""
+        values = self._ensure_key(root, key_path)
+        values[value_name.lower()] = (value_name, value, value_type)
+        self._touch((root, self._normalize(key_path)))
+    
+    def _ensure_key(self, root: int, key_path: str) -> Dict[str, Tuple[str, Any, int]]:
+        """キーを（親キーも含めて）作成し、その値の辞書を返す"""
+        names = key_path.strip("\\").split("\\")
+        parts = [name.lower() for name in names]
+        for depth in range(1, len(parts) + 1):
+            key = (root, "\\".join(parts[:depth]))
+            if key not in self.keys:
+                self.keys[key] = {}
+                self.subkeys[key] = {}
+                self._touch(key)
+                parent = (root, "\\".join(parts[:depth - 1]))
+                self.subkeys.setdefault(parent, {})[parts[depth - 1]] = names[depth - 1]
+                self._touch(parent)
+        return self.keys[(root, "\\".join(parts))]
+    
+    def open_key(self, root, key_path, access=winreg.KEY_READ):
+        self._tick("open")
+        key = (root, self._normalize(key_path))
+        if key not in self.keys:
+            raise FileNotFoundError(f"キーが見つかりません: {key_path}")
+        return (key, self.keys[key])
+    
+    def create_key(self, root, key_path, access=winreg.KEY_WRITE):
+        self._tick("create")
+        values = self._ensure_key(root, key_path)
+        return ((root, self._normalize(key_path)), values)
+    
+    def close_key(self, handle):
+        self._tick("close")
+    
+    def delete_key(self, root, key_path):
+        self._tick("delete")
+        key = (root, self._normalize(key_path))
+        if key not in self.keys:
+            raise FileNotFoundError(f"キーが見つかりません: {key_path}")
+        if self.subkeys.get(key):
+            raise PermissionError(f"サブキーを持つキーは削除できません: {key_path}")
+        del self.keys[key]
+        del self.subkeys[key]
+        self.timestamps.pop(key, None)
+        parent, _, name = key[1].rpartition("\\")
+        self.subkeys.get((root, parent), {}).pop(name, None)
+        self._touch((root, parent))
+    
+    def query_value(self, handle, value_name):
+        self._tick("query")
+        values = self._values(handle)
+        if value_name.lower() not in values:
+            raise FileNotFoundError(f"値が見つかりません: {value_name}")
+        _, value, value_type = values[value_name.lower()]
+        return value, value_type
+    
+    def set_value(self, handle, value_name, value_type, value):
+        self._tick("set")
+        if value_name.lower() in self.fail_writes:
+            raise PermissionError(f"アクセスが拒否されました: {value_name}")
+        self._values(handle)[value_name.lower()] = (value_name, value, value_type)
+        self._touch(handle[0])
+    
+    def delete_value(self, handle, value_name):
+        self._tick("delete_value")
+        values = self._values(handle)
+        if value_name.lower() not in values:
+            raise FileNotFoundError(f"値が見つかりません: {value_name}")
+        del values[value_name.lower()]
+        self._touch(handle[0])
+    
+    def enum_keys(self, handle):
+        self._tick("enum_keys")
+        self._values(handle)
+        key, _ = handle
+        return list(self.subkeys[key].values())
+    
+    def enum_values(self, handle):
+        self._tick("enum_values")
+        return list(self._values(handle).values())
+    
+    def query_info_key(self, handle):
+        self._tick("query_info")
+        values = self._values(handle)
+        key, _ = handle
+        return len(self.subkeys[key]), len(values), self.timestamps[key]
+
+class _registry_method:
+    """クラスから呼ばれた場合はキャッシュなしの既定インスタンスに束縛するデスクリプタ"""
+    
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+    
+    def __get__(self, instance, owner):
+        if instance is None:
+            instance = owner._default_manager()
+        return self.func.__get__(instance, owner)
+
+class RegistryManager:
+    """レジストリ操作を管理するクラス
+    
+    RegistryManager.read_value(...) のようにクラスから呼ぶと従来どおり毎回キーを開閉する。
+    RegistryManager(cache_size=32) のようにインスタンス化すると、開いたキーハンドルを
+    (root, キーパス, アクセス権) ごとにLRUキャッシュして再利用する。
+    """
+    
+    # Windows以外ではメモリ上のレジストリを使う
+    backend: RegistryBackend = WinRegBackend() if HAS_WINREG else MemoryRegistryBackend()
+    
+    # 書き込み用ハンドルは読み取りにも使えるようにする
+    WRITE_ACCESS = winreg.KEY_READ | winreg.KEY_WRITE
+    
+    _default = None
+    
+    def __init__(self, backend: Optional[RegistryBackend] = None, cache_size: int = 0):
+        self.backend = backend or type(self).backend
+        self.cache_size = cache_size
+        self._handles: "OrderedDict[Tuple[int, str, int], Any]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @classmethod
+    def _default_manager(cls) -> "RegistryManager":
+        """クラス経由の呼び出しで使うキャッシュなしのインスタンス"""
+        manager = cls._default
+        if manager is None or manager.backend is not cls.backend:
+            manager = cls(cls.backend)
+            cls._default = manager
+        return manager
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def _acquire(self, root: int, key_path: str, write: bool) -> Tuple[Any, bool]:
+        """キーハンドルを取得し、(ハンドル, キャッシュ済みか) を返す"""
+        if self.cache_size <= 0:
+            if write:
+                return self.backend.create_key(root, key_path, self.WRITE_ACCESS), False
+            return self.backend.open_key(root, key_path, winreg.KEY_READ), False
+        
+        path = key_path.lower()
+        write_entry = (root, path, self.WRITE_ACCESS)
+        read_entry = (root, path, winreg.KEY_READ)
+        candidates = (write_entry,) if write else (read_entry, write_entry)
+        for entry in candidates:
+            handle = self._handles.get(entry)
+            if handle is not None:
+                self._handles.move_to_end(entry)
+                self.hits += 1
+                return handle, True
+        
+        self.misses += 1
+        if write:
+            # 読み取り用ハンドルは書き込み可能なハンドルに置き換える
+            stale = self._handles.pop(read_entry, None)
+            if stale is not None:
+                self.backend.close_key(stale)
+            handle = self.backend.create_key(root, key_path, self.WRITE_ACCESS)
+            entry = write_entry
+        else:
+            handle = self.backend.open_key(root, key_path, winreg.KEY_READ)
+            entry = read_entry
+        
+        self._handles[entry] = handle
+        while len(self._handles) > self.cache_size:
+            _, evicted = self._handles.popitem(last=False)
+            self.backend.close_key(evicted)
+            self.evictions += 1
+        return handle, True
+    
+    def _release(self, handle: Any, cached: bool):
+        if not cached:
+            self.backend.close_key(handle)
+    
+    # これより長くロックを待った場合だけ競合として記録する（秒）
+    CONTENTION_THRESHOLD = 0.00005
+    
+    def _run(self, root: int, key_path: str, write: bool, operation, name: str = "query"):
+        """ハンドルを取得して処理を実行する（計測が有効ならキーごとの所要時間を記録）"""
+        if not INSTRUMENTATION.enabled:
+            return self._execute(root, key_path, write, operation)
+        
+        key = f"{ROOT_NAMES.get(root, hex(root))}\\{key_path}"
+        waiting = time.perf_counter()
+        with self._lock:
+            waited = time.perf_counter() - waiting
+            if waited >= self.CONTENTION_THRESHOLD:
+                INSTRUMENTATION.record("registry", "lock_wait", key, waited, waiting)
+            with INSTRUMENTATION.span("registry", name, key):
+                return self._execute(root, key_path, write, operation)
+    
+    def _execute(self, root: int, key_path: str, write: bool, operation):
+        """ハンドルを取得して処理を実行する（キャッシュ済みのハンドルが無効なら開き直す）
+        
+        アクセス拒否や書き込みの失敗は、同じ処理を繰り返さないよう開き直さずにそのまま送出する。
+        """
+        with self._lock:
+            handle, cached = self._acquire(root, key_path, write)
+            try:
+                return operation(handle)
+            except OSError as e:
+                if not cached or not is_stale_handle(e):
+                    raise
+                # 外部でキーが削除・再作成された場合
+                self.invalidate(key_path, root)
+                handle, cached = self._acquire(root, key_path, write)
+                return operation(handle)
+            finally:
+                self._release(handle, cached)
+    
+    def invalidate(self, key_path: str, root=winreg.HKEY_CURRENT_USER):
+        """指定キーとそのサブキーのキャッシュ済みハンドルを閉じる"""
+        path = key_path.lower()
+        with self._lock:
+            for entry in list(self._handles):
+                entry_root, entry_path, _ = entry
+                if entry_root == root and (entry_path == path or entry_path.startswith(path + "\\")):
+                    self.backend.close_key(self._handles.pop(entry))
+    
+    def close(self):
+        """キャッシュ済みのハンドルをすべて閉じる"""
+        with self._lock:
+            while self._handles:
+                _, handle = self._handles.popitem(last=False)
+                self.backend.close_key(handle)
+    
+    def cache_stats(self) -> Dict[str, int]:
+        """キャッシュのヒット・ミス回数を取得"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "open_handles": len(self._handles),
+        }
+    
+    @_registry_method
+    def read_value(self, key_path: str, value_name: str, root=winreg.HKEY_CURRENT_USER) -> Optional[Any]:
+        """レジストリ値を読み取る"""
+        try:
+            value, _ = self._run(
+                root, key_path, False, lambda handle: self.backend.query_value(handle, value_name), "read_value"
+            )
+            return value
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"読み取りエラー: {e}")
+            return None
+    
+    @_registry_method
+    def query_values(self, key_path: str, value_names: List[str],
+                     root=winreg.HKEY_CURRENT_USER) -> Optional[Dict[str, Optional[Tuple[Any, int]]]]:
+        """同じキーの複数の値を (値, 型) で読み取る（キーが存在しない場合はNone）"""
+        def query_all(handle):
+            values = {}
+            for value_name in value_names:
+                try:
+                    values[value_name] = self.backend.query_value(handle, value_name)
+                except FileNotFoundError:
+                    values[value_name] = None
+            return values
+        
+        try:
+            return self._run(root, key_path, False, query_all, "query_values")
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"読み取りエラー: {e}")
+            return {value_name: None for value_name in value_names}
+    
+    @_registry_method
+    def query_values_since(self, key_path: str, value_names: List[str], last_write: Optional[int],
+                           root=winreg.HKEY_CURRENT_USER
+                           ) -> Tuple[Optional[int], Optional[Dict[str, Optional[Tuple[Any, int]]]]]:
+        """キーの最終書き込み時刻がlast_writeと異なる場合だけ複数の値を (値, 型) で読み取る
+        
+        (最終書き込み時刻, 値) を返す。時刻が変わっていなければ値はNone、
+        キーが存在しない場合は (None, None)、読み取りエラーの場合は時刻がNoneになる。
+        """
+        def query_changed(handle):
+            _, _, timestamp = self.backend.query_info_key(handle)
+            if timestamp == last_write:
+                return timestamp, None
+            values = {}
+            for value_name in value_names:
+                try:
+                    values[value_name] = self.backend.query_value(handle, value_name)
+                except FileNotFoundError:
+                    values[value_name] = None
+            return timestamp, values
+        
+        try:
+            return self._run(root, key_path, False, query_changed, "query_values_since")
+        except FileNotFoundError:
+            return None, None
+        except Exception as e:
+            print(f"読み取りエラー: {e}")
+            return None, {value_name: None for value_name in value_names}
+    
+    @_registry_method
+    def read_values(self, key_path: str, value_names: List[str], root=winreg.HKEY_CURRENT_USER) -> Dict[str, Any]:
+        """同じキーの複数の値をキーを1回だけ開いて読み取る"""
+        values = self.query_values(key_path, value_names, root) or {}
+        return {value_name: (values.get(value_name) or (None, None))[0] for value_name in value_names}
+    
+    @_registry_method
+    def write_value(self, key_path: str, value_name: str, value: Any, value_type: int, root=winreg.HKEY_CURRENT_USER):
+        """レジストリ値を書き込む"""
+        try:
+            self._run(
+                root, key_path, True,
+                lambda handle: self.backend.set_value(handle, value_name, value_type, value), "write_value"
+            )
+            return True
+        except Exception as e:
+            print(f"書き込みエラー: {e}")
+            return False
+    
+    @_registry_method
+    def write_values(self, key_path: str, entries: List[Tuple[str, int, Any]], root=winreg.HKEY_CURRENT_USER) -> int:
+        """同じキーに (値名, 型, 値) を順に書き込み、成功した件数を返す（最初の失敗で中断）
+        
+        型がNoneの項目は値を削除する（既に存在しなければ成功として扱う）。
+        """
+        written = 0
+        
+        def set_all(handle):
+            nonlocal written
+            for value_name, value_type, value in entries[written:]:
+                if value_type is None:
+                    try:
+                        self.backend.delete_value(handle, value_name)
+                    except FileNotFoundError:
+                        pass
+                else:
+                    self.backend.set_value(handle, value_name, value_type, value)
+                written += 1
+        
+        try:
+            self._run(root, key_path, True, set_all, "write_values")
+        except Exception as e:
+            print(f"書き込みエラー: {e}")
+        return written
+    
+    @_registry_method
+    def list_values(self, key_path: str, root=winreg.HKEY_CURRENT_USER) -> Optional[List[Tuple[str, Any, int]]]:
+        """キーのすべての値を (値名, 値, 型) で取得（キーが存在しない場合はNone）"""
+        try:
+            return self._run(root, key_path, False, self.backend.enum_values, "list_values")
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"読み取りエラー: {e}")
+            return []
+    
+    @_registry_method
+    def list_subkeys(self, key_path: str, root=winreg.HKEY_CURRENT_USER) -> Optional[List[str]]:
+        """サブキーの名前の一覧を取得（キーが存在しない場合はNone）"""
+        try:
+            return self._run(root, key_path, False, self.backend.enum_keys, "list_subkeys")
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"読み取りエラー: {e}")
+            return []
+    
+    @_registry_method
+    def delete_value(self, key_path: str, value_name: str, root=winreg.HKEY_CURRENT_USER) -> bool:
+        """レジストリ値を削除する（既に存在しない場合も成功とみなす）"""
+        try:
+            self._run(root, key_path, True, lambda handle: self.backend.delete_value(handle, value_name), "delete_value")
+            return True
+        except FileNotFoundError:
+            return True
+        except Exception as e:
+            print(f"削除エラー: {e}")
+            return False
+    
+    @_registry_method
+    def key_exists(self, key_path: str, root=winreg.HKEY_CURRENT_USER) -> bool:
+        """レジストリキーが存在するかチェック"""
+        try:
+            self._run(root, key_path, False, lambda handle: None, "key_exists")
+            return True
+        except FileNotFoundError:
+            return False
+    
+    @_registry_method
+    def delete_key(self, key_path: str, root=winreg.HKEY_CURRENT_USER) -> bool:
+        """レジストリキーを削除する"""
+        self.invalidate(key_path, root)
+        try:
+            with INSTRUMENTATION.span("registry", "delete_key", f"{ROOT_NAMES.get(root, hex(root))}\\{key_path}"):
+                self.backend.delete_key(root, key_path)
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"削除エラー: {e}")
+            return False
+
+class BackupManager:
+    """設定のバックアップを管理するクラス"""
+    
+    def __init__(self, backup_file="settings_backup.json"):
+        self.backup_file = backup_file
+    
+    def save_backup(self, settings: Dict[str, Any]):
+        """設定をバックアップ"""
+        backup_data = {
+            "timestamp": datetime.now().isoformat(),
+            "settings": settings
+        }
+        try:
+            with INSTRUMENTATION.span("backup", "save_backup", self.backup_file):
+                with open(self.backup_file, 'w', encoding='utf-8') as f:
+                    json.dump(backup_data, f, indent=4, ensure_ascii=False)
+            return True
+        except Exception as e:
+            print(f"バックアップエラー: {e}")
+            return False
+    
+    def load_backup(self) -> Optional[Dict[str, Any]]:
+        """バックアップを読み込む"""
+        try:
+            if os.path.exists(self.backup_file):
+                with INSTRUMENTATION.span("backup", "load_backup", self.backup_file):
+                    with open(self.backup_file, 'r', encoding='utf-8') as f:
+                        return json.load(f)
+            return None
+        except Exception as e:
+            print(f"バックアップ読み込みエラー: {e}")
+            return None
+
+# 設定を反映させるために必要な操作（後ろほど影響が大きく、前の操作の効果を含む）
+EFFECTS = ("none", "broadcast", "explorer", "signout", "reboot")
+
+# 反映方法の表示名
+EFFECT_LABELS = {
+    "none": "即時適用",
+    "broadcast": "即時適用",
+    "explorer": "Explorer再起動",
+    "signout": "サインアウト",
+    "reboot": "PC再起動",
+}
+
+# 設定項目の状態と、状態配列に格納するコード（0はスキャン前・適用待ちの選択なし）
+STATES = (None, "unknown", "enabled", "disabled")
+STATE_CODES = {state: code for code, state in enumerate(STATES)}
+
+# 0のバイトを"0"、それ以外を"1"に変換する表（バイト列をビット列の文字列にする）
+_FLAG_DIGITS = bytes([0x30] + [0x31] * 255)
+
+def mask_from_flags(flags: bytes) -> int:
+    """位置ごとのバイト（0以外が真）を、位置iをビットiとするビットセットに変換"""
+    return int(flags.translate(_FLAG_DIGITS)[::-1], 2) if flags else 0
+
+def mask_positions(mask: int) -> List[int]:
+    """ビットセットで立っているビットの位置の一覧"""
+    bits = format(mask, "b")[::-1]
+    positions = []
+    position = bits.find("1")
+    while position >= 0:
+        positions.append(position)
+        position = bits.find("1", position + 1)
+    return positions
+
+def mask_count(mask: int) -> int:
+    """ビットセットで立っているビットの数"""
+    return bin(mask).count("1")
+
+class StateVector:
+    """カタログの並び順に、各項目の状態を1バイトのコード（STATE_CODES）で持つ配列
+    
+    比較は配列全体を整数としてXORして行い、結果を項目の位置をビットにしたビットセットで返す。
+    同じカタログの配列どうしは設定IDの一覧と位置の索引を共有する。
+    """
+    
+    __slots__ = ("setting_ids", "positions", "codes")
+    
+    def __init__(self, setting_ids: List[str], codes: Optional[bytes] = None,
+                 positions: Optional[Dict[str, int]] = None):
+        self.setting_ids = setting_ids
+        if positions is None:
+            positions = {setting_id: position for position, setting_id in enumerate(setting_ids)}
+        self.positions = positions
+        self.codes = bytearray(codes) if codes is not None else bytearray(len(setting_ids))
+    
+    def like(self, codes: Optional[bytes] = None) -> "StateVector":
+        """同じ並び順の配列を作成（codesを省略するとすべて0）"""
+        return StateVector(self.setting_ids, codes, self.positions)
+    
+    def copy(self) -> "StateVector":
+        return self.like(self.codes)
+    
+    def __len__(self) -> int:
+        return len(self.codes)
+    
+    def __getitem__(self, setting_id: str) -> Optional[str]:
+        return STATES[self.codes[self.positions[setting_id]]]
+    
+    def __setitem__(self, setting_id: str, state: Optional[str]):
+        self.codes[self.positions[setting_id]] = STATE_CODES[state]
+    
+    def update(self, states: Dict[str, Optional[str]]):
+        """設定ID -> 状態 の辞書で更新（カタログにないIDは無視）"""
+        positions = self.positions
+        for setting_id, state in states.items():
+            position = positions.get(setting_id)
+            if position is not None:
+                self.codes[position] = STATE_CODES[state]
+    
+    def to_dict(self) -> Dict[str, Optional[str]]:
+        return {setting_id: STATES[code] for setting_id, code in zip(self.setting_ids, self.codes)}
+    
+    def defined(self) -> int:
+        """状態が設定されている（コードが0でない）項目のビットセット"""
+        return mask_from_flags(self.codes)
+    
+    def differs(self, other: "StateVector") -> int:
+        """状態が異なる項目のビットセット"""
+        xor = int.from_bytes(self.codes, "little") ^ int.from_bytes(other.codes, "little")
+        return mask_from_flags(xor.to_bytes(len(self.codes), "little"))
+    
+    def mismatches(self, other: "StateVector") -> int:
+        """状態が設定されている項目のうち、otherと状態が異なるもののビットセット"""
+        return self.defined() & self.differs(other)
+    
+    def where(self, state: Optional[str]) -> int:
+        """指定した状態の項目のビットセット"""
+        table = bytearray(256)
+        table[STATE_CODES[state]] = 1
+        return mask_from_flags(self.codes.translate(table))
+    
+    def ids(self, mask: int) -> List[str]:
+        """ビットセットに含まれる設定ID（カタログの並び順）"""
+        return [self.setting_ids[position] for position in mask_positions(mask)]
+    
+    def clear(self, mask: int):
+        """ビットセットに含まれる項目のコードを0に戻す"""
+        for position in mask_positions(mask):
+            self.codes[position] = 0
+    
+    @staticmethod
+    def divergence(vectors: List["StateVector"]) -> int:
+        """複数の配列（マシンごとの状態など）の間で状態が一致しない項目のビットセット"""
+        if not vectors:
+            return 0
+        first = int.from_bytes(vectors[0].codes, "little")
+        flags = 0
+        for vector in vectors[1:]:
+            flags |= first ^ int.from_bytes(vector.codes, "little")
+        return mask_from_flags(flags.to_bytes(len(vectors[0].codes), "little"))
+
+# 単独で作成した設定項目が使う1項目分の配列の設定ID
+_SINGLE_IDS = [""]
+
+class SettingItem:
+    """設定項目を表す基底クラス
+    
+    現在の状態（current_value）と適用待ちの選択（new_value）は、所属するカタログの
+    状態配列（SettingCatalog.current / pending）の自分の位置に格納する。
+    """
+    
+    __slots__ = ("name", "description", "category", "effect", "broadcast_area", "_current", "_pending", "_position")
+    
+    def __init__(self, name: str, description: str, category: str = "その他",
+                 effect: str = "none", broadcast_area: Optional[str] = None):
+        self.name = name
+        self.description = description
+        self.category = category
+        # 反映に必要な操作（EFFECTSのいずれか）と、WM_SETTINGCHANGEで通知する設定の種類
+        self.effect = effect
+        self.broadcast_area = broadcast_area
+        # カタログに属さない場合は状態を設定したときに1項目分の配列を作る
+        self._current: Optional[StateVector] = None
+        self._pending: Optional[StateVector] = None
+        self._position = 0
+    
+    def bind(self, current: StateVector, pending: StateVector, position: int):
+        """状態の格納先をカタログの状態配列にする"""
+        self._current = current
+        self._pending = pending
+        self._position = position
+    
+    def _vectors(self) -> Tuple[StateVector, StateVector]:
+        if self._current is None:
+            self.bind(StateVector(_SINGLE_IDS), StateVector(_SINGLE_IDS), 0)
+        return self._current, self._pending
+    
+    @property
+    def current_value(self) -> Optional[str]:
+        """スキャンした状態（スキャン前はNone）"""
+        return STATES[self._current.codes[self._position]] if self._current is not None else None
+    
+    @current_value.setter
+    def current_value(self, state: Optional[str]):
+        self._vectors()[0].codes[self._position] = STATE_CODES[state]
+    
+    @property
+    def new_value(self) -> Optional[str]:
+        """適用待ちの選択（なければNone）"""
+        return STATES[self._pending.codes[self._position]] if self._pending is not None else None
+    
+    @new_value.setter
+    def new_value(self, state: Optional[str]):
+        self._vectors()[1].codes[self._position] = STATE_CODES[state]
+    
+    @property
+    def modified(self) -> bool:
+        """適用待ちの選択が現在の状態と異なるか"""
+        if self._pending is None:
+            return False
+        pending = self._pending.codes[self._position]
+        return pending != 0 and pending != self._current.codes[self._position]
+    
+    def scan_current_value(self, registry=None):
+        """現在の設定値をスキャン"""
+        raise NotImplementedError
+    
+    def apply_setting(self, registry=None):
+        """設定を適用"""
+        raise NotImplementedError
+    
+    def get_backup_data(self) -> Dict[str, Any]:
+        """バックアップデータを取得"""
+        return {
+            "name": self.name,
+            "current_value": self.current_value
+        }
+
+# バイナリ値として扱う型（bytes / bytearray / memoryview）
+BINARY_TYPES = (bytes, bytearray, memoryview)
+
+class RegistrySettingItem(SettingItem):
+    """レジストリ設定項目
+    
+    offsetを指定した REG_BINARY の項目は、値全体ではなくoffsetバイト目からの
+    enabled_value / disabled_value の長さの部分を、maskのビットだけ比較・書き換える（リトルエンディアン）。
+    """
+    
+    __slots__ = ("key_path", "value_name", "value_type", "enabled_value", "disabled_value", "root", "labels",
+                 "offset", "mask", "_match")
+    
+    def __init__(self, name: str, description: str, key_path: str, value_name: str, 
+                 value_type: int, enabled_value: Any, disabled_value: Any, 
+                 root=winreg.HKEY_CURRENT_USER, labels=("有効", "無効"), category: str = "その他",
+                 effect: str = "none", broadcast_area: Optional[str] = None,
+                 offset: Optional[int] = None, mask: Optional[bytes] = None):
+        super().__init__(name, description, category, effect, broadcast_area)
+        self.key_path = key_path
+        self.value_name = value_name
+        self.value_type = value_type
+        self.enabled_value = enabled_value
+        self.disabled_value = disabled_value
+        self.root = root
+        self.labels = labels
+        self.offset = offset
+        self.mask = mask
+        # 値 -> 状態 の判定はカタログの読み込み時に1回だけ組み立てる
+        self._match = self._compile_match()
+    
+    def _compile_match(self) -> Callable[[Any], str]:
+        """値の型に合わせた 生の値 -> 状態 の判定関数を作成"""
+        enabled_value, disabled_value = self.enabled_value, self.disabled_value
+        if self.offset is not None:
+            # 値の一部分：コピーせずにmemoryviewで該当するバイトだけを整数にしてmaskで比較する
+            start, end = self.offset, self.offset + len(enabled_value)
+            mask = int.from_bytes(self.mask or b"\xff" * len(enabled_value), "little")
+            states = {
+                int.from_bytes(enabled_value, "little") & mask: "enabled",
+                int.from_bytes(disabled_value, "little") & mask: "disabled",
+            }
+            
+            def match(value: Any) -> str:
+                if not isinstance(value, BINARY_TYPES) or len(value) < end:
+                    return "unknown"
+                with memoryview(value) as view:
+                    return states.get(int.from_bytes(view[start:end], "little") & mask, "unknown")
+            return match
+        
+        if self.value_type == winreg.REG_BINARY:
+            # 値全体：bytesとbytearrayはそのまま比較できる
+            def match(value: Any) -> str:
+                if not isinstance(value, BINARY_TYPES):
+                    return "unknown"
+                if value == enabled_value:
+                    return "enabled"
+                if value == disabled_value:
+                    return "disabled"
+                return "unknown"
+            return match
+        
+        if self.value_type == winreg.REG_MULTI_SZ:
+            # 文字列のリスト：タプルにして辞書で引く
+            states = {tuple(enabled_value): "enabled", tuple(disabled_value): "disabled"}
+            return lambda value: states.get(tuple(value), "unknown") if isinstance(value, list) else "unknown"
+        
+        # 整数・文字列：辞書で引く（型の違うハッシュできない値は不明）
+        states = {enabled_value: "enabled", disabled_value: "disabled"}
+        
+        def match(value: Any) -> str:
+            try:
+                return states.get(value, "unknown")
+            except TypeError:
+                return "unknown"
+        return match
+    
+    def evaluate(self, value: Any) -> str:
+        """レジストリの生の値を状態に変換"""
+        return self._match(value)
+    
+    def target_value(self, state: Optional[str], current: Any = None) -> Any:
+        """状態に対応するレジストリの値を取得（対応しない状態はNone）
+        
+        offsetを指定した項目は、現在の値currentの該当する部分を書き換えた値になる（currentが短ければNone）。
+        """
+        if state == "enabled":
+            value = self.enabled_value
+        elif state == "disabled":
+            value = self.disabled_value
+        else:
+            return None
+        if self.offset is None:
+            return value
+        return self.patch(current, value)
+    
+    def patch(self, current: Any, value: bytes) -> Optional[bytes]:
+        """現在の値のoffsetバイト目からをvalueのmaskのビットで書き換えた値（書き換えられなければNone）"""
+        end = self.offset + len(value)
+        if not isinstance(current, BINARY_TYPES) or len(current) < end:
+            return None
+        mask = int.from_bytes(self.mask or b"\xff" * len(value), "little")
+        blob = bytearray(current)
+        with memoryview(blob) as view:
+            field = int.from_bytes(view[self.offset:end], "little")
+            field = (field & ~mask) | (int.from_bytes(value, "little") & mask)
+            view[self.offset:end] = field.to_bytes(len(value), "little")
+        return bytes(blob)
+    
+    def scan_current_value(self, registry=None):
+        """現在の設定値をスキャン"""
+        registry = registry or RegistryManager
+        value = registry.read_value(self.key_path, self.value_name, self.root)
+        self.current_value = self.evaluate(value)
+        return self.current_value
+    
+    def apply_setting(self, registry=None):
+        """設定を適用"""
+        registry = registry or RegistryManager
+        current = None
+        if self.offset is not None:
+            current = registry.read_value(self.key_path, self.value_name, self.root)
+        value = self.target_value(self.new_value, current)
+        if value is None:
+            return False
+        return registry.write_value(self.key_path, self.value_name, value, self.value_type, self.root)
+
+# サービスの開始の種類（sc.exe config の start= の値）
+SERVICE_START_TYPES = ("boot", "system", "auto", "delayed-auto", "demand", "disabled")
+
+# Win32_ServiceのStartModeから開始の種類への変換
+_SERVICE_START_MODES = {"boot": "boot", "system": "system", "auto": "auto", "manual": "demand", "disabled": "disabled"}
+
+def parse_service_csv(text: str) -> Dict[str, str]:
+    """Win32_Service（Name, StartMode, DelayedAutoStart）のCSVを 小文字のサービス名 -> 開始の種類 にする"""
+    services = {}
+    for row in csv.DictReader(io.StringIO(text.strip())):
+        name = (row.get("Name") or "").strip()
+        start_type = _SERVICE_START_MODES.get((row.get("StartMode") or "").strip().lower())
+        if not name or start_type is None:
+            continue
+        if start_type == "auto" and (row.get("DelayedAutoStart") or "").strip().lower() == "true":
+            start_type = "delayed-auto"
+        services[name.lower()] = start_type
+    return services
+
+def parse_task_xml(text: str) -> Dict[str, bool]:
+    """schtasks /query /xml ONE の出力を 小文字のタスクのパス -> 有効ならTrue にする
+    
+    出力では各タスクの直前のコメントにタスクのパスが書かれている。
+    """
+    from xml.etree import ElementTree
+    
+    # str として解析するため、エンコーディングの宣言は取り除く
+    text = re.sub(r"<\?xml[^>]*\?>", "", text).strip()
+    if not text:
+        return {}
+    parser = ElementTree.XMLParser(target=ElementTree.TreeBuilder(insert_comments=True))
+    parser.feed(text)
+    document = parser.close()
+    tasks = {}
+    path = None
+    for node in document:
+        if node.tag is ElementTree.Comment:
+            path = (node.text or "").strip()
+        elif isinstance(node.tag, str) and node.tag.rpartition("}")[2] == "Task" and path:
+            enabled = node.find("{*}Settings/{*}Enabled")
+            tasks[path.lower()] = enabled is None or (enabled.text or "").strip().lower() != "false"
+            path = None
+    return tasks
+
+class SystemQuery:
+    """サービス・タスクスケジューラーの状態の一括取得と変更を抽象化する基底クラス"""
+    
+    def query_services(self) -> Dict[str, str]:
+        """すべてのサービスの開始の種類（小文字のサービス名 -> SERVICE_START_TYPESのいずれか）"""
+        raise NotImplementedError
+    
+    def set_service_start(self, service: str, start_type: str):
+        """サービスの開始の種類を変更する（失敗した場合は例外）"""
+        raise NotImplementedError
+    
+    def query_tasks(self) -> Dict[str, bool]:
+        """すべてのタスクの状態（小文字のタスクのパス -> 有効ならTrue）"""
+        raise NotImplementedError
+    
+    def set_task_enabled(self, task: str, enabled: bool):
+        """タスクを有効・無効にする（失敗した場合は例外）"""
+        raise NotImplementedError
+
+class WindowsSystemQuery(SystemQuery):
+    """PowerShell・sc.exe・schtasks.exeを使う実環境の問い合わせ層（問い合わせは種類ごとに1回の外部コマンド）"""
+    
+    SERVICE_COMMAND = [
+        "powershell", "-NoProfile", "-NonInteractive", "-Command",
+        "Get-CimInstance Win32_Service | Select-Object Name,StartMode,DelayedAutoStart"
+        " | ConvertTo-Csv -NoTypeInformation",
+    ]
+    TASK_COMMAND = ["schtasks", "/query", "/xml", "ONE"]
+    
+    @staticmethod
+    def _run(command: List[str]) -> str:
+        with INSTRUMENTATION.span("subprocess", os.path.basename(command[0]), " ".join(command[1:3])):
+            completed = subprocess.run(command, check=True, capture_output=True, text=True, errors="replace")
+        return completed.stdout
+    
+    def query_services(self):
+        return parse_service_csv(self._run(self.SERVICE_COMMAND))
+    
+    def set_service_start(self, service, start_type):
+        self._run(["sc.exe", "config", service, "start=", start_type])
+    
+    def query_tasks(self):
+        return parse_task_xml(self._run(self.TASK_COMMAND))
+    
+    def set_task_enabled(self, task, enabled):
+        self._run(["schtasks", "/change", "/tn", task, "/enable" if enabled else "/disable"])
+
+class FixtureSystemQuery(SystemQuery):
+    """記録したコマンドの出力を解析して使う問い合わせ層（Windows以外でのベンチマーク・テスト用）
+    
+    変更はメモリ上の状態に反映され、問い合わせ・変更の回数はcallsに記録される。
+    """
+    
+    def __init__(self, services_csv: str = "", tasks_xml: str = ""):
+        self.services = parse_service_csv(services_csv) if services_csv else {}
+        self.tasks = parse_task_xml(tasks_xml) if tasks_xml else {}
+        self.calls = Counter()
+        # 変更を失敗させるサービス名・タスクのパス（小文字、障害の再現用）
+        self.fail_changes: set = set()
+    
+    def _change(self, states: Dict[str, Any], name: str, value: Any):
+        if name.lower() in self.fail_changes:
+            raise PermissionError(f"アクセスが拒否されました: {name}")
+        if name.lower() not in states:
+            raise FileNotFoundError(f"見つかりません: {name}")
+        states[name.lower()] = value
+    
+    def query_services(self):
+        self.calls["query_services"] += 1
+        return dict(self.services)
+    
+    def set_service_start(self, service, start_type):
+        self.calls["set_service_start"] += 1
+        self._change(self.services, service, start_type)
+    
+    def query_tasks(self):
+        self.calls["query_tasks"] += 1
+        return dict(self.tasks)
+    
+    def set_task_enabled(self, task, enabled):
+        self.calls["set_task_enabled"] += 1
+        self._change(self.tasks, task, enabled)
+
+# 問い合わせ層を指定しない項目が使う既定の問い合わせ層
+_default_system: Optional[SystemQuery] = None
+
+def default_system_query() -> SystemQuery:
+    """既定の問い合わせ層（Windows以外では空のフィクスチャ）"""
+    global _default_system
+    if _default_system is None:
+        _default_system = WindowsSystemQuery() if HAS_WINREG else FixtureSystemQuery()
+    return _default_system
+
+class SystemSettingItem(SettingItem):
+    """レジストリ以外（サービス・スケジュールされたタスク）の設定項目の基底クラス
+    
+    状態は種類ごとに1回の問い合わせ（query_all）で対象すべての値を取得して求める。
+    """
+    
+    __slots__ = ("target", "enabled_value", "disabled_value", "labels", "system")
+    
+    def __init__(self, name: str, description: str, target: str, enabled_value: Any, disabled_value: Any,
+                 labels=("有効", "無効"), category: str = "その他", effect: str = "none",
+                 broadcast_area: Optional[str] = None, system: Optional[SystemQuery] = None):
+        super().__init__(name, description, category, effect, broadcast_area)
+        # サービス名・タスクのパス
+        self.target = target
+        self.enabled_value = enabled_value
+        self.disabled_value = disabled_value
+        self.labels = labels
+        # 問い合わせ層（Noneなら既定の問い合わせ層）
+        self.system = system
+    
+    @classmethod
+    def query_all(cls, system: SystemQuery) -> Dict[str, Any]:
+        """この種類の対象すべての生の値（小文字の対象名 -> 値）を1回の問い合わせで取得"""
+        raise NotImplementedError
+    
+    def change(self, system: SystemQuery, value: Any):
+        """生の値を書き込む（失敗した場合は例外）"""
+        raise NotImplementedError
+    
+    def evaluate(self, value: Any) -> str:
+        """生の値を状態に変換"""
+        if value == self.enabled_value:
+            return "enabled"
+        elif value == self.disabled_value:
+            return "disabled"
+        return "unknown"
+    
+    def target_value(self, state: Optional[str]) -> Any:
+        """状態に対応する生の値を取得（対応しない状態はNone）"""
+        if state == "enabled":
+            return self.enabled_value
+        elif state == "disabled":
+            return self.disabled_value
+        return None
+    
+    @staticmethod
+    def group_by_kind(settings: Dict[str, SettingItem]) -> Dict[type, Dict[str, "SystemSettingItem"]]:
+        """サービス・タスクの設定項目を種類ごとにまとめる"""
+        groups: Dict[type, Dict[str, SystemSettingItem]] = {}
+        for setting_id, setting in settings.items():
+            if isinstance(setting, SystemSettingItem):
+                groups.setdefault(type(setting), {})[setting_id] = setting
+        return groups
+    
+    @classmethod
+    def read_batch(cls, items: Dict[str, "SystemSettingItem"]) -> Dict[str, Any]:
+        """同じ種類の項目の生の値を、問い合わせ層ごとに1回の問い合わせでまとめて取得（取得できなければNone）"""
+        by_system: Dict[int, Tuple[SystemQuery, List[str]]] = {}
+        for setting_id, setting in items.items():
+            system = setting.system or default_system_query()
+            by_system.setdefault(id(system), (system, []))[1].append(setting_id)
+        
+        raw_values: Dict[str, Any] = {}
+        for system, setting_ids in by_system.values():
+            try:
+                values = cls.query_all(system)
+            except Exception as e:
+                print(f"読み取りエラー: {e}")
+                values = {}
+            for setting_id in setting_ids:
+                raw_values[setting_id] = values.get(items[setting_id].target.lower())
+        return raw_values
+    
+    @classmethod
+    def scan_batch(cls, items: Dict[str, "SystemSettingItem"]) -> Dict[str, str]:
+        """同じ種類の項目をまとめてスキャンして状態を返す"""
+        states = {}
+        for setting_id, value in cls.read_batch(items).items():
+            setting = items[setting_id]
+            setting.current_value = setting.evaluate(value)
+            states[setting_id] = setting.current_value
+        return states
+    
+    def scan_current_value(self, registry=None):
+        """現在の設定値をスキャン"""
+        return self.scan_batch({self.target: self})[self.target]
+    
+    def apply_value(self, value: Any) -> bool:
+        """生の値を書き込む"""
+        try:
+            self.change(self.system or default_system_query(), value)
+            return True
+        except Exception as e:
+            print(f"書き込みエラー: {e}")
+            return False
+    
+    def apply_setting(self, registry=None):
+        """設定を適用"""
+        value = self.target_value(self.new_value)
+        if value is None:
+            return False
+        return self.apply_value(value)
+
+class ServiceSettingItem(SystemSettingItem):
+    """サービスの開始の種類の設定項目（生の値はSERVICE_START_TYPESのいずれか）"""
+    
+    __slots__ = ()
+    
+    @classmethod
+    def query_all(cls, system):
+        return system.query_services()
+    
+    def change(self, system, value):
+        system.set_service_start(self.target, value)
+
+class TaskSettingItem(SystemSettingItem):
+    """スケジュールされたタスクの有効・無効の設定項目（生の値は有効ならTrue）"""
+    
+    __slots__ = ()
+    
+    def __init__(self, name: str, description: str, target: str, enabled_value: Any = True,
+                 disabled_value: Any = False, **options):
+        super().__init__(name, description, target, enabled_value, disabled_value, **options)
+    
+    @classmethod
+    def query_all(cls, system):
+        return system.query_tasks()
+    
+    def change(self, system, value):
+        system.set_task_enabled(self.target, value)
+
+# カタログの項目の種類 -> 設定項目のクラス
+SETTING_KINDS = {
+    "registry": RegistrySettingItem,
+    "service": ServiceSettingItem,
+    "task": TaskSettingItem,
+}
+
+# スキャンキャッシュの既定の場所
+SCAN_CACHE_FILE = os.path.join(APP_DIR, "scan_cache.bin")
+
+class ScanCache:
+    """キーの最終書き込み時刻と、そのキーから読み取った値を起動をまたいで保存するスキャンキャッシュ
+    
+    次回のスキャンではキーの最終書き込み時刻だけを確認し、変わったキーの値だけを読み直す。
+    """
+    
+    # キャッシュ形式を変更したら更新する（異なるバージョンのファイルは読み込まずにすべて読み直す）
+    VERSION = 1
+    
+    def __init__(self, cache_file: Optional[str] = SCAN_CACHE_FILE):
+        self.cache_file = cache_file
+        # (root, 小文字のキーパス) -> (最終書き込み時刻, {小文字の値名: (値, 型)、値がなければNone})
+        self.entries: Dict[Tuple[int, str], Tuple[int, Dict[str, Optional[Tuple[Any, int]]]]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self._lock = threading.Lock()
+    
+    def load(self) -> bool:
+        """キャッシュファイルを読み込む（存在しない・壊れている・形式が古い場合は空のままFalse）"""
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return False
+        try:
+            with open(self.cache_file, 'rb') as f:
+                cached = marshal.loads(f.read())
+            if cached.get("version") == self.VERSION:
+                with self._lock:
+                    self.entries = {
+                        (root, key_path): (timestamp, values)
+                        for root, key_path, timestamp, values in cached["entries"]
+                    }
+                    self.dirty = False
+                return True
+        except Exception as e:
+            print(f"スキャンキャッシュ読み込みエラー: {e}")
+        return False
+    
+    def save(self):
+        """変更があればキャッシュファイルに保存"""
+        if not self.cache_file or not self.dirty:
+            return
+        with self._lock:
+            cached = {
+                "version": self.VERSION,
+                "entries": [
+                    (root, key_path, timestamp, values)
+                    for (root, key_path), (timestamp, values) in self.entries.items()
+                ],
+            }
+            self.dirty = False
+        temp_file = self.cache_file + ".tmp"
+        try:
+            with open(temp_file, 'wb') as f:
+                f.write(marshal.dumps(cached))
+            os.replace(temp_file, self.cache_file)
+        except Exception as e:
+            print(f"スキャンキャッシュ保存エラー: {e}")
+    
+    def lookup(self, root: int, key_path: str, value_names: List[str]) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """指定した値がすべて記録されていれば (最終書き込み時刻, 値) を返す"""
+        entry = self.entries.get((root, key_path.lower()))
+        if entry is None or any(value_name.lower() not in entry[1] for value_name in value_names):
+            return None
+        return entry
+    
+    def store(self, root: int, key_path: str, timestamp: int, values: Dict[str, Optional[Tuple[Any, int]]]):
+        """読み取った値を記録（同じ時刻の記録があれば値を追加する）"""
+        key = (root, key_path.lower())
+        with self._lock:
+            entry = self.entries.get(key)
+            merged = dict(entry[1]) if entry is not None and entry[0] == timestamp else {}
+            merged.update((value_name.lower(), value) for value_name, value in values.items())
+            self.entries[key] = (timestamp, merged)
+            self.dirty = True
+    
+    def record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+    
+    def stats(self) -> Dict[str, int]:
+        """キーごとのヒット・ミス回数"""
+        return {"hits": self.hits, "misses": self.misses, "keys": len(self.entries)}
+
+class BatchScanner:
+    """設定項目をキー単位にまとめて一括スキャンするエンジン
+    
+    cacheを指定すると、最終書き込み時刻が前回と変わっていないキーの値はキャッシュから返す。
+    """
+    
+    def __init__(self, registry=None, cache: Optional[ScanCache] = None):
+        self.registry = registry or RegistryManager
+        self.cache = cache
+    
+    @staticmethod
+    def group_by_key(settings: Dict[str, SettingItem]) -> Dict[Tuple[int, str], List[str]]:
+        """レジストリ設定項目を(root, キーパス)ごとにまとめる"""
+        groups: Dict[Tuple[int, str], List[str]] = {}
+        for setting_id, setting in settings.items():
+            if isinstance(setting, RegistrySettingItem):
+                key = (setting.root, setting.key_path.lower())
+                groups.setdefault(key, []).append(setting_id)
+        return groups
+    
+    def iter_read(self, settings: Dict[str, SettingItem]) -> Iterator[Dict[str, Any]]:
+        """キーを1回ずつ開き、キーごとに生の値をまとめて返す"""
+        for (root, _), setting_ids in self.group_by_key(settings).items():
+            key_path = settings[setting_ids[0]].key_path
+            value_names = [settings[setting_id].value_name for setting_id in setting_ids]
+            if self.cache is not None:
+                values = self._read_cached(root, key_path, value_names)
+            else:
+                values = self.registry.read_values(key_path, value_names, root)
+            yield {setting_id: values[settings[setting_id].value_name] for setting_id in setting_ids}
+    
+    def _read_cached(self, root: int, key_path: str, value_names: List[str]) -> Dict[str, Any]:
+        """キーの最終書き込み時刻がキャッシュと同じならキャッシュの値を、変わっていれば読み直した値を返す"""
+        cached = self.cache.lookup(root, key_path, value_names)
+        timestamp, values = self.registry.query_values_since(
+            key_path, value_names, cached[0] if cached is not None else None, root
+        )
+        if values is None and timestamp is not None:
+            self.cache.record(True)
+            return {value_name: (cached[1][value_name.lower()] or (None, None))[0] for value_name in value_names}
+        
+        self.cache.record(False)
+        if values is None:
+            # キーが存在しない
+            return {value_name: None for value_name in value_names}
+        if timestamp is not None:
+            self.cache.store(root, key_path, timestamp, values)
+        return {value_name: (values.get(value_name) or (None, None))[0] for value_name in value_names}
+    
+    def read_all(self, settings: Dict[str, SettingItem]) -> Dict[str, Any]:
+        """レジストリ設定項目の生の値をまとめて読み取る"""
+        raw_values: Dict[str, Any] = {}
+        for batch in self.iter_read(settings):
+            raw_values.update(batch)
+        return raw_values
+    
+    def iter_scan(self, settings: Dict[str, SettingItem]) -> Iterator[Dict[str, str]]:
+        """キーごとにスキャンし、読み取れた分の状態を順次返す"""
+        for batch in self.iter_read(settings):
+            states = {}
+            for setting_id, value in batch.items():
+                setting = settings[setting_id]
+                setting.current_value = setting.evaluate(value)
+                states[setting_id] = setting.current_value
+            yield states
+        
+        # サービス・タスクは種類ごとに1回の問い合わせでまとめてスキャン
+        for kind, items in SystemSettingItem.group_by_kind(settings).items():
+            with INSTRUMENTATION.span("phase", "scan_batch", kind.__name__):
+                yield kind.scan_batch(items)
+        
+        # それ以外の設定項目は個別にスキャン
+        for setting_id, setting in settings.items():
+            if not isinstance(setting, (RegistrySettingItem, SystemSettingItem)):
+                yield {setting_id: setting.scan_current_value(self.registry)}
+    
+    def scan(self, settings: Dict[str, SettingItem]) -> Dict[str, str]:
+        """すべての設定項目をスキャンして状態を返す"""
+        states: Dict[str, str] = {}
+        with INSTRUMENTATION.span("phase", "scan"):
+            for batch in self.iter_scan(settings):
+                states.update(batch)
+        return {setting_id: states[setting_id] for setting_id in settings}
+
+class ScanWorker:
+    """バックグラウンドスレッドで設定をスキャンし、キーごとの結果を通知するワーカー
+    
+    on_batchとon_doneはワーカースレッドから呼ばれる。GUIから使う場合は
+    キューに積んでTkのafter()で取り出すこと。
+    """
+    
+    def __init__(self, scanner: BatchScanner, settings: Dict[str, SettingItem],
+                 on_batch: Callable[[Dict[str, str]], None],
+                 on_done: Optional[Callable[[float], None]] = None):
+        self.scanner = scanner
+        self.settings = settings
+        self.on_batch = on_batch
+        self.on_done = on_done
+        self.elapsed: Optional[float] = None
+        self._thread = threading.Thread(target=self._run, name="scan-worker", daemon=True)
+    
+    def start(self) -> "ScanWorker":
+        self._thread.start()
+        return self
+    
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """スキャン完了を待つ（完了していればTrue）"""
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+    
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            for batch in self.scanner.iter_scan(self.settings):
+                self.on_batch(batch)
+        except Exception as e:
+            print(f"スキャンエラー: {e}")
+        finally:
+            self.elapsed = time.perf_counter() - start
+            INSTRUMENTATION.record("phase", "background_scan", None, self.elapsed, start)
+            if self.on_done:
+                self.on_done(self.elapsed)
+
+class PlannedWrite(NamedTuple):
+    """適用計画の1件分の書き込み（value_typeがNoneの場合は値の削除）"""
+    setting_id: str
+    value_name: str
+    value_type: Optional[int]
+    new_value: Any
+    # 書き込み前の値と型（値が存在しない場合はNone）
+    old_value: Any
+    old_type: Optional[int]
+
+class PlannedChange(NamedTuple):
+    """適用計画の1件分のサービス・タスクの変更"""
+    setting_id: str
+    old_value: Any
+    new_value: Any
+
+class KeyWriteGroup:
+    """同じキーへの書き込みをまとめたもの"""
+    
+    def __init__(self, root: int, key_path: str, key_existed: bool):
+        self.root = root
+        self.key_path = key_path
+        self.key_existed = key_existed
+        self.writes: List[PlannedWrite] = []
+
+class WritePlan:
+    """実際に値が変わる項目だけを含む適用計画"""
+    
+    def __init__(self):
+        self.groups: Dict[Tuple[int, str], KeyWriteGroup] = {}
+        # 既に目標値になっているため書き込みを省略した項目
+        self.skipped: List[str] = []
+        # 目標値を決められない（"unknown"など）項目
+        self.invalid: List[str] = []
+        # サービス・タスクの変更（レジストリの書き込みの後に適用し、失敗時は元に戻す）
+        self.changes: List[PlannedChange] = []
+        # それ以外の設定項目（トランザクション外で個別に適用）
+        self.others: List[str] = []
+    
+    def __len__(self) -> int:
+        return sum(len(group.writes) for group in self.groups.values()) + len(self.changes) + len(self.others)
+    
+    @property
+    def setting_ids(self) -> List[str]:
+        """書き込み対象の設定IDの一覧"""
+        ids = [write.setting_id for group in self.groups.values() for write in group.writes]
+        return ids + [change.setting_id for change in self.changes] + self.others
+    
+    def describe(self) -> str:
+        """ドライラン用に計画を文字列化"""
+        lines = []
+        for group in self.groups.values():
+            suffix = "" if group.key_existed else "（新規作成）"
+            lines.append(f"[{ROOT_NAMES.get(group.root, hex(group.root))}\\{group.key_path}]{suffix}")
+            for write in group.writes:
+                value_name = write.value_name or "(既定)"
+                old_value = "(なし)" if write.old_type is None else repr(write.old_value)
+                new_value = "(削除)" if write.value_type is None else repr(write.new_value)
+                lines.append(f"  {value_name}: {old_value} -> {new_value}  ({write.setting_id})")
+        if self.changes:
+            lines.append("[サービス・タスク]")
+        for change in self.changes:
+            lines.append(f"  {change.setting_id}: {change.old_value!r} -> {change.new_value!r}")
+        for setting_id in self.others:
+            lines.append(f"  {setting_id}: 個別に適用")
+        if self.skipped:
+            lines.append(f"変更なし: {', '.join(self.skipped)}")
+        if self.invalid:
+            lines.append(f"対象外: {', '.join(self.invalid)}")
+        if not len(self):
+            lines.insert(0, "書き込みが必要な項目はありません。")
+        return "\n".join(lines)
+
+class ApplyPlanner:
+    """現在値と比較して最小限の書き込み計画を作成する"""
+    
+    def __init__(self, registry=None):
+        self.registry = registry or RegistryManager
+    
+    def plan(self, settings: Dict[str, SettingItem], targets: Dict[str, Optional[str]]) -> WritePlan:
+        """targets（設定ID -> "enabled"/"disabled"）を実現する書き込み計画を作成"""
+        with INSTRUMENTATION.span("phase", "plan"):
+            return self._plan(settings, targets)
+    
+    def _plan(self, settings: Dict[str, SettingItem], targets: Dict[str, Optional[str]]) -> WritePlan:
+        plan = WritePlan()
+        registry_items: Dict[str, RegistrySettingItem] = {}
+        system_values: Dict[str, Any] = {}
+        for setting_id, state in targets.items():
+            setting = settings.get(setting_id)
+            if setting is None:
+                plan.invalid.append(setting_id)
+            elif isinstance(setting, SystemSettingItem):
+                system_values[setting_id] = setting.target_value(state)
+            elif not isinstance(setting, RegistrySettingItem):
+                plan.others.append(setting_id)
+            elif state not in ("enabled", "disabled"):
+                plan.invalid.append(setting_id)
+            else:
+                registry_items[setting_id] = setting
+        
+        for (root, key), setting_ids in BatchScanner.group_by_key(registry_items).items():
+            key_path = registry_items[setting_ids[0]].key_path
+            current = self.registry.query_values(
+                key_path, [registry_items[setting_id].value_name for setting_id in setting_ids], root
+            )
+            group = KeyWriteGroup(root, key_path, current is not None)
+            # 小文字の値名 -> その値への直前の書き込み
+            written: Dict[str, PlannedWrite] = {}
+            for setting_id in setting_ids:
+                setting = registry_items[setting_id]
+                old_value, old_type = (current or {}).get(setting.value_name) or (None, None)
+                previous = written.get(setting.value_name.lower())
+                if previous is not None and setting.offset is not None:
+                    # 同じ値の別の部分を書き換える項目は、前の項目の書き換え結果に重ねる
+                    old_value, old_type = previous.new_value, previous.value_type
+                # 値の一部分を書き換える項目は現在の値から目標値を作る（現在の値がなければ適用できない）
+                new_value = setting.target_value(targets[setting_id], old_value)
+                if new_value is None:
+                    plan.invalid.append(setting_id)
+                    continue
+                if old_type == setting.value_type and old_value == new_value:
+                    plan.skipped.append(setting_id)
+                    continue
+                write = written[setting.value_name.lower()] = PlannedWrite(
+                    setting_id, setting.value_name, setting.value_type, new_value, old_value, old_type
+                )
+                group.writes.append(write)
+            if group.writes:
+                plan.groups[(root, key)] = group
+        self._plan_changes(plan, settings, system_values)
+        return plan
+    
+    @staticmethod
+    def _plan_changes(plan: WritePlan, settings: Dict[str, SettingItem], values: Dict[str, Any]):
+        """サービス・タスクの目標値（設定ID -> 生の値）を現在値と比較して計画に追加"""
+        items = {setting_id: settings[setting_id] for setting_id in values}
+        for kind, group in SystemSettingItem.group_by_kind(items).items():
+            current = kind.read_batch(group)
+            for setting_id in group:
+                old_value, new_value = current[setting_id], values[setting_id]
+                if old_value is None or new_value is None:
+                    plan.invalid.append(setting_id)
+                elif old_value == new_value:
+                    plan.skipped.append(setting_id)
+                else:
+                    plan.changes.append(PlannedChange(setting_id, old_value, new_value))
+    
+    def plan_values(self, targets: List[Tuple[str, Optional[int], str, str, Optional[int], Any]],
+                    settings: Optional[Dict[str, SettingItem]] = None) -> WritePlan:
+        """生の値 (設定ID, root, キーパス, 値名, 型, 値) に戻す書き込み計画を作成（型がNoneなら削除）
+        
+        rootがNoneのものはサービス・タスクの値で、settingsの設定項目を通して戻す。
+        """
+        with INSTRUMENTATION.span("phase", "plan_values"):
+            return self._plan_values(targets, settings or {})
+    
+    def _plan_values(self, targets: List[Tuple[str, Optional[int], str, str, Optional[int], Any]],
+                     settings: Dict[str, SettingItem]) -> WritePlan:
+        plan = WritePlan()
+        by_key: Dict[Tuple[int, str], List[Tuple[str, int, str, str, Optional[int], Any]]] = {}
+        system_values: Dict[str, Any] = {}
+        for target in targets:
+            if target[1] is not None:
+                by_key.setdefault((target[1], target[2].lower()), []).append(target)
+            elif isinstance(settings.get(target[0]), SystemSettingItem):
+                system_values[target[0]] = target[5]
+            else:
+                plan.invalid.append(target[0])
+        
+        for (root, key), entries in by_key.items():
+            key_path = entries[0][2]
+            current = self.registry.query_values(key_path, [entry[3] for entry in entries], root)
+            group = KeyWriteGroup(root, key_path, current is not None)
+            for setting_id, _, _, value_name, value_type, value in entries:
+                old_value, old_type = (current or {}).get(value_name) or (None, None)
+                if old_type == value_type and (value_type is None or old_value == value):
+                    plan.skipped.append(setting_id)
+                    continue
+                group.writes.append(PlannedWrite(setting_id, value_name, value_type, value, old_value, old_type))
+            if group.writes:
+                plan.groups[(root, key)] = group
+        self._plan_changes(plan, settings, system_values)
+        return plan
+
+class TransactionResult:
+    """適用トランザクションの結果"""
+    
+    def __init__(self):
+        self.committed = False
+        self.written: List[str] = []
+        self.failed: Optional[str] = None
+        self.rolled_back = False
+        self.rollback_errors: List[str] = []
+        # 取り消し要求により途中で中止した（書き込んだ分は元に戻す）
+        self.cancelled = False
+
+class ApplyTransaction:
+    """書き込み計画をキー単位で実行し、失敗時は書き込み前の値に戻す"""
+    
+    def __init__(self, registry=None, backup_journal=None):
+        self.registry = registry or RegistryManager
+        # 書き込み前の値を記録する追記型のバックアップジャーナル（journal.BackupJournal）
+        self.backup_journal = backup_journal
+        # (グループ, 書き込み) の適用済みジャーナル
+        self.journal: List[Tuple[KeyWriteGroup, PlannedWrite]] = []
+        # 書き込みを試みたキー
+        self.touched: List[KeyWriteGroup] = []
+        # 適用済みのサービス・タスクの変更
+        self.changed: List[Tuple[SystemSettingItem, PlannedChange]] = []
+    
+    def execute(self, plan: WritePlan, settings: Optional[Dict[str, SettingItem]] = None,
+                label: str = "apply", progress: Optional[Callable[[str, bool], None]] = None,
+                cancel: Optional[threading.Event] = None) -> TransactionResult:
+        """計画を実行（失敗した場合は自動でロールバック）
+        
+        progressは項目を書き込むたびに (設定ID, 成否) で呼ばれる。cancelが設定されると
+        次のキーの書き込みの前で中止し、それまでに書き込んだ分を元に戻す。
+        """
+        with INSTRUMENTATION.span("phase", label):
+            if self.backup_journal is not None and (plan.groups or plan.changes):
+                # 書き込む前に記録しておき、途中で終了しても元に戻せるようにする
+                session = self.backup_journal.begin(plan, label)
+                result = self._execute(plan, settings, progress, cancel)
+                self.backup_journal.end(session, result.committed)
+                return result
+            return self._execute(plan, settings, progress, cancel)
+    
+    def _execute(self, plan: WritePlan, settings: Optional[Dict[str, SettingItem]],
+                 progress: Optional[Callable[[str, bool], None]] = None,
+                 cancel: Optional[threading.Event] = None) -> TransactionResult:
+        result = TransactionResult()
+        self.journal = []
+        self.touched = []
+        self.changed = []
+        for group in plan.groups.values():
+            if cancel is not None and cancel.is_set():
+                result.cancelled = True
+                self.rollback(result)
+                return result
+            self.touched.append(group)
+            entries = [(write.value_name, write.value_type, write.new_value) for write in group.writes]
+            written = self.registry.write_values(group.key_path, entries, group.root)
+            for write in group.writes[:written]:
+                self.journal.append((group, write))
+                result.written.append(write.setting_id)
+                if progress is not None:
+                    progress(write.setting_id, True)
+            if written < len(group.writes):
+                result.failed = group.writes[written].setting_id
+                if progress is not None:
+                    progress(result.failed, False)
+                self.rollback(result)
+                return result
+        
+        for change in plan.changes:
+            if cancel is not None and cancel.is_set():
+                result.cancelled = True
+                self.rollback(result)
+                return result
+            setting = (settings or {}).get(change.setting_id)
+            applied = isinstance(setting, SystemSettingItem) and setting.apply_value(change.new_value)
+            if progress is not None:
+                progress(change.setting_id, applied)
+            if not applied:
+                result.failed = change.setting_id
+                self.rollback(result)
+                return result
+            self.changed.append((setting, change))
+            result.written.append(change.setting_id)
+        
+        if cancel is not None and cancel.is_set() and plan.others:
+            result.cancelled = True
+            self.rollback(result)
+            return result
+        
+        # レジストリ以外の設定項目はトランザクション外で適用
+        for setting_id in plan.others:
+            applied = settings is not None and settings[setting_id].apply_setting(self.registry)
+            if applied:
+                result.written.append(setting_id)
+            if progress is not None:
+                progress(setting_id, applied)
+        
+        result.committed = True
+        return result
+    
+    def rollback(self, result: TransactionResult):
+        """ジャーナルを逆順にたどって書き込み前の値に戻す"""
+        with INSTRUMENTATION.span("phase", "rollback"):
+            self._rollback(result)
+    
+    def _rollback(self, result: TransactionResult):
+        # サービス・タスクはレジストリの後に変更しているため先に戻す
+        for setting, change in reversed(self.changed):
+            if not setting.apply_value(change.old_value):
+                result.rollback_errors.append(change.setting_id)
+        
+        for group, write in reversed(self.journal):
+            if write.old_type is None:
+                restored = self.registry.delete_value(group.key_path, write.value_name, group.root)
+            else:
+                restored = self.registry.write_value(
+                    group.key_path, write.value_name, write.old_value, write.old_type, group.root
+                )
+            if not restored:
+                result.rollback_errors.append(write.setting_id)
+        
+        # トランザクションで新規作成したキーを削除
+        for group in reversed(self.touched):
+            if not group.key_existed:
+                self.registry.delete_key(group.key_path, group.root)
+        
+        self.journal = []
+        self.touched = []
+        self.changed = []
+        result.rolled_back = True
+
+class CatalogError(ValueError):
+    """カタログファイルの内容が不正"""
+
+# カタログで使えるルートキー名
+CATALOG_ROOTS = {
+    "HKCU": winreg.HKEY_CURRENT_USER,
+    "HKEY_CURRENT_USER": winreg.HKEY_CURRENT_USER,
+    "HKLM": winreg.HKEY_LOCAL_MACHINE,
+    "HKEY_LOCAL_MACHINE": winreg.HKEY_LOCAL_MACHINE,
+    "HKCR": winreg.HKEY_CLASSES_ROOT,
+    "HKEY_CLASSES_ROOT": winreg.HKEY_CLASSES_ROOT,
+    "HKU": winreg.HKEY_USERS,
+    "HKEY_USERS": winreg.HKEY_USERS,
+}
+
+def parse_hex(text: Any) -> Optional[bytes]:
+    """"03 00 ff" のような16進数の文字列をbytesに変換（空白・カンマ区切り可、不正ならNone）"""
+    if not isinstance(text, str):
+        return None
+    try:
+        return bytes.fromhex(text.replace(",", " "))
+    except ValueError:
+        return None
+
+# カタログで使える値の型と、値の検証方法（REG_BINARYは16進数の文字列で書き、bytesに変換する）
+CATALOG_VALUE_TYPES = {
+    "REG_DWORD": (winreg.REG_DWORD, lambda value: type(value) is int and 0 <= value <= 0xFFFFFFFF),
+    "REG_QWORD": (winreg.REG_QWORD, lambda value: type(value) is int and 0 <= value <= 0xFFFFFFFFFFFFFFFF),
+    "REG_SZ": (winreg.REG_SZ, lambda value: isinstance(value, str)),
+    "REG_EXPAND_SZ": (winreg.REG_EXPAND_SZ, lambda value: isinstance(value, str)),
+    "REG_MULTI_SZ": (winreg.REG_MULTI_SZ, lambda value: isinstance(value, list) and all(
+        isinstance(item, str) and item and "\0" not in item for item in value
+    )),
+    "REG_BINARY": (winreg.REG_BINARY, lambda value: parse_hex(value) is not None),
+}
+
+# カタログの項目の種類と、種類ごとに指定できる項目
+CATALOG_KIND_FIELDS = {
+    "registry": {"root", "key_path", "value_name", "value_type", "offset", "mask"},
+    "service": {"service"},
+    "task": {"task"},
+}
+
+# カタログファイルの既定の場所
+CATALOG_DIR = os.path.join(APP_DIR, "catalog")
+# カタログの索引のキャッシュの既定の場所
+CATALOG_CACHE_FILE = os.path.join(APP_DIR, "catalog_cache.bin")
+
+class SettingCatalog:
+    """設定項目と、ID・キーパス・カテゴリの索引"""
+    
+    def __init__(self, records: List[Dict[str, Any]], index: Optional[Dict[str, Any]] = None):
+        self.records = records
+        if index is None:
+            index = self.build_index(records)
+        self.index = index
+        # (root, 小文字のキーパス) -> 設定IDの一覧
+        self.by_key: Dict[Tuple[int, str], List[str]] = {
+            (root, key_path): setting_ids for root, key_path, setting_ids in index["by_key"]
+        }
+        self.by_category: Dict[str, List[str]] = index["by_category"]
+        # カタログの並び順の現在の状態と適用待ちの選択（項目の状態はここに格納される）
+        self.current = StateVector([record["id"] for record in records])
+        self.pending = self.current.like()
+        # Windowsの既定の状態（カタログに指定がなければ0）
+        self.defaults = self.current.like()
+        self.settings: Dict[str, SettingItem] = {}
+        for position, record in enumerate(records):
+            options = dict(record)
+            setting_id = options.pop("id")
+            self.defaults.codes[position] = STATE_CODES[options.pop("default", None)]
+            setting = SETTING_KINDS[options.pop("kind")](**options)
+            setting.bind(self.current, self.pending, position)
+            self.settings[setting_id] = setting
+    
+    @staticmethod
+    def build_index(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """キーパス・カテゴリの索引を作成（キャッシュに保存できる形式）"""
+        by_key: Dict[Tuple[int, str], List[str]] = {}
+        by_category: Dict[str, List[str]] = {}
+        for record in records:
+            if record["kind"] == "registry":
+                by_key.setdefault((record["root"], record["key_path"].lower()), []).append(record["id"])
+            by_category.setdefault(record["category"], []).append(record["id"])
+        return {
+            "by_key": [(root, key_path, setting_ids) for (root, key_path), setting_ids in by_key.items()],
+            "by_category": by_category,
+        }
+    
+    def __len__(self) -> int:
+        return len(self.settings)
+    
+    def __contains__(self, setting_id: str) -> bool:
+        return setting_id in self.settings
+    
+    def get(self, setting_id: str) -> Optional[SettingItem]:
+        return self.settings.get(setting_id)
+    
+    def modified_mask(self) -> int:
+        """適用待ちの選択が現在の状態と異なる項目のビットセット"""
+        return self.pending.mismatches(self.current)
+    
+    def modified_ids(self) -> List[str]:
+        return self.current.ids(self.modified_mask())
+    
+    def non_default_mask(self) -> int:
+        """現在の状態が有効・無効で、Windowsの既定の状態と異なる項目のビットセット"""
+        known = self.current.where("enabled") | self.current.where("disabled")
+        return known & self.defaults.mismatches(self.current)
+    
+    def clear_settled(self) -> int:
+        """現在の状態と同じになった適用待ちの選択を取り消し、そのビットセットを返す"""
+        settled = self.pending.defined() & ~self.pending.differs(self.current)
+        self.pending.clear(settled)
+        return settled
+    
+    def profile_vector(self, profile: Dict[str, Optional[str]]) -> StateVector:
+        """プロファイルの状態を配列にする（プロファイルにない項目は0）
+        
+        profile_vector(profile).mismatches(states) でプロファイルと異なる項目が求まる。
+        """
+        target = self.current.like()
+        target.update({
+            setting_id: state for setting_id, state in profile.items() if state in ("enabled", "disabled")
+        })
+        return target
+
+class CatalogLoader:
+    """JSON/TOMLのカタログファイルを読み込み、検証済みの索引をディスクにキャッシュする"""
+    
+    # キャッシュ形式を変更したら更新する
+    CACHE_VERSION = 5
+    
+    def __init__(self, paths: Optional[List[str]] = None, cache_file: Optional[str] = CATALOG_CACHE_FILE):
+        self.paths = paths or [CATALOG_DIR]
+        self.cache_file = cache_file
+        # 直前の読み込みでキャッシュを使ったかどうか
+        self.cache_hit = False
+    
+    def source_files(self) -> List[str]:
+        """カタログファイルの一覧（ディレクトリは直下の *.json / *.toml を名前順に展開）"""
+        files = []
+        for path in self.paths:
+            if os.path.isdir(path):
+                for name in sorted(os.listdir(path)):
+                    if name.endswith((".json", ".toml")):
+                        files.append(os.path.join(path, name))
+            else:
+                files.append(path)
+        return files
+    
+    def load(self) -> SettingCatalog:
+        """カタログを読み込む（内容が変わっていなければキャッシュを使う）"""
+        sources = []
+        for path in self.source_files():
+            with open(path, 'rb') as f:
+                sources.append((path, f.read()))
+        
+        digest = hashlib.sha256(str(self.CACHE_VERSION).encode())
+        for path, data in sources:
+            digest.update(os.path.basename(path).encode('utf-8'))
+            digest.update(hashlib.sha256(data).digest())
+        source_hash = digest.hexdigest()
+        
+        cached = self._read_cache(source_hash)
+        if cached is not None:
+            self.cache_hit = True
+            return SettingCatalog(cached["records"], cached["index"])
+        
+        self.cache_hit = False
+        records = []
+        seen = set()
+        for path, data in sources:
+            for entry in self._parse(path, data):
+                record = self.validate(entry, path)
+                if record["id"] in seen:
+                    raise CatalogError(f"{path}: IDが重複しています: {record['id']}")
+                seen.add(record["id"])
+                records.append(record)
+        
+        catalog = SettingCatalog(records)
+        self._write_cache(source_hash, catalog)
+        return catalog
+    
+    @staticmethod
+    def _parse(path: str, data: bytes) -> List[Any]:
+        """カタログファイルを解析して設定項目の一覧を返す"""
+        try:
+            if path.endswith(".toml"):
+                if tomllib is None:
+                    raise CatalogError(f"{path}: TOMLの読み込みにはPython 3.11以降が必要です")
+                document = tomllib.loads(data.decode('utf-8'))
+            else:
+                document = json.loads(data.decode('utf-8-sig'))
+        except CatalogError:
+            raise
+        except Exception as e:
+            raise CatalogError(f"{path}: 解析できません: {e}") from e
+        
+        if not isinstance(document, dict) or not isinstance(document.get("settings"), list):
+            raise CatalogError(f"{path}: \"settings\" に設定項目の配列が必要です")
+        return document["settings"]
+    
+    @staticmethod
+    def validate(entry: Any, source: str = "<catalog>") -> Dict[str, Any]:
+        """設定項目1件を検証し、正規化したレコードを返す"""
+        if not isinstance(entry, dict):
+            raise CatalogError(f"{source}: 設定項目はオブジェクトである必要があります")
+        setting_id = entry.get("id")
+        if not isinstance(setting_id, str) or not re.fullmatch(r"[a-z0-9_]+", setting_id):
+            raise CatalogError(f"{source}: IDは英小文字・数字・_で指定してください: {setting_id!r}")
+        
+        def fail(message: str):
+            raise CatalogError(f"{source}: {setting_id}: {message}")
+        
+        kind = entry.get("kind", "registry")
+        if kind not in CATALOG_KIND_FIELDS:
+            fail(f"\"kind\" は {' / '.join(CATALOG_KIND_FIELDS)} のいずれかで指定してください")
+        unknown = set(entry) - {
+            "id", "kind", "name", "description", "category", "enabled_value", "disabled_value",
+            "labels", "effect", "broadcast_area", "default",
+        } - CATALOG_KIND_FIELDS[kind]
+        if unknown:
+            fail(f"不明な項目があります: {', '.join(sorted(unknown))}")
+        
+        for field in ("name", "description"):
+            if not isinstance(entry.get(field), str):
+                fail(f"\"{field}\" は文字列で指定してください")
+        
+        if kind == "registry":
+            for field in ("key_path", "value_name"):
+                if not isinstance(entry.get(field), str):
+                    fail(f"\"{field}\" は文字列で指定してください")
+            if not entry["key_path"].strip("\\"):
+                fail("\"key_path\" が空です")
+            
+            root = entry.get("root", "HKCU")
+            if root not in CATALOG_ROOTS:
+                fail(f"不明なルートキーです: {root!r}")
+            
+            value_type = entry.get("value_type")
+            if value_type not in CATALOG_VALUE_TYPES:
+                fail(f"未対応の値の型です: {value_type!r}")
+            type_code, is_valid_value = CATALOG_VALUE_TYPES[value_type]
+            for field in ("enabled_value", "disabled_value"):
+                if field not in entry or not is_valid_value(entry[field]):
+                    fail(f"\"{field}\" は {value_type} の値で指定してください")
+            enabled_value, disabled_value = entry["enabled_value"], entry["disabled_value"]
+            if type_code == winreg.REG_BINARY:
+                enabled_value, disabled_value = parse_hex(enabled_value), parse_hex(disabled_value)
+            target = {
+                "root": CATALOG_ROOTS[root],
+                "key_path": entry["key_path"].strip("\\"),
+                "value_name": entry["value_name"],
+                "value_type": type_code,
+            }
+            if "offset" in entry:
+                # 値の一部分（offsetバイト目から）のmaskのビットだけを比較・書き換える
+                offset = entry["offset"]
+                if type_code != winreg.REG_BINARY:
+                    fail("\"offset\" は REG_BINARY の項目にだけ指定できます")
+                if type(offset) is not int or offset < 0:
+                    fail("\"offset\" は0以上の整数で指定してください")
+                if not enabled_value or len(enabled_value) != len(disabled_value):
+                    fail("\"enabled_value\" と \"disabled_value\" は同じ長さで指定してください")
+                mask = parse_hex(entry.get("mask", "ff" * len(enabled_value)))
+                if mask is None or len(mask) != len(enabled_value):
+                    fail("\"mask\" は \"enabled_value\" と同じ長さの16進数で指定してください")
+                bits = int.from_bytes(mask, "little")
+                for field, value in (("enabled_value", enabled_value), ("disabled_value", disabled_value)):
+                    if int.from_bytes(value, "little") & ~bits:
+                        fail(f"\"{field}\" に \"mask\" の外のビットが指定されています")
+                target.update(offset=offset, mask=mask)
+            elif "mask" in entry:
+                fail("\"mask\" は \"offset\" と一緒に指定してください")
+        elif kind == "service":
+            service = entry.get("service")
+            if not isinstance(service, str) or not service.strip():
+                fail("\"service\" はサービス名で指定してください")
+            enabled_value = entry.get("enabled_value")
+            disabled_value = entry.get("disabled_value", "disabled")
+            for field, value in (("enabled_value", enabled_value), ("disabled_value", disabled_value)):
+                if value not in SERVICE_START_TYPES:
+                    fail(f"\"{field}\" は {' / '.join(SERVICE_START_TYPES)} のいずれかで指定してください")
+            target = {"target": service.strip()}
+        else:
+            task = entry.get("task")
+            if not isinstance(task, str) or not task.startswith("\\") or not task.strip("\\"):
+                fail("\"task\" は \\ で始まるタスクのパスで指定してください")
+            if "enabled_value" in entry or "disabled_value" in entry:
+                fail("タスクには \"enabled_value\" / \"disabled_value\" を指定できません")
+            enabled_value, disabled_value = True, False
+            target = {"target": task}
+        if enabled_value == disabled_value:
+            fail("\"enabled_value\" と \"disabled_value\" が同じです")
+        
+        labels = entry.get("labels", ["有効", "無効"])
+        if not (isinstance(labels, list) and len(labels) == 2 and all(isinstance(label, str) for label in labels)):
+            fail("\"labels\" は2つの文字列の配列で指定してください")
+        
+        category = entry.get("category", "その他")
+        if not isinstance(category, str):
+            fail("\"category\" は文字列で指定してください")
+        
+        default = entry.get("default")
+        if default not in (None, "enabled", "disabled"):
+            fail("\"default\" は enabled / disabled のいずれかで指定してください")
+        
+        effect = entry.get("effect", "none")
+        if effect not in EFFECTS:
+            fail(f"\"effect\" は {' / '.join(EFFECTS)} のいずれかで指定してください")
+        broadcast_area = entry.get("broadcast_area")
+        if broadcast_area is not None and (effect != "broadcast" or not isinstance(broadcast_area, str)):
+            fail("\"broadcast_area\" は \"effect\": \"broadcast\" の項目に文字列で指定してください")
+        
+        return {
+            "id": setting_id,
+            "kind": kind,
+            "name": entry["name"],
+            "description": entry["description"],
+            "category": category,
+            **target,
+            "enabled_value": enabled_value,
+            "disabled_value": disabled_value,
+            "labels": tuple(labels),
+            "effect": effect,
+            "broadcast_area": broadcast_area,
+            "default": default,
+        }
+    
+    def _read_cache(self, source_hash: str) -> Optional[Dict[str, Any]]:
+        """ソースのハッシュが一致するキャッシュを読み込む（壊れている場合はNone）"""
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return None
+        try:
+            with open(self.cache_file, 'rb') as f:
+                cached = marshal.loads(f.read())
+            if cached.get("version") == self.CACHE_VERSION and cached.get("source_hash") == source_hash:
+                return cached
+        except Exception as e:
+            print(f"カタログキャッシュ読み込みエラー: {e}")
+        return None
+    
+    def _write_cache(self, source_hash: str, catalog: SettingCatalog):
+        """検証済みのレコードと索引をキャッシュに保存"""
+        if not self.cache_file:
+            return
+        cached = {
+            "version": self.CACHE_VERSION,
+            "source_hash": source_hash,
+            "records": catalog.records,
+            "index": catalog.index,
+        }
+        temp_file = self.cache_file + ".tmp"
+        try:
+            with open(temp_file, 'wb') as f:
+                f.write(marshal.dumps(cached))
+            os.replace(temp_file, self.cache_file)
+        except Exception as e:
+            print(f"カタログキャッシュ保存エラー: {e}")
+
+def load_catalog(paths: Optional[List[str]] = None) -> SettingCatalog:
+    """カタログを読み込む"""
+    return CatalogLoader(paths).load()
+
+def create_default_settings() -> Dict[str, SettingItem]:
+    """既定の設定項目を作成"""
+    return load_catalog().settings
@@ -0,0 +1,236 @@
+import ctypes
+import queue
+import subprocess
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from core import EFFECT_LABELS, EFFECTS, SettingItem
+from instrumentation import INSTRUMENTATION
+
+class EffectPlan:
+    """反映に必要な操作を設定項目ごとにまとめたもの
+    
+    必要な操作のうち最も影響の大きいもの（action）を1回だけ実行すれば、すべての項目が反映される。
+    """
+    
+    def __init__(self, by_effect: Optional[Dict[str, List[str]]] = None,
+                 broadcast_areas: Optional[Set[Optional[str]]] = None):
+        # 反映方法 -> 設定IDの一覧
+        self.by_effect: Dict[str, List[str]] = by_effect or {}
+        # WM_SETTINGCHANGEで通知する設定の種類（Noneは種類を指定しない通知）
+        self.broadcast_areas: Set[Optional[str]] = broadcast_areas or set()
+    
+    @property
+    def action(self) -> str:
+        """実行する操作（"none"なら何もしなくてよい）"""
+        return max(self.by_effect, key=EFFECTS.index, default="none")
+    
+    def __bool__(self) -> bool:
+        return self.action != "none"
+    
+    @property
+    def setting_ids(self) -> List[str]:
+        return [setting_id for setting_ids in self.by_effect.values() for setting_id in setting_ids]
+    
+    def merge(self, other: "EffectPlan") -> "EffectPlan":
+        """2つの計画をまとめる"""
+        by_effect = {effect: list(setting_ids) for effect, setting_ids in self.by_effect.items()}
+        for effect, setting_ids in other.by_effect.items():
+            merged = by_effect.setdefault(effect, [])
+            merged.extend(setting_id for setting_id in setting_ids if setting_id not in merged)
+        return EffectPlan(by_effect, self.broadcast_areas | other.broadcast_areas)
+    
+    def split(self, limit: str) -> Tuple["EffectPlan", "EffectPlan"]:
+        """limit以下の操作で反映できる部分と、それより大きな操作が必要な部分に分ける"""
+        bound = EFFECTS.index(limit)
+        lower = {effect: ids for effect, ids in self.by_effect.items() if EFFECTS.index(effect) <= bound}
+        higher = {effect: ids for effect, ids in self.by_effect.items() if EFFECTS.index(effect) > bound}
+        return EffectPlan(lower, self.broadcast_areas), EffectPlan(higher)
+    
+    def broadcast_only(self) -> "EffectPlan":
+        """通知だけで反映できる部分（再起動などを後回しにするときに先に送る）"""
+        return self.split("broadcast")[0]
+    
+    def describe(self, settings: Dict[str, SettingItem]) -> str:
+        """反映に必要な操作と対象の項目を文字列化"""
+        lines = []
+        for effect in reversed(EFFECTS):
+            setting_ids = self.by_effect.get(effect)
+            if effect == "none" or not setting_ids:
+                continue
+            names = ", ".join(settings[setting_id].name if setting_id in settings else setting_id
+                              for setting_id in setting_ids)
+            lines.append(f"{EFFECT_LABELS[effect]}: {names}")
+        return "\n".join(lines)
+
+def coalesce(settings: Dict[str, SettingItem], setting_ids: Iterable[str]) -> EffectPlan:
+    """適用した項目の反映方法をまとめる"""
+    plan = EffectPlan()
+    for setting_id in setting_ids:
+        setting = settings.get(setting_id)
+        if setting is None:
+            continue
+        plan.by_effect.setdefault(setting.effect, []).append(setting_id)
+        if setting.effect == "broadcast":
+            plan.broadcast_areas.add(setting.broadcast_area)
+    return plan
+
+class EffectRunner:
+    """設定の反映操作（通知・Explorer再起動・サインアウト・再起動）を実行するインターフェース"""
+    
+    def broadcast(self, area: Optional[str]):
+        """WM_SETTINGCHANGEで設定の変更を通知"""
+        raise NotImplementedError
+    
+    def restart_explorer(self):
+        raise NotImplementedError
+    
+    def sign_out(self):
+        raise NotImplementedError
+    
+    def reboot(self):
+        raise NotImplementedError
+
+class WindowsEffectRunner(EffectRunner):
+    """Windowsで反映操作を実行する"""
+    
+    HWND_BROADCAST = 0xFFFF
+    WM_SETTINGCHANGE = 0x001A
+    SMTO_ABORTIFHUNG = 0x0002
+    # 応答しないウィンドウを待つ最大時間（ミリ秒）
+    BROADCAST_TIMEOUT = 5000
+    
+    @classmethod
+    def available(cls) -> bool:
+        return hasattr(ctypes, "windll")
+    
+    def broadcast(self, area):
+        from ctypes import wintypes
+        
+        send = ctypes.windll.user32.SendMessageTimeoutW
+        send.argtypes = [
+            wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPCWSTR,
+            wintypes.UINT, wintypes.UINT, ctypes.POINTER(ctypes.c_size_t)
+        ]
+        send.restype = ctypes.c_ssize_t
+        result = ctypes.c_size_t()
+        with INSTRUMENTATION.span("subprocess", "broadcast", area):
+            if not send(self.HWND_BROADCAST, self.WM_SETTINGCHANGE, 0, area,
+                        self.SMTO_ABORTIFHUNG, self.BROADCAST_TIMEOUT, ctypes.byref(result)):
+                raise ctypes.WinError()
+    
+    def restart_explorer(self):
+        with INSTRUMENTATION.span("subprocess", "taskkill", "explorer.exe"):
+            subprocess.run(["taskkill", "/f", "/im", "explorer.exe"], check=True, capture_output=True)
+        with INSTRUMENTATION.span("subprocess", "start", "explorer.exe"):
+            subprocess.Popen(["explorer.exe"])
+    
+    def sign_out(self):
+        with INSTRUMENTATION.span("subprocess", "shutdown", "/l"):
+            subprocess.run(["shutdown", "/l"], check=True)
+    
+    def reboot(self):
+        with INSTRUMENTATION.span("subprocess", "shutdown", "/r"):
+            subprocess.run(["shutdown", "/r", "/t", "0"], check=True)
+
+class RecordingEffectRunner(EffectRunner):
+    """実行する代わりに呼び出しを記録するだけのRunner（Windows以外・テスト用）"""
+    
+    def __init__(self):
+        self.calls: List[Tuple[str, Optional[str]]] = []
+    
+    def broadcast(self, area):
+        self.calls.append(("broadcast", area))
+    
+    def restart_explorer(self):
+        self.calls.append(("restart_explorer", None))
+    
+    def sign_out(self):
+        self.calls.append(("sign_out", None))
+    
+    def reboot(self):
+        self.calls.append(("reboot", None))
+
+def create_runner() -> EffectRunner:
+    """環境に合わせたRunnerを作成"""
+    return WindowsEffectRunner() if WindowsEffectRunner.available() else RecordingEffectRunner()
+
+def execute_plan(runner: EffectRunner, plan: EffectPlan):
+    """計画のうち最も影響の大きい操作を1回だけ実行"""
+    action = plan.action
+    with INSTRUMENTATION.span("effect", action):
+        if action == "reboot":
+            runner.reboot()
+        elif action == "signout":
+            runner.sign_out()
+        elif action in ("explorer", "broadcast"):
+            if action == "explorer":
+                runner.restart_explorer()
+            # Explorer以外のアプリには再起動では伝わらないため、通知は常に送る
+            for area in sorted(plan.broadcast_areas, key=lambda area: area or ""):
+                runner.broadcast(area)
+
+class EffectScheduler:
+    """適用した設定の反映操作をためておき、まとめてバックグラウンドで実行する
+    
+    on_doneは (実行した計画, 例外またはNone) を引数にワーカースレッドから呼ばれる。
+    """
+    
+    def __init__(self, settings: Dict[str, SettingItem], runner: Optional[EffectRunner] = None,
+                 on_done: Optional[Callable[[EffectPlan, Optional[Exception]], None]] = None):
+        self.settings = settings
+        self.runner = runner or create_runner()
+        self.on_done = on_done
+        # まだ実行していない反映操作
+        self.pending = EffectPlan()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[EffectPlan]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+    
+    def request(self, setting_ids: Iterable[str]) -> EffectPlan:
+        """適用した項目の反映操作を追加し、ためている計画全体を返す"""
+        with self._lock:
+            self.pending = self.pending.merge(coalesce(self.settings, setting_ids))
+            return self.pending
+    
+    def take(self, limit: str = "reboot") -> EffectPlan:
+        """ためている計画のうちlimit以下の操作で反映できる部分を取り出す"""
+        with self._lock:
+            taken, self.pending = self.pending.split(limit)
+            return taken
+    
+    def run_async(self, plan: EffectPlan):
+        """計画をバックグラウンドで実行（実行待ちの計画があればまとめて1回にする）"""
+        if not plan:
+            return
+        self._queue.put(plan)
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name="effect-scheduler", daemon=True)
+                self._thread.start()
+    
+    def wait(self):
+        """実行待ちの計画がすべて終わるまで待つ"""
+        self._queue.join()
+    
+    def _worker(self):
+        while True:
+            plan = self._queue.get()
+            count = 1
+            while True:
+                try:
+                    plan = plan.merge(self._queue.get_nowait())
+                    count += 1
+                except queue.Empty:
+                    break
+            error = None
+            try:
+                execute_plan(self.runner, plan)
+            except Exception as e:
+                print(f"反映操作エラー: {e}")
+                error = e
+            finally:
+                for _ in range(count):
+                    self._queue.task_done()
+            if self.on_done is not None:
+                self.on_done(plan, error)
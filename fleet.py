@@ -0,0 +1,324 @@
+import heapq
+import json
+import queue
+import random
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from core import (
+    ApplyPlanner,
+    ApplyTransaction,
+    BatchScanner,
+    MemoryRegistryBackend,
+    RegistryBackend,
+    RegistryManager,
+    RemoteRegistryBackend,
+    SettingCatalog,
+    StateVector,
+)
+from journal import encode_value
+
+# フリートモードで実行できる処理
+FLEET_MODES = ("scan", "diff", "apply")
+
+def load_hosts(path: str) -> List[str]:
+    """ホスト一覧を読み込む（1行に1ホスト、#以降はコメント）"""
+    hosts = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            host = line.split("#", 1)[0].strip()
+            if host and host not in hosts:
+                hosts.append(host)
+    return hosts
+
+class HostConnection:
+    """ホストのレジストリへの接続を提供するインターフェース
+    
+    connect/closeはワーカースレッドから並行して呼ばれる。
+    """
+    
+    def connect(self, host: str) -> RegistryBackend:
+        """ホストに接続してバックエンドを返す（接続できなければOSError）"""
+        raise NotImplementedError
+    
+    def close(self, host: str, backend: RegistryBackend):
+        """接続を閉じる"""
+    
+    def abort(self):
+        """実行中の接続待ちを中断（フリートの処理終了時に呼ばれる）"""
+
+class RemoteHostConnection(HostConnection):
+    """リモートレジストリ（winreg.ConnectRegistry）で各ホストに接続する"""
+    
+    def __init__(self, user_sid: Optional[str] = None):
+        # HKEY_CURRENT_USERの設定を書き込むユーザーのSID
+        self.user_sid = user_sid
+    
+    def connect(self, host):
+        backend = RemoteRegistryBackend(host, self.user_sid)
+        # 到達できないホストはここでOSErrorになる
+        backend.connect()
+        return backend
+    
+    def close(self, host, backend):
+        backend.close()
+
+class SimulatedHostConnection(HostConnection):
+    """メモリ上のレジストリで多数のホストを模擬する（スループット計測・テスト用）
+    
+    失敗・応答なしはホスト名と試行回数から決まるため、スレッドの実行順に関係なく再現できる。
+    """
+    
+    def __init__(self, latency: float = 0.0, connect_latency: float = 0.0, failure_rate: float = 0.0,
+                 hang_rate: float = 0.0, hang_time: float = 60.0, seed: int = 0,
+                 presets: Optional[List[Tuple[int, str, str, Any, int]]] = None):
+        # レジストリ操作1回ごとの遅延（秒）
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.failure_rate = failure_rate
+        self.hang_rate = hang_rate
+        self.hang_time = hang_time
+        self.seed = seed
+        # 全ホストに設定する初期値 (root, キーパス, 値名, 値, 型)
+        self.presets = presets or []
+        # 常に接続できないホスト
+        self.unreachable: set = set()
+        self.backends: Dict[str, MemoryRegistryBackend] = {}
+        self.attempts = Counter()
+        self._lock = threading.Lock()
+        self._aborted = threading.Event()
+    
+    def backend(self, host: str) -> MemoryRegistryBackend:
+        """ホストのレジストリ（接続の成否に関係なく取得）"""
+        with self._lock:
+            backend = self.backends.get(host)
+            if backend is None:
+                backend = MemoryRegistryBackend(self.latency)
+                for preset in self.presets:
+                    backend.preset(*preset)
+                self.backends[host] = backend
+            return backend
+    
+    def connect(self, host):
+        with self._lock:
+            self.attempts[host] += 1
+            attempt = self.attempts[host]
+        roll = random.Random(f"{self.seed}:{host}:{attempt}").random()
+        if self.connect_latency:
+            time.sleep(self.connect_latency)
+        if host in self.unreachable or roll < self.failure_rate:
+            raise ConnectionError(f"{host}: 接続できません")
+        if roll < self.failure_rate + self.hang_rate:
+            # 応答しないホスト（abort()で打ち切る）
+            self._aborted.wait(self.hang_time)
+            raise TimeoutError(f"{host}: 応答がありません")
+        return self.backend(host)
+    
+    def abort(self):
+        self._aborted.set()
+
+class FleetRunner:
+    """ホストごとのスキャン・差分確認・適用を、同時実行数を制限して並行に行う
+    
+    結果は完了した順に1ホスト1件の辞書として返す。
+    """
+    
+    def __init__(self, connection: HostConnection, catalog: SettingCatalog,
+                 profile: Optional[Dict[str, Optional[str]]] = None, mode: str = "diff",
+                 workers: int = 16, timeout: float = 30.0, retries: int = 2, retry_delay: float = 1.0):
+        if mode not in FLEET_MODES:
+            raise ValueError(f"不明なモード: {mode}")
+        if mode != "scan" and profile is None:
+            raise ValueError(f"{mode}にはプロファイルが必要です")
+        self.connection = connection
+        if any(record["kind"] != "registry" for record in catalog.records):
+            # サービス・タスクはリモートレジストリ経由では扱えない（問い合わせるとローカルの状態になる）ため除く
+            catalog = SettingCatalog([record for record in catalog.records if record["kind"] == "registry"])
+        self.catalog = catalog
+        self.profile = profile or {}
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.summary: Dict[str, Any] = {}
+        # スキャンしたホスト -> カタログの並び順の状態（1項目1バイト）
+        self.host_states: Dict[str, StateVector] = {}
+        self._profile_vector = catalog.profile_vector(self.profile) if self.profile else None
+    
+    def _catalog(self) -> SettingCatalog:
+        """ホストごとに独立したカタログを作成（スキャン結果をカタログの状態配列に保持するため）"""
+        return SettingCatalog(self.catalog.records, self.catalog.index)
+    
+    def process_host(self, host: str, abandoned: Optional[threading.Event] = None) -> Dict[str, Any]:
+        """1ホスト分の処理（接続できない場合などは例外）"""
+        backend = self.connection.connect(host)
+        registry = RegistryManager(backend, cache_size=32)
+        try:
+            catalog = self._catalog()
+            settings = catalog.settings
+            if self.mode == "scan":
+                outcome = {"status": "ok", "states": BatchScanner(registry).scan(settings)}
+                if self._profile_vector is not None:
+                    outcome["differs_from_profile"] = catalog.current.ids(
+                        self._profile_vector.mismatches(catalog.current)
+                    )
+                # 全ホストの比較用（結果には含めない）
+                outcome["codes"] = bytes(catalog.current.codes)
+                return outcome
+            
+            plan = ApplyPlanner(registry).plan(settings, self.profile)
+            outcome: Dict[str, Any] = {
+                "status": "ok",
+                # バイナリの値はジャーナルと同じ形式にしてJSONで書き出せるようにする
+                "changes": {
+                    write.setting_id: {"old": encode_value(write.old_value), "new": encode_value(write.new_value)}
+                    for group in plan.groups.values() for write in group.writes
+                },
+                "skipped": plan.skipped,
+                "invalid": plan.invalid,
+            }
+            if self.mode == "apply" and len(plan):
+                if abandoned is not None and abandoned.is_set():
+                    # タイムアウト後は書き込みを始めない
+                    raise TimeoutError(f"{host}: タイムアウトしたため適用を中止しました")
+                result = ApplyTransaction(registry).execute(plan, settings)
+                outcome["written"] = result.written
+                if not result.committed:
+                    outcome.update(
+                        status="failed", failed=result.failed, rollback_errors=result.rollback_errors
+                    )
+            return outcome
+        finally:
+            registry.close()
+            self.connection.close(host, backend)
+    
+    def _retryable(self, error: BaseException, timed_out: bool) -> bool:
+        """再試行してよいエラーか"""
+        if timed_out:
+            # 適用中にタイムアウトした場合、前の試行がまだ書き込んでいる可能性がある
+            return self.mode != "apply"
+        return isinstance(error, OSError) and not isinstance(error, (PermissionError, FileNotFoundError))
+    
+    def _attempt(self, token: int, host: str, abandoned: threading.Event, results: "queue.Queue"):
+        """ワーカースレッドで1回分の試行を実行し、結果をキューに入れる"""
+        try:
+            results.put((token, self.process_host(host, abandoned), None))
+        except Exception as e:
+            results.put((token, None, e))
+    
+    def run(self, hosts: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        """全ホストを処理し、完了したホストから順に結果を返す
+        
+        タイムアウトした試行のスレッドは止められないため、結果を捨てて同時実行数から外す。
+        """
+        hosts = list(dict.fromkeys(hosts))
+        started = time.perf_counter()
+        first_started: Dict[str, float] = {}
+        pending = deque((host, 1) for host in hosts)
+        # 再試行待ち (開始時刻, ホスト, 試行回数)
+        delayed: List[Tuple[float, str, int]] = []
+        # 試行の識別番号 -> (ホスト, 試行回数, 開始時刻, 中止イベント)
+        running: Dict[int, Tuple[str, int, float, threading.Event]] = {}
+        results: "queue.Queue" = queue.Queue()
+        counts = Counter()
+        token = 0
+        
+        try:
+            while pending or delayed or running:
+                now = time.monotonic()
+                while delayed and delayed[0][0] <= now:
+                    _, host, attempt = heapq.heappop(delayed)
+                    pending.append((host, attempt))
+                while pending and len(running) < self.workers:
+                    host, attempt = pending.popleft()
+                    token += 1
+                    abandoned = threading.Event()
+                    running[token] = (host, attempt, time.monotonic(), abandoned)
+                    first_started.setdefault(host, time.perf_counter())
+                    threading.Thread(
+                        target=self._attempt, args=(token, host, abandoned, results),
+                        name=f"fleet-{host}", daemon=True
+                    ).start()
+                
+                deadlines = [attempt_started + self.timeout for _, _, attempt_started, _ in running.values()]
+                if delayed:
+                    deadlines.append(delayed[0][0])
+                wait_time = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+                
+                finished = []
+                try:
+                    finished.append(results.get(timeout=wait_time))
+                    while True:
+                        finished.append(results.get_nowait())
+                except queue.Empty:
+                    pass
+                
+                for finished_token, outcome, error in finished:
+                    if finished_token not in running:
+                        # タイムアウト済みの試行の結果は捨てる
+                        continue
+                    host, attempt, _, _ = running.pop(finished_token)
+                    record = self._record(host, attempt, first_started[host], outcome, error, False, delayed)
+                    if record is not None:
+                        counts[record["status"]] += 1
+                        yield record
+                
+                now = time.monotonic()
+                for expired_token, (host, attempt, attempt_started, abandoned) in list(running.items()):
+                    if now - attempt_started < self.timeout:
+                        continue
+                    del running[expired_token]
+                    abandoned.set()
+                    error = TimeoutError(f"{host}: {self.timeout}秒以内に完了しませんでした")
+                    record = self._record(host, attempt, first_started[host], None, error, True, delayed)
+                    if record is not None:
+                        counts[record["status"]] += 1
+                        yield record
+        finally:
+            self.connection.abort()
+            elapsed = time.perf_counter() - started
+            self.summary = {
+                "mode": self.mode,
+                "hosts": len(hosts),
+                **{status: counts[status] for status in ("ok", "failed", "error", "timeout")},
+                "elapsed": round(elapsed, 3),
+                "hosts_per_second": round(sum(counts.values()) / elapsed, 2) if elapsed else 0.0,
+            }
+            if self.host_states:
+                self.summary["divergent"] = self.divergent_settings()
+    
+    def divergent_settings(self) -> List[str]:
+        """スキャンしたホストの間で状態が一致しない設定ID"""
+        return self.catalog.current.ids(StateVector.divergence(list(self.host_states.values())))
+    
+    def _record(self, host: str, attempt: int, first_started: float, outcome: Optional[Dict[str, Any]],
+                error: Optional[BaseException], timed_out: bool, delayed: list) -> Optional[Dict[str, Any]]:
+        """試行の結果をホストの結果にまとめる（再試行する場合はNone）"""
+        if error is not None and attempt <= self.retries and self._retryable(error, timed_out):
+            retry_at = time.monotonic() + self.retry_delay * 2 ** (attempt - 1)
+            heapq.heappush(delayed, (retry_at, host, attempt + 1))
+            return None
+        
+        record: Dict[str, Any] = {"host": host, "mode": self.mode}
+        if error is not None:
+            record.update(status="timeout" if timed_out else "error", error=str(error))
+        else:
+            codes = outcome.pop("codes", None)
+            if codes is not None:
+                self.host_states[host] = self.catalog.current.like(codes)
+            record.update(outcome)
+        record["attempts"] = attempt
+        record["elapsed"] = round(time.perf_counter() - first_started, 3)
+        return record
+
+def write_jsonl(records: Iterable[Dict[str, Any]], stream: TextIO) -> int:
+    """結果を1行1件のJSONとして逐次書き出し、件数を返す"""
+    count = 0
+    for record in records:
+        stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+        stream.flush()
+        count += 1
+    return count
@@ -0,0 +1,1007 @@
+import customtkinter as ctk
+import time
+import queue
+from tkinter import filedialog, messagebox
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from core import (
+    BackupManager,
+    BatchScanner,
+    EFFECT_LABELS,
+    HAS_WINREG,
+    RegistryManager,
+    RegistrySettingItem,
+    ScanCache,
+    ScanWorker,
+    SettingCatalog,
+    SettingItem,
+    SystemSettingItem,
+    is_admin,
+    load_catalog,
+    mask_count,
+)
+from effects import EffectPlan, EffectScheduler
+from instrumentation import INSTRUMENTATION
+from jobs import ITEM_STATUS_LABELS, Job, JobQueue
+from journal import BackupJournal
+from overlay import ApplyPreview
+from search import STATE_FILTERS, SettingsFilter
+from watcher import create_refresher
+
+class FontCache:
+    """CTkFontを共有するキャッシュ（クリックや適用のたびにフォントを作らない）"""
+    
+    _fonts: Dict[Tuple[int, str, bool], ctk.CTkFont] = {}
+    
+    @classmethod
+    def get(cls, size: int, weight: str = "normal", underline: bool = False) -> ctk.CTkFont:
+        key = (size, weight, underline)
+        font = cls._fonts.get(key)
+        if font is None:
+            font = ctk.CTkFont(size=size, weight=weight, underline=underline)
+            cls._fonts[key] = font
+        return font
+
+class RowState(NamedTuple):
+    """設定一覧の1行に表示する内容"""
+    setting: SettingItem
+    selection: str
+    modified: bool
+    scanning: bool
+
+class SettingRow(ctk.CTkFrame):
+    """設定項目1行分のウィジェット（スクロール時に別の項目へ再利用される）"""
+    
+    def __init__(self, master, height: int, on_change: Callable[[str, str], None]):
+        super().__init__(master, corner_radius=10, height=height)
+        # 行の高さを中身に合わせて変えない（スクロール位置の計算を単純にする）
+        self.grid_propagate(False)
+        self.setting_id: Optional[str] = None
+        self._on_change = on_change
+        # 前回表示した内容（変化のない項目は再設定しない）
+        self._shown: Dict[str, Any] = {}
+        self.grid_columnconfigure(0, weight=1)
+        
+        # 設定名ラベル
+        self.name_label = ctk.CTkLabel(self, text="", font=FontCache.get(14, "bold"), anchor="w")
+        self.name_label.grid(row=0, column=0, sticky="w", padx=15, pady=(10, 0))
+        
+        # 説明ラベル
+        self.desc_label = ctk.CTkLabel(
+            self,
+            text="",
+            font=FontCache.get(11),
+            text_color="gray",
+            anchor="w"
+        )
+        self.desc_label.grid(row=1, column=0, sticky="w", padx=15, pady=(0, 5))
+        
+        # ラジオボタン変数
+        self.radio_var = ctk.StringVar(value="enabled")
+        
+        # ラジオボタンフレーム
+        radio_frame = ctk.CTkFrame(self, fg_color="transparent")
+        radio_frame.grid(row=0, column=1, rowspan=2, padx=15, pady=10)
+        
+        # スキャン状態ラベル
+        self.status_label = ctk.CTkLabel(self, text="", font=FontCache.get(11), text_color="gray")
+        self.status_label.grid(row=0, column=2, rowspan=2, padx=(0, 15))
+        
+        # 有効・無効ラジオボタン
+        self.enabled_radio = ctk.CTkRadioButton(
+            radio_frame,
+            text="",
+            variable=self.radio_var,
+            value="enabled",
+            command=self._on_radio
+        )
+        self.enabled_radio.pack(side="left", padx=10)
+        self.disabled_radio = ctk.CTkRadioButton(
+            radio_frame,
+            text="",
+            variable=self.radio_var,
+            value="disabled",
+            command=self._on_radio
+        )
+        self.disabled_radio.pack(side="left", padx=10)
+    
+    def _on_radio(self):
+        if self.setting_id is not None:
+            self._on_change(self.setting_id, self.radio_var.get())
+    
+    def _update(self, name: str, widget, **options):
+        """前回と異なる場合だけウィジェットを再設定"""
+        if self._shown.get(name) != options:
+            self._shown[name] = options
+            widget.configure(**options)
+    
+    def show(self, setting_id: str, state: RowState):
+        """行に設定項目を割り当てて表示を更新"""
+        self.setting_id = setting_id
+        setting = state.setting
+        if isinstance(setting, (RegistrySettingItem, SystemSettingItem)):
+            enabled_label, disabled_label = setting.labels
+        else:
+            enabled_label, disabled_label = "有効", "無効"
+        
+        self._update("name", self.name_label, text=setting.name,
+                     font=FontCache.get(14, "bold", underline=state.modified))
+        description = setting.description
+        if setting.effect not in ("none", "broadcast"):
+            description += f"（反映には{EFFECT_LABELS[setting.effect]}が必要）"
+        self._update("description", self.desc_label, text=description)
+        self._update("enabled", self.enabled_radio, text=enabled_label)
+        self._update("disabled", self.disabled_radio, text=disabled_label)
+        self._update("status", self.status_label, text="スキャン中…" if state.scanning else "")
+        if self.radio_var.get() != state.selection:
+            self.radio_var.set(state.selection)
+
+class VirtualSettingsList(ctk.CTkFrame):
+    """表示されている行の分だけウィジェットを作成し、スクロール時に使い回す設定一覧"""
+    
+    # 1行の高さ（行間を含む、スケーリング前のピクセル）
+    ROW_HEIGHT = 78
+    ROW_GAP = 8
+    
+    def __init__(self, master, row_state: Callable[[str], RowState],
+                 on_change: Callable[[str, str], None], **kwargs):
+        super().__init__(master, **kwargs)
+        self.row_state = row_state
+        self.on_change = on_change
+        self.item_ids: List[str] = []
+        self.offset = 0
+        self.visible_count = 0
+        self.rows: List[SettingRow] = []
+        
+        self.viewport = ctk.CTkFrame(self, fg_color="transparent")
+        self.viewport.pack(side="left", fill="both", expand=True, padx=10)
+        self.scrollbar = ctk.CTkScrollbar(self, command=self._on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+        
+        self.viewport.bind("<Configure>", self._on_resize)
+        # CTkウィジェットではbind_allが使えないため、ウィンドウ側に登録する
+        toplevel = self.winfo_toplevel()
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            toplevel.bind_all(sequence, self._on_mousewheel, add="+")
+    
+    def set_items(self, item_ids: List[str], offset: Optional[int] = None):
+        """表示する設定IDの一覧を設定（行ウィジェットは作り直さずに割り当て直す）"""
+        self.item_ids = list(item_ids)
+        self.scroll_to(self.offset if offset is None else offset)
+    
+    def scroll_to(self, offset: int):
+        """先頭に表示する行を変更"""
+        max_offset = max(0, len(self.item_ids) - self.visible_count)
+        self.offset = min(max(0, offset), max_offset)
+        self.refresh()
+    
+    def refresh(self):
+        """表示中のすべての行を更新"""
+        for slot, row in enumerate(self.rows):
+            index = self.offset + slot
+            if slot < self.visible_count and index < len(self.item_ids):
+                setting_id = self.item_ids[index]
+                row.show(setting_id, self.row_state(setting_id))
+                row.place(x=0, y=slot * self.ROW_HEIGHT + self.ROW_GAP // 2, relwidth=1)
+            else:
+                row.setting_id = None
+                row.place_forget()
+        
+        total = max(1, len(self.item_ids))
+        self.scrollbar.set(self.offset / total, min(1.0, (self.offset + self.visible_count) / total))
+    
+    def refresh_items(self, setting_ids):
+        """指定した設定IDを表示している行だけを更新"""
+        for row in self.rows:
+            if row.setting_id is not None and row.setting_id in setting_ids:
+                row.show(row.setting_id, self.row_state(row.setting_id))
+    
+    def _on_resize(self, event):
+        """表示できる行数に合わせて行ウィジェットを追加"""
+        row_height = self._apply_widget_scaling(self.ROW_HEIGHT)
+        self.visible_count = max(1, int(event.height // row_height))
+        while len(self.rows) < self.visible_count:
+            self.rows.append(SettingRow(self.viewport, self.ROW_HEIGHT - self.ROW_GAP, self.on_change))
+        self.scroll_to(self.offset)
+    
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(round(float(amount) * len(self.item_ids)))
+        elif unit == "pages":
+            self.scroll_to(self.offset + int(amount) * self.visible_count)
+        else:
+            self.scroll_to(self.offset + int(amount))
+    
+    def _on_mousewheel(self, event):
+        # ポインタが行の上にある場合だけスクロール（スクロールバーは自身で処理する）
+        widget = self.winfo_containing(event.x_root, event.y_root)
+        if widget is None or not str(widget).startswith(str(self.viewport)):
+            return
+        if event.num in (4, 5):
+            step = 3 if event.num == 5 else -3
+        else:
+            step = -max(1, abs(event.delta) // 40) if event.delta > 0 else max(1, abs(event.delta) // 40)
+        self.scroll_to(self.offset + step)
+
+class DiagnosticsPanel(ctk.CTkToplevel):
+    """計測結果（操作・キーごとの所要時間、直近のエラー）を表示する診断パネル"""
+    
+    # 表示を更新する間隔（ミリ秒）
+    UPDATE_INTERVAL = 1000
+    
+    GROUPS = {"キー別": "key", "操作別": "operation"}
+    
+    def __init__(self, app: "PoleToWinApp"):
+        super().__init__(app)
+        self.app = app
+        self.title("診断")
+        self.geometry("900x500")
+        self._after_id: Optional[str] = None
+        
+        toolbar = ctk.CTkFrame(self)
+        toolbar.pack(fill="x", padx=10, pady=(10, 5))
+        
+        self.enabled_var = ctk.BooleanVar(value=INSTRUMENTATION.enabled)
+        ctk.CTkSwitch(
+            toolbar, text="計測を有効にする", variable=self.enabled_var, command=self._on_toggle
+        ).pack(side="left", padx=5)
+        
+        self.group_button = ctk.CTkSegmentedButton(
+            toolbar, values=list(self.GROUPS), command=lambda _: self.update_view()
+        )
+        self.group_button.set("キー別")
+        self.group_button.pack(side="left", padx=10)
+        
+        ctk.CTkButton(toolbar, text="トレースを書き出す", width=140, command=self.export_trace).pack(side="right", padx=5)
+        ctk.CTkButton(toolbar, text="リセット", width=80, fg_color="gray", command=self.reset).pack(side="right", padx=5)
+        
+        self.textbox = ctk.CTkTextbox(self, font=ctk.CTkFont(family="Consolas", size=12), wrap="none")
+        self.textbox.pack(fill="both", expand=True, padx=10, pady=(5, 10))
+        
+        self.update_view()
+    
+    def _on_toggle(self):
+        if self.enabled_var.get():
+            INSTRUMENTATION.enable()
+        else:
+            INSTRUMENTATION.disable()
+        self.update_view()
+    
+    def reset(self):
+        INSTRUMENTATION.reset()
+        self.update_view()
+    
+    def export_trace(self):
+        """Chromeのトレースイベント形式で保存"""
+        path = filedialog.asksaveasfilename(
+            parent=self, defaultextension=".json", initialfile="poletowin_trace.json",
+            filetypes=[("Trace JSON", "*.json")]
+        )
+        if not path:
+            return
+        try:
+            count = INSTRUMENTATION.export_chrome_trace(path)
+            messagebox.showinfo("完了", f"{count}件のイベントを書き出しました。", parent=self)
+        except OSError as e:
+            messagebox.showerror("エラー", f"書き出しに失敗しました: {e}", parent=self)
+    
+    def update_view(self):
+        """表示を更新し、開いている間は定期的に更新する"""
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+        
+        lines = []
+        if not INSTRUMENTATION.enabled:
+            lines.append("計測は無効です。スイッチを有効にすると、以降の操作の所要時間を記録します。\n")
+        metrics = ", ".join(f"{name}: {value:.2f}秒" for name, value in self.app.startup_metrics.items())
+        cache = ", ".join(f"{name}: {value}" for name, value in self.app.registry.cache_stats().items())
+        lines.append(f"起動: {metrics or '計測中'}")
+        lines.append(f"ハンドルキャッシュ: {cache}\n")
+        lines.append(INSTRUMENTATION.format_table(self.GROUPS[self.group_button.get()]))
+        if INSTRUMENTATION.recent_errors:
+            lines.append("\n直近のエラー:")
+            for timestamp, category, name, key, message in reversed(INSTRUMENTATION.recent_errors):
+                moment = time.strftime("%H:%M:%S", time.localtime(timestamp))
+                lines.append(f"  {moment} {category}/{name} {key or ''}: {message}")
+        
+        self.textbox.configure(state="normal")
+        self.textbox.delete("1.0", "end")
+        self.textbox.insert("1.0", "\n".join(lines))
+        self.textbox.configure(state="disabled")
+        self._after_id = self.after(self.UPDATE_INTERVAL, self.update_view)
+    
+    def destroy(self):
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+        super().destroy()
+
+class JobSummaryPanel(ctk.CTkToplevel):
+    """適用・復元ジョブの項目ごとの結果を表示するパネル（モーダルにしない）"""
+    
+    TITLES = {"apply": "適用結果", "restore": "復元結果"}
+    
+    # 先に表示する結果（失敗したものを上にする）
+    ORDER = ("failed", "rollback_failed", "rolled_back", "not_run", "written", "skipped", "invalid")
+    
+    def __init__(self, app: "PoleToWinApp", job: Job):
+        super().__init__(app)
+        self.title(self.TITLES.get(job.label, "結果"))
+        self.geometry("700x400")
+        
+        ctk.CTkLabel(self, text=self.headline(job, app.settings), font=FontCache.get(14, "bold"),
+                     justify="left").pack(fill="x", padx=10, pady=(10, 5))
+        
+        self.textbox = ctk.CTkTextbox(self, font=ctk.CTkFont(family="Consolas", size=12), wrap="none")
+        self.textbox.pack(fill="both", expand=True, padx=10, pady=5)
+        self.textbox.insert("1.0", self.describe(job, app.settings))
+        self.textbox.configure(state="disabled")
+        
+        ctk.CTkButton(self, text="閉じる", width=80, command=self.destroy).pack(side="right", padx=10, pady=(5, 10))
+    
+    @staticmethod
+    def headline(job: Job, settings: Dict[str, SettingItem]) -> str:
+        """結果の要約"""
+        action = "復元" if job.label == "restore" else "適用"
+        counts = job.counts()
+        skipped = f"（{counts['skipped']}個は変更なしのため省略）" if counts["skipped"] else ""
+        if job.error is not None:
+            return f"{action}中にエラーが発生しました: {job.error}"
+        if job.state == "cancelled":
+            return f"{action}を取り消しました。書き込んだ{counts['rolled_back']}個の項目は元に戻しました。"
+        if job.state == "failed":
+            failed = settings.get(job.result.failed)
+            failed_name = failed.name if failed is not None else job.result.failed
+            if job.result.rollback_errors:
+                return f"「{failed_name}」の書き込みに失敗しました。一部の項目を元に戻せませんでした。"
+            return f"「{failed_name}」の書き込みに失敗したため、すべての変更を元に戻しました。"
+        if not job.total:
+            return "すべての項目が既に指定の値になっています。"
+        return f"{counts['written']}個の設定を{action}しました。{skipped}"
+    
+    @classmethod
+    def describe(cls, job: Job, settings: Dict[str, SettingItem]) -> str:
+        """項目ごとの結果を文字列化"""
+        lines = []
+        for status in cls.ORDER:
+            for setting_id, item_status in job.items.items():
+                if item_status != status:
+                    continue
+                setting = settings.get(setting_id)
+                name = setting.name if setting is not None else setting_id
+                lines.append(f"{ITEM_STATUS_LABELS[status]:<10}{name}  ({setting_id})")
+        return "\n".join(lines)
+
+class PreviewPanel(ctk.CTkToplevel):
+    """上書きレイヤーに適用した結果を表示し、確定・破棄を選ぶパネル"""
+    
+    STATE_LABELS = {None: "未確認", "unknown": "不明"}
+    
+    def __init__(self, app: "PoleToWinApp", preview: ApplyPreview):
+        super().__init__(app)
+        self.app = app
+        self.preview = preview
+        self.title("適用内容の確認")
+        self.geometry("700x450")
+        
+        changed = preview.changed_ids()
+        headline = (f"適用すると{len(changed)}個の設定が変わります。" if changed
+                    else "すべての項目が既に指定の値になっています。")
+        ctk.CTkLabel(self, text=headline, font=FontCache.get(14, "bold"),
+                     justify="left").pack(fill="x", padx=10, pady=(10, 5))
+        
+        self.textbox = ctk.CTkTextbox(self, font=ctk.CTkFont(family="Consolas", size=12), wrap="none")
+        self.textbox.pack(fill="both", expand=True, padx=10, pady=5)
+        self.textbox.insert("1.0", self.describe(preview, app.settings))
+        self.textbox.configure(state="disabled")
+        
+        ctk.CTkButton(self, text="破棄", width=80, fg_color="gray", command=self.destroy).pack(
+            side="right", padx=10, pady=(5, 10)
+        )
+        if len(preview.plan):
+            ctk.CTkButton(self, text="この内容で適用", width=120, command=self.commit).pack(
+                side="right", padx=0, pady=(5, 10)
+            )
+    
+    @classmethod
+    def label(cls, setting: SettingItem, state: Optional[str]) -> str:
+        """状態の表示名（項目にラベルがあればそれを使う）"""
+        if state in ("enabled", "disabled") and isinstance(setting, (RegistrySettingItem, SystemSettingItem)):
+            return setting.labels[0 if state == "enabled" else 1]
+        return cls.STATE_LABELS.get(state, {"enabled": "有効", "disabled": "無効"}.get(state, str(state)))
+    
+    @classmethod
+    def describe(cls, preview: ApplyPreview, settings: Dict[str, SettingItem]) -> str:
+        """状態が変わる項目と、書き込む値の一覧"""
+        lines = []
+        for setting_id in preview.changed_ids():
+            setting = settings[setting_id]
+            before = cls.label(setting, setting.current_value)
+            after = cls.label(setting, preview.states[setting_id])
+            lines.append(f"{setting.name}: {before} → {after}  ({setting_id})")
+        if lines:
+            lines.append("")
+        lines.append(preview.plan.describe())
+        return "\n".join(lines)
+    
+    def commit(self):
+        """上書きレイヤーの内容を1回のジョブで実際のレジストリに書き込む"""
+        # 書き込む値は実際のレジストリの現在値と比べ直す（ブローカーにもそのまま送れる）
+        targets = self.preview.commit_targets()
+        self.app._submit_job(lambda: self.app.jobs.submit_restore(self.app.settings, targets, label="apply"))
+        self.destroy()
+    
+    def destroy(self):
+        # 確定しなかった上書き内容は破棄する
+        if self.preview is not None:
+            self.preview.discard()
+            self.preview = None
+        super().destroy()
+
+class PoleToWinApp(ctk.CTk):
+    """メインアプリケーション"""
+    
+    # バックグラウンドスキャン結果をUIに反映する間隔（ミリ秒）
+    SCAN_POLL_INTERVAL = 30
+    # 初期スキャン後に変更通知の結果を反映する間隔（ミリ秒）
+    REFRESH_POLL_INTERVAL = 200
+    # 変更通知が使えないキーを読み直す間隔（秒）
+    WATCH_POLL_INTERVAL = 2.0
+    # カテゴリで絞り込まない場合の表示
+    ALL_CATEGORIES = "すべてのカテゴリ"
+    
+    def __init__(self):
+        self._launch_time = time.perf_counter()
+        super().__init__()
+        
+        # ウィンドウ設定
+        self.title("Pole To Win No11 - Windows 11 最適化ツール")
+        self.geometry("900x700")
+        
+        # テーマ設定
+        ctk.set_appearance_mode("dark")
+        ctk.set_default_color_theme("blue")
+        
+        # マネージャー初期化
+        # 適用のたびに変更前の値を追記するジャーナル（旧形式のバックアップは復元にだけ使う）
+        self.backup_journal = BackupJournal()
+        self.backup_manager = BackupManager()
+        # スキャン・適用・再スキャンでキーハンドルを再利用する
+        self.registry = RegistryManager(cache_size=32)
+        # 前回の起動から書き込まれていないキーは値を読み直さない
+        self.scan_cache = ScanCache()
+        self.scan_cache.load()
+        self.scanner = BatchScanner(self.registry, self.scan_cache)
+        
+        # スキャン結果・変更通知の結果はこのキューを経由してUIに反映する
+        self._scan_queue: "queue.Queue[Optional[Dict[str, str]]]" = queue.Queue()
+        
+        # 設定項目リスト
+        self.settings = self._initialize_settings()
+        # ワーカースレッドのスキャンは別のカタログに書き込み、結果はUIスレッドで画面のカタログに反映する
+        self.scan_catalog = SettingCatalog(self.catalog.records, self.catalog.index)
+        self.refresher = create_refresher(
+            self.scan_catalog.settings, self.scanner, self._scan_queue.put, self.WATCH_POLL_INTERVAL
+        )
+        
+        # 適用した設定の反映操作（通知・Explorer再起動など）をまとめて実行し、結果をキューで受け取る
+        self._effect_results: "queue.Queue[Tuple[EffectPlan, Optional[Exception]]]" = queue.Queue()
+        self.effects = EffectScheduler(
+            self.settings, on_done=lambda plan, error: self._effect_results.put((plan, error))
+        )
+        
+        # 適用・復元はジョブとしてワーカースレッドで実行し、進捗と完了をキューで受け取る
+        self._job_events: "queue.Queue[Tuple[Job, bool]]" = queue.Queue()
+        self.jobs = self._create_job_queue()
+        
+        # 診断パネル・結果パネル（開いているときだけ作成）
+        self.diagnostics_panel: Optional[DiagnosticsPanel] = None
+        self.job_summary_panel: Optional[JobSummaryPanel] = None
+        self.preview_panel: Optional[PreviewPanel] = None
+        
+        # 画面上の選択状態（適用待ちの選択はカタログの状態配列に格納される）
+        self.scanning_items = set(self.settings)
+        self._pending_refresh = set()
+        self._refresh_scheduled = False
+        
+        # 起動計測（初回描画・スキャン完了までの秒数）
+        self.startup_metrics: Dict[str, float] = {}
+        self.bind("<Map>", self._on_first_map, add="+")
+        
+        # UIの構築
+        self._build_ui()
+        
+        # 初期スキャン（ウィンドウを先に表示し、バックグラウンドで実行）
+        self.start_background_scan()
+    
+    def _create_job_queue(self) -> JobQueue:
+        """ジョブキューを作成（管理者権限がなければ、GUIは昇格せずに書き込みだけをブローカーに送る）"""
+        def on_progress(job: Job, setting_id: str, ok: bool):
+            self._job_events.put((job, False))
+        
+        if not HAS_WINREG or is_admin():
+            return JobQueue(self.registry, self.backup_journal, on_progress=on_progress, on_done=self._on_job_finished)
+        
+        from broker import BrokerClient, BrokerJobQueue
+        
+        # ブローカーは最初の適用・復元のときに起動する（UACの確認はそのときに1回だけ表示される）
+        client = BrokerClient(journal_file=self.backup_journal.journal_file)
+        return BrokerJobQueue(client, on_progress=on_progress, on_done=self._on_job_finished)
+    
+    def _initialize_settings(self) -> Dict[str, SettingItem]:
+        """設定項目を初期化"""
+        self.catalog = load_catalog()
+        # 検索用のn-gram索引はカタログの読み込み時に1回だけ作成する
+        self.settings_filter = SettingsFilter(self.catalog)
+        return self.catalog.settings
+    
+    def _build_ui(self):
+        """UIを構築"""
+        # ヘッダー
+        header = ctk.CTkLabel(
+            self, 
+            text="Pole To Win No11", 
+            font=FontCache.get(24, "bold")
+        )
+        header.pack(pady=20)
+        
+        # 警告ラベル（設定変更時に表示）
+        self.warning_label = ctk.CTkLabel(
+            self,
+            text="",
+            font=FontCache.get(12),
+            text_color="orange"
+        )
+        self.warning_label.pack(pady=5)
+        
+        # 適用・復元の進捗（ジョブの実行中だけ表示）
+        self.job_frame = ctk.CTkFrame(self)
+        self.job_label = ctk.CTkLabel(self.job_frame, text="", font=FontCache.get(12), width=200, anchor="w")
+        self.job_label.pack(side="left", padx=10)
+        self.job_progress = ctk.CTkProgressBar(self.job_frame)
+        self.job_progress.set(0)
+        self.job_progress.pack(side="left", padx=5, expand=True, fill="x")
+        ctk.CTkButton(
+            self.job_frame, text="取り消し", width=80, fg_color="gray", command=self.cancel_jobs
+        ).pack(side="left", padx=10, pady=5)
+        
+        # 検索・絞り込み（キー入力のたびに一覧に割り当てる項目だけを入れ替える）
+        filter_frame = ctk.CTkFrame(self, fg_color="transparent")
+        filter_frame.pack(pady=(5, 0), padx=20, fill="x")
+        self.search_entry = ctk.CTkEntry(
+            filter_frame, placeholder_text="設定を検索（名前・説明・キーパス）", height=32
+        )
+        self.search_entry.pack(side="left", padx=5, expand=True, fill="x")
+        self.search_entry.bind("<KeyRelease>", lambda event: self.apply_filter())
+        self.category_menu = ctk.CTkOptionMenu(
+            filter_frame,
+            values=[self.ALL_CATEGORIES, *self.catalog.by_category],
+            command=lambda _: self.apply_filter(),
+            width=160
+        )
+        self.category_menu.pack(side="left", padx=5)
+        self.state_filter = ctk.CTkSegmentedButton(
+            filter_frame, values=list(STATE_FILTERS.values()), command=lambda _: self.apply_filter()
+        )
+        self.state_filter.set(STATE_FILTERS["all"])
+        self.state_filter.pack(side="left", padx=5)
+        
+        # 設定一覧（表示中の行だけウィジェットを作成）
+        self.settings_list = VirtualSettingsList(
+            self,
+            row_state=self.row_state,
+            on_change=self._on_setting_changed,
+            width=850,
+            height=400
+        )
+        self.settings_list.pack(pady=10, padx=20, fill="both", expand=True)
+        self.settings_list.set_items(list(self.settings))
+        
+        # ボタンフレーム
+        button_frame = ctk.CTkFrame(self)
+        button_frame.pack(pady=20, padx=20, fill="x")
+        
+        # 設定適用ボタン
+        apply_btn = ctk.CTkButton(
+            button_frame,
+            text="選択した項目の設定を適用",
+            command=self.apply_selected_settings,
+            font=FontCache.get(14, "bold"),
+            height=40
+        )
+        apply_btn.pack(side="left", padx=5, expand=True, fill="x")
+        
+        # すべて適用ボタン
+        apply_all_btn = ctk.CTkButton(
+            button_frame,
+            text="すべての設定を適用",
+            command=self.apply_all_settings,
+            font=FontCache.get(14, "bold"),
+            height=40,
+            fg_color="green"
+        )
+        apply_all_btn.pack(side="left", padx=5, expand=True, fill="x")
+        
+        # 初期設定に戻すボタン
+        reset_btn = ctk.CTkButton(
+            button_frame,
+            text="初期設定に戻す",
+            command=self.reset_settings,
+            font=FontCache.get(14),
+            height=40,
+            fg_color="gray"
+        )
+        reset_btn.pack(side="left", padx=5, expand=True, fill="x")
+        
+        # システムボタンフレーム
+        system_button_frame = ctk.CTkFrame(self)
+        system_button_frame.pack(pady=10, padx=20, fill="x")
+        
+        # 適用内容確認ボタン
+        preview_btn = ctk.CTkButton(
+            system_button_frame,
+            text="適用内容を確認",
+            command=self.preview_changes,
+            height=35,
+            fg_color="gray"
+        )
+        preview_btn.pack(side="left", padx=5, expand=True, fill="x")
+        
+        # Explorer再起動ボタン
+        explorer_btn = ctk.CTkButton(
+            system_button_frame,
+            text="Explorer.exeを再起動",
+            command=self.restart_explorer,
+            height=35
+        )
+        explorer_btn.pack(side="left", padx=5, expand=True, fill="x")
+        
+        # Windows再起動ボタン
+        windows_btn = ctk.CTkButton(
+            system_button_frame,
+            text="Windowsを再起動",
+            command=self.restart_windows,
+            height=35,
+            fg_color="red"
+        )
+        windows_btn.pack(side="left", padx=5, expand=True, fill="x")
+        
+        # 診断パネルボタン
+        diagnostics_btn = ctk.CTkButton(
+            system_button_frame,
+            text="診断",
+            command=self.show_diagnostics,
+            height=35,
+            width=80,
+            fg_color="gray"
+        )
+        diagnostics_btn.pack(side="left", padx=5)
+    
+    def _filter_state(self) -> str:
+        """選択中の状態の絞り込み（STATE_FILTERSのキー）"""
+        label = self.state_filter.get()
+        return next((state for state, state_label in STATE_FILTERS.items() if state_label == label), "all")
+    
+    def apply_filter(self):
+        """検索語・カテゴリ・状態で設定一覧を絞り込む"""
+        category = self.category_menu.get()
+        item_ids = self.settings_filter.apply(
+            self.search_entry.get(), None if category == self.ALL_CATEGORIES else category, self._filter_state()
+        )
+        if item_ids != self.settings_list.item_ids:
+            self.settings_list.set_items(item_ids, offset=0)
+    
+    def row_state(self, setting_id: str) -> RowState:
+        """設定一覧の行に表示する内容を取得"""
+        setting = self.settings[setting_id]
+        return RowState(
+            setting,
+            self._selection(setting),
+            setting.modified,
+            setting_id in self.scanning_items
+        )
+    
+    @staticmethod
+    def _selection(setting: SettingItem) -> str:
+        """ラジオボタンの値（適用待ちの選択、なければ現在の状態。不明なら無効、スキャン前は有効）"""
+        if setting.new_value is not None:
+            return setting.new_value
+        if setting.current_value is None:
+            return "enabled"
+        return setting.current_value if setting.current_value != "unknown" else "disabled"
+    
+    def _on_setting_changed(self, setting_id: str, new_value: str):
+        """設定が変更されたときの処理"""
+        setting = self.settings[setting_id]
+        
+        # 現在値と異なる場合だけ適用待ちにする（変更扱いかどうかは状態配列の比較で決まる）
+        setting.new_value = new_value if new_value != setting.current_value else None
+        
+        # ラベルの太字・警告メッセージはまとめて更新
+        self._schedule_refresh([setting_id])
+    
+    def _schedule_refresh(self, setting_ids):
+        """行の表示と警告メッセージの更新を次のアイドル時に1回だけ行う"""
+        self._pending_refresh.update(setting_ids)
+        if not self._refresh_scheduled:
+            self._refresh_scheduled = True
+            self.after_idle(self._flush_refresh)
+    
+    def _flush_refresh(self):
+        self._refresh_scheduled = False
+        pending, self._pending_refresh = self._pending_refresh, set()
+        # 状態で絞り込んでいる場合は、状態が変わった項目を一覧に出し入れする
+        if self._filter_state() != "all":
+            self.apply_filter()
+        self.settings_list.refresh_items(pending)
+        self._update_warning_message()
+    
+    def _update_warning_message(self):
+        """警告メッセージを更新"""
+        count = mask_count(self.catalog.modified_mask())
+        if count:
+            self.warning_label.configure(
+                text=f"設定を変更しようとしている項目があります。「設定を適用」ボタンで設定が反映されます。（{count}項目）"
+            )
+        else:
+            self.warning_label.configure(text="")
+    
+    def scan_all_settings(self):
+        """すべての設定をスキャン"""
+        self._apply_scan_results(self.scanner.scan(self.settings))
+    
+    def rescan_settings(self, setting_ids):
+        """指定した設定項目だけを再スキャン"""
+        self.refresher.refresh_settings(list(setting_ids))
+    
+    def _apply_scan_results(self, states: Dict[str, str]):
+        """スキャン結果をラジオボタンに反映"""
+        # ワーカースレッドのスキャン結果はここで（UIスレッドで）状態配列に記録する
+        self.catalog.current.update(states)
+        self.scanning_items.difference_update(states)
+        # 未適用の変更は残し、現在値と一致したものだけ取り消す
+        self.catalog.clear_settled()
+        self._schedule_refresh(states)
+    
+    def start_background_scan(self):
+        """ワーカースレッドでスキャンを開始し、結果をafter()でまとめて反映"""
+        self.scan_in_progress = True
+        ScanWorker(
+            self.scanner,
+            self.scan_catalog.settings,
+            on_batch=self._scan_queue.put,
+            on_done=lambda elapsed: self._scan_queue.put(None)
+        ).start()
+        self.after(self.SCAN_POLL_INTERVAL, self._drain_scan_queue)
+    
+    def _drain_scan_queue(self):
+        """キューに溜まったスキャン結果を一度に反映"""
+        states: Dict[str, str] = {}
+        finished = False
+        while True:
+            try:
+                batch = self._scan_queue.get_nowait()
+            except queue.Empty:
+                break
+            if batch is None:
+                finished = True
+            else:
+                states.update(batch)
+        
+        if states:
+            self._apply_scan_results(states)
+        
+        if finished:
+            self.scan_in_progress = False
+            self._record_metric("fully_scanned")
+            self.scan_cache.save()
+            # 以降は変更のあったキーの項目だけを再スキャンする
+            self.refresher.start()
+        
+        self._drain_effect_results()
+        self._drain_job_events()
+        
+        self.after(
+            self.SCAN_POLL_INTERVAL if self.scan_in_progress or self.jobs.busy else self.REFRESH_POLL_INTERVAL,
+            self._drain_scan_queue
+        )
+    
+    def _drain_job_events(self):
+        """ジョブの進捗をまとめてプログレスバーに反映し、完了したジョブの結果を表示"""
+        current: Optional[Job] = None
+        finished: List[Job] = []
+        while True:
+            try:
+                job, done = self._job_events.get_nowait()
+            except queue.Empty:
+                break
+            current = job
+            if done:
+                finished.append(job)
+        
+        for job in finished:
+            self._on_job_done(job)
+        
+        if not self.jobs.busy:
+            self.job_frame.pack_forget()
+        elif current is not None and current.total:
+            action = "復元" if current.label == "restore" else "適用"
+            self.job_label.configure(text=f"{action}中 {current.done}/{current.total}")
+            self.job_progress.set(current.done / current.total)
+    
+    def _submit_job(self, submit: Callable[[], Job]) -> Job:
+        """ジョブを追加して進捗を表示（結果は_drain_job_eventsで表示）"""
+        job = submit()
+        self.job_label.configure(text="準備中...")
+        self.job_progress.set(0)
+        self.job_frame.pack(pady=5, padx=20, fill="x", before=self.settings_list)
+        return job
+    
+    def cancel_jobs(self):
+        """実行中・実行待ちの適用・復元を取り消す"""
+        self.jobs.cancel_all()
+        self.job_label.configure(text="取り消し中...")
+    
+    def _on_job_finished(self, job: Job):
+        """（ワーカースレッド）対象の項目を再スキャンしてから完了を通知"""
+        # 変更なしで省略した項目も含めて再スキャンし、現在値と一致した選択を取り消す
+        if job.items:
+            self.refresher.refresh_settings(list(job.items))
+        self._job_events.put((job, True))
+    
+    def _on_job_done(self, job: Job):
+        """ジョブの結果を表示し、書き込んだ項目を反映する"""
+        if self.job_summary_panel is not None and self.job_summary_panel.winfo_exists():
+            self.job_summary_panel.destroy()
+        self.job_summary_panel = JobSummaryPanel(self, job)
+        if job.state == "done" and job.written:
+            self._schedule_effects(job.written)
+    
+    def _drain_effect_results(self):
+        """バックグラウンドで実行した反映操作の結果を通知"""
+        while True:
+            try:
+                plan, error = self._effect_results.get_nowait()
+            except queue.Empty:
+                break
+            if error is not None:
+                messagebox.showerror("エラー", f"{EFFECT_LABELS[plan.action]}に失敗しました: {error}")
+            elif plan.action == "explorer":
+                messagebox.showinfo("完了", "Explorer.exeを再起動しました。")
+    
+    def _on_first_map(self, event):
+        """ウィンドウが最初に表示された時刻を記録"""
+        if event.widget is self and "first_paint" not in self.startup_metrics:
+            self._record_metric("first_paint")
+    
+    def _record_metric(self, name: str):
+        """起動からの経過時間を記録（診断画面に表示し、計測が有効なら計測結果にも残す）"""
+        elapsed = time.perf_counter() - self._launch_time
+        self.startup_metrics[name] = elapsed
+        INSTRUMENTATION.record("phase", "startup", name, elapsed, self._launch_time)
+    
+    def _scan_pending(self) -> bool:
+        """初期スキャン中なら通知してTrueを返す"""
+        if self.scan_in_progress:
+            messagebox.showinfo("情報", "現在の設定をスキャン中です。完了までお待ちください。")
+            return True
+        return False
+    
+    def apply_selected_settings(self):
+        """選択した設定を適用"""
+        if self._scan_pending():
+            return
+        
+        modified = self.catalog.modified_mask()
+        if not modified:
+            messagebox.showinfo("情報", "変更された設定項目がありません。")
+            return
+        
+        modified_ids = self.catalog.current.ids(modified)
+        targets = {setting_id: self.settings[setting_id].new_value for setting_id in modified_ids}
+        # 適用待ちの選択は再スキャンで現在値と一致したときに取り消される
+        self._submit_job(lambda: self.jobs.submit_apply(self.settings, targets))
+    
+    def apply_all_settings(self):
+        """すべての設定を適用"""
+        if self._scan_pending():
+            return
+        
+        # すべての設定項目を画面上の選択どおりにする
+        targets = {setting_id: self._selection(setting) for setting_id, setting in self.settings.items()}
+        self._submit_job(lambda: self.jobs.submit_apply(self.settings, targets))
+    
+    def _schedule_effects(self, setting_ids: List[str]):
+        """書き込んだ項目を反映させる（再起動・サインアウトが必要なら確認する）"""
+        pending = self.effects.request(setting_ids)
+        if pending.action in ("none", "broadcast"):
+            self.effects.run_async(self.effects.take())
+            return
+        
+        response = messagebox.askyesno(
+            "確認",
+            f"次の設定の反映には以下の操作が必要です。\n\n{pending.describe(self.settings)}\n\n"
+            f"今すぐ{EFFECT_LABELS[pending.action]}しますか？\n"
+            "（「いいえ」の場合、通知だけで反映できる項目を先に反映し、残りは後でまとめて行います）"
+        )
+        # 断った場合も、より大きな操作が必要な項目はためておき、次に再起動するときにまとめて反映する
+        self.effects.run_async(self.effects.take() if response else self.effects.take("broadcast"))
+    
+    def preview_changes(self):
+        """「すべての設定を適用」を上書きレイヤーに対して実行し、結果を書き込まずに表示"""
+        if self._scan_pending():
+            return
+        
+        targets = {setting_id: self._selection(setting) for setting_id, setting in self.settings.items()}
+        preview = ApplyPreview(self.registry, self.catalog, targets).run()
+        if self.preview_panel is not None and self.preview_panel.winfo_exists():
+            self.preview_panel.destroy()
+        self.preview_panel = PreviewPanel(self, preview)
+    
+    def reset_settings(self):
+        """初期設定に戻す"""
+        if self._scan_pending():
+            return
+        
+        # 最後の適用の直前の状態に戻す（ジャーナルがなければ旧形式のバックアップを使う）
+        session = self.backup_journal.last_session("apply")
+        backup_data = None if session is not None else self.backup_manager.load_backup()
+        
+        if session is None and not backup_data:
+            messagebox.showwarning("警告", "バックアップが見つかりません。")
+            return
+        
+        timestamp = session["timestamp"] if session is not None else backup_data.get('timestamp', '不明')
+        response = messagebox.askyesno(
+            "確認",
+            f"バックアップ（{timestamp}）から設定を復元しますか？"
+        )
+        
+        if not response:
+            return
+        if session is not None:
+            # 記録された変更前の生の値に戻す（ジャーナルの読み込みもワーカースレッドで行う）
+            self._submit_job(lambda: self.jobs.submit_restore(
+                self.settings, lambda: self.backup_journal.restore_targets(session["session"])
+            ))
+        else:
+            settings_data = backup_data.get("settings", {})
+            # バックアップされた値に戻す
+            targets = {
+                setting_id: data.get("current_value")
+                for setting_id, data in settings_data.items()
+                if setting_id in self.settings
+            }
+            self._submit_job(lambda: self.jobs.submit_apply(self.settings, targets, label="restore"))
+    
+    def show_diagnostics(self):
+        """診断パネルを表示（既に開いていれば前面に出す）"""
+        if self.diagnostics_panel is not None and self.diagnostics_panel.winfo_exists():
+            self.diagnostics_panel.focus()
+            return
+        self.diagnostics_panel = DiagnosticsPanel(self)
+    
+    def restart_explorer(self):
+        """Explorerを再起動"""
+        response = messagebox.askyesno("確認", "Explorer.exeを再起動しますか？")
+        if response:
+            # Explorerの再起動で反映できる、ためている項目も一緒に反映する（結果は_drain_effect_resultsで通知）
+            self.effects.run_async(self.effects.take("explorer").merge(EffectPlan({"explorer": []})))
+    
+    def restart_windows(self):
+        """Windowsを再起動"""
+        response = messagebox.askyesno("確認", "Windowsを再起動しますか？\n保存されていないデータは失われます。")
+        if response:
+            self.effects.run_async(self.effects.take().merge(EffectPlan({"reboot": []})))
+    
+    def destroy(self):
+        """ウィンドウ破棄時に監視を終了し、キャッシュ済みのキーハンドルを閉じる"""
+        # 実行中の適用・復元は取り消し、書き込んだ分を元に戻してから終了する
+        self.jobs.cancel_all()
+        self.jobs.wait()
+        self.jobs.close()
+        self.refresher.stop()
+        self.registry.close()
+        self.scan_cache.save()
+        super().destroy()
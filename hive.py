@@ -0,0 +1,467 @@
+import mmap
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from core import (
+    CATALOG_ROOTS,
+    BatchScanner,
+    RegistryBackend,
+    RegistryManager,
+    SettingCatalog,
+    StateVector,
+    winreg,
+)
+from regfile import decode_data, encode_data
+
+# ハイブビンの開始位置（セルのオフセットはここからの相対位置）
+HBIN_START = 0x1000
+# nkレコードのフラグ: キー名がASCII（Latin-1）で格納されている
+KEY_COMP_NAME = 0x0020
+# vkレコードのフラグ: 値名がASCII（Latin-1）で格納されている
+VALUE_COMP_NAME = 0x0001
+# データサイズの最上位ビットが立っていればデータはオフセットの位置に直接格納されている
+DATA_RESIDENT = 0x80000000
+# これより大きなデータはdbレコード（分割されたセグメント）に格納されている（バージョン1.4以降）
+BIG_DATA_SEGMENT = 16344
+
+# ファイル名 -> マウント先 (root, キーパス)
+HIVE_MOUNTS = {
+    "ntuser.dat": (winreg.HKEY_CURRENT_USER, ""),
+    "usrclass.dat": (winreg.HKEY_CURRENT_USER, "Software\\Classes"),
+    "software": (winreg.HKEY_LOCAL_MACHINE, "SOFTWARE"),
+    "system": (winreg.HKEY_LOCAL_MACHINE, "SYSTEM"),
+    "default": (winreg.HKEY_USERS, ".DEFAULT"),
+}
+
+class HiveError(ValueError):
+    """ハイブファイルの形式が不正"""
+
+class HiveFile:
+    """regf形式のハイブファイルをメモリマップして読むリーダー
+    
+    セルはmemoryview上のオフセットとして扱い、名前と値のデータ以外は複製しない。
+    キーのサブキー・値の索引は、そのキーを初めてたどったときに作成する。
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:
+            self._file.close()
+            raise HiveError(f"{path}: 空のファイルです") from e
+        self.data = memoryview(self._map)
+        if len(self.data) < HBIN_START or self.data[:4] != b"regf":
+            self.close()
+            raise HiveError(f"{path}: ハイブファイルではありません")
+        self.minor_version = self._u32(0x18)
+        # 書き込み途中で終わったハイブ（シーケンス番号が一致しない）は内容が古い可能性がある
+        self.dirty = self._u32(0x04) != self._u32(0x08)
+        self.root = self._u32(0x24)
+        self._check_key(self.root)
+        # nkのオフセット -> {小文字の名前: オフセット}
+        self._subkeys: Dict[int, Dict[str, int]] = {}
+        self._values: Dict[int, Dict[str, int]] = {}
+    
+    def close(self):
+        self.data.release()
+        self._map.close()
+        self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def _u16(self, position: int) -> int:
+        return struct.unpack_from("<H", self.data, position)[0]
+    
+    def _u32(self, position: int) -> int:
+        return struct.unpack_from("<I", self.data, position)[0]
+    
+    def _cell(self, offset: int) -> Tuple[int, int]:
+        """セルのデータの開始位置と長さ"""
+        position = HBIN_START + offset
+        if offset == 0xFFFFFFFF or position + 4 > len(self.data):
+            raise HiveError(f"{self.path}: 不正なセルのオフセット: {offset:#x}")
+        size = abs(struct.unpack_from("<i", self.data, position)[0])
+        if size < 8 or position + size > len(self.data):
+            raise HiveError(f"{self.path}: 不正なセルのサイズ: {offset:#x}")
+        return position + 4, size - 4
+    
+    def _record(self, offset: int, signature: bytes) -> int:
+        position, _ = self._cell(offset)
+        if self.data[position:position + 2] != signature:
+            raise HiveError(f"{self.path}: {signature.decode()}レコードではありません: {offset:#x}")
+        return position
+    
+    def _check_key(self, offset: int) -> int:
+        return self._record(offset, b"nk")
+    
+    def _name(self, position: int, length: int, compressed: bool) -> str:
+        view = self.data[position:position + length]
+        return str(view, "latin-1" if compressed else "utf-16-le")
+    
+    def key_name(self, offset: int) -> str:
+        position = self._check_key(offset)
+        return self._name(position + 76, self._u16(position + 72), bool(self._u16(position + 2) & KEY_COMP_NAME))
+    
+    def key_info(self, offset: int) -> Tuple[int, int, int]:
+        """(サブキーの数, 値の数, 最終書き込み時刻) をQueryInfoKeyと同じ形で返す"""
+        position = self._check_key(offset)
+        last_write = struct.unpack_from("<Q", self.data, position + 4)[0]
+        return self._u32(position + 20), self._u32(position + 36), last_write
+    
+    def _list_offsets(self, offset: int) -> Iterator[int]:
+        """サブキーの一覧（li/lf/lh/ri）からnkのオフセットを順に返す"""
+        position, _ = self._cell(offset)
+        signature = bytes(self.data[position:position + 2])
+        count = self._u16(position + 2)
+        if signature == b"li":
+            for index in range(count):
+                yield self._u32(position + 4 + index * 4)
+        elif signature in (b"lf", b"lh"):
+            for index in range(count):
+                yield self._u32(position + 4 + index * 8)
+        elif signature == b"ri":
+            for index in range(count):
+                yield from self._list_offsets(self._u32(position + 4 + index * 4))
+        else:
+            raise HiveError(f"{self.path}: 不明なサブキーの一覧です: {offset:#x}")
+    
+    def subkeys(self, offset: int) -> Dict[str, int]:
+        """キーのサブキー（小文字の名前 -> nkのオフセット）"""
+        index = self._subkeys.get(offset)
+        if index is None:
+            position = self._check_key(offset)
+            index = {}
+            if self._u32(position + 20):
+                for child in self._list_offsets(self._u32(position + 28)):
+                    index[self.key_name(child).lower()] = child
+            self._subkeys[offset] = index
+        return index
+    
+    def find_key(self, key_path: str) -> Optional[int]:
+        """ハイブのルートからの相対パスでキーを探す（見つからなければNone）"""
+        offset = self.root
+        for name in key_path.split("\\"):
+            if not name:
+                continue
+            offset = self.subkeys(offset).get(name.lower())
+            if offset is None:
+                return None
+        return offset
+    
+    def _value_name(self, position: int) -> str:
+        return self._name(position + 20, self._u16(position + 2), bool(self._u16(position + 16) & VALUE_COMP_NAME))
+    
+    def values(self, offset: int) -> Dict[str, int]:
+        """キーの値（小文字の値名 -> vkのオフセット）"""
+        index = self._values.get(offset)
+        if index is None:
+            position = self._check_key(offset)
+            index = {}
+            count = self._u32(position + 36)
+            if count:
+                list_position, size = self._cell(self._u32(position + 40))
+                if count * 4 > size:
+                    raise HiveError(f"{self.path}: 値の一覧が壊れています: {offset:#x}")
+                for value_index in range(count):
+                    value = self._u32(list_position + value_index * 4)
+                    index[self._value_name(self._record(value, b"vk")).lower()] = value
+            self._values[offset] = index
+        return index
+    
+    def _value_data(self, position: int) -> bytes:
+        """vkレコードのデータ（dbレコードに分割されていれば連結する）"""
+        size = self._u32(position + 4)
+        if size & DATA_RESIDENT:
+            size &= ~DATA_RESIDENT
+            return bytes(self.data[position + 8:position + 8 + min(size, 4)])
+        if not size:
+            return b""
+        data_position, cell_size = self._cell(self._u32(position + 8))
+        if size > BIG_DATA_SEGMENT and self.minor_version > 3 and self.data[data_position:data_position + 2] == b"db":
+            segments = self._u16(data_position + 2)
+            list_position, _ = self._cell(self._u32(data_position + 4))
+            chunks = []
+            remaining = size
+            for index in range(segments):
+                segment_position, segment_size = self._cell(self._u32(list_position + index * 4))
+                length = min(remaining, segment_size, BIG_DATA_SEGMENT)
+                chunks.append(self.data[segment_position:segment_position + length])
+                remaining -= length
+            return b"".join(chunks)
+        return bytes(self.data[data_position:data_position + min(size, cell_size)])
+    
+    def value(self, offset: int) -> Tuple[str, Any, int]:
+        """vkのオフセットから (値名, 値, 型) を読み取る（値はwinregと同じ形）"""
+        position = self._record(offset, b"vk")
+        value_type = self._u32(position + 12)
+        return self._value_name(position), decode_data(value_type, self._value_data(position)), value_type
+
+class HiveRegistryBackend(RegistryBackend):
+    """オフラインのハイブファイルを読み取り専用のレジストリとして扱うバックエンド
+    
+    mount()でハイブファイルを (root, キーパス) に割り当てる（NTUSER.DATならHKEY_CURRENT_USER）。
+    割り当てていない場所のキーは存在しないものとして扱い、書き込みはPermissionErrorになる。
+    """
+    
+    def __init__(self):
+        # (root, 小文字のキーパス, ハイブ)（長いキーパスから順に探す）
+        self.mounts: List[Tuple[int, str, HiveFile]] = []
+    
+    def mount(self, hive: HiveFile, root: int, key_path: str = "") -> HiveFile:
+        self.mounts.append((root, key_path.strip("\\").lower(), hive))
+        self.mounts.sort(key=lambda mount: len(mount[1]), reverse=True)
+        return hive
+    
+    def close(self):
+        """割り当てたハイブファイルをすべて閉じる"""
+        for _, _, hive in self.mounts:
+            hive.close()
+        self.mounts = []
+    
+    def _resolve(self, root: int, key_path: str) -> Tuple[HiveFile, int]:
+        """キーハンドル (ハイブ, nkのオフセット) を求める"""
+        path = key_path.strip("\\")
+        lowered = path.lower()
+        for mount_root, prefix, hive in self.mounts:
+            if mount_root != root:
+                continue
+            if lowered == prefix or not prefix or lowered.startswith(prefix + "\\"):
+                offset = hive.find_key(path[len(prefix):])
+                if offset is not None:
+                    return hive, offset
+                break
+        raise FileNotFoundError(f"キーが見つかりません: {key_path}")
+    
+    @staticmethod
+    def _read_only(*args):
+        raise PermissionError("ハイブファイルは読み取り専用です")
+    
+    create_key = delete_key = set_value = delete_value = _read_only
+    
+    def open_key(self, root, key_path, access=winreg.KEY_READ):
+        if access & winreg.KEY_WRITE & ~winreg.KEY_READ:
+            self._read_only()
+        return self._resolve(root, key_path)
+    
+    def close_key(self, handle):
+        pass
+    
+    def query_value(self, handle, value_name):
+        hive, offset = handle
+        value = hive.values(offset).get(value_name.lower())
+        if value is None:
+            raise FileNotFoundError(f"値が見つかりません: {value_name}")
+        _, data, value_type = hive.value(value)
+        return data, value_type
+    
+    def enum_keys(self, handle):
+        hive, offset = handle
+        return [hive.key_name(child) for child in hive.subkeys(offset).values()]
+    
+    def enum_values(self, handle):
+        hive, offset = handle
+        return [hive.value(value) for value in hive.values(offset).values()]
+    
+    def query_info_key(self, handle):
+        hive, offset = handle
+        return hive.key_info(offset)
+
+def default_mount(path: str) -> Optional[Tuple[int, str]]:
+    """ファイル名からマウント先を決める（不明ならNone）"""
+    return HIVE_MOUNTS.get(os.path.basename(path).lower())
+
+def parse_mount(name: str) -> Tuple[int, str]:
+    """"HKCU" / "HKLM\\SOFTWARE" のようなマウント先を (root, キーパス) にする"""
+    root, _, key_path = name.strip("\\").partition("\\")
+    if root.upper() not in CATALOG_ROOTS:
+        raise ValueError(f"不明なルートキーです: {root}")
+    return CATALOG_ROOTS[root.upper()], key_path
+
+def open_image(path: str, mount: Optional[Tuple[int, str]] = None) -> HiveRegistryBackend:
+    """ハイブファイル、またはハイブファイルを含むフォルダ（1台分）を割り当てたバックエンドを作成"""
+    backend = HiveRegistryBackend()
+    try:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                target = default_mount(name)
+                if target is not None and os.path.isfile(os.path.join(path, name)):
+                    backend.mount(HiveFile(os.path.join(path, name)), *target)
+            if not backend.mounts:
+                raise HiveError(f"{path}: ハイブファイルがありません")
+        else:
+            target = mount or default_mount(path)
+            if target is None:
+                raise HiveError(f"{path}: マウント先を決められません（--mountで指定してください）")
+            backend.mount(HiveFile(path), *target)
+    except Exception:
+        backend.close()
+        raise
+    return backend
+
+# ワーカープロセスごとのカタログ（初期化時に1回だけ作成する）
+_worker_catalog: Optional[SettingCatalog] = None
+
+def _init_worker(records: List[Dict[str, Any]]):
+    global _worker_catalog
+    _worker_catalog = SettingCatalog(records)
+
+def scan_image(path: str, mount: Optional[Tuple[int, str]] = None) -> Dict[str, Any]:
+    """（ワーカープロセス）1台分のハイブをスキャンし、状態をカタログの並び順のバイト列で返す"""
+    started = time.perf_counter()
+    try:
+        backend = open_image(path, mount)
+    except (OSError, HiveError) as e:
+        return {"image": path, "status": "error", "error": str(e)}
+    try:
+        BatchScanner(RegistryManager(backend, cache_size=32)).scan(_worker_catalog.settings)
+        return {
+            "image": path,
+            "status": "ok",
+            "dirty": any(hive.dirty for _, _, hive in backend.mounts),
+            "codes": bytes(_worker_catalog.current.codes),
+            "elapsed": round(time.perf_counter() - started, 4),
+        }
+    except HiveError as e:
+        return {"image": path, "status": "error", "error": str(e)}
+    finally:
+        backend.close()
+
+def scan_images(paths: List[str], catalog: SettingCatalog, mount: Optional[Tuple[int, str]] = None,
+                workers: int = 1) -> Iterator[Dict[str, Any]]:
+    """複数台分のハイブをプロセスを分けて並行にスキャンし、結果を入力の順に返す
+    
+    レジストリ以外（サービス・タスク）の項目はハイブから評価できないため除く。
+    """
+    records = [record for record in catalog.records if record["kind"] == "registry"]
+    setting_ids = [record["id"] for record in records]
+    if workers <= 1 or len(paths) <= 1:
+        _init_worker(records)
+        results: Iterable[Dict[str, Any]] = (scan_image(path, mount) for path in paths)
+        yield from _decode_results(results, setting_ids)
+        return
+    chunksize = max(1, len(paths) // (workers * 4))
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(records,)) as executor:
+        results = executor.map(scan_image, paths, [mount] * len(paths), chunksize=chunksize)
+        yield from _decode_results(results, setting_ids)
+
+def _decode_results(results: Iterable[Dict[str, Any]], setting_ids: List[str]) -> Iterator[Dict[str, Any]]:
+    for result in results:
+        codes = result.pop("codes", None)
+        if codes is not None:
+            result["states"] = StateVector(setting_ids, codes).to_dict()
+        yield result
+
+def _hash_name(name: str) -> int:
+    """lhレコードのハッシュ"""
+    value = 0
+    for char in name.upper():
+        value = (value * 37 + ord(char)) & 0xFFFFFFFF
+    return value
+
+class HiveWriter:
+    """テスト・ベンチマーク用に小さなハイブファイルを作成する（読み取りの検証用で、Windowsには読み込まない）"""
+    
+    def __init__(self, list_limit: int = 0):
+        # サブキーがこの数を超えるキーはriレコードに分割する（0なら分割しない）
+        self.list_limit = list_limit
+        # 小文字のキーパス -> (キー名, {小文字の値名: (値名, 型, 値)}, [小文字の子のキーパス])
+        self.keys: Dict[str, Tuple[str, Dict[str, Tuple[str, int, Any]], List[str]]] = {"": ("ROOT", {}, [])}
+        self._cells = bytearray()
+    
+    def add_key(self, key_path: str) -> str:
+        names = [name for name in key_path.split("\\") if name]
+        parent = ""
+        for name in names:
+            path = f"{parent}\\{name.lower()}" if parent else name.lower()
+            if path not in self.keys:
+                self.keys[path] = (name, {}, [])
+                self.keys[parent][2].append(path)
+            parent = path
+        return parent
+    
+    def set_value(self, key_path: str, value_name: str, value_type: int, value: Any):
+        self.keys[self.add_key(key_path)][1][value_name.lower()] = (value_name, value_type, value)
+    
+    def _alloc(self, data: bytes) -> int:
+        """セルを追加してオフセットを返す（8バイト境界に揃える）"""
+        offset = 0x20 + len(self._cells)
+        size = (len(data) + 4 + 7) & ~7
+        self._cells += struct.pack("<i", -size) + data + b"\0" * (size - 4 - len(data))
+        return offset
+    
+    @staticmethod
+    def _encode_name(name: str) -> Tuple[bytes, bool]:
+        try:
+            return name.encode("ascii"), True
+        except UnicodeEncodeError:
+            return name.encode("utf-16-le"), False
+    
+    def _write_value(self, value_name: str, value_type: int, value: Any) -> int:
+        data = encode_data(value_type, value)
+        if len(data) <= 4:
+            size, data_offset = len(data) | DATA_RESIDENT, int.from_bytes(data.ljust(4, b"\0"), "little")
+        elif len(data) > BIG_DATA_SEGMENT:
+            segments = [self._alloc(data[start:start + BIG_DATA_SEGMENT])
+                        for start in range(0, len(data), BIG_DATA_SEGMENT)]
+            segment_list = self._alloc(struct.pack(f"<{len(segments)}I", *segments))
+            size, data_offset = len(data), self._alloc(b"db" + struct.pack("<HI", len(segments), segment_list))
+        else:
+            size, data_offset = len(data), self._alloc(data)
+        name, compressed = self._encode_name(value_name)
+        return self._alloc(b"vk" + struct.pack("<HIIIHH", len(name), size, data_offset, value_type,
+                                               VALUE_COMP_NAME if compressed else 0, 0) + name)
+    
+    def _write_key(self, path: str, parent: int) -> int:
+        name, values, children = self.keys[path]
+        encoded, compressed = self._encode_name(name)
+        # 子のオフセットを後から書き込むため、先に自分のセルを確保する
+        offset = self._alloc(bytes(76 + len(encoded)))
+        child_offsets = [(self.keys[child][0], self._write_key(child, offset)) for child in sorted(children)]
+        subkey_list = 0xFFFFFFFF
+        if child_offsets:
+            chunks = [child_offsets]
+            if self.list_limit and len(child_offsets) > self.list_limit:
+                chunks = [child_offsets[start:start + self.list_limit]
+                          for start in range(0, len(child_offsets), self.list_limit)]
+            lists = [
+                self._alloc(b"lh" + struct.pack("<H", len(chunk)) + b"".join(
+                    struct.pack("<II", child, _hash_name(child_name)) for child_name, child in chunk
+                ))
+                for chunk in chunks
+            ]
+            subkey_list = lists[0] if len(lists) == 1 else self._alloc(
+                b"ri" + struct.pack(f"<H{len(lists)}I", len(lists), *lists)
+            )
+        value_offsets = [self._write_value(*value) for value in values.values()]
+        value_list = self._alloc(struct.pack(f"<{len(value_offsets)}I", *value_offsets)) if value_offsets else 0xFFFFFFFF
+        record = b"nk" + struct.pack(
+            "<HQIIIIIIIIIIIIIIIHH", (KEY_COMP_NAME if compressed else 0) | (0x0004 if path == "" else 0),
+            time.time_ns() // 100 + 116444736000000000, 0, parent, len(children), 0, subkey_list, 0xFFFFFFFF,
+            len(values), value_list, 0xFFFFFFFF, 0xFFFFFFFF, 0, 0, 0, 0, 0, len(encoded), 0,
+        ) + encoded
+        position = offset - 0x20 + 4
+        self._cells[position:position + len(record)] = record
+        return offset
+    
+    def write(self, path: str):
+        """ハイブファイルを書き出す（ハイブビンは1つだけ）"""
+        self._cells = bytearray()
+        root = self._write_key("", 0xFFFFFFFF)
+        size = (0x20 + len(self._cells) + 0xFFF) & ~0xFFF
+        free = size - 0x20 - len(self._cells)
+        if free:
+            self._cells += struct.pack("<i", free) + bytes(free - 4)
+        hbin = b"hbin" + struct.pack("<III", 0, size, 0) + bytes(16) + self._cells
+        header = bytearray(HBIN_START)
+        struct.pack_into("<4sIIQIIIIII", header, 0, b"regf", 1, 1, 0, 1, 5, 0, 1, root, size)
+        with open(path, 'wb') as f:
+            f.write(bytes(header) + hbin)
@@ -0,0 +1,236 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+# ヒストグラムの区間の上限（マイクロ秒、1µs〜約67秒を2倍刻み）
+BUCKET_BOUNDS_US = tuple(2 ** exponent for exponent in range(27))
+
+class Histogram:
+    """所要時間の件数・合計・最小・最大と、2倍刻みの区間ごとの件数"""
+    
+    def __init__(self):
+        self.count = 0
+        # FileNotFoundError以外の例外で終わった回数
+        self.errors = 0
+        # キー・値が存在しなかった回数
+        self.missing = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKET_BOUNDS_US) + 1)
+    
+    def add(self, duration: float):
+        self.count += 1
+        self.total += duration
+        if duration < self.min:
+            self.min = duration
+        if duration > self.max:
+            self.max = duration
+        # 上限が所要時間以上になる最初の区間
+        microseconds = duration * 1_000_000
+        bucket = (math.ceil(microseconds) - 1).bit_length() if microseconds > 1 else 0
+        self.buckets[min(bucket, len(BUCKET_BOUNDS_US))] += 1
+    
+    def merge(self, other: "Histogram"):
+        self.count += other.count
+        self.errors += other.errors
+        self.missing += other.missing
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for index, count in enumerate(other.buckets):
+            self.buckets[index] += count
+    
+    def percentile(self, fraction: float) -> float:
+        """指定した割合の所要時間（秒、区間の上限で近似）"""
+        if not self.count:
+            return 0.0
+        threshold = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= threshold:
+                if index >= len(BUCKET_BOUNDS_US):
+                    return self.max
+                return min(BUCKET_BOUNDS_US[index] / 1_000_000, self.max)
+        return self.max
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "missing": self.missing,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "min_ms": round(self.min * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.5) * 1000, 3),
+            "p95_ms": round(self.percentile(0.95) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+class _NullSpan:
+    """計測が無効なときに返す何もしないコンテキストマネージャー"""
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+class Span:
+    """with文の範囲の所要時間を記録する"""
+    
+    def __init__(self, instrumentation: "Instrumentation", category: str, name: str, key: Optional[str]):
+        self.instrumentation = instrumentation
+        self.category = category
+        self.name = name
+        self.key = key
+        self.started = 0.0
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.instrumentation.record(
+            self.category, self.name, self.key, time.perf_counter() - self.started, self.started, exc_value
+        )
+        return False
+
+class Instrumentation:
+    """レジストリ操作・バックアップ・スキャン/適用・外部コマンドの所要時間を集計する
+    
+    無効なときはspan()が共有のNULL_SPANを返すだけなので、呼び出し側の負担はほぼない。
+    """
+    
+    def __init__(self, enabled: bool = False, trace_limit: int = 100_000):
+        self.enabled = enabled
+        self.trace_limit = trace_limit
+        self._lock = threading.Lock()
+        # (分類, 操作, キー) -> ヒストグラム
+        self._histograms: Dict[Tuple[str, str, Optional[str]], Histogram] = {}
+        # Chromeのトレース用のイベント (分類, 操作, キー, 開始, 所要時間, スレッドID, エラー)
+        self._events: deque = deque(maxlen=trace_limit)
+        # 直近のエラー (時刻, 分類, 操作, キー, メッセージ)
+        self.recent_errors: deque = deque(maxlen=100)
+        self._origin = time.perf_counter()
+        self._thread_names: Dict[int, str] = {}
+    
+    def enable(self):
+        self.enabled = True
+    
+    def disable(self):
+        self.enabled = False
+    
+    def reset(self):
+        """集計結果を消去"""
+        with self._lock:
+            self._histograms = {}
+            self._events = deque(maxlen=self.trace_limit)
+            self.recent_errors.clear()
+            self._origin = time.perf_counter()
+    
+    def span(self, category: str, name: str, key: Optional[str] = None):
+        """所要時間を記録するコンテキストマネージャー（無効ならNULL_SPAN）"""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, category, name, key)
+    
+    def record(self, category: str, name: str, key: Optional[str], duration: float,
+               started: Optional[float] = None, error: Optional[BaseException] = None):
+        """1回分の所要時間を記録"""
+        if not self.enabled:
+            return
+        if started is None:
+            started = time.perf_counter() - duration
+        thread = threading.current_thread()
+        with self._lock:
+            histogram = self._histograms.get((category, name, key))
+            if histogram is None:
+                histogram = self._histograms[(category, name, key)] = Histogram()
+            histogram.add(duration)
+            if isinstance(error, FileNotFoundError):
+                histogram.missing += 1
+            elif error is not None:
+                histogram.errors += 1
+                self.recent_errors.append((time.time(), category, name, key, f"{type(error).__name__}: {error}"))
+            self._thread_names.setdefault(thread.ident, thread.name)
+            self._events.append((category, name, key, started, duration, thread.ident, error))
+    
+    def stats(self, group_by: str = "key") -> List[Dict[str, Any]]:
+        """集計結果（group_byが"operation"ならキーをまとめる）を合計時間の長い順に返す"""
+        with self._lock:
+            items = list(self._histograms.items())
+        merged: Dict[Tuple[str, str, Optional[str]], Histogram] = {}
+        for (category, name, key), histogram in items:
+            group = (category, name, key if group_by == "key" else None)
+            target = merged.get(group)
+            if target is None:
+                target = merged[group] = Histogram()
+            target.merge(histogram)
+        rows = []
+        for (category, name, key), histogram in merged.items():
+            row = {"category": category, "operation": name, "key": key}
+            row.update(histogram.to_dict())
+            rows.append(row)
+        rows.sort(key=lambda row: row["total_ms"], reverse=True)
+        return rows
+    
+    def chrome_trace(self) -> Dict[str, Any]:
+        """Chrome（chrome://tracing / Perfetto）で開けるトレースイベント形式"""
+        pid = os.getpid()
+        with self._lock:
+            events = list(self._events)
+            thread_names = dict(self._thread_names)
+            origin = self._origin
+        trace_events: List[Dict[str, Any]] = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in thread_names.items()
+        ]
+        for category, name, key, started, duration, tid, error in events:
+            event = {
+                "name": name if key is None else f"{name} {key}",
+                "cat": category,
+                "ph": "X",
+                "ts": round((started - origin) * 1_000_000, 3),
+                "dur": round(duration * 1_000_000, 3),
+                "pid": pid,
+                "tid": tid,
+            }
+            args = {}
+            if key is not None:
+                args["key"] = key
+            if isinstance(error, FileNotFoundError):
+                args["missing"] = True
+            elif error is not None:
+                args["error"] = f"{type(error).__name__}: {error}"
+            if args:
+                event["args"] = args
+            trace_events.append(event)
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+    
+    def export_chrome_trace(self, path: str) -> int:
+        """トレースをJSONファイルに書き出し、イベント数を返す"""
+        trace = self.chrome_trace()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(trace, f, ensure_ascii=False)
+        return len(trace["traceEvents"])
+    
+    def format_table(self, group_by: str = "key", limit: int = 50) -> str:
+        """集計結果を表形式の文字列にする（診断パネル・CLI用）"""
+        lines = [f"{'分類':<10}{'操作':<16}{'回数':>8}{'エラー':>7}{'平均ms':>9}{'p95ms':>9}{'最大ms':>9}  キー"]
+        for row in self.stats(group_by)[:limit]:
+            lines.append(
+                f"{row['category']:<10}{row['operation']:<16}{row['count']:>8}{row['errors']:>7}"
+                f"{row['mean_ms']:>9.3f}{row['p95_ms']:>9.3f}{row['max_ms']:>9.3f}  {row['key'] or ''}"
+            )
+        return "\n".join(lines)
+
+# アプリケーション全体で共有する計測（既定は無効）
+INSTRUMENTATION = Instrumentation()
@@ -0,0 +1,220 @@
+import itertools
+import queue
+import threading
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from core import ApplyPlanner, ApplyTransaction, SettingItem, TransactionResult, WritePlan
+from instrumentation import INSTRUMENTATION
+
+# ジョブの状態
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+
+# 項目ごとの結果の表示名
+ITEM_STATUS_LABELS = {
+    "written": "書き込み済み",
+    "skipped": "変更なし",
+    "invalid": "対象外",
+    "failed": "失敗",
+    "rolled_back": "元に戻した",
+    "rollback_failed": "元に戻せなかった",
+    "not_run": "未実行",
+}
+
+class Job:
+    """ジョブキューで実行する適用・復元1回分
+    
+    計画はワーカースレッドで作成する（build_planはApplyPlannerを受け取って計画を返す）。
+    requestはブローカーで実行する場合に送る要求（{"targets": ...} か {"values": ...}）を作る関数。
+    """
+    
+    _numbers = itertools.count(1)
+    
+    def __init__(self, label: str, settings: Dict[str, SettingItem],
+                 build_plan: Callable[[ApplyPlanner], WritePlan],
+                 request: Optional[Callable[[], Dict[str, Any]]] = None):
+        self.id = next(self._numbers)
+        # ジャーナルに記録するラベル（"apply" / "restore"）
+        self.label = label
+        self.settings = settings
+        self.build_plan = build_plan
+        self.request = request
+        self.state = "queued"
+        self.plan: Optional[WritePlan] = None
+        self.result: Optional[TransactionResult] = None
+        self.error: Optional[Exception] = None
+        # 書き込みが終わった項目数と、書き込む項目の総数
+        self.done = 0
+        self.total = 0
+        # 設定ID -> 結果（ITEM_STATUS_LABELSのいずれか）
+        self.items: Dict[str, str] = {}
+        self.cancel_event = threading.Event()
+        self._finished = threading.Event()
+    
+    def cancel(self):
+        """取り消しを要求（実行中なら次のキーの書き込みの前で中止し、書き込んだ分を元に戻す）"""
+        self.cancel_event.set()
+    
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """ジョブの完了を待つ（完了していればTrue）"""
+        return self._finished.wait(timeout)
+    
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+    
+    @property
+    def written(self) -> List[str]:
+        return [setting_id for setting_id, status in self.items.items() if status == "written"]
+    
+    def counts(self) -> Dict[str, int]:
+        """結果ごとの項目数"""
+        counts = {status: 0 for status in ITEM_STATUS_LABELS}
+        for status in self.items.values():
+            counts[status] += 1
+        return counts
+    
+    def _collect(self):
+        """計画とトランザクションの結果から項目ごとの結果をまとめる"""
+        plan, result = self.plan, self.result
+        items = {setting_id: "skipped" for setting_id in plan.skipped}
+        items.update((setting_id, "invalid") for setting_id in plan.invalid)
+        written = set(result.written) if result is not None else set()
+        rollback_errors = set(result.rollback_errors) if result is not None else set()
+        for setting_id in plan.setting_ids:
+            if result is None:
+                items[setting_id] = "not_run"
+            elif result.committed:
+                items[setting_id] = "written" if setting_id in written else "failed"
+            elif setting_id == result.failed:
+                items[setting_id] = "failed"
+            elif setting_id in rollback_errors:
+                items[setting_id] = "rollback_failed"
+            elif setting_id in written:
+                items[setting_id] = "rolled_back"
+            else:
+                items[setting_id] = "not_run"
+        self.items = items
+
+class JobQueue:
+    """適用・復元のジョブをワーカースレッドで1件ずつ実行するキュー
+    
+    GUIとヘッドレス実行の両方から使う。on_progressは (ジョブ, 設定ID, 成否) で項目を書き込むたびに、
+    on_doneは (ジョブ) で完了時にワーカースレッドから呼ばれる。GUIから使う場合は
+    キューに積んでTkのafter()で取り出すこと。
+    """
+    
+    def __init__(self, registry=None, backup_journal=None,
+                 on_progress: Optional[Callable[[Job, str, bool], None]] = None,
+                 on_done: Optional[Callable[[Job], None]] = None):
+        self.registry = registry
+        self.backup_journal = backup_journal
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.current: Optional[Job] = None
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Job]" = queue.Queue()
+        self._pending: List[Job] = []
+        self._thread: Optional[threading.Thread] = None
+    
+    def submit(self, label: str, settings: Dict[str, SettingItem],
+               build_plan: Callable[[ApplyPlanner], WritePlan],
+               request: Optional[Callable[[], Dict[str, Any]]] = None) -> Job:
+        """ジョブを追加（前のジョブが終わってから実行される）"""
+        job = Job(label, settings, build_plan, request)
+        with self._lock:
+            self._pending.append(job)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name="job-queue", daemon=True)
+                self._thread.start()
+        self._queue.put(job)
+        return job
+    
+    def submit_apply(self, settings: Dict[str, SettingItem], targets: Dict[str, Optional[str]],
+                     label: str = "apply") -> Job:
+        """設定ID -> 状態 を適用するジョブを追加"""
+        return self.submit(
+            label, settings, lambda planner: planner.plan(settings, targets), lambda: {"targets": targets}
+        )
+    
+    def submit_restore(self, settings: Dict[str, SettingItem], targets: Union[list, Callable[[], list]],
+                       label: str = "restore") -> Job:
+        """生の値（BackupJournal.restore_targetsの形式）に戻すジョブを追加
+        
+        targetsには一覧か、ワーカースレッドで一覧を返す関数（ジャーナルの読み込みなど）を渡す。
+        """
+        def values() -> list:
+            return targets() if callable(targets) else targets
+        
+        return self.submit(
+            label, settings, lambda planner: planner.plan_values(values(), settings), lambda: {"values": values()}
+        )
+    
+    @property
+    def busy(self) -> bool:
+        """実行中・実行待ちのジョブがあるか"""
+        with self._lock:
+            return bool(self._pending)
+    
+    def cancel_all(self):
+        """実行中・実行待ちのジョブをすべて取り消す"""
+        with self._lock:
+            for job in self._pending:
+                job.cancel()
+    
+    def wait(self):
+        """実行待ちのジョブがすべて終わるまで待つ"""
+        self._queue.join()
+    
+    def close(self):
+        """キューを閉じる（ブローカーに送るキューは接続を閉じてブローカーを終了させる）"""
+    
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            finally:
+                with self._lock:
+                    self._pending.remove(job)
+                    self.current = None
+                job._finished.set()
+                self._queue.task_done()
+            if self.on_done is not None:
+                self.on_done(job)
+    
+    def _run(self, job: Job):
+        with self._lock:
+            self.current = job
+        if job.cancel_event.is_set():
+            job.state = "cancelled"
+            return
+        job.state = "running"
+        
+        def progress(setting_id: str, ok: bool):
+            job.done += 1
+            if self.on_progress is not None:
+                self.on_progress(job, setting_id, ok)
+        
+        try:
+            with INSTRUMENTATION.span("phase", "job", job.label):
+                job.plan = job.build_plan(ApplyPlanner(self.registry))
+                job.total = len(job.plan)
+                if job.cancel_event.is_set():
+                    job.state = "cancelled"
+                elif job.total:
+                    job.result = ApplyTransaction(self.registry, self.backup_journal).execute(
+                        job.plan, job.settings, job.label, progress, job.cancel_event
+                    )
+                    if job.result.cancelled:
+                        job.state = "cancelled"
+                    else:
+                        job.state = "done" if job.result.committed else "failed"
+                else:
+                    job.state = "done"
+            job._collect()
+        except Exception as e:
+            print(f"ジョブエラー: {e}")
+            job.error = e
+            job.state = "failed"
+            if job.plan is not None:
+                job._collect()
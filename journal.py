@@ -0,0 +1,320 @@
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from core import WritePlan
+from instrumentation import INSTRUMENTATION
+
+# 戻す値 (設定ID, root, キーパス, 値名, 型, 値)（型がNoneなら値が存在しなかった）
+# サービス・タスクの状態は (設定ID, None, "", 設定ID, None, 値)
+RestoreTarget = Tuple[str, Optional[int], str, str, Optional[int], Any]
+
+def encode_value(value: Any) -> Any:
+    """レジストリの値をJSONで表せる形に変換（バイナリは16進文字列）"""
+    if isinstance(value, (bytes, bytearray)):
+        return {"hex": bytes(value).hex()}
+    return value
+
+def decode_value(value: Any) -> Any:
+    """encode_valueの逆変換"""
+    if isinstance(value, dict) and "hex" in value:
+        return bytes.fromhex(value["hex"])
+    return value
+
+class BackupJournal:
+    """書き込みごとに変更前後の生の値を追記するバックアップジャーナル
+    
+    ジャーナル本体（JSONL）は追記のみで、1行が1レコード:
+      {"s": 番号, "b": 日時, "l": ラベル}                      適用セッションの開始
+      {"s": 番号, "id": 設定ID, "r": root, "k": キーパス, "v": 値名,
+       "ot": 変更前の型, "o": 変更前の値, "nt": 型, "n": 値}     書き込み1件（型がNoneなら値なし・削除）
+      {"s": 番号, "id": 設定ID, "r": null, "k": "", "v": 設定ID,
+       "ot": null, "o": 変更前の値, "nt": null, "n": 値}        サービス・タスクの状態の変更1件
+      {"s": 番号, "e": 日時, "ok": 成否}                       適用セッションの終了
+      {"s": 番号, "snap": [[root, キーパス, 値名, 設定ID, 型, 値], ...]}
+                                                              それまでに触れた値の最初の状態
+    索引ファイル（.idx）にセッション・スナップショットの開始位置を記録し、
+    復元時は必要な位置から末尾までだけを読む。
+    """
+    
+    def __init__(self, journal_file: str = "backup_journal.jsonl", snapshot_interval: int = 256 * 1024):
+        self.journal_file = journal_file
+        self.index_file = journal_file + ".idx"
+        # 前回のスナップショットからこのバイト数を追記したらスナップショットを追加
+        self.snapshot_interval = snapshot_interval
+        self._lock = threading.Lock()
+        self._index: Optional[List[list]] = None
+        # 索引を読み込んだ時点のジャーナルの (サイズ, 更新時刻)（別のプロセスが追記したら索引を読み直す）
+        self._stamp: Optional[Tuple[int, int]] = None
+    
+    def _journal_stamp(self) -> Optional[Tuple[int, int]]:
+        """ジャーナルの (サイズ, 更新時刻)（存在しなければNone）"""
+        try:
+            stat = os.stat(self.journal_file)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+    
+    def _append(self, records: List[Dict[str, Any]]) -> int:
+        """レコードを追記してディスクに書き出し、先頭レコードの位置を返す"""
+        data = "".join(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n" for record in records)
+        # 索引が最新のときだけ自分の追記を反映した時刻にする（他のプロセスの追記があれば次回読み直す）
+        current = self._journal_stamp() == self._stamp
+        with INSTRUMENTATION.span("backup", "journal_append", self.journal_file):
+            with open(self.journal_file, 'ab') as f:
+                offset = f.tell()
+                f.write(data.encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+        if current:
+            self._stamp = self._journal_stamp()
+        return offset
+    
+    def _append_index(self, entry: list):
+        """索引に追記（索引はジャーナルから作り直せるためfsyncしない）"""
+        self._index.append(entry)
+        with open(self.index_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    
+    def begin(self, plan: WritePlan, label: str = "apply") -> int:
+        """書き込み前に計画の全件を記録し、セッション番号を返す"""
+        with self._lock:
+            index = self.index()
+            session = max((entry[1] for entry in index), default=0) + 1
+            timestamp = datetime.now().isoformat(timespec="seconds")
+            records: List[Dict[str, Any]] = [{"s": session, "b": timestamp, "l": label}]
+            for group in plan.groups.values():
+                for write in group.writes:
+                    records.append({
+                        "s": session, "id": write.setting_id, "r": group.root, "k": group.key_path,
+                        "v": write.value_name, "ot": write.old_type, "o": encode_value(write.old_value),
+                        "nt": write.value_type, "n": encode_value(write.new_value),
+                    })
+            for change in plan.changes:
+                records.append({
+                    "s": session, "id": change.setting_id, "r": None, "k": "", "v": change.setting_id,
+                    "ot": None, "o": change.old_value, "nt": None, "n": change.new_value,
+                })
+            offset = self._append(records)
+            self._append_index(["b", session, offset, timestamp, label])
+            return session
+    
+    def end(self, session: int, committed: bool):
+        """セッションの終了を記録（一定量を追記するごとにスナップショットも追加）"""
+        with self._lock:
+            timestamp = datetime.now().isoformat(timespec="seconds")
+            offset = self._append([{"s": session, "e": timestamp, "ok": committed}])
+            self._append_index(["e", session, offset, committed])
+            snapshots = [entry[2] for entry in self._index if entry[0] == "snap"]
+            if offset - (snapshots[-1] if snapshots else 0) >= self.snapshot_interval:
+                offset = self._append([self._snapshot_record(session, self._origins())])
+                self._append_index(["snap", session, offset])
+    
+    @staticmethod
+    def _snapshot_record(session: int, origins: Dict[Tuple[int, str, str], list]) -> Dict[str, Any]:
+        return {"s": session, "snap": [[key[0], *value] for key, value in origins.items()]}
+    
+    def _read_from(self, offset: int) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """指定位置から末尾までのレコードを (位置, レコード) で返す（途中で切れた行は無視）"""
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file, 'rb') as f:
+            f.seek(offset)
+            position = offset
+            for line in f:
+                line_offset = position
+                position += len(line)
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    yield line_offset, json.loads(line)
+                except ValueError:
+                    continue
+    
+    @staticmethod
+    def _index_entry(offset: int, record: Dict[str, Any]) -> Optional[list]:
+        if "b" in record:
+            return ["b", record["s"], offset, record["b"], record.get("l", "")]
+        if "e" in record:
+            return ["e", record["s"], offset, record["ok"]]
+        if "snap" in record:
+            return ["snap", record["s"], offset]
+        return None
+    
+    def index(self) -> List[list]:
+        """索引を読み込む（索引より後ろに追記されたレコードはジャーナルから補う）
+        
+        ブローカーなど別のプロセスがジャーナルに書き込んでいれば、サイズか更新時刻の変化で気づいて読み直す。
+        """
+        if self._index is not None and self._journal_stamp() == self._stamp:
+            return self._index
+        with INSTRUMENTATION.span("backup", "journal_index", self.journal_file):
+            self._index = self._load_index()
+            # 末尾の修復でサイズが変わることがあるため読み込んだ後の時刻を記録
+            self._stamp = self._journal_stamp()
+        return self._index
+    
+    def _load_index(self) -> List[list]:
+        index: List[list] = []
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                lines = f.read().split("\n")
+            # 行ごとに解析すると件数に比例して遅くなるため、1つの配列としてまとめて解析（最後の不完全な行は除く）
+            index = json.loads("[" + ",".join(line for line in lines[:-1] if line) + "]")
+        except (OSError, ValueError):
+            index = []
+        
+        size = os.path.getsize(self.journal_file) if os.path.exists(self.journal_file) else 0
+        stale = bool(index) and index[-1][2] >= size
+        if stale:
+            # ジャーナルと食い違う索引は作り直す
+            index = []
+        start = index[-1][2] if index else 0
+        missing = []
+        for offset, record in self._read_from(start):
+            entry = self._index_entry(offset, record)
+            if entry is not None and (not index or offset > index[-1][2]):
+                missing.append(entry)
+        self._repair_tail()
+        
+        if stale or missing:
+            index.extend(missing)
+            with open(self.index_file, 'w', encoding='utf-8') as f:
+                for entry in index:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return index
+    
+    def _repair_tail(self):
+        """書き込み途中で終了した末尾の不完全な行を切り詰める"""
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            # 最後の改行の直後まで戻す
+            position = size
+            while position > 0:
+                step = min(4096, position)
+                f.seek(position - step)
+                chunk = f.read(step)
+                newline = chunk.rfind(b"\n")
+                if newline >= 0:
+                    position = position - step + newline + 1
+                    break
+                position -= step
+            f.truncate(position)
+    
+    def sessions(self) -> List[Dict[str, Any]]:
+        """適用セッションの一覧（古い順）"""
+        sessions: Dict[int, Dict[str, Any]] = {}
+        for entry in self.index():
+            if entry[0] == "b":
+                sessions[entry[1]] = {
+                    "session": entry[1], "timestamp": entry[3], "label": entry[4], "committed": None
+                }
+            elif entry[0] == "e" and entry[1] in sessions:
+                sessions[entry[1]]["committed"] = entry[3]
+        return list(sessions.values())
+    
+    def last_session(self, label: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """最後に書き込みまで完了したセッション（labelを指定した場合はそのラベルのもの）"""
+        for session in reversed(self.sessions()):
+            if session["committed"] and (label is None or session["label"] == label):
+                return session
+        return None
+    
+    def session_after(self, timestamp: str) -> Optional[int]:
+        """指定日時より後に始まった最初のセッション番号"""
+        for session in self.sessions():
+            if session["timestamp"] > timestamp:
+                return session["session"]
+        return None
+    
+    def _first_values(self, offset: int, origins: Dict[Tuple[int, str, str], list]):
+        """offset以降で最初に書き込まれる前の値をoriginsに追加（既にある値は変更しない）"""
+        for _, record in self._read_from(offset):
+            if "id" not in record:
+                continue
+            key = (record["r"], record["k"].lower(), record["v"].lower())
+            if key not in origins:
+                origins[key] = [record["k"], record["v"], record["id"], record["ot"], record["o"]]
+    
+    def _origins(self) -> Dict[Tuple[int, str, str], list]:
+        """ジャーナルで最初に触れる前の値（最新のスナップショット + それ以降の末尾から求める）"""
+        origins: Dict[Tuple[int, str, str], list] = {}
+        snapshots = [entry for entry in self.index() if entry[0] == "snap"]
+        start = 0
+        if snapshots:
+            start = snapshots[-1][2]
+            for _, record in self._read_from(start):
+                for root, key_path, value_name, setting_id, value_type, value in record["snap"]:
+                    origins[(root, key_path.lower(), value_name.lower())] = [
+                        key_path, value_name, setting_id, value_type, value
+                    ]
+                break
+        self._first_values(start, origins)
+        return origins
+    
+    @staticmethod
+    def _targets(origins: Dict[Tuple[int, str, str], list]) -> List[RestoreTarget]:
+        return [
+            (setting_id, root, key_path, value_name, value_type, decode_value(value))
+            for (root, _, _), (key_path, value_name, setting_id, value_type, value) in origins.items()
+        ]
+    
+    def restore_targets(self, session: int) -> List[RestoreTarget]:
+        """指定セッションの適用前の状態に戻すための値（そのセッション以降の末尾だけを読む）"""
+        offsets = [entry[2] for entry in self.index() if entry[0] == "b" and entry[1] == session]
+        if not offsets:
+            raise KeyError(f"セッション{session}はジャーナルにありません")
+        origins: Dict[Tuple[int, str, str], list] = {}
+        with INSTRUMENTATION.span("backup", "journal_restore", self.journal_file):
+            self._first_values(offsets[0], origins)
+        return self._targets(origins)
+    
+    def origin_targets(self) -> List[RestoreTarget]:
+        """ジャーナルに記録される前の最初の状態に戻すための値"""
+        with INSTRUMENTATION.span("backup", "journal_origin", self.journal_file):
+            return self._targets(self._origins())
+    
+    def compact(self, keep_sessions: int = 20) -> int:
+        """最新のkeep_sessions件より前の履歴を1つのスナップショットにまとめ、削除したセッション数を返す
+        
+        最初の状態への復元は引き続き行えるが、まとめたセッションの時点には戻せなくなる。
+        """
+        with self._lock:
+            sessions = [entry for entry in self.index() if entry[0] == "b"]
+            if len(sessions) <= keep_sessions:
+                return 0
+            kept = sessions[len(sessions) - keep_sessions] if keep_sessions > 0 else None
+            cut = kept[2] if kept else os.path.getsize(self.journal_file)
+            origins = self._origins()
+            snapshot_session = (kept[1] if kept else sessions[-1][1] + 1) - 1
+            
+            temp_file = self.journal_file + ".tmp"
+            with open(temp_file, 'wb') as out:
+                snapshot = self._snapshot_record(snapshot_session, origins)
+                out.write((json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")) + "\n").encode('utf-8'))
+                with open(self.journal_file, 'rb') as f:
+                    f.seek(cut)
+                    while True:
+                        chunk = f.read(1 << 20)
+                        if not chunk:
+                            break
+                        out.write(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(temp_file, self.journal_file)
+            
+            # 索引は作り直す
+            self._index = None
+            if os.path.exists(self.index_file):
+                os.remove(self.index_file)
+            self.index()
+            return len(sessions) - keep_sessions
@@ -1,617 +1,573 @@
-import customtkinter as ctk
-import winreg
-import ctypes
-import sys
-import os
+import argparse
 import json
+import os
+import re
 import subprocess
-from datetime import datetime
-from tkinter import filedialog, messagebox
-from typing import Dict, Any, Optional
+import sys
+import time
+from typing import Dict, List, Optional
 
-# 管理者権限チェック
-def is_admin():
-    try:
-        return ctypes.windll.shell32.IsUserAnAdmin()
-    except:
-        return False
+from core import (
+    ApplyPlanner,
+    BackupManager,
+    BatchScanner,
+    RegistryManager,
+    ScanCache,
+    SettingItem,
+    WritePlan,
+    create_default_settings,
+    is_admin,
+    load_catalog,
+)
+from effects import coalesce, create_runner, execute_plan
+from instrumentation import INSTRUMENTATION
+from jobs import Job, JobQueue
+from journal import BackupJournal
 
-# 管理者権限で再起動
-def run_as_admin():
-    if not is_admin():
-        ctypes.windll.shell32.ShellExecuteW(
-            None, "runas", sys.executable, " ".join(sys.argv), None, 1
-        )
-        sys.exit()
+# GUIを起動したときにだけ読み込まれるモジュール
+GUI_MODULES = ("gui", "customtkinter", "tkinter")
+
+def load_profile(path: str) -> Dict[str, str]:
+    """プロファイル（設定ID -> "enabled"/"disabled"）を読み込む"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    # scan --json の出力やバックアップファイルもそのまま使えるようにする
+    data = data.get("settings", data)
+    profile = {}
+    for setting_id, value in data.items():
+        if isinstance(value, dict):
+            value = value.get("current_value")
+        profile[setting_id] = value
+    return profile
+
+def cmd_scan(args, registry, settings: Dict[str, SettingItem]) -> int:
+    """現在の設定をスキャンして表示"""
+    # 前回のスキャンから書き込まれていないキーは値を読み直さない
+    cache = None if args.no_cache else ScanCache()
+    if cache is not None:
+        cache.load()
+    states = BatchScanner(registry, cache).scan(settings)
+    if cache is not None:
+        cache.save()
+    if args.json:
+        print(json.dumps({"settings": states}, indent=4, ensure_ascii=False))
+    else:
+        for setting_id, state in states.items():
+            print(f"{setting_id:<24}{state:<10}{settings[setting_id].name}")
+    return 0
 
-class RegistryManager:
-    """レジストリ操作を管理するクラス"""
+def cmd_diff(args, registry, settings: Dict[str, SettingItem]) -> int:
+    """プロファイルを適用した場合の変更内容を表示（書き込みは行わない）"""
+    plan = ApplyPlanner(registry).plan(settings, load_profile(args.profile))
+    print(plan.describe())
+    return 0
+
+def _run_plan(registry, settings: Dict[str, SettingItem], plan: WritePlan,
+              backup_journal: BackupJournal, label: str, effects: str = "broadcast") -> int:
+    """書き込み計画を変更前の値をジャーナルに記録するトランザクションとして実行
     
-    @staticmethod
-    def read_value(key_path: str, value_name: str, root=winreg.HKEY_CURRENT_USER) -> Optional[Any]:
-        """レジストリ値を読み取る"""
-        try:
-            with winreg.OpenKey(root, key_path, 0, winreg.KEY_READ) as key:
-                value, _ = winreg.QueryValueEx(key, value_name)
-                return value
-        except FileNotFoundError:
-            return None
-        except Exception as e:
-            print(f"読み取りエラー: {e}")
-            return None
+    effectsは書き込み後に自動で行う反映操作（none: 行わない、broadcast: 通知のみ、all: 再起動なども行う）。
+    """
+    if not is_admin():
+        print("エラー: 設定を適用するには管理者権限が必要です。", file=sys.stderr)
+        return 1
     
-    @staticmethod
-    def write_value(key_path: str, value_name: str, value: Any, value_type: int, root=winreg.HKEY_CURRENT_USER):
-        """レジストリ値を書き込む"""
-        try:
-            with winreg.CreateKeyEx(root, key_path, 0, winreg.KEY_WRITE) as key:
-                winreg.SetValueEx(key, value_name, 0, value_type, value)
-            return True
-        except Exception as e:
-            print(f"書き込みエラー: {e}")
-            return False
+    print(plan.describe())
+    if not len(plan):
+        return 0
     
-    @staticmethod
-    def key_exists(key_path: str, root=winreg.HKEY_CURRENT_USER) -> bool:
-        """レジストリキーが存在するかチェック"""
-        try:
-            with winreg.OpenKey(root, key_path, 0, winreg.KEY_READ):
-                return True
-        except FileNotFoundError:
-            return False
-
-class BackupManager:
-    """設定のバックアップを管理するクラス"""
+    # GUIと同じジョブキューで実行し、Ctrl+Cでは次のキーの前で中止して書き込んだ分を元に戻す
+    jobs = JobQueue(registry, backup_journal, on_progress=_print_progress if sys.stderr.isatty() else None)
+    job = jobs.submit(label, settings, lambda planner: plan)
+    try:
+        while not job.wait(0.1):
+            pass
+    except KeyboardInterrupt:
+        print("\n取り消しています...", file=sys.stderr)
+        job.cancel()
+        job.wait()
+    if sys.stderr.isatty() and job.done:
+        print(file=sys.stderr)
     
-    def __init__(self, backup_file="settings_backup.json"):
-        self.backup_file = backup_file
+    if job.error is not None:
+        print(f"エラー: {job.error}", file=sys.stderr)
+        return 1
+    result = job.result
+    if job.state == "cancelled":
+        written = len(result.written) if result is not None else 0
+        print(f"取り消しました。書き込んだ{written}個の項目は元に戻しました。", file=sys.stderr)
+        if result is not None and result.rollback_errors:
+            print(f"元に戻せなかった項目: {', '.join(result.rollback_errors)}", file=sys.stderr)
+        return 1
+    if not result.committed:
+        print(f"エラー: {result.failed} の書き込みに失敗したため、変更を元に戻しました。", file=sys.stderr)
+        if result.rollback_errors:
+            print(f"元に戻せなかった項目: {', '.join(result.rollback_errors)}", file=sys.stderr)
+        return 1
     
-    def save_backup(self, settings: Dict[str, Any]):
-        """設定をバックアップ"""
-        backup_data = {
-            "timestamp": datetime.now().isoformat(),
-            "settings": settings
-        }
-        try:
-            with open(self.backup_file, 'w', encoding='utf-8') as f:
-                json.dump(backup_data, f, indent=4, ensure_ascii=False)
-            return True
-        except Exception as e:
-            print(f"バックアップエラー: {e}")
-            return False
+    print(f"{len(result.written)}個の設定を適用しました。")
     
-    def load_backup(self) -> Optional[Dict[str, Any]]:
-        """バックアップを読み込む"""
+    effect_plan = coalesce(settings, result.written)
+    if effects != "all":
+        deferred = effect_plan.split("broadcast")[1]
+        if deferred:
+            print(f"次の設定の反映には以下の操作が必要です:\n{deferred.describe(settings)}")
+        effect_plan = effect_plan.broadcast_only() if effects == "broadcast" else None
+    if effect_plan:
         try:
-            if os.path.exists(self.backup_file):
-                with open(self.backup_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            return None
+            execute_plan(create_runner(), effect_plan)
         except Exception as e:
-            print(f"バックアップ読み込みエラー: {e}")
-            return None
+            print(f"反映操作エラー: {e}", file=sys.stderr)
+            return 1
+    return 0
 
-class SettingItem:
-    """設定項目を表す基底クラス"""
-    
-    def __init__(self, name: str, description: str):
-        self.name = name
-        self.description = description
-        self.current_value = None
-        self.new_value = None
-        self.modified = False
-    
-    def scan_current_value(self):
-        """現在の設定値をスキャン"""
-        raise NotImplementedError
-    
-    def apply_setting(self):
-        """設定を適用"""
-        raise NotImplementedError
-    
-    def get_backup_data(self) -> Dict[str, Any]:
-        """バックアップデータを取得"""
-        return {
-            "name": self.name,
-            "current_value": self.current_value
-        }
+def _print_progress(job: Job, setting_id: str, ok: bool):
+    """書き込みの進捗を標準エラー出力の同じ行に表示"""
+    if job.done == job.total or job.done % 100 == 0:
+        print(f"\r{job.done}/{job.total}", end="", file=sys.stderr, flush=True)
 
-class RegistrySettingItem(SettingItem):
-    """レジストリ設定項目"""
-    
-    def __init__(self, name: str, description: str, key_path: str, value_name: str, 
-                 value_type: int, enabled_value: Any, disabled_value: Any, 
-                 root=winreg.HKEY_CURRENT_USER, labels=("有効", "無効")):
-        super().__init__(name, description)
-        self.key_path = key_path
-        self.value_name = value_name
-        self.value_type = value_type
-        self.enabled_value = enabled_value
-        self.disabled_value = disabled_value
-        self.root = root
-        self.labels = labels
-    
-    def scan_current_value(self):
-        """現在の設定値をスキャン"""
-        value = RegistryManager.read_value(self.key_path, self.value_name, self.root)
-        if value == self.enabled_value:
-            self.current_value = "enabled"
-        elif value == self.disabled_value:
-            self.current_value = "disabled"
-        else:
-            self.current_value = "unknown"
-        return self.current_value
-    
-    def apply_setting(self):
-        """設定を適用"""
-        if self.new_value == "enabled":
-            return RegistryManager.write_value(
-                self.key_path, self.value_name, self.enabled_value, self.value_type, self.root
-            )
-        elif self.new_value == "disabled":
-            return RegistryManager.write_value(
-                self.key_path, self.value_name, self.disabled_value, self.value_type, self.root
-            )
-        return False
+def cmd_apply(args, registry, settings: Dict[str, SettingItem]) -> int:
+    """プロファイルを適用"""
+    plan = ApplyPlanner(registry).plan(settings, load_profile(args.profile))
+    return _run_plan(registry, settings, plan, BackupJournal(args.journal), "apply", args.effects)
 
-class PoleToWinApp(ctk.CTk):
-    """メインアプリケーション"""
+def cmd_restore(args, registry, settings: Dict[str, SettingItem]) -> int:
+    """ジャーナルから指定した時点の設定に復元（既定は最後の適用の直前）"""
+    backup_journal = BackupJournal(args.journal)
+    planner = ApplyPlanner(registry)
+    if args.origin:
+        print("ジャーナルに記録される前の状態に復元します。")
+        return _run_plan(registry, settings, planner.plan_values(backup_journal.origin_targets(), settings),
+                         backup_journal, "restore", args.effects)
     
-    def __init__(self):
-        super().__init__()
-        
-        # ウィンドウ設定
-        self.title("Pole To Win No11 - Windows 11 最適化ツール")
-        self.geometry("900x700")
-        
-        # テーマ設定
-        ctk.set_appearance_mode("dark")
-        ctk.set_default_color_theme("blue")
-        
-        # マネージャー初期化
-        self.backup_manager = BackupManager()
-        
-        # 設定項目リスト
-        self.settings = self._initialize_settings()
-        
-        # UI要素の辞書
-        self.setting_widgets = {}
-        self.modified_items = set()
-        
-        # UIの構築
-        self._build_ui()
-        
-        # 初期スキャン
-        self.scan_all_settings()
-    
-    def _initialize_settings(self) -> Dict[str, SettingItem]:
-        """設定項目を初期化"""
-        settings = {
-            # Bing検索連携
-            "bing_search": RegistrySettingItem(
-                name="Bing検索連携",
-                description="検索ボックスとBingの連携",
-                key_path=r"Software\Policies\Microsoft\Windows\Explorer",
-                value_name="DisableSearchBoxSuggestions",
-                value_type=winreg.REG_DWORD,
-                enabled_value=0,
-                disabled_value=1
-            ),
-            
-            # フォルダ自動検出
-            "folder_type": RegistrySettingItem(
-                name="フォルダ自動検出",
-                description="フォルダの種類の自動検出機能",
-                key_path=r"Software\Classes\Local Settings\Software\Microsoft\Windows\Shell\Bags\AllFolders\Shell",
-                value_name="FolderType",
-                value_type=winreg.REG_SZ,
-                enabled_value="Generic",
-                disabled_value="NotSpecified"
-            ),
-            
-            # 広告ID
-            "ad_id": RegistrySettingItem(
-                name="広告ID",
-                description="個人用広告の表示",
-                key_path=r"Software\Microsoft\Windows\CurrentVersion\AdvertisingInfo",
-                value_name="Enabled",
-                value_type=winreg.REG_DWORD,
-                enabled_value=1,
-                disabled_value=0
-            ),
-            
-            # 透明効果
-            "transparency": RegistrySettingItem(
-                name="透明効果",
-                description="ウィンドウの透明効果",
-                key_path=r"Software\Microsoft\Windows\CurrentVersion\Themes\Personalize",
-                value_name="EnableTransparency",
-                value_type=winreg.REG_DWORD,
-                enabled_value=1,
-                disabled_value=0,
-                labels=("オン", "オフ")
-            ),
-            
-            # タスクバー配置
-            "taskbar_align": RegistrySettingItem(
-                name="タスクバー配置",
-                description="タスクバーアイコンの配置",
-                key_path=r"Software\Microsoft\Windows\CurrentVersion\Explorer\Advanced",
-                value_name="TaskbarAl",
-                value_type=winreg.REG_DWORD,
-                enabled_value=1,  # 中央
-                disabled_value=0,  # 左
-                labels=("中央揃え", "左揃え")
-            ),
-            
-            # タスクビュー
-            "task_view": RegistrySettingItem(
-                name="タスクビュー",
-                description="タスクバーのタスクビューボタン",
-                key_path=r"Software\Microsoft\Windows\CurrentVersion\Explorer\Advanced",
-                value_name="ShowTaskViewButton",
-                value_type=winreg.REG_DWORD,
-                enabled_value=1,
-                disabled_value=0,
-                labels=("表示", "非表示")
-            ),
-            
-            # 右クリックメニュー
-            "context_menu": RegistrySettingItem(
-                name="右クリックメニュー",
-                description="エクスプローラーの右クリックメニュー",
-                key_path=r"Software\Classes\CLSID\{86ca1aa0-34aa-4e8b-a509-50c905bae2a2}\InprocServer32",
-                value_name="",
-                value_type=winreg.REG_SZ,
-                enabled_value="",  # 従来仕様
-                disabled_value="default",  # Windows 11仕様
-                labels=("従来仕様", "Windows11仕様")
-            ),
-            
-            # オプション診断データ
-            "optional_diagnostic": RegistrySettingItem(
-                name="オプション診断データ",
-                description="Microsoftに送信する診断データ",
-                key_path=r"Software\Microsoft\Windows\CurrentVersion\Diagnostics\DiagTrack",
-                value_name="ShowedToastAtLevel",
-                value_type=winreg.REG_DWORD,
-                enabled_value=3,
-                disabled_value=1,
-                labels=("送信する", "最小限")
-            ),
+    if args.session is not None:
+        session = args.session
+    elif args.before is not None:
+        session = backup_journal.session_after(args.before)
+        if session is None:
+            print(f"{args.before}より後の変更はありません。")
+            return 0
+    else:
+        last = backup_journal.last_session("apply")
+        session = last["session"] if last is not None else None
+    
+    if session is None:
+        # ジャーナルがなければ旧形式のバックアップから復元
+        backup_data = BackupManager(args.backup).load_backup()
+        if not backup_data:
+            print("エラー: バックアップが見つかりません。", file=sys.stderr)
+            return 1
+        print(f"バックアップ（{backup_data.get('timestamp', '不明')}）から復元します。")
+        targets = {
+            setting_id: data.get("current_value")
+            for setting_id, data in backup_data.get("settings", {}).items()
         }
-        
-        return settings
-    
-    def _build_ui(self):
-        """UIを構築"""
-        # ヘッダー
-        header = ctk.CTkLabel(
-            self, 
-            text="Pole To Win No11", 
-            font=ctk.CTkFont(size=24, weight="bold")
-        )
-        header.pack(pady=20)
-        
-        # 警告ラベル（設定変更時に表示）
-        self.warning_label = ctk.CTkLabel(
-            self,
-            text="",
-            font=ctk.CTkFont(size=12),
-            text_color="orange"
-        )
-        self.warning_label.pack(pady=5)
-        
-        # メインコンテナ（スクロール可能）
-        main_container = ctk.CTkScrollableFrame(self, width=850, height=400)
-        main_container.pack(pady=10, padx=20, fill="both", expand=True)
-        
-        # 設定項目を表示
-        for setting_id, setting in self.settings.items():
-            self._create_setting_widget(main_container, setting_id, setting)
-        
-        # ボタンフレーム
-        button_frame = ctk.CTkFrame(self)
-        button_frame.pack(pady=20, padx=20, fill="x")
-        
-        # 設定適用ボタン
-        apply_btn = ctk.CTkButton(
-            button_frame,
-            text="選択した項目の設定を適用",
-            command=self.apply_selected_settings,
-            font=ctk.CTkFont(size=14, weight="bold"),
-            height=40
-        )
-        apply_btn.pack(side="left", padx=5, expand=True, fill="x")
-        
-        # すべて適用ボタン
-        apply_all_btn = ctk.CTkButton(
-            button_frame,
-            text="すべての設定を適用",
-            command=self.apply_all_settings,
-            font=ctk.CTkFont(size=14, weight="bold"),
-            height=40,
-            fg_color="green"
-        )
-        apply_all_btn.pack(side="left", padx=5, expand=True, fill="x")
-        
-        # 初期設定に戻すボタン
-        reset_btn = ctk.CTkButton(
-            button_frame,
-            text="初期設定に戻す",
-            command=self.reset_settings,
-            font=ctk.CTkFont(size=14),
-            height=40,
-            fg_color="gray"
-        )
-        reset_btn.pack(side="left", padx=5, expand=True, fill="x")
-        
-        # システムボタンフレーム
-        system_button_frame = ctk.CTkFrame(self)
-        system_button_frame.pack(pady=10, padx=20, fill="x")
-        
-        # Explorer再起動ボタン
-        explorer_btn = ctk.CTkButton(
-            system_button_frame,
-            text="Explorer.exeを再起動",
-            command=self.restart_explorer,
-            height=35
-        )
-        explorer_btn.pack(side="left", padx=5, expand=True, fill="x")
-        
-        # Windows再起動ボタン
-        windows_btn = ctk.CTkButton(
-            system_button_frame,
-            text="Windowsを再起動",
-            command=self.restart_windows,
-            height=35,
-            fg_color="red"
-        )
-        windows_btn.pack(side="left", padx=5, expand=True, fill="x")
+        return _run_plan(registry, settings, planner.plan(settings, targets), backup_journal, "restore",
+                         args.effects)
     
-    def _create_setting_widget(self, parent, setting_id: str, setting: SettingItem):
-        """設定項目のウィジェットを作成"""
-        # フレーム
-        frame = ctk.CTkFrame(parent, corner_radius=10)
-        frame.pack(pady=8, padx=10, fill="x")
-        
-        # 設定名ラベル
-        name_label = ctk.CTkLabel(
-            frame,
-            text=setting.name,
-            font=ctk.CTkFont(size=14, weight="bold"),
-            anchor="w"
-        )
-        name_label.grid(row=0, column=0, sticky="w", padx=15, pady=(10, 0))
-        
-        # 説明ラベル
-        desc_label = ctk.CTkLabel(
-            frame,
-            text=setting.description,
-            font=ctk.CTkFont(size=11),
-            text_color="gray",
-            anchor="w"
-        )
-        desc_label.grid(row=1, column=0, sticky="w", padx=15, pady=(0, 5))
-        
-        # ラジオボタン変数
-        radio_var = ctk.StringVar(value="enabled")
-        
-        # ラジオボタンフレーム
-        radio_frame = ctk.CTkFrame(frame, fg_color="transparent")
-        radio_frame.grid(row=0, column=1, rowspan=2, padx=15, pady=10)
-        
-        # ラジオボタンラベルを取得
-        if isinstance(setting, RegistrySettingItem):
-            enabled_label, disabled_label = setting.labels
-        else:
-            enabled_label, disabled_label = "有効", "無効"
-        
-        # 有効ラジオボタン
-        enabled_radio = ctk.CTkRadioButton(
-            radio_frame,
-            text=enabled_label,
-            variable=radio_var,
-            value="enabled",
-            command=lambda: self._on_setting_changed(setting_id, radio_var)
-        )
-        enabled_radio.pack(side="left", padx=10)
-        
-        # 無効ラジオボタン
-        disabled_radio = ctk.CTkRadioButton(
-            radio_frame,
-            text=disabled_label,
-            variable=radio_var,
-            value="disabled",
-            command=lambda: self._on_setting_changed(setting_id, radio_var)
+    try:
+        targets = backup_journal.restore_targets(session)
+    except KeyError as e:
+        print(f"エラー: {e.args[0]}", file=sys.stderr)
+        return 1
+    print(f"セッション{session}の適用前の状態に復元します。")
+    return _run_plan(registry, settings, planner.plan_values(targets, settings), backup_journal, "restore",
+                     args.effects)
+
+def cmd_history(args, registry, settings: Dict[str, SettingItem]) -> int:
+    """ジャーナルに記録された適用の履歴を表示"""
+    sessions = BackupJournal(args.journal).sessions()
+    for session in sessions[-args.limit:]:
+        status = {True: "完了", False: "取り消し", None: "中断"}[session["committed"]]
+        print(f"{session['session']:>6}  {session['timestamp']}  {session['label']:<8}{status}")
+    if not sessions:
+        print("履歴はありません。")
+    return 0
+
+def cmd_compact(args, registry, settings: Dict[str, SettingItem]) -> int:
+    """古い履歴をスナップショットにまとめてジャーナルを小さくする"""
+    removed = BackupJournal(args.journal).compact(args.keep)
+    print(f"{removed}件のセッションをまとめました。")
+    return 0
+
+def cmd_fleet(args, registry, settings: Dict[str, SettingItem]) -> int:
+    """複数のホストに対してスキャン・差分確認・適用を並行して行い、結果をJSONLで出力"""
+    from fleet import FleetRunner, RemoteHostConnection, SimulatedHostConnection, load_hosts, write_jsonl
+    
+    if args.hosts:
+        hosts = load_hosts(args.hosts)
+    elif args.simulate:
+        hosts = [f"sim-{number:04d}" for number in range(args.simulate)]
+    else:
+        print("エラー: ホスト一覧を指定してください。", file=sys.stderr)
+        return 1
+    
+    if args.mode != "scan" and not args.profile:
+        print(f"エラー: {args.mode}にはプロファイル（--profile）が必要です。", file=sys.stderr)
+        return 1
+    profile = load_profile(args.profile) if args.profile else None
+    
+    if args.simulate:
+        connection = SimulatedHostConnection(
+            latency=args.latency, failure_rate=args.failure_rate, hang_rate=args.hang_rate
         )
-        disabled_radio.pack(side="left", padx=10)
-        
-        # ウィジェット情報を保存
-        self.setting_widgets[setting_id] = {
-            "frame": frame,
-            "name_label": name_label,
-            "radio_var": radio_var,
-            "enabled_radio": enabled_radio,
-            "disabled_radio": disabled_radio
+    else:
+        connection = RemoteHostConnection(args.user_sid)
+    runner = FleetRunner(
+        connection, load_catalog(), profile, args.mode,
+        workers=args.workers, timeout=args.timeout, retries=args.retries
+    )
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            write_jsonl(runner.run(hosts), f)
+    else:
+        write_jsonl(runner.run(hosts), sys.stdout)
+    
+    summary = runner.summary
+    print(f"{summary['hosts']}台: 成功 {summary['ok']} / 適用失敗 {summary['failed']} / "
+          f"エラー {summary['error']} / タイムアウト {summary['timeout']}  "
+          f"{summary['elapsed']:.1f}秒 ({summary['hosts_per_second']}台/秒)", file=sys.stderr)
+    if "divergent" in summary:
+        print(f"ホスト間で状態が異なる項目: {len(summary['divergent'])}件 "
+              f"{', '.join(summary['divergent'][:20])}", file=sys.stderr)
+    return 0 if summary["ok"] == summary["hosts"] else 1
+
+def cmd_users(args, registry, settings: Dict[str, SettingItem]) -> int:
+    """マシン上の全ユーザーのハイブに対してスキャン・差分確認・適用を並行して行い、ユーザー×項目の状態を表示"""
+    from userhives import FakeHiveProvider, MultiHiveRunner, WindowsHiveProvider, format_matrix
+    
+    if args.mode != "scan" and not args.profile:
+        print(f"エラー: {args.mode}にはプロファイル（--profile）が必要です。", file=sys.stderr)
+        return 1
+    if args.mode == "apply" and not args.simulate and not is_admin():
+        print("エラー: 他のユーザーの設定を適用するには管理者権限が必要です。", file=sys.stderr)
+        return 1
+    profile = load_profile(args.profile) if args.profile else None
+    
+    catalog = load_catalog()
+    if args.simulate:
+        provider = FakeHiveProvider(args.simulate, args.offline, latency=args.latency, load_offline=args.load_offline)
+        provider.populate(catalog.records)
+        backup_journal = None
+    else:
+        provider = WindowsHiveProvider(load_offline=args.load_offline)
+        backup_journal = BackupJournal(args.journal)
+    runner = MultiHiveRunner(provider, catalog, profile, args.mode, args.workers, backup_journal)
+    matrix = runner.run()
+    
+    if args.json:
+        output = json.dumps(matrix, indent=4, ensure_ascii=False)
+    else:
+        output = format_matrix(matrix, {setting_id: setting.name for setting_id, setting in settings.items()})
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    
+    summary = runner.summary
+    print(f"{summary['users']}ユーザー: 成功 {summary['ok']} / 適用失敗 {summary['failed']} / "
+          f"スキップ {summary['skipped']} / エラー {summary['error']}  "
+          f"{summary['elapsed']:.2f}秒 ({summary['users_per_second']}ユーザー/秒)", file=sys.stderr)
+    return 0 if summary["failed"] == 0 and summary["error"] == 0 else 1
+
+def cmd_audit(args, registry, settings: Dict[str, SettingItem]) -> int:
+    """ディスクイメージなどから取り出したハイブファイルを読み取り専用で開き、カタログの項目を評価"""
+    from hive import parse_mount, scan_images
+    
+    try:
+        mount = parse_mount(args.mount) if args.mount else None
+    except ValueError as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        return 1
+    profile = load_profile(args.profile) if args.profile else None
+    
+    started = time.perf_counter()
+    counts = {"ok": 0, "error": 0, "differs": 0}
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        # イメージが数千件になっても結果を溜め込まないよう、1件ずつ書き出す
+        for result in scan_images(args.images, load_catalog(), mount, args.workers):
+            counts[result["status"]] += 1
+            states = result.get("states", {})
+            if profile is not None and "states" in result:
+                result["differs"] = [
+                    setting_id for setting_id, target in profile.items()
+                    if target is not None and setting_id in states and states[setting_id] != target
+                ]
+                counts["differs"] += bool(result["differs"])
+            if args.json:
+                line = json.dumps(result, ensure_ascii=False)
+            elif result["status"] == "error":
+                line = f"{result['image']}: エラー: {result['error']}"
+            else:
+                values = list(states.values())
+                line = (f"{result['image']}: 有効 {values.count('enabled')} / 無効 {values.count('disabled')} / "
+                        f"不明 {values.count('unknown')}")
+                if "differs" in result:
+                    line += f" / プロファイルと異なる {len(result['differs'])}"
+                if result["dirty"]:
+                    line += "（書き込み途中のハイブ）"
+            print(line, file=output)
+    finally:
+        if args.output:
+            output.close()
+    
+    elapsed = time.perf_counter() - started
+    total = counts["ok"] + counts["error"]
+    print(f"{total}台: 成功 {counts['ok']} / エラー {counts['error']}"
+          + (f" / プロファイルと異なる {counts['differs']}" if profile is not None else "")
+          + f"  {elapsed:.2f}秒 ({total / elapsed if elapsed else 0:.1f}台/秒)", file=sys.stderr)
+    return 0 if counts["error"] == 0 and counts["differs"] == 0 else 1
+
+def cmd_export(args, registry, settings: Dict[str, SettingItem]) -> int:
+    """カタログの項目（または指定したキー以下）の現在の値を.regファイルに書き出す"""
+    from regfile import RegFileError, export_reg, iter_catalog, iter_tree, split_key_name
+    
+    if args.key:
+        try:
+            keys = [split_key_name(name) for name in args.key]
+        except RegFileError as e:
+            print(f"エラー: {e}", file=sys.stderr)
+            return 1
+        entries = (entry for root, key_path in keys for entry in iter_tree(root, key_path, registry))
+    else:
+        entries = iter_catalog(settings, registry)
+    count = export_reg(args.output, entries)
+    print(f"{count}個の値を{args.output}に保存しました。")
+    return 0
+
+def cmd_import(args, registry, settings: Dict[str, SettingItem]) -> int:
+    """.regファイルの内容をキーごとにまとめて書き込む（ファイル全体は読み込まない）"""
+    from regfile import RegFileError, import_reg, parse_reg
+    
+    if not is_admin():
+        print("エラー: 設定を適用するには管理者権限が必要です。", file=sys.stderr)
+        return 1
+    
+    try:
+        counts = import_reg(parse_reg(args.file), registry, args.batch_size)
+    except (OSError, RegFileError) as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        return 1
+    print(f"キー {counts['keys']}個・値 {counts['values']}個を書き込み、キー {counts['deleted_keys']}個を削除しました。")
+    if counts["failed"]:
+        print(f"エラー: {counts['failed']}件の書き込みに失敗しました。", file=sys.stderr)
+        return 1
+    return 0
+
+def measure_import_time(module: str) -> Dict[str, int]:
+    """-X importtime でモジュールを読み込み、モジュールごとの累積時間（マイクロ秒）を返す"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)", line)
+        if match:
+            cumulative[match.group(4)] = int(match.group(2))
+    return cumulative
+
+def cmd_importtime(args, registry, settings: Dict[str, SettingItem]) -> int:
+    """ヘッドレス実行とGUI起動時の読み込み時間を計測"""
+    results = {}
+    for label, module in (("headless", "main"), ("gui", "gui")):
+        runs: List[int] = []
+        for _ in range(args.repeat):
+            timings = measure_import_time(module)
+            runs.append(timings.get(module, 0))
+        gui_loaded = [name for name in GUI_MODULES if name in timings]
+        results[label] = {
+            "module": module,
+            "best_us": min(runs),
+            "modules": len(timings),
+            "gui_modules": gui_loaded,
         }
     
-    def _on_setting_changed(self, setting_id: str, radio_var: ctk.StringVar):
-        """設定が変更されたときの処理"""
-        setting = self.settings[setting_id]
-        new_value = radio_var.get()
-        
-        # 現在値と異なる場合は変更フラグを立てる
-        if new_value != setting.current_value:
-            setting.modified = True
-            setting.new_value = new_value
-            self.modified_items.add(setting_id)
-            
-            # ラベルを太字に
-            widgets = self.setting_widgets[setting_id]
-            widgets["name_label"].configure(font=ctk.CTkFont(size=14, weight="bold", underline=True))
-        else:
-            setting.modified = False
-            if setting_id in self.modified_items:
-                self.modified_items.remove(setting_id)
-            
-            # ラベルを通常に
-            widgets = self.setting_widgets[setting_id]
-            widgets["name_label"].configure(font=ctk.CTkFont(size=14, weight="bold"))
-        
-        # 警告メッセージを更新
-        self._update_warning_message()
-    
-    def _update_warning_message(self):
-        """警告メッセージを更新"""
-        if self.modified_items:
-            self.warning_label.configure(
-                text=f"設定を変更しようとしている項目があります。「設定を適用」ボタンで設定が反映されます。（{len(self.modified_items)}項目）"
-            )
-        else:
-            self.warning_label.configure(text="")
-    
-    def scan_all_settings(self):
-        """すべての設定をスキャン"""
-        for setting_id, setting in self.settings.items():
-            current_value = setting.scan_current_value()
-            
-            # ラジオボタンの値を更新
-            if setting_id in self.setting_widgets:
-                radio_var = self.setting_widgets[setting_id]["radio_var"]
-                radio_var.set(current_value if current_value != "unknown" else "disabled")
-    
-    def apply_selected_settings(self):
-        """選択した設定を適用"""
-        if not self.modified_items:
-            messagebox.showinfo("情報", "変更された設定項目がありません。")
-            return
-        
-        if not is_admin():
-            messagebox.showerror("エラー", "設定を適用するには管理者権限が必要です。")
-            return
-        
-        # バックアップを作成
-        backup_data = {}
-        for setting_id in self.modified_items:
-            setting = self.settings[setting_id]
-            backup_data[setting_id] = setting.get_backup_data()
-        
-        self.backup_manager.save_backup(backup_data)
-        
-        # 設定を適用
-        success_count = 0
-        for setting_id in list(self.modified_items):
-            setting = self.settings[setting_id]
-            if setting.apply_setting():
-                success_count += 1
-                setting.modified = False
-                self.modified_items.remove(setting_id)
-                
-                # ラベルを通常に戻す
-                widgets = self.setting_widgets[setting_id]
-                widgets["name_label"].configure(font=ctk.CTkFont(size=14, weight="bold"))
-        
-        self._update_warning_message()
-        
-        messagebox.showinfo("完了", f"{success_count}個の設定を適用しました。\n一部の設定は再起動後に反映されます。")
-        
-        # 設定を再スキャン
-        self.scan_all_settings()
+    if args.json:
+        print(json.dumps(results, indent=4, ensure_ascii=False))
+    else:
+        for label, result in results.items():
+            gui_loaded = ", ".join(result["gui_modules"]) or "なし"
+            print(f"{label:<10}{result['best_us'] / 1000:8.1f} ms  "
+                  f"{result['modules']:4d} modules  GUIモジュール: {gui_loaded}")
+    return 0
+
+def cmd_broker(args, registry, settings: Dict[str, SettingItem]) -> int:
+    """（GUIから管理者権限で起動される）GUIが終了するまで常駐し、送られた適用・復元を実行"""
+    from broker import BrokerServer, LocalPipeTransport
     
-    def apply_all_settings(self):
-        """すべての設定を適用"""
-        if not is_admin():
-            messagebox.showerror("エラー", "設定を適用するには管理者権限が必要です。")
-            return
-        
-        # すべての設定項目の新しい値を設定
-        for setting_id, setting in self.settings.items():
-            radio_var = self.setting_widgets[setting_id]["radio_var"]
-            setting.new_value = radio_var.get()
-        
-        # バックアップを作成
-        backup_data = {}
-        for setting_id, setting in self.settings.items():
-            backup_data[setting_id] = setting.get_backup_data()
-        
-        self.backup_manager.save_backup(backup_data)
-        
-        # すべて適用
-        success_count = 0
-        for setting_id, setting in self.settings.items():
-            if setting.apply_setting():
-                success_count += 1
-        
-        self.modified_items.clear()
-        self._update_warning_message()
-        
-        messagebox.showinfo("完了", f"{success_count}個の設定を適用しました。\n一部の設定は再起動後に反映されます。")
-        
-        # 設定を再スキャン
-        self.scan_all_settings()
+    server = BrokerServer(load_catalog(), registry, BackupJournal(args.journal))
+    try:
+        server.serve(LocalPipeTransport(args.address, bytes.fromhex(args.authkey)))
+    except (PermissionError, ValueError) as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+def build_parser() -> argparse.ArgumentParser:
+    """コマンドライン引数の定義"""
+    parser = argparse.ArgumentParser(
+        description="Pole To Win No11 - Windows 11 最適化ツール（引数なしでGUIを起動）"
+    )
+    parser.add_argument("--backup", default="settings_backup.json", help="旧形式のバックアップファイル")
+    parser.add_argument("--journal", default="backup_journal.jsonl", help="バックアップジャーナル")
+    parser.add_argument("--profile", dest="profile_output", metavar="FILE",
+                        help="実行全体をcProfileで計測して統計を保存（メインスレッドのみ）")
+    parser.add_argument("--trace", metavar="FILE", help="操作ごとの所要時間をChromeのトレース形式で保存")
+    parser.add_argument("--stats", action="store_true", help="終了時に操作ごとの所要時間を表示")
+    parser.add_argument("--effects", choices=("none", "broadcast", "all"), default="broadcast",
+                        help="適用後の反映操作（none: 行わない、broadcast: 変更通知のみ、all: 再起動なども行う）")
+    subparsers = parser.add_subparsers(dest="command")
     
-    def reset_settings(self):
-        """初期設定に戻す"""
-        backup_data = self.backup_manager.load_backup()
-        
-        if not backup_data:
-            messagebox.showwarning("警告", "バックアップが見つかりません。")
-            return
-        
+    scan_parser = subparsers.add_parser("scan", help="現在の設定を表示")
+    scan_parser.add_argument("--json", action="store_true", help="プロファイル形式のJSONで出力")
+    scan_parser.add_argument("--no-cache", action="store_true", help="スキャンキャッシュを使わずにすべての値を読み直す")
+    scan_parser.set_defaults(handler=cmd_scan)
+    
+    diff_parser = subparsers.add_parser("diff", help="プロファイルとの差分を表示（書き込みなし）")
+    diff_parser.add_argument("profile", help="プロファイル（JSON）")
+    diff_parser.set_defaults(handler=cmd_diff)
+    
+    apply_parser = subparsers.add_parser("apply", help="プロファイルを適用")
+    apply_parser.add_argument("profile", help="プロファイル（JSON）")
+    apply_parser.set_defaults(handler=cmd_apply)
+    
+    restore_parser = subparsers.add_parser("restore", help="バックアップから復元（既定は最後の適用の直前）")
+    restore_target = restore_parser.add_mutually_exclusive_group()
+    restore_target.add_argument("--session", type=int, help="指定したセッションの適用前に戻す")
+    restore_target.add_argument("--before", metavar="TIMESTAMP", help="指定日時（ISO形式）の状態に戻す")
+    restore_target.add_argument("--origin", action="store_true", help="ジャーナルに記録される前の状態に戻す")
+    restore_parser.set_defaults(handler=cmd_restore)
+    
+    history_parser = subparsers.add_parser("history", help="適用の履歴を表示")
+    history_parser.add_argument("--limit", type=int, default=20, help="表示する件数")
+    history_parser.set_defaults(handler=cmd_history)
+    
+    compact_parser = subparsers.add_parser("compact", help="古い履歴をまとめてジャーナルを圧縮")
+    compact_parser.add_argument("--keep", type=int, default=20, help="個別に残すセッション数")
+    compact_parser.set_defaults(handler=cmd_compact)
+    
+    fleet_parser = subparsers.add_parser("fleet", help="複数のホストに並行して実行（結果はJSONL）")
+    fleet_parser.add_argument("hosts", nargs="?", help="ホスト一覧（1行に1ホスト）")
+    fleet_parser.add_argument("--mode", choices=("scan", "diff", "apply"), default="diff", help="実行する処理")
+    fleet_parser.add_argument("--profile", help="プロファイル（JSON、diff/applyで必須）")
+    fleet_parser.add_argument("--workers", type=int, default=16, help="同時に処理するホスト数")
+    fleet_parser.add_argument("--timeout", type=float, default=30.0, help="1ホストあたりのタイムアウト（秒）")
+    fleet_parser.add_argument("--retries", type=int, default=2, help="接続エラー時の再試行回数")
+    fleet_parser.add_argument("--output", help="結果の出力先（省略時は標準出力）")
+    fleet_parser.add_argument("--user-sid", help="HKEY_CURRENT_USERの代わりに書き込むユーザーのSID")
+    fleet_parser.add_argument("--simulate", type=int, metavar="N",
+                              help="実機の代わりにメモリ上のホストを使う（ホスト一覧がなければN台）")
+    fleet_parser.add_argument("--latency", type=float, default=0.0, help="模擬ホストのレジストリ操作の遅延（秒）")
+    fleet_parser.add_argument("--failure-rate", type=float, default=0.0, help="模擬ホストの接続失敗率")
+    fleet_parser.add_argument("--hang-rate", type=float, default=0.0, help="模擬ホストの無応答率")
+    fleet_parser.set_defaults(handler=cmd_fleet)
+    
+    users_parser = subparsers.add_parser("users", help="マシン上の全ユーザーの設定をスキャン・適用")
+    users_parser.add_argument("--mode", choices=("scan", "diff", "apply"), default="scan", help="実行する処理")
+    users_parser.add_argument("--profile", help="プロファイル（JSON、diff/applyで必須）")
+    users_parser.add_argument("--workers", type=int, default=8, help="同時に処理するユーザー数")
+    users_parser.add_argument("--load-offline", action="store_true",
+                              help="ログオンしていないユーザーのNTUSER.DATを読み込んで処理する")
+    users_parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    users_parser.add_argument("--output", help="結果の出力先（省略時は標準出力）")
+    users_parser.add_argument("--simulate", type=int, metavar="N", help="実機の代わりにメモリ上のN人分のハイブを使う")
+    users_parser.add_argument("--offline", type=int, default=0, help="模擬するユーザーのうちログオンしていない人数")
+    users_parser.add_argument("--latency", type=float, default=0.0, help="模擬ハイブのレジストリ操作の遅延（秒）")
+    users_parser.set_defaults(handler=cmd_users)
+    
+    audit_parser = subparsers.add_parser("audit", help="オフラインのハイブファイルに対してカタログを評価")
+    audit_parser.add_argument("images", nargs="+",
+                              help="ハイブファイル、またはNTUSER.DAT・SOFTWAREなどを含むフォルダ（1フォルダを1台分として扱う）")
+    audit_parser.add_argument("--mount", help="ハイブファイルの割り当て先（例: HKCU、HKLM\\SOFTWARE。省略時はファイル名から判断）")
+    audit_parser.add_argument("--profile", help="比較するプロファイル（JSON）")
+    audit_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="並行して処理するプロセス数")
+    audit_parser.add_argument("--json", action="store_true", help="結果を1台1行のJSONで出力")
+    audit_parser.add_argument("--output", help="結果の出力先（省略時は標準出力）")
+    audit_parser.set_defaults(handler=cmd_audit)
+    
+    export_parser = subparsers.add_parser("export", help="現在の値を.regファイルに書き出す")
+    export_parser.add_argument("output", help="出力先（.reg）")
+    export_parser.add_argument("--key", action="append",
+                               help="書き出すキー（例: HKCU\\Software\\Foo、複数指定可。省略時はカタログの項目）")
+    export_parser.set_defaults(handler=cmd_export)
+    
+    import_parser = subparsers.add_parser("import", help=".regファイルを取り込む")
+    import_parser.add_argument("file", help=".regファイル（Registry Editor 5.00 / REGEDIT4）")
+    import_parser.add_argument("--batch-size", type=int, default=256, help="1回のキー操作でまとめて書き込む値の数")
+    import_parser.set_defaults(handler=cmd_import)
+    
+    importtime_parser = subparsers.add_parser("importtime", help="起動時の読み込み時間を計測")
+    importtime_parser.add_argument("--repeat", type=int, default=5, help="計測回数（最小値を採用）")
+    importtime_parser.add_argument("--json", action="store_true", help="JSONで出力")
+    importtime_parser.set_defaults(handler=cmd_importtime)
+    
+    broker_parser = subparsers.add_parser("broker", help="（GUIから起動される）管理者権限で適用・復元を実行するブローカー")
+    broker_parser.add_argument("--address", required=True, help="待ち受ける名前付きパイプ・ソケット")
+    broker_parser.add_argument("--authkey", required=True, help="接続の認証に使う鍵（16進数）")
+    broker_parser.set_defaults(handler=cmd_broker)
+    
+    return parser
+
+def run_gui():
+    """GUIを起動（GUIモジュールはここで初めて読み込む）"""
+    from gui import PoleToWinApp
+    
+    app = PoleToWinApp()
+    app.mainloop()
+
+def run(args) -> Optional[int]:
+    """GUIまたはサブコマンドを実行"""
+    if args.command is None:
+        # 管理者権限チェック（情報表示のみ）
         if not is_admin():
-            messagebox.showerror("エラー", "設定を復元するには管理者権限が必要です。")
-            return
-        
-        response = messagebox.askyesno(
-            "確認",
-            f"バックアップ（{backup_data.get('timestamp', '不明')}）から設定を復元しますか？"
-        )
+            print("情報: 管理者権限なしで起動しています。設定の適用時に管理者権限のブローカーを起動します。")
         
-        if response:
-            settings_data = backup_data.get("settings", {})
-            success_count = 0
-            
-            for setting_id, data in settings_data.items():
-                if setting_id in self.settings:
-                    setting = self.settings[setting_id]
-                    # バックアップされた値に戻す
-                    setting.new_value = data.get("current_value")
-                    if setting.apply_setting():
-                        success_count += 1
-            
-            messagebox.showinfo("完了", f"{success_count}個の設定を復元しました。")
-            self.scan_all_settings()
-    
-    def restart_explorer(self):
-        """Explorerを再起動"""
-        response = messagebox.askyesno("確認", "Explorer.exeを再起動しますか？")
-        if response:
-            try:
-                subprocess.run("taskkill /f /im explorer.exe", shell=True, check=True)
-                subprocess.run("start explorer.exe", shell=True, check=True)
-                messagebox.showinfo("完了", "Explorer.exeを再起動しました。")
-            except Exception as e:
-                messagebox.showerror("エラー", f"再起動に失敗しました: {e}")
-    
-    def restart_windows(self):
-        """Windowsを再起動"""
-        response = messagebox.askyesno("確認", "Windowsを再起動しますか？\n保存されていないデータは失われます。")
-        if response:
-            try:
-                subprocess.run("shutdown /r /t 0", shell=True, check=True)
-            except Exception as e:
-                messagebox.showerror("エラー", f"再起動に失敗しました: {e}")
+        # アプリケーション起動
+        run_gui()
+        return None
+    
+    with RegistryManager(cache_size=32) as registry:
+        return args.handler(args, registry, create_default_settings())
 
-def main():
+def dump_profile(profiler, path: str):
+    """cProfileの統計を保存し、累積時間の上位を表示"""
+    import pstats
+    
+    profiler.dump_stats(path)
+    print(f"プロファイルを{path}に保存しました。", file=sys.stderr)
+    pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(25)
+
+def main(argv: Optional[List[str]] = None):
     """メイン関数"""
-    # 管理者権限チェック（情報表示のみ）
-    if not is_admin():
-        print("警告: 管理者権限なしで起動しています。設定の適用には管理者権限が必要です。")
+    args = build_parser().parse_args(argv)
     
-    # アプリケーション起動
-    app = PoleToWinApp()
-    app.mainloop()
+    if args.trace or args.stats:
+        INSTRUMENTATION.enable()
+    profiler = None
+    if args.profile_output:
+        import cProfile
+        
+        profiler = cProfile.Profile()
+        profiler.enable()
+    
+    try:
+        code = run(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            dump_profile(profiler, args.profile_output)
+        if args.trace:
+            count = INSTRUMENTATION.export_chrome_trace(args.trace)
+            print(f"{count}件のイベントを{args.trace}に保存しました。", file=sys.stderr)
+        if args.stats:
+            print(INSTRUMENTATION.format_table("operation"), file=sys.stderr)
+    
+    if code is not None:
+        sys.exit(code)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,305 @@
+import itertools
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from core import (
+    ROOT_NAMES,
+    ApplyPlanner,
+    BatchScanner,
+    RegistryBackend,
+    RegistryManager,
+    RegistrySettingItem,
+    SettingCatalog,
+    SettingItem,
+    StaleHandleError,
+    StateVector,
+    WritePlan,
+    winreg,
+)
+from instrumentation import INSTRUMENTATION
+
+class _OverlayKey:
+    """上書きレイヤー上のキー1つ分の変更"""
+    
+    __slots__ = ("key_path", "values", "exists", "replaced", "timestamp")
+    
+    def __init__(self, key_path: str, exists: bool = True, replaced: bool = False, timestamp: int = 0):
+        self.key_path = key_path
+        # 小文字の値名 -> (値名, 値, 型)（型がNoneなら削除した値）
+        self.values: Dict[str, Tuple[str, Any, Optional[int]]] = {}
+        # Falseなら削除したキー
+        self.exists = exists
+        # 元のレジストリのキーを隠す（削除・新規作成したキー）
+        self.replaced = replaced
+        self.timestamp = timestamp
+
+class OverlayHandle(NamedTuple):
+    """上書きレイヤーのキーハンドル"""
+    key: Tuple[int, str]
+    key_path: str
+    # 元のレジストリのハンドル（元のキーが存在しない・隠している場合はNone）
+    base: Any
+    # 開いた時点のキーの削除回数（削除後の古いハンドルを見分ける）
+    generation: int
+
+class OverlayRegistryBackend(RegistryBackend):
+    """元のレジストリの上に重ねるコピーオンライトの上書きレイヤー
+    
+    書き込みはメモリ上の差分にだけ記録し、書き込んでいないキー・値の読み取りは元のレジストリに
+    そのまま渡す（変更していないキーは複製しない）。changes()で差分を取り出して確定するか、
+    discard()で破棄する。
+    """
+    
+    def __init__(self, base: Optional[RegistryBackend] = None):
+        self.base = base or RegistryManager.backend
+        # (root, 小文字のキーパス) -> 変更
+        self.keys: Dict[Tuple[int, str], _OverlayKey] = {}
+        self._deletions = Counter()
+        self._clock = itertools.count(time.time_ns() // 100)
+        self._lock = threading.RLock()
+    
+    @staticmethod
+    def _normalize(key_path: str) -> str:
+        return key_path.strip("\\").lower()
+    
+    def _base_exists(self, root: int, key_path: str) -> bool:
+        try:
+            self.base.close_key(self.base.open_key(root, key_path, winreg.KEY_READ))
+            return True
+        except FileNotFoundError:
+            return False
+    
+    def _live(self, handle: OverlayHandle) -> Optional[_OverlayKey]:
+        """ハンドルが指すキーの変更を返す（削除後の古いハンドルはStaleHandleError）"""
+        if self._deletions[handle.key] != handle.generation:
+            raise StaleHandleError(f"キーは削除されています: {handle.key_path}")
+        return self.keys.get(handle.key)
+    
+    def _writable(self, handle: OverlayHandle) -> _OverlayKey:
+        """値を書き込むキーの変更を取得（なければ作成）し、最終書き込み時刻を進める"""
+        entry = self._live(handle)
+        if entry is None:
+            entry = self.keys[handle.key] = _OverlayKey(handle.key_path)
+        entry.timestamp = next(self._clock)
+        return entry
+    
+    def _shows_base(self, entry: Optional[_OverlayKey], handle: OverlayHandle) -> bool:
+        return handle.base is not None and (entry is None or not entry.replaced)
+    
+    def open_key(self, root, key_path, access=winreg.KEY_READ):
+        key = (root, self._normalize(key_path))
+        with self._lock:
+            entry = self.keys.get(key)
+            if entry is not None and not entry.exists:
+                raise FileNotFoundError(f"キーが見つかりません: {key_path}")
+            base = None
+            if entry is None or not entry.replaced:
+                try:
+                    base = self.base.open_key(root, key_path, winreg.KEY_READ)
+                except FileNotFoundError:
+                    if entry is None:
+                        raise
+            return OverlayHandle(key, key_path.strip("\\"), base, self._deletions[key])
+    
+    def create_key(self, root, key_path, access=winreg.KEY_WRITE):
+        with self._lock:
+            # 存在しないキーは親キーも含めて上書きレイヤーにだけ作成する
+            names = key_path.strip("\\").split("\\")
+            for depth in range(1, len(names) + 1):
+                path = "\\".join(names[:depth])
+                key = (root, path.lower())
+                entry = self.keys.get(key)
+                if entry is not None:
+                    if not entry.exists:
+                        entry.exists = True
+                        entry.timestamp = next(self._clock)
+                elif not self._base_exists(root, path):
+                    self.keys[key] = _OverlayKey(path, replaced=True, timestamp=next(self._clock))
+            return self.open_key(root, key_path, access)
+    
+    def close_key(self, handle):
+        if handle.base is not None:
+            self.base.close_key(handle.base)
+    
+    def delete_key(self, root, key_path):
+        with self._lock:
+            handle = self.open_key(root, key_path)
+            try:
+                if self.enum_keys(handle):
+                    raise PermissionError(f"サブキーを持つキーは削除できません: {key_path}")
+            finally:
+                self.close_key(handle)
+            self.keys[handle.key] = _OverlayKey(handle.key_path, exists=False, replaced=True)
+            self._deletions[handle.key] += 1
+    
+    def query_value(self, handle, value_name):
+        with self._lock:
+            entry = self._live(handle)
+            if entry is not None:
+                change = entry.values.get(value_name.lower())
+                if change is not None:
+                    if change[2] is None:
+                        raise FileNotFoundError(f"値が見つかりません: {value_name}")
+                    return change[1], change[2]
+            if not self._shows_base(entry, handle):
+                raise FileNotFoundError(f"値が見つかりません: {value_name}")
+        return self.base.query_value(handle.base, value_name)
+    
+    def set_value(self, handle, value_name, value_type, value):
+        with self._lock:
+            self._writable(handle).values[value_name.lower()] = (value_name, value, value_type)
+    
+    def delete_value(self, handle, value_name):
+        with self._lock:
+            # 存在しない値はFileNotFoundError
+            self.query_value(handle, value_name)
+            self._writable(handle).values[value_name.lower()] = (value_name, None, None)
+    
+    def enum_keys(self, handle):
+        with self._lock:
+            entry = self._live(handle)
+            names = {}
+            if self._shows_base(entry, handle):
+                names = {name.lower(): name for name in self.base.enum_keys(handle.base)}
+            root, path = handle.key
+            prefix = path + "\\" if path else ""
+            for (child_root, child_path), child in self.keys.items():
+                if child_root != root or not child_path.startswith(prefix) or "\\" in child_path[len(prefix):]:
+                    continue
+                if child.exists:
+                    names[child_path[len(prefix):]] = child.key_path.rpartition("\\")[2]
+                else:
+                    names.pop(child_path[len(prefix):], None)
+            return list(names.values())
+    
+    def enum_values(self, handle):
+        with self._lock:
+            entry = self._live(handle)
+            values = {}
+            if self._shows_base(entry, handle):
+                values = {name.lower(): (name, value, value_type)
+                          for name, value, value_type in self.base.enum_values(handle.base)}
+            if entry is not None:
+                for name, change in entry.values.items():
+                    if change[2] is None:
+                        values.pop(name, None)
+                    else:
+                        values[name] = change
+            return list(values.values())
+    
+    def query_info_key(self, handle):
+        with self._lock:
+            entry = self._live(handle)
+            if entry is None:
+                return self.base.query_info_key(handle.base)
+            return len(self.enum_keys(handle)), len(self.enum_values(handle)), entry.timestamp
+    
+    def changes(self) -> List[Tuple[int, str, str, Optional[int], Any]]:
+        """元のレジストリとの差分 (root, キーパス, 値名, 型, 値) の一覧（型がNoneなら値の削除）
+        
+        削除・再作成したキーは、元のキーにあった値を削除する差分として返す（キー自体は削除しない）。
+        """
+        changes = []
+        with self._lock:
+            for (root, _), entry in self.keys.items():
+                values = dict(entry.values) if entry.exists else {}
+                if entry.replaced and self._base_exists(root, entry.key_path):
+                    base = self.base.open_key(root, entry.key_path, winreg.KEY_READ)
+                    try:
+                        for name, _, _ in self.base.enum_values(base):
+                            values.setdefault(name.lower(), (name, None, None))
+                    finally:
+                        self.base.close_key(base)
+                for name, value, value_type in values.values():
+                    changes.append((root, entry.key_path, name, value_type, value))
+        return changes
+    
+    def targets(self, settings: Optional[Dict[str, SettingItem]] = None
+                ) -> List[Tuple[str, int, str, str, Optional[int], Any]]:
+        """差分をApplyPlanner.plan_valuesの形式にする（設定項目の値でなければ設定IDの代わりにキーパス\\値名）"""
+        setting_ids = {
+            (setting.root, setting.key_path.lower(), setting.value_name.lower()): setting_id
+            for setting_id, setting in (settings or {}).items() if isinstance(setting, RegistrySettingItem)
+        }
+        targets = []
+        for root, key_path, value_name, value_type, value in self.changes():
+            setting_id = setting_ids.get((root, key_path.lower(), value_name.lower()))
+            if setting_id is None:
+                setting_id = f"{ROOT_NAMES.get(root, hex(root))}\\{key_path}\\{value_name}"
+            targets.append((setting_id, root, key_path, value_name, value_type, value))
+        return targets
+    
+    def discard(self):
+        """上書きした内容をすべて破棄"""
+        with self._lock:
+            self.keys = {}
+    
+    def stats(self) -> Dict[str, int]:
+        """上書きしているキー・値の数"""
+        with self._lock:
+            return {
+                "keys": len(self.keys),
+                "values": sum(len(entry.values) for entry in self.keys.values()),
+            }
+
+class ApplyPreview:
+    """適用を上書きレイヤーに対して実行し、適用後の状態を求める（確定するまで実際には書き込まない）
+    
+    サービス・タスクは上書きレイヤーでは扱えないため、現在の状態に計画の変更を重ねて求める。
+    """
+    
+    def __init__(self, registry, catalog: SettingCatalog, targets: Dict[str, Optional[str]]):
+        self.overlay = OverlayRegistryBackend((registry or RegistryManager).backend)
+        self.registry = RegistryManager(self.overlay)
+        self.catalog = catalog
+        self.targets = targets
+        self.plan: Optional[WritePlan] = None
+        # 適用後の状態（カタログと同じ並び順）
+        self.states: Optional[StateVector] = None
+    
+    def run(self) -> "ApplyPreview":
+        """上書きレイヤーに書き込んで再スキャンする"""
+        with INSTRUMENTATION.span("phase", "preview"):
+            self.overlay.discard()
+            self.plan = ApplyPlanner(self.registry).plan(self.catalog.settings, self.targets)
+            for group in self.plan.groups.values():
+                entries = [(write.value_name, write.value_type, write.new_value) for write in group.writes]
+                self.registry.write_values(group.key_path, entries, group.root)
+            
+            # 項目の状態は状態配列に格納されるため、画面の状態を変えないよう別のカタログでスキャンする
+            preview = SettingCatalog(self.catalog.records, self.catalog.index)
+            BatchScanner(self.registry).scan({
+                setting_id: setting for setting_id, setting in preview.settings.items()
+                if isinstance(setting, RegistrySettingItem)
+            })
+            for setting_id, setting in preview.settings.items():
+                if not isinstance(setting, RegistrySettingItem):
+                    setting.current_value = self.catalog.current[setting_id]
+            for change in self.plan.changes:
+                setting = preview.settings[change.setting_id]
+                setting.current_value = setting.evaluate(change.new_value)
+            self.states = preview.current
+        return self
+    
+    def changed_ids(self) -> List[str]:
+        """適用すると状態が変わる項目"""
+        return self.catalog.current.ids(self.states.differs(self.catalog.current))
+    
+    def commit_targets(self) -> List[Tuple[str, Optional[int], str, str, Optional[int], Any]]:
+        """確定時にApplyPlanner.plan_valuesに渡す値（サービス・タスクの変更も含む）"""
+        targets = self.overlay.targets(self.catalog.settings)
+        targets.extend(
+            (change.setting_id, None, "", change.setting_id, None, change.new_value) for change in self.plan.changes
+        )
+        return targets
+    
+    def commit_plan(self, planner: ApplyPlanner) -> WritePlan:
+        """実際のレジストリの現在値と比べた確定用の計画（ジョブキューのbuild_planに渡す）"""
+        plan = planner.plan_values(self.commit_targets(), self.catalog.settings)
+        self.overlay.discard()
+        return plan
+    
+    def discard(self):
+        self.overlay.discard()
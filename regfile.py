@@ -0,0 +1,373 @@
+import io
+import locale
+import re
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from core import CATALOG_ROOTS, ROOT_NAMES, BatchScanner, RegistryManager, SettingItem, winreg
+from instrumentation import INSTRUMENTATION
+
+# 対応するファイル形式のヘッダー
+REG5_HEADER = "Windows Registry Editor Version 5.00"
+REG4_HEADER = "REGEDIT4"
+
+# 値名・文字列値（\\ と \" だけがエスケープされる）
+_QUOTED = re.compile(r'"((?:[^"\\]|\\.)*)"')
+_ESCAPE = re.compile(r'\\(.)')
+_HEX_TYPE = re.compile(r'hex(?:\(([0-9a-fA-F]+)\))?:', re.ASCII)
+
+# 16進の値を折り返す位置（regeditと同じく1行80文字以内）
+_HEX_LINE_WIDTH = 76
+
+class RegFileError(ValueError):
+    """.regファイルの内容が不正"""
+
+class RegKey(NamedTuple):
+    """キーの作成（deleteがTrueならサブキーを含めた削除）"""
+    root: int
+    key_path: str
+    delete: bool = False
+
+class RegValue(NamedTuple):
+    """値の書き込み（value_typeがNoneなら削除、既定の値の値名は空文字列）"""
+    root: int
+    key_path: str
+    value_name: str
+    value_type: Optional[int]
+    value: Any = None
+
+RegEntry = Union[RegKey, RegValue]
+
+def split_key_name(name: str) -> Tuple[int, str]:
+    """"HKEY_CURRENT_USER\\Software\\..." のようなキー名を (root, キーパス) に分ける（HKCUなどの略称も可）"""
+    root_name, _, key_path = name.strip().partition("\\")
+    root = CATALOG_ROOTS.get(root_name.upper())
+    if root is None:
+        raise RegFileError(f"不明なルートキーです: {root_name!r}")
+    return root, key_path.strip("\\")
+
+def _unquote(text: str) -> str:
+    return _ESCAPE.sub(r"\1", text) if "\\" in text else text
+
+def _quote(text: str) -> str:
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def decode_data(value_type: int, data: bytes, encoding: str = "utf-16-le") -> Any:
+    """hex(n): の生データをwinregと同じ形の値に変換"""
+    if value_type in (winreg.REG_SZ, winreg.REG_EXPAND_SZ, winreg.REG_MULTI_SZ):
+        if encoding == "utf-16-le" and len(data) % 2:
+            data = data[:-1]
+        text = data.decode(encoding, errors="replace")
+        if value_type != winreg.REG_MULTI_SZ:
+            return text.split("\0", 1)[0]
+        strings = []
+        for string in text.split("\0"):
+            if not string:
+                break
+            strings.append(string)
+        return strings
+    if value_type == winreg.REG_DWORD and len(data) == 4:
+        return int.from_bytes(data, "little")
+    if value_type == winreg.REG_QWORD and len(data) == 8:
+        return int.from_bytes(data, "little")
+    return data
+
+def encode_data(value_type: int, value: Any) -> bytes:
+    """値をhex(n): で書き出す生データに変換（decode_dataの逆変換）"""
+    if value is None:
+        return b""
+    if value_type in (winreg.REG_SZ, winreg.REG_EXPAND_SZ):
+        return (str(value) + "\0").encode("utf-16-le")
+    if value_type == winreg.REG_MULTI_SZ:
+        return "".join(string + "\0" for string in value).encode("utf-16-le") + b"\0\0"
+    if value_type == winreg.REG_DWORD and isinstance(value, int):
+        return value.to_bytes(4, "little")
+    if value_type == winreg.REG_QWORD and isinstance(value, int):
+        return value.to_bytes(8, "little")
+    return bytes(value)
+
+class RegFileParser:
+    """.regファイルを1行ずつ読み、キー・値を順に返すパーサー
+    
+    ファイル全体を読み込まないため、大きなファイルでもメモリ使用量は最大の値1件分で済む。
+    """
+    
+    def __init__(self, source: Union[str, BinaryIO], name: Optional[str] = None):
+        self.source = source
+        self.name = name or (source if isinstance(source, str) else getattr(source, "name", "<reg>"))
+        # REGEDIT4形式の hex(2)/hex(7) はANSIの文字コード
+        self.string_encoding = "utf-16-le"
+        self.line_number = 0
+    
+    def _fail(self, message: str):
+        raise RegFileError(f"{self.name}:{self.line_number}: {message}")
+    
+    @staticmethod
+    def _detect_encoding(stream: BinaryIO) -> str:
+        """BOMから文字コードを判定（BOMがなければUTF-8）"""
+        head = stream.peek(3)[:3]
+        if head.startswith(b"\xff\xfe"):
+            return "utf-16"
+        if head.startswith(b"\xef\xbb\xbf"):
+            return "utf-8-sig"
+        return "utf-8"
+    
+    def _logical_lines(self, text: io.TextIOBase) -> Iterator[str]:
+        """行末の \\ で続く行を1行につなげ、コメントと空行を除いて返す"""
+        pending: List[str] = []
+        for line in text:
+            self.line_number += 1
+            line = line.rstrip("\r\n")
+            if line.lstrip().startswith(";"):
+                # コメントの行は行末が \ でも次の行につなげず、続いていた行もそこで終える
+                if pending:
+                    yield "".join(pending)
+                    pending = []
+                continue
+            if pending:
+                line = line.lstrip()
+            stripped = line.rstrip()
+            if stripped.endswith("\\") and not stripped.endswith('"'):
+                pending.append(stripped[:-1])
+                continue
+            if pending:
+                pending.append(line)
+                line = "".join(pending)
+                pending = []
+            if line.strip():
+                yield line
+        if pending:
+            yield "".join(pending)
+    
+    def __iter__(self) -> Iterator[RegEntry]:
+        if isinstance(self.source, str):
+            with open(self.source, 'rb') as f:
+                yield from self._parse(f)
+        else:
+            stream = self.source if hasattr(self.source, "peek") else io.BufferedReader(self.source)
+            yield from self._parse(stream)
+    
+    def _parse(self, stream: BinaryIO) -> Iterator[RegEntry]:
+        text = io.TextIOWrapper(stream, encoding=self._detect_encoding(stream), errors="replace", newline=None)
+        try:
+            yield from self._parse_lines(self._logical_lines(text))
+        finally:
+            # 呼び出し側から渡されたストリームは閉じない
+            text.detach()
+    
+    def _parse_lines(self, lines: Iterator[str]) -> Iterator[RegEntry]:
+        header = next(lines, "").strip()
+        if header == REG4_HEADER:
+            self.string_encoding = locale.getpreferredencoding(False)
+        elif header != REG5_HEADER:
+            self._fail(f"レジストリファイルではありません: {header[:40]!r}")
+        
+        current: Optional[Tuple[int, str]] = None
+        for line in lines:
+            line = line.strip()
+            if line.startswith("["):
+                if not line.endswith("]"):
+                    self._fail("キーの行が ] で終わっていません")
+                delete = line.startswith("[-")
+                root, key_path = self._split_key(line[2 if delete else 1:-1])
+                # 削除したキーの後ろの値は書き込まない
+                current = None if delete else (root, key_path)
+                yield RegKey(root, key_path, delete)
+            elif current is None:
+                self._fail("キーの前に値があります")
+            else:
+                yield self._parse_value(current, line)
+    
+    def _split_key(self, path: str) -> Tuple[int, str]:
+        try:
+            return split_key_name(path)
+        except RegFileError as e:
+            self._fail(str(e))
+    
+    def _parse_value(self, key: Tuple[int, str], line: str) -> RegValue:
+        if line.startswith("@"):
+            value_name, rest = "", line[1:]
+        else:
+            match = _QUOTED.match(line)
+            if match is None:
+                self._fail("値名が正しくありません")
+            value_name, rest = _unquote(match.group(1)), line[match.end():]
+        rest = rest.lstrip()
+        if not rest.startswith("="):
+            self._fail("値名の後に = がありません")
+        data = rest[1:].strip()
+        
+        if data == "-":
+            return RegValue(key[0], key[1], value_name, None)
+        if data.startswith('"'):
+            match = _QUOTED.match(data)
+            if match is None or match.end() != len(data):
+                self._fail("文字列の値が正しくありません")
+            return RegValue(key[0], key[1], value_name, winreg.REG_SZ, _unquote(match.group(1)))
+        if data[:6].lower() == "dword:":
+            digits = data[6:].strip()
+            if not re.fullmatch(r"[0-9a-fA-F]{1,8}", digits):
+                self._fail(f"DWORDの値が正しくありません: {digits!r}")
+            return RegValue(key[0], key[1], value_name, winreg.REG_DWORD, int(digits, 16))
+        match = _HEX_TYPE.match(data.lower())
+        if match is None:
+            self._fail(f"未対応の値の形式です: {data[:20]!r}")
+        value_type = int(match.group(1), 16) if match.group(1) else winreg.REG_BINARY
+        try:
+            raw = bytes.fromhex(data[match.end():].replace(",", " "))
+        except ValueError:
+            self._fail("16進の値が正しくありません")
+        return RegValue(key[0], key[1], value_name, value_type, decode_data(value_type, raw, self.string_encoding))
+
+def parse_reg(source: Union[str, BinaryIO]) -> Iterator[RegEntry]:
+    """.regファイル（パスまたはバイナリストリーム）のキー・値を先頭から順に返す"""
+    return iter(RegFileParser(source))
+
+def _wrap_hex(data: bytes, column: int) -> str:
+    """regeditと同じく、16進の値を行末の \\ で折り返す"""
+    text = data.hex(",")
+    first = max(1, (_HEX_LINE_WIDTH - column) // 3) * 3
+    chunks = [text[:first]]
+    step = (_HEX_LINE_WIDTH - 2) // 3 * 3
+    for position in range(first, len(text), step):
+        chunks.append(text[position:position + step])
+    return "\\\n  ".join(chunks)
+
+def format_value(value_name: str, value_type: Optional[int], value: Any) -> str:
+    """値1件を.regファイルの行に変換"""
+    name = "@" if value_name == "" else _quote(value_name)
+    if value_type is None:
+        return f"{name}=-"
+    if value_type == winreg.REG_SZ and isinstance(value, str) and not any(c in value for c in "\r\n\0"):
+        return f"{name}={_quote(value)}"
+    if value_type == winreg.REG_DWORD and isinstance(value, int) and 0 <= value <= 0xFFFFFFFF:
+        return f"{name}=dword:{value:08x}"
+    prefix = f"{name}=hex:" if value_type == winreg.REG_BINARY else f"{name}=hex({value_type:x}):"
+    return prefix + _wrap_hex(encode_data(value_type, value), len(prefix))
+
+def _key_name(root: int, key_path: str) -> str:
+    root_name = ROOT_NAMES.get(root, hex(root))
+    return f"{root_name}\\{key_path}" if key_path else root_name
+
+def write_reg(entries: Iterable[RegEntry], stream: BinaryIO) -> int:
+    """キー・値を順に.regファイル（UTF-16LE・BOM付き）として書き出し、値の件数を返す
+    
+    キーが変わるたびに見出しを書くため、同じキーの値はまとめて渡す。
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-16-le", newline="\r\n")
+    count = 0
+    try:
+        text.write("\ufeff" + REG5_HEADER + "\n")
+        current: Optional[Tuple[int, str]] = None
+        for entry in entries:
+            key = (entry.root, entry.key_path.lower())
+            if isinstance(entry, RegKey):
+                text.write(f"\n[{'-' if entry.delete else ''}{_key_name(entry.root, entry.key_path)}]\n")
+                current = None if entry.delete else key
+                continue
+            if key != current:
+                text.write(f"\n[{_key_name(entry.root, entry.key_path)}]\n")
+                current = key
+            text.write(format_value(entry.value_name, entry.value_type, entry.value) + "\n")
+            count += 1
+        text.write("\n")
+        text.flush()
+    finally:
+        text.detach()
+    return count
+
+def export_reg(path: str, entries: Iterable[RegEntry]) -> int:
+    """キー・値を.regファイルに保存し、値の件数を返す"""
+    with open(path, 'wb') as f:
+        with INSTRUMENTATION.span("regfile", "export", path):
+            return write_reg(entries, f)
+
+def iter_catalog(settings: Dict[str, SettingItem], registry=None) -> Iterator[RegEntry]:
+    """カタログの項目が参照する値の現在の状態を返す（存在しない値は含めない）"""
+    registry = registry or RegistryManager
+    for (root, _), setting_ids in BatchScanner.group_by_key(settings).items():
+        # グループのキーは小文字に正規化されているため、カタログの表記を使う
+        key_path = settings[setting_ids[0]].key_path
+        value_names = list(dict.fromkeys(settings[setting_id].value_name for setting_id in setting_ids))
+        values = registry.query_values(key_path, value_names, root)
+        if values is None:
+            continue
+        yield RegKey(root, key_path)
+        for value_name in value_names:
+            if values.get(value_name) is not None:
+                value, value_type = values[value_name]
+                yield RegValue(root, key_path, value_name, value_type, value)
+
+def iter_tree(root: int, key_path: str, registry=None) -> Iterator[RegEntry]:
+    """キーとそのサブキーの値をすべて返す（深さ優先、1つのキーの値だけを保持する）"""
+    registry = registry or RegistryManager
+    stack = [key_path.strip("\\")]
+    while stack:
+        path = stack.pop()
+        values = registry.list_values(path, root)
+        if values is None:
+            continue
+        yield RegKey(root, path)
+        for value_name, value, value_type in values:
+            yield RegValue(root, path, value_name, value_type, value)
+        subkeys = registry.list_subkeys(path, root) or []
+        # 名前順に出力するため逆順に積む
+        for name in sorted(subkeys, key=str.lower, reverse=True):
+            stack.append(f"{path}\\{name}" if path else name)
+
+def delete_tree(root: int, key_path: str, registry=None) -> bool:
+    """キーをサブキーも含めて削除（存在しなければTrue）"""
+    registry = registry or RegistryManager
+    subkeys = registry.list_subkeys(key_path, root)
+    if subkeys is None:
+        return True
+    ok = all(delete_tree(root, f"{key_path}\\{name}", registry) for name in subkeys)
+    return registry.delete_key(key_path, root) and ok
+
+def import_reg(entries: Iterable[RegEntry], registry=None, batch_size: int = 256) -> Dict[str, int]:
+    """キー・値を順に書き込み、件数を返す（同じキーの連続する値は1回のキー操作でまとめて書き込む）
+    
+    entriesはparse_regの結果をそのまま渡せば、ファイル全体を読み込まずに取り込める。
+    """
+    registry = registry or RegistryManager
+    counts = {"keys": 0, "values": 0, "deleted_keys": 0, "failed": 0}
+    batch: List[Tuple[str, Optional[int], Any]] = []
+    current: Optional[Tuple[int, str]] = None
+    
+    def flush():
+        pending = batch[:]
+        batch.clear()
+        while current is not None:
+            written = registry.write_values(current[1], pending, current[0])
+            counts["values"] += written
+            if written >= len(pending):
+                return
+            # 失敗した値だけを飛ばして続ける
+            counts["failed"] += 1
+            pending = pending[written + 1:]
+            if not pending:
+                return
+    
+    with INSTRUMENTATION.span("regfile", "import"):
+        for entry in entries:
+            if isinstance(entry, RegKey):
+                flush()
+                if entry.delete:
+                    current = None
+                    if delete_tree(entry.root, entry.key_path, registry):
+                        counts["deleted_keys"] += 1
+                    else:
+                        counts["failed"] += 1
+                    continue
+                current = (entry.root, entry.key_path)
+                counts["keys"] += 1
+                # 値のないキーも作成する
+                flush()
+                continue
+            if current is None or (entry.root, entry.key_path.lower()) != (current[0], current[1].lower()):
+                flush()
+                current = (entry.root, entry.key_path)
+            batch.append((entry.value_name, entry.value_type, entry.value))
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+    return counts
@@ -0,0 +1,132 @@
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+from core import SettingCatalog, mask_from_flags, mask_positions
+
+# 索引にする文字n-gramの長さ（これより短い検索語は1文字の索引で探す）
+NGRAM = 2
+
+# 状態による絞り込み
+STATE_FILTERS = {
+    "all": "すべて",
+    "modified": "変更あり",
+    "non_default": "既定と異なる",
+    "unknown": "不明",
+}
+
+# カタカナ -> ひらがな
+_KANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+def normalize(text: str) -> str:
+    """検索用に正規化（全角・半角、大文字・小文字、カタカナ・ひらがなを区別しない）"""
+    return unicodedata.normalize("NFKC", text).casefold().translate(_KANA)
+
+def ngrams(term: str) -> List[str]:
+    """検索語のn-gram（NGRAMより短ければ検索語そのもの）"""
+    if len(term) <= NGRAM:
+        return [term] if term else []
+    return [term[start:start + NGRAM] for start in range(len(term) - NGRAM + 1)]
+
+class SearchIndex:
+    """設定項目の名前・説明・カテゴリ・キーパス・値名の文字n-gramによる転置索引
+    
+    日本語は単語に区切れないため、2文字の組と1文字をそれぞれ索引にする。n-gram -> 項目の位置の一覧を
+    カタログの読み込み時に作成し、検索で使ったn-gramだけを位置のビットセットに変換して使い回す。
+    """
+    
+    # 索引にするレコードの項目（サービス・タスクはtargetにサービス名・タスクのパスが入る）
+    FIELDS = ("name", "description", "category", "key_path", "value_name", "target", "id")
+    
+    def __init__(self, records: List[Dict[str, Any]]):
+        self.size = len(records)
+        self.all_mask = (1 << self.size) - 1
+        # 位置 -> 正規化した検索対象の文字列（項目の間は改行で区切り、項目をまたいで一致させない）
+        self.texts: List[str] = []
+        self._positions: Dict[str, List[int]] = {}
+        self._masks: Dict[str, int] = {}
+        for position, record in enumerate(records):
+            text = "\n".join(normalize(str(record[field])) for field in self.FIELDS if record.get(field))
+            self.texts.append(text)
+            grams = set(text)
+            grams.update(text[start:start + NGRAM] for start in range(len(text) - NGRAM + 1))
+            for gram in grams:
+                if "\n" not in gram:
+                    self._positions.setdefault(gram, []).append(position)
+    
+    def gram_mask(self, gram: str) -> int:
+        """n-gramを含む項目のビットセット"""
+        mask = self._masks.get(gram)
+        if mask is None:
+            flags = bytearray(self.size)
+            for position in self._positions.get(gram, ()):
+                flags[position] = 1
+            mask = self._masks[gram] = mask_from_flags(bytes(flags))
+        return mask
+    
+    def search(self, query: str, within: Optional[int] = None) -> int:
+        """検索語（空白区切りはすべてを含む）に一致する項目のビットセット
+        
+        withinを指定すると、そのビットセットの項目の中だけを探す。
+        """
+        mask = self.all_mask if within is None else within
+        for term in normalize(query).split():
+            for gram in ngrams(term):
+                mask &= self.gram_mask(gram)
+                if not mask:
+                    return 0
+            if len(term) > NGRAM:
+                # n-gramをすべて含んでいても連続しているとは限らないため、残った候補だけを文字列で確かめる
+                flags = bytearray(self.size)
+                for position in mask_positions(mask):
+                    if term not in self.texts[position]:
+                        flags[position] = 1
+                mask &= ~mask_from_flags(bytes(flags))
+        return mask
+
+class SettingsFilter:
+    """検索語・カテゴリ・状態による設定一覧の絞り込み（GUIのキー入力ごとに呼ばれる）
+    
+    前回の検索語を延長した検索語（1文字追加など）は、前回の結果の中だけを探す。
+    """
+    
+    def __init__(self, catalog: SettingCatalog, index: Optional[SearchIndex] = None):
+        self.catalog = catalog
+        self.index = index or SearchIndex(catalog.records)
+        positions = catalog.current.positions
+        self.category_masks: Dict[str, int] = {}
+        for category, setting_ids in catalog.by_category.items():
+            flags = bytearray(len(positions))
+            for setting_id in setting_ids:
+                flags[positions[setting_id]] = 1
+            self.category_masks[category] = mask_from_flags(bytes(flags))
+        self._last_query = ""
+        self._last_mask = self.index.all_mask
+    
+    def text_mask(self, query: str) -> int:
+        """検索語に一致する項目のビットセット"""
+        query = normalize(query)
+        if not query.strip():
+            mask = self.index.all_mask
+        elif self._last_query.strip() and query.startswith(self._last_query):
+            mask = self.index.search(query, self._last_mask)
+        else:
+            mask = self.index.search(query)
+        self._last_query, self._last_mask = query, mask
+        return mask
+    
+    def state_mask(self, state: str) -> int:
+        """状態による絞り込み（STATE_FILTERSのいずれか）のビットセット"""
+        if state == "modified":
+            return self.catalog.modified_mask()
+        if state == "non_default":
+            return self.catalog.non_default_mask()
+        if state == "unknown":
+            return self.catalog.current.where("unknown")
+        return self.index.all_mask
+    
+    def apply(self, query: str = "", category: Optional[str] = None, state: str = "all") -> List[str]:
+        """条件に一致する設定ID（カタログの並び順）"""
+        mask = self.text_mask(query) & self.state_mask(state)
+        if category is not None:
+            mask &= self.category_masks.get(category, 0)
+        return self.catalog.current.ids(mask)
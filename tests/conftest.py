@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# リポジトリ直下のモジュールを import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import CatalogLoader, MemoryRegistryBackend, RegistryManager  # noqa: E402
+
+@pytest.fixture
+def backend():
+    """メモリ上のレジストリ"""
+    return MemoryRegistryBackend()
+
+@pytest.fixture
+def registry(backend):
+    """メモリ上のレジストリを使うキャッシュなしのRegistryManager"""
+    with RegistryManager(backend) as manager:
+        yield manager
+
+@pytest.fixture
+def catalog():
+    """既定のカタログ（キャッシュファイルは使わない）"""
+    return CatalogLoader(cache_file=None).load()
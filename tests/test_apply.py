@@ -0,0 +1,38 @@
+from core import ApplyPlanner, ApplyTransaction, winreg
+
+HKCU = winreg.HKEY_CURRENT_USER
+ADVANCED = r"Software\Microsoft\Windows\CurrentVersion\Explorer\Advanced"
+POLICY = r"Software\Policies\Microsoft\Windows\Explorer"
+ADVERTISING = r"Software\Microsoft\Windows\CurrentVersion\AdvertisingInfo"
+
+def test_plan_skips_values_already_set(backend, registry, catalog):
+    backend.preset(HKCU, ADVANCED, "TaskbarAl", 1, winreg.REG_DWORD)
+    backend.preset(HKCU, ADVANCED, "ShowTaskViewButton", 1, winreg.REG_DWORD)
+    plan = ApplyPlanner(registry).plan(catalog.settings, {"taskbar_align": "enabled", "task_view": "disabled"})
+    assert plan.skipped == ["taskbar_align"]
+    writes = [write for group in plan.groups.values() for write in group.writes]
+    assert [(write.setting_id, write.old_value, write.new_value) for write in writes] == [("task_view", 1, 0)]
+    
+    result = ApplyTransaction(registry).execute(plan, catalog.settings)
+    assert result.committed and result.written == ["task_view"]
+    assert registry.read_value(ADVANCED, "ShowTaskViewButton") == 0
+    assert backend.calls["set"] == 1
+
+def test_failed_write_rolls_back(backend, registry, catalog):
+    backend.preset(HKCU, ADVERTISING, "Enabled", 1, winreg.REG_DWORD)
+    backend.fail_writes.add("enabled")
+    plan = ApplyPlanner(registry).plan(catalog.settings, {"bing_search": "disabled", "ad_id": "disabled"})
+    assert list(plan.groups) == [(HKCU, POLICY.lower()), (HKCU, ADVERTISING.lower())]
+    
+    result = ApplyTransaction(registry).execute(plan, catalog.settings)
+    assert not result.committed
+    assert result.failed == "ad_id"
+    assert result.rolled_back and not result.rollback_errors
+    # 書き込んだ値を戻し、トランザクションで作成したキーは削除する
+    assert not registry.key_exists(POLICY)
+    assert registry.read_value(ADVERTISING, "Enabled") == 1
+
+def test_unknown_targets_are_invalid(registry, catalog):
+    plan = ApplyPlanner(registry).plan(catalog.settings, {"missing": "enabled", "task_view": None})
+    assert plan.invalid == ["missing", "task_view"]
+    assert not plan.groups
@@ -0,0 +1,17 @@
+import benchmark
+
+def test_all_scenarios_run_on_a_small_catalog():
+    report = benchmark.run_benchmarks(sizes=(10,), repeat=1)
+    results = {result["scenario"]: result for result in report["results"]}
+    assert set(results) == set(benchmark.SCENARIOS)
+    assert all(result["items"] == 10 for result in results.values())
+    assert results["scan"]["calls"]["open"] == 2
+
+def test_compare_reports_regressions(capsys):
+    result = {"scenario": "scan", "items": 10, "wall_ms": 1.0, "total_calls": 12}
+    baseline = {"latency": 0.0, "results": [result]}
+    assert benchmark.compare(baseline, {"latency": 0.0, "results": [dict(result, wall_ms=1.1)]}, 0.2) == []
+    assert len(benchmark.compare(baseline, {"latency": 0.0, "results": [dict(result, wall_ms=2.0)]}, 0.2)) == 1
+    # 時間が変わらなくてもレジストリ操作が増えれば悪化とみなす
+    assert len(benchmark.compare(baseline, {"latency": 0.0, "results": [dict(result, total_calls=13)]}, 0.2)) == 1
+    capsys.readouterr()
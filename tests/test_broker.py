@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+from broker import BrokerClient, BrokerError, BrokerServer, LocalPipeTransport, decode_frame, encode_frame
+from core import winreg
+
+HKCU = winreg.HKEY_CURRENT_USER
+ADVANCED = r"Software\Microsoft\Windows\CurrentVersion\Explorer\Advanced"
+
+@pytest.fixture
+def server(registry, catalog):
+    return BrokerServer(catalog, registry, privilege_check=lambda: True)
+
+def test_frames_keep_binary_values():
+    frame = encode_frame(2, 7, {"values": [["blob", HKCU, "k", "v", winreg.REG_BINARY, b"\x00\xff"]]})
+    assert decode_frame(frame) == (2, 7, {"values": [["blob", HKCU, "k", "v", winreg.REG_BINARY, b"\x00\xff"]]})
+    with pytest.raises(BrokerError):
+        decode_frame(b"\x02")
+
+def test_request_round_trip(tmp_path, backend, server):
+    backend.preset(HKCU, ADVANCED, "TaskbarAl", 1, winreg.REG_DWORD)
+    transport = LocalPipeTransport(str(tmp_path / "broker.sock"))
+    
+    def launch(command):
+        # 別プロセスの代わりにスレッドでブローカーを動かす
+        threading.Thread(target=server.serve, args=(transport,), daemon=True).start()
+    
+    client = BrokerClient(transport, launch, connect_timeout=5)
+    progress = []
+    try:
+        reply = client.execute("apply", {"targets": {"taskbar_align": "disabled", "unknown": "enabled"}},
+                               lambda setting_id, ok, done, total: progress.append((setting_id, ok, done, total)))
+    finally:
+        client.close()
+    assert reply["state"] == "done"
+    assert reply["items"] == {"taskbar_align": "written", "unknown": "invalid"}
+    assert progress == [("taskbar_align", True, 1, 1)]
+    assert client.round_trips == 1 and client.info["settings"] == len(server.settings)
+    assert backend.keys[(HKCU, ADVANCED.lower())]["taskbaral"][1] == 0
+
+def test_unknown_values_are_rejected(server):
+    allowed = [
+        ["taskbar_align", HKCU, ADVANCED.upper(), "taskbaral", winreg.REG_DWORD, 1],
+        ["taskbar_align", HKCU, ADVANCED, "TaskbarAl", None, None],
+        # 変更前の値はカタログの有効・無効の値とは限らない
+        ["diagtrack_service", None, "", "diagtrack_service", None, "demand"],
+        ["compatibility_appraiser", None, "", "compatibility_appraiser", None, False],
+    ]
+    refused = [
+        ["taskbar_align", HKCU, r"Software\Other", "TaskbarAl", winreg.REG_DWORD, 1],
+        ["taskbar_align", winreg.HKEY_LOCAL_MACHINE, ADVANCED, "TaskbarAl", winreg.REG_DWORD, 1],
+        ["taskbar_align", HKCU, ADVANCED, "TaskbarAl", 6, 1],  # REG_LINK
+        ["diagtrack_service", None, "", "diagtrack_service", None, "bogus"],
+        ["diagtrack_service", None, "", "diagtrack_service", None, ["auto"]],
+        ["diagtrack_service", None, "", "sysmain_service", None, "disabled"],
+        ["diagtrack_service", None, "", "diagtrack_service", winreg.REG_SZ, "disabled"],
+        ["compatibility_appraiser", None, "", "compatibility_appraiser", None, 0],
+        ["compatibility_appraiser", None, "", "compatibility_appraiser", None, "false"],
+        ["missing", None, "", "missing", None, True],
+        ["short"],
+    ]
+    _, rejected = server.validate({"values": allowed + refused})
+    assert rejected == [target[0] for target in refused]
+    with pytest.raises(BrokerError):
+        server.validate({})
@@ -0,0 +1,70 @@
+import json
+import os
+
+import pytest
+
+from core import APP_DIR, CATALOG_DIR, CatalogError, CatalogLoader, RegistrySettingItem, ScanCache, winreg
+
+ENTRY = {
+    "id": "sample",
+    "name": "サンプル",
+    "description": "テスト用の設定項目",
+    "key_path": "Software\\Sample",
+    "value_name": "Value",
+    "value_type": "REG_DWORD",
+    "enabled_value": 1,
+    "disabled_value": 0,
+}
+
+def write_catalog(path, entries):
+    path.write_text(json.dumps({"settings": entries}, ensure_ascii=False), encoding="utf-8")
+
+def test_cache_is_reused_until_source_changes(tmp_path):
+    source = tmp_path / "settings.json"
+    write_catalog(source, [ENTRY])
+    cache_file = str(tmp_path / "cache.bin")
+    
+    first = CatalogLoader([str(source)], cache_file)
+    assert first.load().settings["sample"].labels == ("有効", "無効")
+    assert not first.cache_hit
+    second = CatalogLoader([str(source)], cache_file)
+    catalog = second.load()
+    assert second.cache_hit
+    setting = catalog.settings["sample"]
+    assert isinstance(setting, RegistrySettingItem)
+    assert (setting.root, setting.value_type, setting.enabled_value) == (winreg.HKEY_CURRENT_USER, winreg.REG_DWORD, 1)
+    assert catalog.by_key == {(winreg.HKEY_CURRENT_USER, "software\\sample"): ["sample"]}
+    
+    write_catalog(source, [dict(ENTRY, name="変更後")])
+    third = CatalogLoader([str(source)], cache_file)
+    assert third.load().settings["sample"].name == "変更後"
+    assert not third.cache_hit
+
+def test_default_catalog_is_valid(catalog):
+    assert "taskbar_align" in catalog.settings
+    assert set(catalog.by_category) >= {"タスクバー", "プライバシー"}
+
+@pytest.mark.parametrize("changes, message", [
+    ({"id": "Bad-ID"}, "ID"),
+    ({"value_type": "REG_NONE"}, "未対応の値の型"),
+    ({"enabled_value": -1}, "enabled_value"),
+    ({"disabled_value": 1}, "同じです"),
+    ({"root": "HKXX"}, "ルートキー"),
+    ({"extra": 1}, "不明な項目"),
+    ({"effect": "logoff"}, "effect"),
+])
+def test_invalid_entries_are_rejected(changes, message):
+    with pytest.raises(CatalogError, match=message):
+        CatalogLoader.validate(dict(ENTRY, **changes))
+
+def test_duplicate_ids_are_rejected(tmp_path):
+    source = tmp_path / "settings.json"
+    write_catalog(source, [ENTRY, ENTRY])
+    with pytest.raises(CatalogError, match="重複"):
+        CatalogLoader([str(source)], None).load()
+
+def test_default_caches_do_not_depend_on_the_working_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert CatalogLoader().cache_file == os.path.join(APP_DIR, "catalog_cache.bin")
+    assert ScanCache().cache_file == os.path.join(APP_DIR, "scan_cache.bin")
+    assert os.path.dirname(CATALOG_DIR) == APP_DIR
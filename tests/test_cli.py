@@ -0,0 +1,25 @@
+import json
+import os
+import subprocess
+import sys
+
+import main
+from core import winreg
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_import_does_not_load_gui():
+    code = "import sys, main; print([name for name in main.GUI_MODULES if name in sys.modules])"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    assert output.strip() == "[]"
+
+def test_diff_prints_plan_without_writing(tmp_path, backend, registry, catalog, capsys):
+    backend.preset(winreg.HKEY_CURRENT_USER, r"Software\Microsoft\Windows\CurrentVersion\Explorer\Advanced",
+                   "TaskbarAl", 1, winreg.REG_DWORD)
+    profile = tmp_path / "profile.json"
+    # scan --json の出力形式のプロファイル
+    profile.write_text(json.dumps({"settings": {"taskbar_align": "disabled"}}), encoding="utf-8")
+    args = main.build_parser().parse_args(["diff", str(profile)])
+    assert args.handler(args, registry, catalog.settings) == 0
+    assert "TaskbarAl: 1 -> 0" in capsys.readouterr().out
+    assert backend.calls["set"] == 0
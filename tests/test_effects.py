@@ -0,0 +1,58 @@
+import threading
+
+from effects import EffectScheduler, RecordingEffectRunner, coalesce, execute_plan
+
+class BlockingRunner(RecordingEffectRunner):
+    """最初の通知で止まり、release()まで次の計画を実行させないRunner"""
+    
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.released = threading.Event()
+    
+    def broadcast(self, area):
+        super().broadcast(area)
+        self.started.set()
+        self.released.wait(5)
+
+def test_coalesce_runs_the_largest_action_once(catalog):
+    runner = RecordingEffectRunner()
+    plan = coalesce(catalog.settings, ["taskbar_align", "task_view", "ad_id"])
+    assert plan.action == "broadcast"
+    execute_plan(runner, plan)
+    # 同じ種類の通知は1回だけ送る
+    assert runner.calls == [("broadcast", "TraySettings")]
+    
+    runner = RecordingEffectRunner()
+    execute_plan(runner, coalesce(catalog.settings, ["bing_search", "folder_type", "taskbar_align"]))
+    assert runner.calls == [("restart_explorer", None), ("broadcast", "TraySettings")]
+
+def test_scheduler_defers_larger_actions(catalog):
+    scheduler = EffectScheduler(catalog.settings, RecordingEffectRunner())
+    scheduler.request(["taskbar_align", "context_menu"])
+    scheduler.request(["bing_search"])
+    taken = scheduler.take("explorer")
+    assert taken.action == "explorer"
+    assert sorted(taken.setting_ids) == ["bing_search", "taskbar_align"]
+    assert scheduler.pending.action == "reboot"
+    assert scheduler.pending.setting_ids == ["context_menu"]
+
+def test_queued_plans_are_merged(catalog):
+    runner = BlockingRunner()
+    done = []
+    finished = threading.Event()
+    
+    def on_done(plan, error):
+        done.append(plan.action)
+        if len(done) == 2:
+            finished.set()
+    scheduler = EffectScheduler(catalog.settings, runner, on_done)
+    scheduler.run_async(coalesce(catalog.settings, ["taskbar_align"]))
+    assert runner.started.wait(5)
+    # 実行中に届いた計画はまとめて1回で実行する
+    scheduler.run_async(coalesce(catalog.settings, ["bing_search"]))
+    scheduler.run_async(coalesce(catalog.settings, ["folder_type"]))
+    runner.released.set()
+    assert finished.wait(5)
+    assert runner.calls.count(("restart_explorer", None)) == 1
+    assert done == ["broadcast", "explorer"]
@@ -0,0 +1,48 @@
+import io
+import json
+
+import pytest
+
+from core import winreg
+from fleet import FleetRunner, SimulatedHostConnection, write_jsonl
+
+HKCU = winreg.HKEY_CURRENT_USER
+ADVANCED = r"Software\Microsoft\Windows\CurrentVersion\Explorer\Advanced"
+STUCK_RECTS = r"Software\Microsoft\Windows\CurrentVersion\Explorer\StuckRects3"
+HOSTS = [f"pc{number:02d}" for number in range(12)]
+
+def test_apply_to_many_hosts(catalog):
+    connection = SimulatedHostConnection(presets=[(HKCU, ADVANCED, "TaskbarAl", 1, winreg.REG_DWORD)])
+    connection.unreachable.add("pc03")
+    runner = FleetRunner(connection, catalog, {"taskbar_align": "disabled"}, mode="apply",
+                         workers=4, retries=1, retry_delay=0.0)
+    records = {record["host"]: record for record in runner.run(HOSTS)}
+    assert set(records) == set(HOSTS)
+    assert records["pc03"]["status"] == "error" and records["pc03"]["attempts"] == 2
+    assert records["pc00"]["written"] == ["taskbar_align"]
+    assert connection.backend("pc00").keys[(HKCU, ADVANCED.lower())]["taskbaral"][1] == 0
+    assert runner.summary["ok"] == 11 and runner.summary["error"] == 1
+
+def test_scan_reports_divergent_settings(catalog):
+    connection = SimulatedHostConnection()
+    connection.backend("pc01").preset(HKCU, ADVANCED, "TaskbarAl", 0, winreg.REG_DWORD)
+    runner = FleetRunner(connection, catalog, mode="scan", workers=2)
+    records = list(runner.run(HOSTS[:3]))
+    assert all(record["status"] == "ok" for record in records)
+    assert runner.summary["divergent"] == ["taskbar_align"]
+    # サービス・タスクはフリートの対象外
+    assert "sysmain_service" not in records[0]["states"]
+
+@pytest.mark.parametrize("mode", ["diff", "apply"])
+def test_binary_changes_are_written_as_json(catalog, mode):
+    # StuckRects3\Settings（48バイト、9バイト目が02で自動的に隠すがオフ）
+    settings_off = bytes(8) + b"\x02" + bytes(39)
+    connection = SimulatedHostConnection(presets=[(HKCU, STUCK_RECTS, "Settings", settings_off, winreg.REG_BINARY)])
+    runner = FleetRunner(connection, catalog, {"taskbar_autohide": "enabled"}, mode=mode, workers=2)
+    stream = io.StringIO()
+    assert write_jsonl(runner.run(HOSTS[:2]), stream) == 2
+    record = json.loads(stream.getvalue().splitlines()[0])
+    assert record["status"] == "ok"
+    change = record["changes"]["taskbar_autohide"]
+    assert bytes.fromhex(change["old"]["hex"]) == settings_off
+    assert bytes.fromhex(change["new"]["hex"])[8] == 0x03
@@ -0,0 +1,63 @@
+import pytest
+
+from core import RegistryManager, winreg
+from hive import HiveError, HiveFile, HiveWriter, open_image, scan_images
+
+HKCU = winreg.HKEY_CURRENT_USER
+ADVANCED = r"Software\Microsoft\Windows\CurrentVersion\Explorer\Advanced"
+
+def write_ntuser(path, taskbar_align):
+    writer = HiveWriter(list_limit=4)
+    writer.set_value(ADVANCED, "TaskbarAl", winreg.REG_DWORD, taskbar_align)
+    writer.set_value(ADVANCED, "ShowTaskViewButton", winreg.REG_DWORD, 1)
+    writer.set_value("Software\\Sample", "Text", winreg.REG_SZ, "値")
+    writer.set_value("Software\\Sample", "Multi", winreg.REG_MULTI_SZ, ["a", "b"])
+    writer.set_value("Software\\Sample", "Blob", winreg.REG_BINARY, bytes(range(64)))
+    for number in range(10):
+        writer.add_key(f"Software\\Sample\\Child{number}")
+    path.parent.mkdir(exist_ok=True)
+    writer.write(str(path))
+    return path
+
+def test_hive_file_reads_keys_and_values(tmp_path):
+    with HiveFile(str(write_ntuser(tmp_path / "NTUSER.DAT", 0))) as hive:
+        sample = hive.find_key("software\\SAMPLE")
+        # サブキーが多いキーはriレコードに分割されている
+        assert sorted(hive.subkeys(sample)) == [f"child{number}" for number in range(10)]
+        values = {name: value for name, value, _ in map(hive.value, hive.values(sample).values())}
+        assert values == {"Text": "値", "Multi": ["a", "b"], "Blob": bytes(range(64))}
+        assert hive.find_key("Software\\Missing") is None
+        assert not hive.dirty
+
+def test_image_is_read_only(tmp_path):
+    backend = open_image(str(write_ntuser(tmp_path / "pc01" / "NTUSER.DAT", 0)))
+    try:
+        registry = RegistryManager(backend)
+        assert registry.read_value(ADVANCED, "TaskbarAl") == 0
+        assert registry.read_value(ADVANCED, "TaskbarAl", winreg.HKEY_LOCAL_MACHINE) is None
+        with pytest.raises(PermissionError):
+            backend.set_value(backend.open_key(HKCU, ADVANCED), "TaskbarAl", winreg.REG_DWORD, 1)
+        with pytest.raises(PermissionError):
+            backend.open_key(HKCU, ADVANCED, winreg.KEY_WRITE)
+    finally:
+        backend.close()
+
+def test_invalid_files_are_rejected(tmp_path):
+    (tmp_path / "NTUSER.DAT").write_bytes(b"not a hive" * 500)
+    with pytest.raises(HiveError, match="ハイブファイルではありません"):
+        open_image(str(tmp_path / "NTUSER.DAT"))
+    with pytest.raises(HiveError, match="マウント先"):
+        open_image(str(tmp_path / "unknown.hiv"))
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_scan_images(tmp_path, catalog, workers):
+    images = [str(write_ntuser(tmp_path / f"pc{number}" / "NTUSER.DAT", number % 2).parent) for number in range(3)]
+    images.append(str(tmp_path / "empty"))
+    (tmp_path / "empty").mkdir()
+    results = list(scan_images(images, catalog, workers=workers))
+    assert [result["image"] for result in results] == images
+    assert [result["states"]["taskbar_align"] for result in results[:3]] == ["disabled", "enabled", "disabled"]
+    assert results[0]["states"]["ad_id"] == "unknown"
+    # サービス・タスクはハイブから評価できない
+    assert "diagtrack_service" not in results[0]["states"]
+    assert results[3]["status"] == "error"
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from core import winreg
+from instrumentation import INSTRUMENTATION, NULL_SPAN, Histogram, Instrumentation
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    for duration in [0.000001] * 90 + [0.001] * 10:
+        histogram.add(duration)
+    assert histogram.count == 100
+    assert histogram.percentile(0.5) == pytest.approx(0.000001)
+    # 区間の上限（1024µs）で近似し、最大値は超えない
+    assert histogram.percentile(0.95) == pytest.approx(0.001)
+    assert histogram.to_dict()["max_ms"] == 1.0
+
+def test_disabled_instrumentation_records_nothing():
+    instrumentation = Instrumentation()
+    assert instrumentation.span("registry", "query") is NULL_SPAN
+    instrumentation.record("registry", "query", None, 0.1)
+    assert instrumentation.stats() == []
+
+def test_spans_are_grouped_and_exported(tmp_path):
+    instrumentation = Instrumentation(enabled=True)
+    with instrumentation.span("registry", "query", "HKCU\\A"):
+        pass
+    with pytest.raises(FileNotFoundError):
+        with instrumentation.span("registry", "query", "HKCU\\B"):
+            raise FileNotFoundError("missing")
+    with pytest.raises(PermissionError):
+        with instrumentation.span("registry", "write", "HKCU\\A"):
+            raise PermissionError("denied")
+    
+    assert len(instrumentation.stats("key")) == 3
+    rows = {row["operation"]: row for row in instrumentation.stats("operation")}
+    assert rows["query"]["count"] == 2 and rows["query"]["missing"] == 1
+    assert rows["write"]["errors"] == 1
+    assert instrumentation.recent_errors[-1][-1] == "PermissionError: denied"
+    
+    path = tmp_path / "trace.json"
+    assert instrumentation.export_chrome_trace(str(path)) == 4
+    events = json.loads(path.read_text(encoding="utf-8"))["traceEvents"]
+    assert [event["name"] for event in events if event["ph"] == "X"] == ["query HKCU\\A", "query HKCU\\B", "write HKCU\\A"]
+
+def test_registry_operations_are_timed_per_key(registry):
+    INSTRUMENTATION.reset()
+    INSTRUMENTATION.enable()
+    try:
+        registry.write_value("Software\\A", "Value", 1, winreg.REG_DWORD)
+        registry.read_value("Software\\A", "Value")
+        keys = {(row["operation"], row["key"]) for row in INSTRUMENTATION.stats("key")}
+    finally:
+        INSTRUMENTATION.disable()
+        INSTRUMENTATION.reset()
+    assert ("write_value", "HKEY_CURRENT_USER\\Software\\A") in keys
+    assert ("read_value", "HKEY_CURRENT_USER\\Software\\A") in keys
@@ -0,0 +1,64 @@
+import threading
+
+from core import winreg
+from jobs import JobQueue
+
+HKCU = winreg.HKEY_CURRENT_USER
+ADVANCED = r"Software\Microsoft\Windows\CurrentVersion\Explorer\Advanced"
+TARGETS = {"taskbar_align": "disabled", "ad_id": "disabled"}
+
+def value(backend, key_path, value_name):
+    entry = backend.keys.get((HKCU, key_path.lower()), {}).get(value_name.lower())
+    return entry[1] if entry is not None else None
+
+def test_apply_job_reports_progress(backend, registry, catalog):
+    progress = []
+    jobs = JobQueue(registry, on_progress=lambda job, setting_id, ok: progress.append((setting_id, ok)))
+    job = jobs.submit_apply(catalog.settings, TARGETS)
+    assert job.wait(5)
+    assert job.state == "done" and not jobs.busy
+    assert sorted(progress) == [("ad_id", True), ("taskbar_align", True)]
+    assert job.done == job.total == 2
+    assert job.counts()["written"] == 2
+    assert value(backend, ADVANCED, "TaskbarAl") == 0
+
+def test_cancel_rolls_back_written_items(backend, registry, catalog):
+    backend.preset(HKCU, ADVANCED, "TaskbarAl", 1, winreg.REG_DWORD)
+    jobs = JobQueue(registry, on_progress=lambda job, setting_id, ok: job.cancel())
+    job = jobs.submit_apply(catalog.settings, TARGETS)
+    assert job.wait(5)
+    assert job.state == "cancelled"
+    assert sorted(job.items.values()) == ["not_run", "rolled_back"]
+    assert value(backend, ADVANCED, "TaskbarAl") == 1
+
+def test_queued_job_can_be_cancelled_before_it_runs(backend, registry, catalog):
+    started = threading.Event()
+    release = threading.Event()
+    
+    def blocking_plan(planner):
+        started.set()
+        release.wait(5)
+        return planner.plan(catalog.settings, {})
+    
+    jobs = JobQueue(registry)
+    first = jobs.submit("apply", catalog.settings, blocking_plan)
+    second = jobs.submit_apply(catalog.settings, TARGETS)
+    assert started.wait(5)
+    second.cancel()
+    release.set()
+    jobs.wait()
+    assert first.state == "done" and second.state == "cancelled"
+    assert backend.calls["set"] == 0
+
+def test_restore_job_reads_targets_on_the_worker(backend, registry, catalog):
+    backend.preset(HKCU, ADVANCED, "TaskbarAl", 0, winreg.REG_DWORD)
+    threads = []
+    
+    def targets():
+        threads.append(threading.current_thread().name)
+        return [("taskbar_align", HKCU, ADVANCED, "TaskbarAl", winreg.REG_DWORD, 1)]
+    
+    job = JobQueue(registry).submit_restore(catalog.settings, targets)
+    assert job.wait(5)
+    assert job.state == "done" and threads == ["job-queue"]
+    assert value(backend, ADVANCED, "TaskbarAl") == 1
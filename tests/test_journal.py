@@ -0,0 +1,77 @@
+import pytest
+
+from core import ApplyPlanner, ApplyTransaction, winreg
+from journal import BackupJournal
+
+HKCU = winreg.HKEY_CURRENT_USER
+ADVANCED = r"Software\Microsoft\Windows\CurrentVersion\Explorer\Advanced"
+
+@pytest.fixture
+def journal(tmp_path):
+    return BackupJournal(str(tmp_path / "journal.jsonl"))
+
+def apply(registry, catalog, journal, targets, label="apply"):
+    plan = ApplyPlanner(registry).plan(catalog.settings, targets)
+    result = ApplyTransaction(registry, journal).execute(plan, catalog.settings, label)
+    assert result.committed
+    return result
+
+def restore(registry, catalog, targets):
+    plan = ApplyPlanner(registry).plan_values(targets, catalog.settings)
+    assert ApplyTransaction(registry).execute(plan, catalog.settings).committed
+
+def test_restore_to_before_a_session(backend, registry, catalog, journal):
+    backend.preset(HKCU, ADVANCED, "TaskbarAl", 1, winreg.REG_DWORD)
+    apply(registry, catalog, journal, {"taskbar_align": "disabled"})
+    apply(registry, catalog, journal, {"taskbar_align": "enabled", "task_view": "disabled"})
+    apply(registry, catalog, journal, {"task_view": "enabled"})
+    assert [session["session"] for session in journal.sessions()] == [1, 2, 3]
+    assert journal.last_session("apply")["session"] == 3
+    
+    # セッション2の直前: TaskbarAl = 0、ShowTaskViewButtonは存在しない
+    restore(registry, catalog, journal.restore_targets(2))
+    assert registry.read_value(ADVANCED, "TaskbarAl") == 0
+    assert registry.read_value(ADVANCED, "ShowTaskViewButton") is None
+    
+    restore(registry, catalog, journal.origin_targets())
+    assert registry.read_value(ADVANCED, "TaskbarAl") == 1
+    with pytest.raises(KeyError):
+        journal.restore_targets(9)
+
+def test_compact_keeps_origin_and_recent_sessions(backend, registry, catalog, journal):
+    backend.preset(HKCU, ADVANCED, "TaskbarAl", 1, winreg.REG_DWORD)
+    for state in ("disabled", "enabled", "disabled", "enabled"):
+        apply(registry, catalog, journal, {"taskbar_align": state})
+    assert journal.compact(keep_sessions=2) == 2
+    assert [session["session"] for session in journal.sessions()] == [3, 4]
+    with pytest.raises(KeyError):
+        journal.restore_targets(1)
+    
+    # 索引を持たない別のインスタンスでも、まとめた後の最初の状態に戻せる
+    reopened = BackupJournal(journal.journal_file)
+    assert [session["session"] for session in reopened.sessions()] == [3, 4]
+    restore(registry, catalog, reopened.origin_targets())
+    assert registry.read_value(ADVANCED, "TaskbarAl") == 1
+
+def test_truncated_tail_is_ignored(registry, catalog, journal):
+    apply(registry, catalog, journal, {"taskbar_align": "disabled"})
+    with open(journal.journal_file, "ab") as f:
+        f.write(b'{"s": 2, "b": "2026')
+    reopened = BackupJournal(journal.journal_file)
+    assert [session["session"] for session in reopened.sessions()] == [1]
+    with open(journal.journal_file, "rb") as f:
+        assert f.read().endswith(b"\n")
+
+def test_sessions_written_by_another_instance_are_seen(backend, registry, catalog, journal):
+    # GUIの索引を読み込んだ後に、ブローカーが別のインスタンスで適用を記録する
+    apply(registry, catalog, journal, {"taskbar_align": "disabled"})
+    assert journal.last_session("apply")["session"] == 1
+    broker = BackupJournal(journal.journal_file)
+    apply(registry, catalog, broker, {"taskbar_align": "enabled"})
+    assert journal.last_session("apply")["session"] == 2
+    
+    # 自分の追記の後も、相手の追記を取りこぼさずに続きの番号を使う
+    apply(registry, catalog, journal, {"taskbar_align": "disabled"})
+    apply(registry, catalog, broker, {"taskbar_align": "enabled"})
+    assert [session["session"] for session in journal.sessions()] == [1, 2, 3, 4]
+    assert [session["session"] for session in broker.sessions()] == [1, 2, 3, 4]
@@ -0,0 +1,46 @@
+from core import ApplyPlanner, ApplyTransaction, BatchScanner, RegistryManager, RegistrySettingItem, winreg
+from overlay import ApplyPreview, OverlayRegistryBackend
+
+HKCU = winreg.HKEY_CURRENT_USER
+ADVANCED = r"Software\Microsoft\Windows\CurrentVersion\Explorer\Advanced"
+
+def test_overlay_reads_through_and_writes_on_top(backend):
+    backend.preset(HKCU, ADVANCED, "TaskbarAl", 1, winreg.REG_DWORD)
+    backend.preset(HKCU, r"Software\Old", "Value", "x", winreg.REG_SZ)
+    overlay = OverlayRegistryBackend(backend)
+    registry = RegistryManager(overlay)
+    assert registry.read_value(ADVANCED, "TaskbarAl") == 1
+    
+    registry.write_value(ADVANCED, "TaskbarAl", 0, winreg.REG_DWORD)
+    overlay.delete_key(HKCU, r"Software\Old")
+    assert registry.read_value(ADVANCED, "TaskbarAl") == 0
+    assert registry.read_value(r"Software\Old", "Value") is None
+    # 元のレジストリは変わらない
+    assert backend.keys[(HKCU, ADVANCED.lower())]["taskbaral"][1] == 1
+    assert backend.calls["set"] == 0
+    assert sorted(overlay.changes()) == [
+        (HKCU, ADVANCED, "TaskbarAl", winreg.REG_DWORD, 0),
+        (HKCU, r"Software\Old", "Value", None, None),
+    ]
+    overlay.discard()
+    assert registry.read_value(ADVANCED, "TaskbarAl") == 1
+
+def test_preview_then_commit(backend, registry, catalog):
+    backend.preset(HKCU, ADVANCED, "TaskbarAl", 1, winreg.REG_DWORD)
+    settings = {setting_id: setting for setting_id, setting in catalog.settings.items()
+                if isinstance(setting, RegistrySettingItem)}
+    BatchScanner(registry).scan(settings)
+    before = catalog.current.copy()
+    
+    preview = ApplyPreview(registry, catalog, {"taskbar_align": "disabled", "ad_id": "disabled"}).run()
+    assert preview.changed_ids() == ["ad_id", "taskbar_align"]
+    assert preview.states["taskbar_align"] == "disabled"
+    # 画面の状態と実際のレジストリは確定するまで変わらない
+    assert catalog.current.differs(before) == 0
+    assert backend.calls["set"] == 0
+    
+    plan = preview.commit_plan(ApplyPlanner(registry))
+    assert sorted(plan.setting_ids) == ["ad_id", "taskbar_align"]
+    assert ApplyTransaction(registry).execute(plan, catalog.settings).committed
+    assert backend.keys[(HKCU, ADVANCED.lower())]["taskbaral"][1] == 0
+    assert preview.overlay.stats() == {"keys": 0, "values": 0}
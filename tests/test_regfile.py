@@ -0,0 +1,87 @@
+import io
+
+import pytest
+
+from core import winreg
+from regfile import RegFileError, RegKey, RegValue, import_reg, iter_tree, parse_reg, write_reg
+
+HKCU = winreg.HKEY_CURRENT_USER
+
+def parse_text(text: str):
+    return list(parse_reg(io.BytesIO(text.encode("utf-8"))))
+
+def test_round_trip_of_all_value_types():
+    entries = [
+        RegKey(HKCU, "Software\\Sample"),
+        RegValue(HKCU, "Software\\Sample", "", winreg.REG_SZ, "既定の値"),
+        RegValue(HKCU, "Software\\Sample", 'Quoted "name"', winreg.REG_SZ, "C:\\Windows"),
+        RegValue(HKCU, "Software\\Sample", "Dword", winreg.REG_DWORD, 0xFFFFFFFF),
+        RegValue(HKCU, "Software\\Sample", "Qword", winreg.REG_QWORD, 2 ** 40),
+        RegValue(HKCU, "Software\\Sample", "Expand", winreg.REG_EXPAND_SZ, "%SystemRoot%\\a.exe"),
+        RegValue(HKCU, "Software\\Sample", "Multi", winreg.REG_MULTI_SZ, ["a", "b"]),
+        # 複数行に折り返される長いバイナリ値
+        RegValue(HKCU, "Software\\Sample", "Blob", winreg.REG_BINARY, bytes(range(200))),
+        RegValue(HKCU, "Software\\Sample", "Removed", None),
+        RegKey(HKCU, "Software\\Old", True),
+    ]
+    stream = io.BytesIO()
+    assert write_reg(entries, stream) == 8
+    data = stream.getvalue()
+    assert data.startswith(b"\xff\xfe")
+    assert "\\\r\n  ".encode("utf-16-le") in data
+    assert list(parse_reg(io.BytesIO(data))) == entries
+
+def test_comments_and_continuation_lines():
+    entries = parse_text(
+        "Windows Registry Editor Version 5.00\n"
+        "\n"
+        "; コメントの行末の \\\n"
+        "[HKEY_CURRENT_USER\\Software\\A]\n"
+        '"Blob"=hex:01,02,\\\n'
+        "  03,04\n"
+        "; 行末が \\ のコメントでも次のキーを飲み込まない \\\n"
+        "[HKCU\\Software\\B]\n"
+        '"Value"=dword:00000010\n'
+    )
+    assert entries == [
+        RegKey(HKCU, "Software\\A"),
+        RegValue(HKCU, "Software\\A", "Blob", winreg.REG_BINARY, b"\x01\x02\x03\x04"),
+        RegKey(HKCU, "Software\\B"),
+        RegValue(HKCU, "Software\\B", "Value", winreg.REG_DWORD, 16),
+    ]
+
+def test_comment_ends_an_unfinished_continuation():
+    entries = parse_text(
+        "Windows Registry Editor Version 5.00\n"
+        "[HKEY_CURRENT_USER\\Software\\A]\n"
+        '"Blob"=hex:01,02,\\\n'
+        "; コメント\n"
+        '"Value"=dword:00000001\n'
+    )
+    assert entries[1] == RegValue(HKCU, "Software\\A", "Blob", winreg.REG_BINARY, b"\x01\x02")
+    assert entries[2] == RegValue(HKCU, "Software\\A", "Value", winreg.REG_DWORD, 1)
+
+@pytest.mark.parametrize("text, message", [
+    ("REGEDIT9\n", "レジストリファイルではありません"),
+    ('Windows Registry Editor Version 5.00\n"Value"=dword:1\n', "キーの前に値"),
+    ("Windows Registry Editor Version 5.00\n[HKEY_NOWHERE\\A]\n", "不明なルートキー"),
+    ('Windows Registry Editor Version 5.00\n[HKCU\\A]\n"Value"=dword:xyz\n', ":3: DWORD"),
+])
+def test_invalid_files_report_the_line(text, message):
+    with pytest.raises(RegFileError, match=message):
+        parse_text(text)
+
+def test_import_and_export_tree(registry):
+    counts = import_reg(parse_text(
+        "Windows Registry Editor Version 5.00\n"
+        "[HKEY_CURRENT_USER\\Software\\A]\n"
+        '"Name"="value"\n'
+        "[HKEY_CURRENT_USER\\Software\\A\\Child]\n"
+        '"Number"=dword:00000002\n'
+    ), registry)
+    assert counts["values"] == 2 and counts["failed"] == 0
+    assert registry.read_value("Software\\A\\Child", "Number") == 2
+    values = [entry for entry in iter_tree(HKCU, "Software\\A", registry) if isinstance(entry, RegValue)]
+    assert [(entry.key_path, entry.value_name, entry.value) for entry in values] == [
+        ("Software\\A", "Name", "value"), ("Software\\A\\Child", "Number", 2),
+    ]
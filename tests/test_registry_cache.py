@@ -0,0 +1,59 @@
+import pytest
+
+from core import RegistryManager, StaleHandleError, is_stale_handle, winreg
+
+HKCU = winreg.HKEY_CURRENT_USER
+
+@pytest.fixture
+def cached(backend):
+    """キーハンドルを2つまでキャッシュするRegistryManager"""
+    with RegistryManager(backend, cache_size=2) as manager:
+        yield manager
+
+def test_lru_eviction(backend, cached):
+    for name in ("A", "B", "C"):
+        backend.preset(HKCU, f"Software\\{name}", "Value", 1, winreg.REG_DWORD)
+    cached.read_value("Software\\A", "Value")
+    cached.read_value("Software\\B", "Value")
+    # Aを最近使ったものにしてからCを開くと、Bが追い出される
+    cached.read_value("Software\\A", "Value")
+    cached.read_value("Software\\C", "Value")
+    assert cached.evictions == 1
+    opened = backend.calls["open"]
+    cached.read_value("Software\\A", "Value")
+    assert backend.calls["open"] == opened
+    cached.read_value("Software\\B", "Value")
+    assert backend.calls["open"] == opened + 1
+
+def test_write_upgrades_read_handle(backend, cached):
+    backend.preset(HKCU, "Software\\A", "Value", 1, winreg.REG_DWORD)
+    cached.read_value("Software\\A", "Value")
+    assert cached.write_value("Software\\A", "Value", 2, winreg.REG_DWORD)
+    # 読み取り用ハンドルは閉じて書き込み可能なハンドルに置き換え、以後の読み取りにも使う
+    assert backend.calls["close"] == 1
+    assert list(cached._handles) == [(HKCU, "software\\a", RegistryManager.WRITE_ACCESS)]
+    hits = cached.hits
+    assert cached.read_value("Software\\A", "Value") == 2
+    assert cached.hits == hits + 1
+    assert backend.calls["create"] == 1
+
+def test_stale_handle_is_reopened(backend, cached):
+    backend.preset(HKCU, "Software\\A", "Value", 1, winreg.REG_DWORD)
+    cached.read_value("Software\\A", "Value")
+    # 外部でキーが削除・再作成された
+    backend.delete_key(HKCU, "Software\\A")
+    backend.preset(HKCU, "Software\\A", "Value", 3, winreg.REG_DWORD)
+    assert cached.read_value("Software\\A", "Value") == 3
+
+def test_failed_write_is_not_retried(backend, cached):
+    backend.preset(HKCU, "Software\\A", "Value", 1, winreg.REG_DWORD)
+    backend.fail_writes.add("value")
+    cached.read_value("Software\\A", "Value")
+    assert not cached.write_value("Software\\A", "Value", 2, winreg.REG_DWORD)
+    assert backend.calls["set"] == 1
+    assert cached.read_value("Software\\A", "Value") == 1
+
+def test_is_stale_handle():
+    assert is_stale_handle(StaleHandleError("deleted"))
+    assert not is_stale_handle(PermissionError("denied"))
+    assert not is_stale_handle(OSError("failed"))
@@ -0,0 +1,27 @@
+from core import BatchScanner, RegistrySettingItem, winreg
+
+HKCU = winreg.HKEY_CURRENT_USER
+ADVANCED = r"Software\Microsoft\Windows\CurrentVersion\Explorer\Advanced"
+
+def registry_settings(catalog):
+    return {setting_id: setting for setting_id, setting in catalog.settings.items()
+            if isinstance(setting, RegistrySettingItem)}
+
+def test_scan_evaluates_values(backend, registry, catalog):
+    backend.preset(HKCU, ADVANCED, "TaskbarAl", 0, winreg.REG_DWORD)
+    backend.preset(HKCU, ADVANCED, "ShowTaskViewButton", 1, winreg.REG_DWORD)
+    states = BatchScanner(registry).scan(registry_settings(catalog))
+    assert states["taskbar_align"] == "disabled"
+    assert states["task_view"] == "enabled"
+    # 値がない項目は不明
+    assert states["ad_id"] == "unknown"
+    assert catalog.settings["taskbar_align"].current_value == "disabled"
+
+def test_scan_opens_each_key_once(backend, registry, catalog):
+    settings = registry_settings(catalog)
+    backend.preset(HKCU, ADVANCED, "TaskbarAl", 1, winreg.REG_DWORD)
+    BatchScanner(registry).scan(settings)
+    keys = BatchScanner.group_by_key(settings)
+    # TaskbarAl と ShowTaskViewButton は同じキーを共有する
+    assert len(keys) < len(settings)
+    assert backend.calls["open"] == len(keys)
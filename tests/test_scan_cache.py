@@ -0,0 +1,46 @@
+import marshal
+
+from core import BatchScanner, RegistrySettingItem, ScanCache, winreg
+
+HKCU = winreg.HKEY_CURRENT_USER
+ADVANCED = r"Software\Microsoft\Windows\CurrentVersion\Explorer\Advanced"
+ADVERTISING = r"Software\Microsoft\Windows\CurrentVersion\AdvertisingInfo"
+
+def registry_settings(catalog):
+    return {setting_id: setting for setting_id, setting in catalog.settings.items()
+            if isinstance(setting, RegistrySettingItem)}
+
+def test_writes_advance_the_key_time(backend):
+    backend.preset(HKCU, ADVANCED, "TaskbarAl", 1, winreg.REG_DWORD)
+    handle = backend.open_key(HKCU, ADVANCED)
+    _, values, before = backend.query_info_key(handle)
+    backend.set_value(handle, "TaskbarAl", winreg.REG_DWORD, 0)
+    assert values == 1 and backend.query_info_key(handle)[2] > before
+
+def test_cache_rereads_only_changed_keys(tmp_path, backend, registry, catalog):
+    settings = registry_settings(catalog)
+    backend.preset(HKCU, ADVANCED, "TaskbarAl", 1, winreg.REG_DWORD)
+    backend.preset(HKCU, ADVERTISING, "Enabled", 0, winreg.REG_DWORD)
+    cache = ScanCache(str(tmp_path / "scan_cache.bin"))
+    BatchScanner(registry, cache).scan(settings)
+    cache.save()
+    
+    backend.preset(HKCU, ADVANCED, "TaskbarAl", 0, winreg.REG_DWORD)
+    cache = ScanCache(str(tmp_path / "scan_cache.bin"))
+    assert cache.load()
+    states = BatchScanner(registry, cache).scan(settings)
+    assert states["taskbar_align"] == "disabled" and states["ad_id"] == "disabled"
+    # 存在しないキーは毎回確認するが、時刻が変わっていないキーは読み直さない
+    missing = len(BatchScanner.group_by_key(settings)) - cache.stats()["keys"]
+    assert cache.misses == missing + 1 and cache.hits == 1
+
+def test_corrupt_or_old_cache_is_ignored(tmp_path):
+    path = tmp_path / "scan_cache.bin"
+    path.write_bytes(b"broken")
+    cache = ScanCache(str(path))
+    assert not cache.load()
+    assert cache.entries == {}
+    
+    path.write_bytes(marshal.dumps({"version": ScanCache.VERSION - 1, "entries": [(HKCU, "a", 1, {})]}))
+    assert not cache.load()
+    assert cache.entries == {}
@@ -0,0 +1,19 @@
+import queue
+
+from core import BatchScanner, MemoryRegistryBackend, RegistryManager, ScanWorker
+
+def test_worker_reports_batches_in_background(catalog):
+    # 遅いレジストリでも start() はすぐに戻り、結果はキーごとに届く
+    registry = RegistryManager(MemoryRegistryBackend(latency=0.001))
+    batches = queue.Queue()
+    done = []
+    worker = ScanWorker(BatchScanner(registry), catalog.settings, batches.put, done.append).start()
+    assert worker.join(timeout=10)
+    states = {}
+    count = 0
+    while not batches.empty():
+        states.update(batches.get())
+        count += 1
+    assert count > 1
+    assert set(states) == set(catalog.settings)
+    assert done == [worker.elapsed]
@@ -0,0 +1,54 @@
+import pytest
+
+from search import SearchIndex, SettingsFilter, normalize
+
+TASKBAR = ["taskbar_align", "task_view", "taskbar_autohide"]
+
+@pytest.fixture
+def settings_filter(catalog):
+    return SettingsFilter(catalog)
+
+def test_normalize_ignores_width_case_and_kana():
+    assert normalize("ﾀｽｸﾊﾞｰ") == normalize("たすくばー") == normalize("タスクバー")
+    assert normalize("ＴａｓｋｂａｒＡｌ") == "taskbaral"
+
+@pytest.mark.parametrize("query, expected", [
+    ("タスクバー", TASKBAR),
+    ("ﾀｽｸﾊﾞｰ", TASKBAR),
+    ("TASKBARAL", ["taskbar_align"]),
+    ("サービス 送信", ["diagtrack_service"]),
+    # n-gramはすべて含んでいても連続していない
+    ("バータ", []),
+    ("", None),
+])
+def test_search(settings_filter, catalog, query, expected):
+    assert settings_filter.apply(query) == (expected if expected is not None else list(catalog.settings))
+
+def test_extended_query_searches_previous_results(settings_filter, catalog, monkeypatch):
+    calls = []
+    search = SearchIndex.search
+    
+    def spy(index, query, within=None):
+        calls.append((query, within))
+        return search(index, query, within)
+    
+    monkeypatch.setattr(SearchIndex, "search", spy)
+    first = settings_filter.text_mask("タス")
+    second = settings_filter.text_mask("タスク")
+    assert catalog.current.ids(second) == TASKBAR + ["compatibility_appraiser", "ceip_consolidator"]
+    assert catalog.current.ids(settings_filter.text_mask("タスクバー")) == TASKBAR
+    # 削除して別の語にした場合は全体から探し直す
+    assert catalog.current.ids(settings_filter.text_mask("広告")) == ["ad_id"]
+    assert calls == [("たす", None), ("たすく", first), ("たすくばー", second), ("広告", None)]
+
+def test_category_and_state_filters(settings_filter, catalog):
+    assert settings_filter.apply(category="タスクバー") == TASKBAR
+    assert settings_filter.apply("自動", category="タスクバー") == ["taskbar_autohide"]
+    assert settings_filter.apply(category="存在しない") == []
+    
+    catalog.current.update({"taskbar_align": "enabled", "ad_id": "disabled", "task_view": "unknown"})
+    catalog.settings["taskbar_align"].new_value = "disabled"
+    assert settings_filter.apply(state="modified") == ["taskbar_align"]
+    assert settings_filter.apply(state="unknown") == ["task_view"]
+    # 広告IDの既定は有効
+    assert "ad_id" in settings_filter.apply(state="non_default")
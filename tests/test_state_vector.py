@@ -0,0 +1,43 @@
+from core import StateVector, mask_count, mask_from_flags, mask_positions
+
+IDS = ["a", "b", "c", "d"]
+
+def test_mask_helpers():
+    assert mask_from_flags(b"\x00\x02\x00\x01") == 0b1010
+    assert mask_from_flags(b"") == 0
+    assert mask_positions(0b1010) == [1, 3]
+    assert mask_positions(0) == []
+    assert mask_count(1 << 100 | 1) == 2
+
+def test_vectors_compare_as_bitsets():
+    current = StateVector(IDS)
+    current.update({"a": "enabled", "b": "disabled", "c": "unknown", "missing": "enabled"})
+    pending = current.like()
+    pending.update({"a": "enabled", "b": "enabled"})
+    assert pending.positions is current.positions
+    assert current.ids(current.where("disabled")) == ["b"]
+    assert current.ids(current.differs(pending)) == ["b", "c"]
+    # 適用待ちの選択がない項目は比較しない
+    assert pending.ids(pending.mismatches(current)) == ["b"]
+    assert current.to_dict() == {"a": "enabled", "b": "disabled", "c": "unknown", "d": None}
+    
+    copy = current.copy()
+    copy.clear(copy.defined())
+    assert copy.defined() == 0 and current["a"] == "enabled"
+
+def test_divergence_across_machines():
+    machines = [StateVector(IDS) for _ in range(3)]
+    for vector in machines:
+        vector.update({"a": "enabled", "b": "disabled"})
+    machines[2]["d"] = "enabled"
+    assert machines[0].ids(StateVector.divergence(machines)) == ["d"]
+    assert StateVector.divergence([]) == 0
+
+def test_catalog_masks(catalog):
+    catalog.current.update({"taskbar_align": "enabled", "task_view": "enabled"})
+    catalog.settings["taskbar_align"].new_value = "disabled"
+    catalog.settings["task_view"].new_value = "enabled"
+    assert catalog.modified_ids() == ["taskbar_align"]
+    assert catalog.current.ids(catalog.clear_settled()) == ["task_view"]
+    target = catalog.profile_vector({"task_view": "disabled", "ad_id": None})
+    assert catalog.current.ids(target.mismatches(catalog.current)) == ["task_view"]
@@ -0,0 +1,83 @@
+import pytest
+
+from core import (
+    ApplyPlanner,
+    ApplyTransaction,
+    BatchScanner,
+    FixtureSystemQuery,
+    SystemSettingItem,
+    parse_service_csv,
+    parse_task_xml,
+)
+
+SERVICES_CSV = """\
+"Name","StartMode","DelayedAutoStart"
+"DiagTrack","Auto","False"
+"SysMain","Disabled","False"
+"WSearch","Auto","True"
+"Spooler","Manual","False"
+"""
+
+APPRAISER = r"\Microsoft\Windows\Application Experience\Microsoft Compatibility Appraiser"
+CONSOLIDATOR = r"\Microsoft\Windows\Customer Experience Improvement Program\Consolidator"
+
+TASKS_XML = f"""\
+<?xml version="1.0" encoding="UTF-16"?>
+<Tasks>
+  <!-- {APPRAISER} -->
+  <Task xmlns="http://schemas.microsoft.com/windows/2004/02/mit/task">
+    <Settings><Enabled>true</Enabled></Settings>
+  </Task>
+  <!-- {CONSOLIDATOR} -->
+  <Task xmlns="http://schemas.microsoft.com/windows/2004/02/mit/task">
+    <Settings><Enabled>false</Enabled></Settings>
+  </Task>
+</Tasks>
+"""
+
+@pytest.fixture
+def system(catalog):
+    system = FixtureSystemQuery(SERVICES_CSV, TASKS_XML)
+    for setting in catalog.settings.values():
+        if isinstance(setting, SystemSettingItem):
+            setting.system = system
+    return system
+
+def system_settings(catalog):
+    return {setting_id: setting for setting_id, setting in catalog.settings.items()
+            if isinstance(setting, SystemSettingItem)}
+
+def test_parse_command_output():
+    assert parse_service_csv(SERVICES_CSV) == {
+        "diagtrack": "auto", "sysmain": "disabled", "wsearch": "delayed-auto", "spooler": "demand",
+    }
+    assert parse_task_xml(TASKS_XML) == {APPRAISER.lower(): True, CONSOLIDATOR.lower(): False}
+
+def test_scan_queries_each_kind_once(registry, catalog, system):
+    states = BatchScanner(registry).scan(system_settings(catalog))
+    assert states == {
+        "diagtrack_service": "enabled",
+        "sysmain_service": "disabled",
+        "search_indexer": "enabled",
+        "compatibility_appraiser": "enabled",
+        "ceip_consolidator": "disabled",
+    }
+    assert system.calls["query_services"] == 1 and system.calls["query_tasks"] == 1
+
+def test_apply_and_rollback(registry, catalog, system):
+    settings = system_settings(catalog)
+    targets = {"diagtrack_service": "disabled", "compatibility_appraiser": "disabled", "sysmain_service": "disabled"}
+    plan = ApplyPlanner(registry).plan(settings, targets)
+    assert sorted(plan.setting_ids) == ["compatibility_appraiser", "diagtrack_service"]
+    assert plan.skipped == ["sysmain_service"]
+    
+    system.fail_changes.add(APPRAISER.lower())
+    result = ApplyTransaction(registry).execute(plan, settings)
+    assert not result.committed and result.failed == "compatibility_appraiser"
+    # 先に変更したサービスは元の開始の種類に戻す
+    assert system.services["diagtrack"] == "auto"
+    
+    system.fail_changes.clear()
+    result = ApplyTransaction(registry).execute(ApplyPlanner(registry).plan(settings, targets), settings)
+    assert result.committed
+    assert system.services["diagtrack"] == "disabled" and system.tasks[APPRAISER.lower()] is False
@@ -0,0 +1,36 @@
+from core import winreg
+from userhives import FakeHiveProvider, MultiHiveRunner, format_matrix
+
+ADVANCED = r"Software\Microsoft\Windows\CurrentVersion\Explorer\Advanced"
+
+def test_scan_skips_offline_hives_unless_loading(catalog):
+    provider = FakeHiveProvider(users=3, offline=1)
+    online, _, offline = provider.hives
+    provider.preset(online.sid, ADVANCED, "TaskbarAl", 0, winreg.REG_DWORD)
+    matrix = MultiHiveRunner(provider, catalog, workers=2).run()
+    users = {user["sid"]: user for user in matrix["users"]}
+    assert users[online.sid]["states"]["taskbar_align"] == "disabled"
+    assert users[offline.sid]["status"] == "skipped"
+    assert matrix["totals"]["taskbar_align"] == {"disabled": 1, "unknown": 1}
+    # HKEY_LOCAL_MACHINEの項目やサービスはユーザーごとの表に含めない
+    assert "diagtrack_service" not in matrix["settings"]
+    assert "×" in format_matrix(matrix)
+
+def test_apply_writes_back_offline_hive(catalog):
+    provider = FakeHiveProvider(users=2, offline=1, load_offline=True)
+    online, offline = provider.hives
+    runner = MultiHiveRunner(provider, catalog, {"taskbar_align": "disabled"}, mode="apply")
+    matrix = runner.run()
+    assert runner.summary["ok"] == 2
+    assert all(user["written"] == ["taskbar_align"] for user in matrix["users"])
+    assert provider.loads[offline.sid] == 1
+    # 解放したハイブは内容を書き戻し、HKEY_USERSから消える
+    assert provider.offline[offline.sid] == [(ADVANCED, "TaskbarAl", 0, winreg.REG_DWORD)]
+    assert provider.backend.keys[(winreg.HKEY_USERS, f"{online.sid}\\{ADVANCED}".lower())]["taskbaral"][1] == 0
+    assert not any("poletowin_" in path for _, path in provider.backend.keys)
+
+def test_diff_does_not_write(catalog):
+    provider = FakeHiveProvider(users=2)
+    matrix = MultiHiveRunner(provider, catalog, {"taskbar_align": "disabled"}, mode="diff").run()
+    assert [user["changes"] for user in matrix["users"]] == [["taskbar_align"], ["taskbar_align"]]
+    assert provider.backend.calls["set"] == 0
@@ -0,0 +1,83 @@
+import pytest
+
+from core import ApplyPlanner, ApplyTransaction, BatchScanner, CatalogError, CatalogLoader, SettingCatalog, winreg
+
+HKCU = winreg.HKEY_CURRENT_USER
+STUCK_RECTS = r"Software\Microsoft\Windows\CurrentVersion\Explorer\StuckRects3"
+# StuckRects3\Settings の実機の値（自動的に隠すがオフで、9バイト目が02）
+SETTINGS_OFF = bytes.fromhex(
+    "30000000feffffff02000000030000003e0000002800000000000000d803000080070000000400006000000001000000"
+)
+SETTINGS_ON = SETTINGS_OFF[:8] + b"\x03" + SETTINGS_OFF[9:]
+
+EXTRA = {
+    "qword": {"value_name": "Qword", "value_type": "REG_QWORD", "enabled_value": 2 ** 40, "disabled_value": 0},
+    "expand": {"value_name": "Expand", "value_type": "REG_EXPAND_SZ",
+               "enabled_value": "%SystemRoot%\\a.exe", "disabled_value": ""},
+    "multi": {"value_name": "Multi", "value_type": "REG_MULTI_SZ",
+              "enabled_value": ["a", "b"], "disabled_value": ["a"]},
+    "binary": {"value_name": "Binary", "value_type": "REG_BINARY",
+               "enabled_value": "01 02, 03", "disabled_value": ""},
+    # タスクバーの位置（13バイト目）
+    "position": {"key_path": STUCK_RECTS, "value_name": "Settings", "value_type": "REG_BINARY",
+                 "offset": 12, "enabled_value": "01000000", "disabled_value": "03000000"},
+}
+
+def entry(setting_id, **changes):
+    record = {"id": setting_id, "name": setting_id, "description": "", "key_path": "Software\\Sample"}
+    record.update(EXTRA[setting_id], **changes)
+    return record
+
+@pytest.fixture
+def settings(catalog):
+    records = catalog.records + [CatalogLoader.validate(entry(setting_id)) for setting_id in EXTRA]
+    return SettingCatalog(records).settings
+
+def test_scan_value_types(backend, registry, settings):
+    backend.preset(HKCU, STUCK_RECTS, "Settings", SETTINGS_OFF, winreg.REG_BINARY)
+    backend.preset(HKCU, "Software\\Sample", "Qword", 2 ** 40, winreg.REG_QWORD)
+    backend.preset(HKCU, "Software\\Sample", "Expand", "", winreg.REG_EXPAND_SZ)
+    backend.preset(HKCU, "Software\\Sample", "Multi", ["a", "b"], winreg.REG_MULTI_SZ)
+    backend.preset(HKCU, "Software\\Sample", "Binary", b"\x01\x02\x03", winreg.REG_BINARY)
+    setting_ids = [*EXTRA, "taskbar_autohide"]
+    states = BatchScanner(registry).scan({setting_id: settings[setting_id] for setting_id in setting_ids})
+    assert states == {"qword": "enabled", "expand": "disabled", "multi": "enabled", "binary": "enabled",
+                      "position": "disabled", "taskbar_autohide": "disabled"}
+
+def test_bitmask_matching(settings):
+    autohide = settings["taskbar_autohide"]
+    assert (autohide.offset, autohide.mask) == (8, b"\x01")
+    for value in (SETTINGS_ON, bytearray(SETTINGS_ON), memoryview(SETTINGS_ON)):
+        assert autohide.evaluate(value) == "enabled"
+    # 短すぎる値・型の異なる値は判定しない
+    assert autohide.evaluate(SETTINGS_OFF[:5]) == "unknown"
+    assert autohide.evaluate(3) == "unknown"
+    assert settings["qword"].evaluate(["x"]) == "unknown"
+    assert settings["multi"].evaluate("a") == "unknown"
+
+def test_offset_items_in_one_value_are_written_together(backend, registry, settings):
+    backend.preset(HKCU, STUCK_RECTS, "Settings", SETTINGS_OFF, winreg.REG_BINARY)
+    plan = ApplyPlanner(registry).plan(settings, {"taskbar_autohide": "enabled", "position": "enabled"})
+    assert ApplyTransaction(registry).execute(plan, settings).committed
+    value = registry.read_value(STUCK_RECTS, "Settings")
+    # 同じ値の2か所を書き換え、それ以外のバイトはそのまま残す
+    assert [position for position in range(len(value)) if value[position] != SETTINGS_OFF[position]] == [8, 12]
+    assert (value[8], value[12]) == (0x03, 0x01)
+
+def test_offset_item_needs_an_existing_value(registry, settings):
+    plan = ApplyPlanner(registry).plan(settings, {"taskbar_autohide": "enabled"})
+    assert plan.invalid == ["taskbar_autohide"]
+
+@pytest.mark.parametrize("setting_id, changes, message", [
+    ("position", {"offset": -1}, "0以上の整数"),
+    ("position", {"mask": "ff"}, "同じ長さ"),
+    ("position", {"enabled_value": "02000000", "mask": "01000000"}, "mask\" の外のビット"),
+    ("qword", {"offset": 1}, "REG_BINARY の項目にだけ"),
+    ("binary", {"mask": "01"}, "\"offset\" と一緒に"),
+    ("multi", {"enabled_value": ["a", ""]}, "REG_MULTI_SZ の値"),
+    ("qword", {"enabled_value": 2 ** 64}, "REG_QWORD の値"),
+    ("binary", {"enabled_value": "zz"}, "REG_BINARY の値"),
+])
+def test_invalid_value_types_are_rejected(setting_id, changes, message):
+    with pytest.raises(CatalogError, match=message):
+        CatalogLoader.validate(entry(setting_id, **changes))
@@ -0,0 +1,68 @@
+import pytest
+
+gui = pytest.importorskip("gui")
+
+class RecordingRow:
+    """SettingRowの代わりに表示内容と配置だけを記録する行"""
+    
+    def __init__(self):
+        self.setting_id = None
+        self.shown = []
+        self.y = None
+    
+    def show(self, setting_id, state):
+        self.setting_id = setting_id
+        self.shown.append(setting_id)
+    
+    def place(self, x, y, relwidth):
+        self.y = y
+    
+    def place_forget(self):
+        self.y = None
+
+class RecordingScrollbar:
+    def set(self, first, last):
+        self.position = (first, last)
+
+@pytest.fixture
+def settings_list():
+    # Tkのウィジェットを作らずに、行の割り当てだけを確かめる
+    settings_list = gui.VirtualSettingsList.__new__(gui.VirtualSettingsList)
+    settings_list.row_state = lambda setting_id: setting_id
+    settings_list.item_ids = []
+    settings_list.offset = 0
+    settings_list.visible_count = 3
+    settings_list.rows = [RecordingRow() for _ in range(3)]
+    settings_list.scrollbar = RecordingScrollbar()
+    return settings_list
+
+def test_rows_are_recycled_while_scrolling(settings_list):
+    rows = list(settings_list.rows)
+    settings_list.set_items([f"item{number}" for number in range(1000)])
+    assert [row.setting_id for row in rows] == ["item0", "item1", "item2"]
+    settings_list.scroll_to(500)
+    assert settings_list.rows == rows
+    assert [row.setting_id for row in rows] == ["item500", "item501", "item502"]
+    assert settings_list.scrollbar.position == (0.5, 0.503)
+    # 末尾より先にはスクロールしない
+    settings_list.scroll_to(5000)
+    assert settings_list.offset == 997
+
+def test_unused_rows_are_hidden(settings_list):
+    settings_list.set_items(["only"])
+    assert [row.setting_id for row in settings_list.rows] == ["only", None, None]
+    assert [row.y is None for row in settings_list.rows] == [False, True, True]
+
+def test_refresh_items_updates_only_matching_rows(settings_list):
+    settings_list.set_items(["a", "b", "c"])
+    settings_list.refresh_items({"b"})
+    assert [len(row.shown) for row in settings_list.rows] == [1, 2, 1]
+
+def test_fonts_are_shared(monkeypatch):
+    created = []
+    monkeypatch.setattr(gui.FontCache, "_fonts", {})
+    monkeypatch.setattr(gui.ctk, "CTkFont", lambda **options: created.append(options) or object())
+    font = gui.FontCache.get(14, "bold")
+    assert gui.FontCache.get(14, "bold") is font
+    assert gui.FontCache.get(14) is not font
+    assert len(created) == 2
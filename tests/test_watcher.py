@@ -0,0 +1,59 @@
+import threading
+import time
+
+from core import BatchScanner, SettingCatalog, winreg
+from watcher import FakeWatcher, IncrementalRefresher, PollingWatcher
+
+HKCU = winreg.HKEY_CURRENT_USER
+ADVANCED = r"Software\Microsoft\Windows\CurrentVersion\Explorer\Advanced"
+ADVERTISING = r"Software\Microsoft\Windows\CurrentVersion\AdvertisingInfo"
+
+def test_change_rescans_only_settings_under_the_key(backend, registry, catalog):
+    notified = []
+    watcher = FakeWatcher(unsupported=[(HKCU, ADVERTISING)])
+    fallback = FakeWatcher()
+    refresher = IncrementalRefresher(catalog.settings, BatchScanner(registry), notified.append, watcher, fallback)
+    refresher.start()
+    # 通知を受け取れないキーだけを代わりのWatcherで監視する
+    assert list(fallback.keys) == [(HKCU, ADVERTISING.lower())]
+    
+    backend.preset(HKCU, ADVANCED, "TaskbarAl", 0, winreg.REG_DWORD)
+    assert watcher.change(HKCU, ADVANCED)
+    assert notified == [{"taskbar_align": "disabled", "task_view": "unknown"}]
+    assert not watcher.change(HKCU, ADVERTISING)
+    assert fallback.change(HKCU, ADVERTISING)
+    assert notified[-1] == {"ad_id": "unknown"}
+    refresher.stop()
+    assert not watcher.change(HKCU, ADVANCED)
+    assert refresher.refresh_count == 2
+
+def test_refresh_scans_a_detached_catalog_and_only_reports_states(backend, registry, catalog):
+    notified = []
+    scan_catalog = SettingCatalog(catalog.records, catalog.index)
+    refresher = IncrementalRefresher(scan_catalog.settings, BatchScanner(registry), notified.append)
+    before = bytes(catalog.current.codes)
+    
+    backend.preset(HKCU, ADVANCED, "TaskbarAl", 0, winreg.REG_DWORD)
+    states = refresher.refresh_settings(["taskbar_align"])
+    # 画面のカタログの状態配列は変えず、状態は通知を受け取った側が反映する
+    assert notified == [states] == [{"taskbar_align": "disabled"}]
+    assert bytes(catalog.current.codes) == before
+    catalog.current.update(states)
+    assert catalog.settings["taskbar_align"].current_value == "disabled"
+
+def test_polling_watcher_detects_value_changes(backend, registry):
+    backend.preset(HKCU, ADVANCED, "TaskbarAl", 1, winreg.REG_DWORD)
+    changed = threading.Event()
+    keys = []
+    watcher = PollingWatcher(registry, interval=0.01)
+    watcher.start({(HKCU, ADVANCED.lower()): (ADVANCED, ["TaskbarAl"])},
+                  lambda changed_keys: (keys.extend(changed_keys), changed.set()))
+    try:
+        # 最初の値を読み取ってから書き換える
+        while backend.calls["query"] < 2:
+            time.sleep(0.001)
+        registry.write_value(ADVANCED, "TaskbarAl", 0, winreg.REG_DWORD)
+        assert changed.wait(5)
+    finally:
+        watcher.stop()
+    assert keys[0] == (HKCU, ADVANCED.lower())
@@ -0,0 +1,353 @@
+import ctypes
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from core import (
+    ApplyPlanner,
+    ApplyTransaction,
+    BatchScanner,
+    MemoryRegistryBackend,
+    RegistryBackend,
+    RegistryManager,
+    SettingCatalog,
+    winreg,
+)
+from instrumentation import INSTRUMENTATION
+
+# ユーザープロファイルの一覧（SIDごとのサブキーにProfileImagePathがある）
+PROFILE_LIST = r"SOFTWARE\Microsoft\Windows NT\CurrentVersion\ProfileList"
+
+# 対話ユーザーのSID（SYSTEM・LOCAL SERVICEなどのサービスアカウントは除く）
+USER_SID_PATTERN = re.compile(r"S-1-5-21(-\d+)+", re.IGNORECASE)
+
+# オフラインのプロファイルを読み込むときのHKEY_USERS直下のキー名
+MOUNT_PREFIX = "PoleToWin_"
+
+# マルチハイブモードで実行できる処理
+HIVE_MODES = ("scan", "diff", "apply")
+
+class UserHive(NamedTuple):
+    """ユーザーのレジストリハイブ（loadedがFalseならログオンしておらず読み込まれていない）"""
+    sid: str
+    profile_path: Optional[str]
+    loaded: bool
+
+class HiveProvider:
+    """ユーザーごとのハイブの列挙・読み込みを提供するインターフェース
+    
+    load/unloadはワーカースレッドから並行して呼ばれる。
+    """
+    
+    # ハイブの読み書きに使うバックエンド（HKEY_USERS以下にアクセスする）
+    backend: RegistryBackend
+    
+    def list_hives(self) -> List[UserHive]:
+        """マシン上のユーザーのハイブを列挙"""
+        raise NotImplementedError
+    
+    def load(self, hive: UserHive) -> str:
+        """ハイブを使える状態にし、HKEY_USERS直下のキー名を返す（読み込めなければOSError）"""
+        raise NotImplementedError
+    
+    def unload(self, hive: UserHive, mount: str):
+        """loadで読み込んだハイブを解放する（元から読み込まれていたハイブは何もしない）"""
+
+def _enable_privileges(*names: str):
+    """プロセスのトークンで特権を有効にする（ハイブの読み込みにはSeBackup/SeRestoreが必要）"""
+    from ctypes import wintypes
+    
+    class LUID(ctypes.Structure):
+        _fields_ = [("LowPart", wintypes.DWORD), ("HighPart", wintypes.LONG)]
+    
+    class LUID_AND_ATTRIBUTES(ctypes.Structure):
+        _fields_ = [("Luid", LUID), ("Attributes", wintypes.DWORD)]
+    
+    class TOKEN_PRIVILEGES(ctypes.Structure):
+        _fields_ = [("PrivilegeCount", wintypes.DWORD), ("Privileges", LUID_AND_ATTRIBUTES * 1)]
+    
+    TOKEN_ADJUST_PRIVILEGES = 0x0020
+    TOKEN_QUERY = 0x0008
+    SE_PRIVILEGE_ENABLED = 0x0002
+    
+    advapi32 = ctypes.WinDLL("advapi32", use_last_error=True)
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    advapi32.OpenProcessToken.argtypes = [wintypes.HANDLE, wintypes.DWORD, ctypes.POINTER(wintypes.HANDLE)]
+    advapi32.LookupPrivilegeValueW.argtypes = [wintypes.LPCWSTR, wintypes.LPCWSTR, ctypes.POINTER(LUID)]
+    advapi32.AdjustTokenPrivileges.argtypes = [
+        wintypes.HANDLE, wintypes.BOOL, ctypes.POINTER(TOKEN_PRIVILEGES), wintypes.DWORD, ctypes.c_void_p, ctypes.c_void_p
+    ]
+    
+    token = wintypes.HANDLE()
+    if not advapi32.OpenProcessToken(kernel32.GetCurrentProcess(), TOKEN_ADJUST_PRIVILEGES | TOKEN_QUERY,
+                                     ctypes.byref(token)):
+        raise ctypes.WinError(ctypes.get_last_error())
+    try:
+        for name in names:
+            luid = LUID()
+            if not advapi32.LookupPrivilegeValueW(None, name, ctypes.byref(luid)):
+                raise ctypes.WinError(ctypes.get_last_error())
+            privileges = TOKEN_PRIVILEGES(1, (LUID_AND_ATTRIBUTES * 1)(LUID_AND_ATTRIBUTES(luid, SE_PRIVILEGE_ENABLED)))
+            advapi32.AdjustTokenPrivileges(token, False, ctypes.byref(privileges), 0, None, None)
+            # 成功しても特権を持っていなければERROR_NOT_ALL_ASSIGNEDになる
+            error = ctypes.get_last_error()
+            if error:
+                raise ctypes.WinError(error)
+    finally:
+        kernel32.CloseHandle(token)
+
+class WindowsHiveProvider(HiveProvider):
+    """ProfileListとHKEY_USERSからハイブを列挙し、オフラインのプロファイルはNTUSER.DATを読み込む"""
+    
+    def __init__(self, load_offline: bool = False, backend: Optional[RegistryBackend] = None):
+        # ログオンしていないユーザーのNTUSER.DATを読み込むか
+        self.load_offline = load_offline
+        self.backend = backend or RegistryManager.backend
+        self.registry = RegistryManager(self.backend)
+        self._privileges_enabled = False
+        self._lock = threading.Lock()
+    
+    def list_hives(self):
+        loaded = {name.upper() for name in self.registry.list_subkeys("", winreg.HKEY_USERS) or []}
+        hives = []
+        for sid in self.registry.list_subkeys(PROFILE_LIST, winreg.HKEY_LOCAL_MACHINE) or []:
+            if not USER_SID_PATTERN.fullmatch(sid):
+                continue
+            path = self.registry.read_value(f"{PROFILE_LIST}\\{sid}", "ProfileImagePath", winreg.HKEY_LOCAL_MACHINE)
+            hives.append(UserHive(sid, os.path.expandvars(path) if path else None, sid.upper() in loaded))
+        return hives
+    
+    def load(self, hive):
+        if hive.loaded:
+            return hive.sid
+        if not self.load_offline:
+            raise PermissionError("ログオンしていないユーザーのハイブは読み込まない設定です")
+        if not hive.profile_path:
+            raise FileNotFoundError(f"{hive.sid}: プロファイルのパスが不明です")
+        with self._lock:
+            if not self._privileges_enabled:
+                _enable_privileges("SeBackupPrivilege", "SeRestorePrivilege")
+                self._privileges_enabled = True
+        mount = MOUNT_PREFIX + hive.sid
+        with INSTRUMENTATION.span("registry", "load_hive", mount):
+            winreg.LoadKey(winreg.HKEY_USERS, mount, os.path.join(hive.profile_path, "NTUSER.DAT"))
+        return mount
+    
+    def unload(self, hive, mount):
+        if mount == hive.sid:
+            return
+        # HKEY_USERSは64ビット環境では符号拡張されたハンドル値
+        root = ctypes.c_void_p(ctypes.c_long(winreg.HKEY_USERS).value)
+        with INSTRUMENTATION.span("registry", "unload_hive", mount):
+            error = ctypes.windll.advapi32.RegUnLoadKeyW(root, mount)
+        if error:
+            raise ctypes.WinError(error)
+
+class FakeHiveProvider(HiveProvider):
+    """メモリ上に複数ユーザーのハイブを用意する（Linuxでの計測・テスト用）
+    
+    オフラインのハイブの内容は読み込まれるまでバックエンドの外に保持し、解放時に書き戻す。
+    """
+    
+    def __init__(self, users: int = 8, offline: int = 0, latency: float = 0.0, load_latency: float = 0.0,
+                 load_offline: bool = False, backend: Optional[MemoryRegistryBackend] = None):
+        self.backend = backend or MemoryRegistryBackend(latency)
+        self.load_offline = load_offline
+        self.load_latency = load_latency
+        self.hives = [
+            UserHive(f"S-1-5-21-1000-2000-3000-{1001 + number}", f"C:\\Users\\user{number + 1:03d}",
+                     number < users - offline)
+            for number in range(users)
+        ]
+        # オフラインのハイブの内容 SID -> [(キーパス, 値名, 値, 型)]
+        self.offline: Dict[str, List[tuple]] = {hive.sid: [] for hive in self.hives if not hive.loaded}
+        self.loads = Counter()
+        self._lock = threading.Lock()
+    
+    def preset(self, sid: str, key_path: str, value_name: str, value: Any, value_type: int):
+        """ユーザーのハイブに初期値を設定"""
+        if sid in self.offline:
+            self.offline[sid].append((key_path, value_name, value, value_type))
+        else:
+            self.backend.preset(winreg.HKEY_USERS, f"{sid}\\{key_path}", value_name, value, value_type)
+    
+    def populate(self, records: List[Dict[str, Any]], seed: int = 0):
+        """HKEY_CURRENT_USERの項目をユーザーごとに有効・無効・未設定のいずれかにする"""
+        rng = random.Random(seed)
+        for hive in self.hives:
+            for record in records:
+                # 値の一部分を書き換える項目は値全体を作れないため未設定のままにする
+                if record.get("root") != winreg.HKEY_CURRENT_USER or "offset" in record:
+                    continue
+                choice = rng.choice(("enabled_value", "disabled_value", None))
+                if choice is not None:
+                    self.preset(hive.sid, record["key_path"], record["value_name"], record[choice],
+                                record["value_type"])
+    
+    def list_hives(self):
+        return list(self.hives)
+    
+    def load(self, hive):
+        if hive.loaded:
+            return hive.sid
+        if not self.load_offline:
+            raise PermissionError("ログオンしていないユーザーのハイブは読み込まない設定です")
+        if self.load_latency:
+            time.sleep(self.load_latency)
+        mount = MOUNT_PREFIX + hive.sid
+        with self._lock:
+            self.loads[hive.sid] += 1
+            for key_path, value_name, value, value_type in self.offline[hive.sid]:
+                self.backend.preset(winreg.HKEY_USERS, f"{mount}\\{key_path}", value_name, value, value_type)
+        return mount
+    
+    def unload(self, hive, mount):
+        if mount == hive.sid:
+            return
+        from regfile import RegValue, delete_tree, iter_tree
+        
+        registry = RegistryManager(self.backend)
+        # 実際のハイブと同じく、解放時に変更をファイル（ここではself.offline）に書き戻す
+        contents = [
+            (entry.key_path[len(mount) + 1:], entry.value_name, entry.value, entry.value_type)
+            for entry in iter_tree(winreg.HKEY_USERS, mount, registry) if isinstance(entry, RegValue)
+        ]
+        delete_tree(winreg.HKEY_USERS, mount, registry)
+        with self._lock:
+            self.offline[hive.sid] = contents
+
+def rebase_records(records: List[Dict[str, Any]], mount: str) -> List[Dict[str, Any]]:
+    """HKEY_CURRENT_USERの項目をHKEY_USERS\\<mount>の項目に置き換える（それ以外の項目は除く）"""
+    rebased = []
+    for record in records:
+        if record.get("root") != winreg.HKEY_CURRENT_USER:
+            continue
+        record = dict(record)
+        record["root"] = winreg.HKEY_USERS
+        record["key_path"] = f"{mount}\\{record['key_path']}"
+        rebased.append(record)
+    return rebased
+
+class MultiHiveRunner:
+    """ユーザーごとのハイブに対してスキャン・差分確認・適用を並行して行い、ユーザー×項目の状態表を作る
+    
+    マシン全体の項目（HKEY_LOCAL_MACHINEなど）はユーザーごとに異ならないため対象外。
+    """
+    
+    def __init__(self, provider: HiveProvider, catalog: SettingCatalog,
+                 profile: Optional[Dict[str, Optional[str]]] = None, mode: str = "scan", workers: int = 8,
+                 backup_journal=None):
+        if mode not in HIVE_MODES:
+            raise ValueError(f"不明なモード: {mode}")
+        if mode != "scan" and profile is None:
+            raise ValueError(f"{mode}にはプロファイルが必要です")
+        self.provider = provider
+        self.catalog = catalog
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.backup_journal = backup_journal
+        # ユーザーごとに異なる項目
+        self.setting_ids = [
+            record["id"] for record in catalog.records if record.get("root") == winreg.HKEY_CURRENT_USER
+        ]
+        self.profile = {
+            setting_id: state for setting_id, state in (profile or {}).items() if setting_id in self.setting_ids
+        }
+        self.summary: Dict[str, Any] = {}
+    
+    def process_hive(self, hive: UserHive) -> Dict[str, Any]:
+        """1ユーザー分の処理（ハイブを読み込めない場合などは例外）"""
+        mount = self.provider.load(hive)
+        registry = RegistryManager(self.provider.backend, cache_size=32)
+        try:
+            settings = SettingCatalog(rebase_records(self.catalog.records, mount)).settings
+            scanner = BatchScanner(registry)
+            if self.mode == "scan":
+                return {"status": "ok", "states": scanner.scan(settings)}
+            
+            plan = ApplyPlanner(registry).plan(settings, self.profile)
+            outcome: Dict[str, Any] = {"status": "ok", "changes": plan.setting_ids}
+            if self.mode == "apply" and len(plan):
+                result = ApplyTransaction(registry, self.backup_journal).execute(plan, settings, f"apply:{hive.sid}")
+                outcome["written"] = result.written
+                if not result.committed:
+                    outcome.update(
+                        status="failed", failed=result.failed, rollback_errors=result.rollback_errors
+                    )
+            outcome["states"] = scanner.scan(settings)
+            return outcome
+        finally:
+            # キーハンドルが開いているとハイブを解放できない
+            registry.close()
+            self.provider.unload(hive, mount)
+    
+    def _run_hive(self, hive: UserHive) -> Dict[str, Any]:
+        record: Dict[str, Any] = {"sid": hive.sid, "profile": hive.profile_path, "loaded": hive.loaded}
+        started = time.perf_counter()
+        try:
+            with INSTRUMENTATION.span("phase", "hive", hive.sid):
+                record.update(self.process_hive(hive))
+        except PermissionError as e:
+            record.update(status="skipped", error=str(e))
+        except Exception as e:
+            record.update(status="error", error=str(e))
+        record["elapsed"] = round(time.perf_counter() - started, 3)
+        return record
+    
+    def run(self, hives: Optional[List[UserHive]] = None) -> Dict[str, Any]:
+        """全ユーザーを処理し、ユーザーごとの結果と項目ごとの状態の集計を返す"""
+        hives = self.provider.list_hives() if hives is None else hives
+        started = time.perf_counter()
+        users: List[Dict[str, Any]] = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hive") as executor:
+            futures = [executor.submit(self._run_hive, hive) for hive in hives]
+            for future in as_completed(futures):
+                users.append(future.result())
+        # 完了順ではなくSIDの順に並べる
+        users.sort(key=lambda user: user["sid"])
+        
+        totals = {setting_id: Counter() for setting_id in self.setting_ids}
+        for user in users:
+            for setting_id, state in user.get("states", {}).items():
+                totals[setting_id][state] += 1
+        statuses = Counter(user["status"] for user in users)
+        elapsed = time.perf_counter() - started
+        self.summary = {
+            "mode": self.mode,
+            "users": len(users),
+            **{status: statuses[status] for status in ("ok", "failed", "skipped", "error")},
+            "elapsed": round(elapsed, 3),
+            "users_per_second": round(len(users) / elapsed, 2) if elapsed else 0.0,
+        }
+        return {
+            "settings": self.setting_ids,
+            "users": users,
+            "totals": {setting_id: dict(counts) for setting_id, counts in totals.items()},
+            "summary": self.summary,
+        }
+
+def format_matrix(matrix: Dict[str, Any], names: Optional[Dict[str, str]] = None) -> str:
+    """ユーザー（列）×項目（行）の状態表を文字列にする"""
+    names = names or {}
+    short = {"enabled": "有効", "disabled": "無効", "unknown": "-"}
+    users = matrix["users"]
+    lines = ["項目" + "".join(f"  {user['sid'][-8:]:>8}" for user in users)]
+    for setting_id in matrix["settings"]:
+        cells = []
+        for user in users:
+            if user["status"] in ("skipped", "error"):
+                cells.append("×")
+            else:
+                state = user["states"].get(setting_id, "unknown")
+                cells.append(short.get(state, state))
+        lines.append(names.get(setting_id, setting_id) + "".join(f"  {cell:>8}" for cell in cells))
+    for user in users:
+        if user.get("error"):
+            lines.append(f"{user['sid']}: {user['error']}")
+    return "\n".join(lines)
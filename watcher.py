@@ -0,0 +1,265 @@
+import ctypes
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from core import HAS_WINREG, BatchScanner, RegistryManager, SettingItem, winreg
+
+# (root, 小文字のキーパス) -> (キーパス, 監視する値名の一覧)
+KeySpec = Dict[Tuple[int, str], Tuple[str, List[str]]]
+
+# 変更のあったキーの一覧を受け取るコールバック
+ChangeCallback = Callable[[List[Tuple[int, str]]], None]
+
+class KeyWatcher:
+    """レジストリキーの変更を監視するインターフェース
+    
+    on_changeは監視スレッドから呼ばれる。
+    """
+    
+    def start(self, keys: KeySpec, on_change: ChangeCallback) -> KeySpec:
+        """監視を開始し、このWatcherでは監視できなかったキーを返す"""
+        raise NotImplementedError
+    
+    def stop(self):
+        """監視を終了"""
+        raise NotImplementedError
+
+class PollingWatcher(KeyWatcher):
+    """一定間隔で値を読み直して変更を検出する（変更通知が使えない環境向け）"""
+    
+    def __init__(self, registry=None, interval: float = 2.0):
+        self.registry = registry or RegistryManager
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def snapshot(self, keys: KeySpec) -> Dict[Tuple[int, str], Any]:
+        """監視対象の現在の値を読み取る"""
+        return {
+            key: self.registry.query_values(key_path, value_names, key[0])
+            for key, (key_path, value_names) in keys.items()
+        }
+    
+    def start(self, keys, on_change):
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(dict(keys), on_change), name="registry-poller", daemon=True
+        )
+        self._thread.start()
+        return {}
+    
+    def _run(self, keys: KeySpec, on_change: ChangeCallback):
+        previous = self.snapshot(keys)
+        while not self._stop.wait(self.interval):
+            current = self.snapshot(keys)
+            changed = [key for key in keys if current[key] != previous[key]]
+            previous = current
+            if changed:
+                on_change(changed)
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+class NotifyWatcher(KeyWatcher):
+    """RegNotifyChangeKeyValueでキーの変更通知を受け取る（Windows専用）"""
+    
+    REG_NOTIFY_CHANGE_NAME = 0x00000001
+    REG_NOTIFY_CHANGE_LAST_SET = 0x00000004
+    KEY_NOTIFY = 0x0010
+    WAIT_OBJECT_0 = 0
+    # WaitForMultipleObjectsで待てる最大数（停止用イベントを1つ含む）
+    MAXIMUM_WAIT_OBJECTS = 64
+    
+    def __init__(self):
+        self._stop_events: List[int] = []
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def available(cls) -> bool:
+        return HAS_WINREG and hasattr(ctypes, "windll")
+    
+    @staticmethod
+    def _prepare_api():
+        """64bit環境でハンドルが切り詰められないように引数と戻り値の型を指定"""
+        from ctypes import wintypes
+        
+        kernel32 = ctypes.windll.kernel32
+        kernel32.CreateEventW.argtypes = [ctypes.c_void_p, wintypes.BOOL, wintypes.BOOL, wintypes.LPCWSTR]
+        kernel32.CreateEventW.restype = ctypes.c_void_p
+        kernel32.SetEvent.argtypes = [ctypes.c_void_p]
+        kernel32.CloseHandle.argtypes = [ctypes.c_void_p]
+        kernel32.WaitForMultipleObjects.argtypes = [
+            wintypes.DWORD, ctypes.POINTER(ctypes.c_void_p), wintypes.BOOL, wintypes.DWORD
+        ]
+        kernel32.WaitForMultipleObjects.restype = wintypes.DWORD
+        advapi32 = ctypes.windll.advapi32
+        advapi32.RegNotifyChangeKeyValue.argtypes = [
+            ctypes.c_void_p, wintypes.BOOL, wintypes.DWORD, ctypes.c_void_p, wintypes.BOOL
+        ]
+        advapi32.RegNotifyChangeKeyValue.restype = wintypes.LONG
+    
+    def start(self, keys, on_change):
+        if not self.available():
+            return dict(keys)
+        
+        self._prepare_api()
+        kernel32 = ctypes.windll.kernel32
+        unsupported: KeySpec = {}
+        watched = []
+        for key, (key_path, value_names) in keys.items():
+            try:
+                handle = winreg.OpenKey(key[0], key_path, 0, self.KEY_NOTIFY)
+            except OSError:
+                # 存在しないキーは通知を受け取れない
+                unsupported[key] = (key_path, value_names)
+                continue
+            event = kernel32.CreateEventW(None, False, False, None)
+            watched.append((key, handle, event))
+        
+        chunk_size = self.MAXIMUM_WAIT_OBJECTS - 1
+        for start in range(0, len(watched), chunk_size):
+            stop_event = kernel32.CreateEventW(None, True, False, None)
+            thread = threading.Thread(
+                target=self._run,
+                args=(watched[start:start + chunk_size], stop_event, on_change),
+                name="registry-notify",
+                daemon=True
+            )
+            self._stop_events.append(stop_event)
+            self._threads.append(thread)
+            thread.start()
+        return unsupported
+    
+    def _arm(self, handle, event) -> bool:
+        """変更通知を（再）登録"""
+        result = ctypes.windll.advapi32.RegNotifyChangeKeyValue(
+            handle.handle, False, self.REG_NOTIFY_CHANGE_NAME | self.REG_NOTIFY_CHANGE_LAST_SET, event, True
+        )
+        return result == 0
+    
+    def _run(self, watched, stop_event: int, on_change: ChangeCallback):
+        kernel32 = ctypes.windll.kernel32
+        for _, handle, event in watched:
+            self._arm(handle, event)
+        handles = (ctypes.c_void_p * (len(watched) + 1))(stop_event, *[event for _, _, event in watched])
+        try:
+            while True:
+                index = kernel32.WaitForMultipleObjects(len(handles), handles, False, 0xFFFFFFFF)
+                if index == self.WAIT_OBJECT_0:
+                    break
+                index -= self.WAIT_OBJECT_0 + 1
+                if not 0 <= index < len(watched):
+                    print(f"変更通知の待機エラー: {kernel32.GetLastError()}")
+                    break
+                key, handle, event = watched[index]
+                # 通知は1回限りのため、読み直す前に再登録する
+                self._arm(handle, event)
+                on_change([key])
+        finally:
+            for _, handle, event in watched:
+                handle.Close()
+                kernel32.CloseHandle(event)
+    
+    def stop(self):
+        with self._lock:
+            for stop_event in self._stop_events:
+                ctypes.windll.kernel32.SetEvent(stop_event)
+            for thread in self._threads:
+                thread.join()
+            for stop_event in self._stop_events:
+                ctypes.windll.kernel32.CloseHandle(stop_event)
+            self._stop_events = []
+            self._threads = []
+
+class FakeWatcher(KeyWatcher):
+    """テスト用のWatcher（change()を呼ぶと同じスレッドで通知する）"""
+    
+    def __init__(self, unsupported: Optional[List[Tuple[int, str]]] = None):
+        # 監視できないものとして扱うキー (root, キーパス)
+        self.unsupported = {(root, key_path.lower()) for root, key_path in unsupported or []}
+        self.keys: KeySpec = {}
+        self._on_change: Optional[ChangeCallback] = None
+    
+    def start(self, keys, on_change):
+        self.keys = {key: spec for key, spec in keys.items() if key not in self.unsupported}
+        self._on_change = on_change
+        return {key: spec for key, spec in keys.items() if key in self.unsupported}
+    
+    def change(self, root: int, key_path: str) -> bool:
+        """キーの変更を通知（監視対象でなければFalse）"""
+        key = (root, key_path.lower())
+        if self._on_change is None or key not in self.keys:
+            return False
+        self._on_change([key])
+        return True
+    
+    def stop(self):
+        self._on_change = None
+
+class IncrementalRefresher:
+    """変更通知のあったキーに属する設定項目だけを再スキャンする
+    
+    再スキャンはWatcherやジョブのスレッドで行われるため、settingsには画面のカタログとは別の
+    カタログの項目を渡し、on_statesで受け取った状態をUIスレッドで反映する。
+    """
+    
+    def __init__(self, settings: Dict[str, SettingItem], scanner: BatchScanner,
+                 on_states: Callable[[Dict[str, str]], None],
+                 watcher: Optional[KeyWatcher] = None, fallback: Optional[KeyWatcher] = None):
+        self.settings = settings
+        self.scanner = scanner
+        self.on_states = on_states
+        self.watcher = watcher
+        self.fallback = fallback
+        self.key_index = BatchScanner.group_by_key(settings)
+        self.refresh_count = 0
+        # 変更通知とジョブ完了の再スキャンが同じ項目に同時に書き込まないようにする
+        self._lock = threading.Lock()
+    
+    def key_spec(self) -> KeySpec:
+        """監視するキーと値名の一覧"""
+        spec: KeySpec = {}
+        for key, setting_ids in self.key_index.items():
+            first = self.settings[setting_ids[0]]
+            spec[key] = (first.key_path, [self.settings[setting_id].value_name for setting_id in setting_ids])
+        return spec
+    
+    def start(self):
+        """監視を開始（通知を受け取れないキーはfallbackで監視）"""
+        unsupported = self.key_spec()
+        if self.watcher is not None:
+            unsupported = self.watcher.start(unsupported, self.refresh_keys)
+        if unsupported and self.fallback is not None:
+            self.fallback.start(unsupported, self.refresh_keys)
+    
+    def stop(self):
+        for watcher in (self.watcher, self.fallback):
+            if watcher is not None:
+                watcher.stop()
+    
+    def refresh_keys(self, keys: List[Tuple[int, str]]) -> Dict[str, str]:
+        """指定キーに属する設定項目を再スキャンして通知"""
+        setting_ids = [setting_id for key in keys for setting_id in self.key_index.get(key, [])]
+        return self.refresh_settings(setting_ids)
+    
+    def refresh_settings(self, setting_ids: List[str]) -> Dict[str, str]:
+        """指定した設定項目だけを再スキャンして通知"""
+        subset = {setting_id: self.settings[setting_id] for setting_id in setting_ids if setting_id in self.settings}
+        if not subset:
+            return {}
+        with self._lock:
+            states = self.scanner.scan(subset)
+            self.refresh_count += 1
+        self.on_states(states)
+        return states
+
+def create_refresher(settings: Dict[str, SettingItem], scanner: BatchScanner,
+                     on_states: Callable[[Dict[str, str]], None], poll_interval: float = 2.0) -> IncrementalRefresher:
+    """環境に合わせたWatcherを使うIncrementalRefresherを作成"""
+    watcher = NotifyWatcher() if NotifyWatcher.available() else None
+    fallback = PollingWatcher(scanner.registry, poll_interval) if poll_interval > 0 else None
+    return IncrementalRefresher(settings, scanner, on_states, watcher, fallback)